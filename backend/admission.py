@@ -0,0 +1,246 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted in time"""
+
+    def __init__(self, scope: str, retry_after: int):
+        super().__init__(f"Servidor ocupado ({scope}), tente novamente em {retry_after}s")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimit:
+    """
+    Concurrency limit with a FIFO wait queue and AIMD adaptation.
+
+    The limit grows by one per successful request while it is actually being
+    used, and is multiplied by `backoff` when the upstream is slower than
+    `latency_target` or fails, staying within [min_limit, max_limit].
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_limit: int,
+        min_limit: int = 1,
+        initial: Optional[int] = None,
+        latency_target: float = 10.0,
+        backoff: float = 0.9,
+        max_queue: int = 256,
+        adaptive: bool = True
+    ):
+        self.name = name
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.limit = float(initial if initial is not None else max(self.min_limit, max_limit // 2))
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.max_queue = max_queue
+        self.adaptive = adaptive
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.errors = 0
+        self._waiters: "deque[asyncio.Future]" = deque()
+        # Moving average of how long a slot is held, for Retry-After
+        self._avg_hold = 1.0
+
+    @property
+    def capacity(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def try_acquire(self) -> bool:
+        if self.in_flight < self.capacity and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        return False
+
+    async def acquire(self, timeout: float) -> bool:
+        """
+        Take a slot, waiting up to `timeout` seconds in FIFO order
+        """
+        if self.try_acquire():
+            return True
+        if timeout <= 0 or len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait((waiter,), timeout=timeout)
+        except BaseException:
+            # Cancelled while queued (e.g. client went away)
+            self._abandon(waiter)
+            raise
+        if waiter.done():
+            self.admitted += 1
+            return True
+        self._abandon(waiter)
+        self.rejected += 1
+        return False
+
+    def _abandon(self, waiter: asyncio.Future):
+        if waiter.done() and not waiter.cancelled():
+            # The slot was handed over just as we gave up: pass it on
+            self.release()
+            return
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.capacity:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(True)
+
+    def record(self, latency: float, hold: float, error: bool = False):
+        """Feed one finished request into the AIMD controller"""
+        self._avg_hold += 0.1 * (hold - self._avg_hold)
+        if error:
+            self.errors += 1
+        if not self.adaptive:
+            return
+        if error or latency > self.latency_target:
+            self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        elif self.in_flight * 2 >= self.limit:
+            self.limit = min(float(self.max_limit), self.limit + 1)
+        self._wake()
+
+    def retry_after(self) -> int:
+        """Rough seconds until a slot frees up for a new request"""
+        estimate = self._avg_hold * (self.queued + 1) / max(self.capacity, 1)
+        return min(60, max(1, math.ceil(estimate)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.capacity,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "errors": self.errors,
+        }
+
+
+class Permit:
+    """
+    A request admitted under the global limit and its tool's limit
+    """
+
+    def __init__(self, limits: List[ConcurrencyLimit]):
+        self.limits = limits
+        self.started = time.monotonic()
+        self.first_token_latency: Optional[float] = None
+        self.released = False
+
+    def first_token(self):
+        """Mark the time to first token, the latency signal for AIMD"""
+        if self.first_token_latency is None:
+            self.first_token_latency = time.monotonic() - self.started
+
+    def __del__(self):
+        # Safety net: a response that never started streaming must not
+        # leak its slots
+        if not self.released:
+            self.release()
+
+    def release(self, error: bool = False):
+        if self.released:
+            return
+        self.released = True
+        hold = time.monotonic() - self.started
+        latency = self.first_token_latency if self.first_token_latency is not None else hold
+        for limit in self.limits:
+            limit.record(latency, hold, error)
+            limit.release()
+
+
+class AdmissionController:
+    """
+    Admission control in front of /chat: one global limit plus optional
+    per-tool limits (e.g. reasoning vs. text vs. search)
+    """
+
+    def __init__(
+        self,
+        global_limit: ConcurrencyLimit,
+        tool_limits: Optional[Dict[str, ConcurrencyLimit]] = None,
+        queue_timeout: float = 5.0
+    ):
+        self.global_limit = global_limit
+        self.tool_limits = tool_limits or {}
+        self.queue_timeout = queue_timeout
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """Build limits from ADMISSION_* environment variables"""
+        latency_target = float(os.getenv("ADMISSION_LATENCY_TARGET", "10"))
+        max_queue = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+
+        def limit(name: str, default: int) -> ConcurrencyLimit:
+            return ConcurrencyLimit(
+                name,
+                max_limit=int(os.getenv(f"ADMISSION_LIMIT_{name.upper()}", str(default))),
+                latency_target=latency_target,
+                max_queue=max_queue
+            )
+
+        return cls(
+            global_limit=limit("global", 128),
+            tool_limits={
+                "text_generation": limit("text_generation", 64),
+                "reasoning": limit("reasoning", 16),
+                "search": limit("search", 32),
+                "vision": limit("vision", 16),
+            },
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+        )
+
+    async def admit(self, tool: str) -> Permit:
+        """
+        Wait for a slot for `tool`, or raise Overloaded when the queue is
+        full or the deadline passes
+        """
+        deadline = time.monotonic() + self.queue_timeout
+        acquired: List[ConcurrencyLimit] = []
+        # Always tool first, then global, so waiters cannot deadlock
+        scopes = [self.tool_limits[tool]] if tool in self.tool_limits else []
+        scopes.append(self.global_limit)
+        try:
+            for limit in scopes:
+                if not await limit.acquire(deadline - time.monotonic()):
+                    raise Overloaded(limit.name, limit.retry_after())
+                acquired.append(limit)
+        except BaseException:
+            for limit in acquired:
+                limit.release()
+            raise
+        return Permit(acquired)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_timeout": self.queue_timeout,
+            "global": self.global_limit.stats(),
+            "tools": {name: limit.stats() for name, limit in self.tool_limits.items()},
+        }
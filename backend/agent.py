@@ -1,9 +1,27 @@
 import httpx
-import json
 import asyncio
-from typing import AsyncGenerator, Dict, List, Optional, Any
+import random
+import time
+from contextlib import aclosing
+from typing import AsyncGenerator, Dict, List, Optional, Any, Set
 from enum import Enum
 
+from cache import ResponseCache
+from context import ContextWindow, truncate_to_tokens
+from history_store import HistoryStore, InMemoryHistoryStore
+from media import ImagePipeline, media_key
+from metrics import ChatMetrics, current_upstream_timing
+from planner import TEXT_TOOLS, PlanStep, ToolPlanner
+from resilience import UpstreamError, UpstreamResilience
+from routing import ModelRouter
+from tool_router import ToolRouter
+from singleflight import SingleFlight
+from speech import SpeechPipeline, SpeechStream
+from summary import ConversationSummarizer
+from sse import iter_delta_content
+from transport import create_upstream_client
+from vision import VisionStore
+
 
 class ToolType(Enum):
     """Available tool types for the agent"""
@@ -16,6 +34,10 @@ class ToolType(Enum):
     REASONING = "reasoning"
 
 
+DEFAULT_TOOL_ROUTER = ToolRouter()
+DEFAULT_CONTEXT_WINDOW = ContextWindow()
+
+
 class PollinationsAgent:
     """
     Mega Agent that uses all Pollinations.AI capabilities
@@ -30,69 +52,205 @@ class PollinationsAgent:
     REASONING_MODELS = ["openai-reasoning", "openai"]
     IMAGE_MODELS = ["flux", "flux-realism", "flux-anime", "flux-3d", "turbo"]
     AUDIO_VOICES = ["alloy", "echo", "fable", "onyx", "nova", "shimmer"]
+    VISION_MODELS = ["openai"]
+    
+    # How much of an earlier step's text a chained text-to-speech step reads
+    SPOKEN_RESULT_TOKENS = 120
     
-    def __init__(self):
-        self.client = httpx.AsyncClient(timeout=300.0)
-        self.conversation_history: List[Dict] = []
+    # Appended to answers cut short, so later turns know they are incomplete
+    INTERRUPTED_MARK = "\n\n[resposta interrompida]"
+    
+    # Image batches: concurrent generations per request and preview size
+    IMAGE_BATCH_CONCURRENCY = 4
+    IMAGE_PREVIEW_SIZE = 256
+    
+    def __init__(
+        self,
+        client: Optional[httpx.AsyncClient] = None,
+        max_history: int = 10,
+        history_store: Optional[HistoryStore] = None,
+        session_id: str = "default",
+        response_cache: Optional[ResponseCache] = None,
+        single_flight: Optional[SingleFlight] = None,
+        resilience: Optional[UpstreamResilience] = None,
+        router: Optional[ModelRouter] = None,
+        tool_router: Optional[ToolRouter] = None,
+        context_window: Optional[ContextWindow] = None,
+        summarizer: Optional[ConversationSummarizer] = None,
+        planner: Optional[ToolPlanner] = None,
+        image_pipeline: Optional[ImagePipeline] = None,
+        speech_pipeline: Optional[SpeechPipeline] = None,
+        vision_store: Optional[VisionStore] = None,
+        metrics: Optional[ChatMetrics] = None
+    ):
+        # A shared client (e.g. from SessionManager) is owned by the caller
+        self._owns_client = client is None
+        self.client = client or create_upstream_client()
+        self.max_history = max_history
+        # Without a shared store each agent keeps its history in memory
+        self.history_store = history_store or InMemoryHistoryStore()
+        self.session_id = session_id
+        # Opt-in cache of complete upstream responses, usually shared
+        self.response_cache = response_cache
+        # Shares one upstream stream between identical concurrent requests
+        self.single_flight = single_flight
+        # Retries, hedging and circuit breaking around upstream calls
+        self.resilience = resilience
+        # Latency-aware model fallback chains
+        self.router = router
+        # Keyword automaton picking the tool, built once and shared
+        self.tool_router = tool_router or DEFAULT_TOOL_ROUTER
+        # Fits past turns into each model's token budget
+        self.context_window = context_window or DEFAULT_CONTEXT_WINDOW
+        # Folds messages trimmed from the history into a rolling summary;
+        # without one they are simply dropped. Trimmed messages wait in the
+        # history store, so they survive eviction and are shared by workers.
+        self.summarizer = summarizer
+        self._summary_due = False
+        self._summary_lock = asyncio.Lock()
+        # Bumped by clear_history so a running update does not save a stale summary
+        self._history_epoch = 0
+        self._background: Set[asyncio.Task] = set()
+        # Splits compound requests into concurrent tool steps; without one
+        # every message gets a single tool
+        self.planner = planner
+        # Fetches images server-side into the local media cache; without it
+        # the browser loads them straight from the upstream
+        self.image_pipeline = image_pipeline
+        # Renders speech sentence by sentence into a local cache; without it
+        # the browser gets one upstream URL with the whole text
+        self.speech_pipeline = speech_pipeline
+        # Uploaded images, processed and deduplicated, for the vision tool
+        self.vision_store = vision_store
+        # Upstream latency histograms served on /metrics
+        self.metrics = metrics
     
     async def close(self):
-        """Close the HTTP client"""
-        await self.client.aclose()
+        """Close the HTTP client if this agent created it"""
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        if self._owns_client:
+            await self.client.aclose()
     
     def _determine_tool(self, user_message: str) -> ToolType:
         """
         Analyze user message to determine which tool to use
         """
-        message_lower = user_message.lower()
-        
-        # Check for image generation keywords
-        image_keywords = ["imagem", "desenhe", "crie uma imagem", "gere uma imagem", "picture", "draw", "image", "foto", "ilustração"]
-        if any(keyword in message_lower for keyword in image_keywords):
-            return ToolType.IMAGE_GENERATION
-        
-        # Check for search keywords
-        search_keywords = ["pesquise", "busque", "procure", "search", "find", "latest", "news", "notícias", "o que está acontecendo"]
-        if any(keyword in message_lower for keyword in search_keywords):
-            return ToolType.SEARCH
-        
-        # Check for audio generation keywords
-        audio_keywords = ["fale", "diga", "áudio", "voz", "speak", "say", "audio", "voice"]
-        if any(keyword in message_lower for keyword in audio_keywords):
-            return ToolType.TEXT_TO_SPEECH
-        
-        # Vision is not yet implemented, so we skip these keywords for now
-        # vision_keywords = ["analise esta imagem", "o que tem nesta imagem", "descreva a imagem", "analyze image", "what's in this image"]
-        # if any(keyword in message_lower for keyword in vision_keywords):
-        #     return ToolType.VISION
-        
-        # Check for reasoning keywords
-        reasoning_keywords = ["pense", "raciocine", "analise profundamente", "think", "reason", "analyze deeply", "complexo"]
-        if any(keyword in message_lower for keyword in reasoning_keywords):
-            return ToolType.REASONING
-        
-        # Default to text generation
-        return ToolType.TEXT_GENERATION
+        return ToolType(self.tool_router.route(user_message))
+    
+    async def _request_completion(self, payload: Dict[str, Any]) -> AsyncGenerator[str, None]:
+        """
+        POST a streaming chat completion and yield its text deltas
+        """
+        timing = current_upstream_timing()
+        started = time.perf_counter()
+        async with self.client.stream(
+            "POST",
+            f"{self.BASE_URL_TEXT}/openai",
+            json=payload,
+            headers={"Content-Type": "application/json", "Accept": "text/event-stream"}
+        ) as response:
+            if timing is not None:
+                timing.ttfb = time.perf_counter() - started
+            # Check for HTTP errors
+            if response.status_code != 200:
+                error_text = await response.aread()
+                retry_after = response.headers.get("Retry-After", "")
+                raise UpstreamError(
+                    response.status_code,
+                    error_text.decode(errors="replace"),
+                    retry_after=float(retry_after) if retry_after.isdigit() else None
+                )
+            
+            body = response.aiter_bytes()
+            async for content in iter_delta_content(body):
+                yield content
+            # Read what follows [DONE] (the end of the body) so the
+            # connection goes back to the pool instead of being closed
+            async for _ in body:
+                pass
+    
+    async def _stream_completion(self, payload: Dict[str, Any]) -> AsyncGenerator[str, None]:
+        """
+        Stream a completion through the resilience layer and the router's
+        measurements, if configured
+        """
+        model = payload.get("model", "")
+        if self.resilience is None:
+            upstream = self._request_completion(payload)
+        else:
+            upstream = self.resilience.stream(model, lambda: self._request_completion(payload))
+        if self.router is not None:
+            upstream = self.router.observe(model, upstream)
+        async for content in upstream:
+            yield content
+    
+    async def _cached_completion(
+        self,
+        payload: Dict[str, Any],
+        tool_type: ToolType
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream a completion through the response cache and the single-flight
+        layer, if configured. A cache hit replays the recorded chunks; only
+        complete streams are stored.
+        """
+        cache = self.response_cache
+        flight = self.single_flight
+        
+        def upstream_stream() -> AsyncGenerator[str, None]:
+            stream = self._stream_completion(payload)
+            if self.metrics is None:
+                return stream
+            return self.metrics.observe_stream(tool_type.value, payload.get("model", ""), stream)
+        
+        # Vision answers are never cached, and keying them would mean
+        # encoding and hashing the whole base64 image
+        if (cache is None and flight is None) or tool_type == ToolType.VISION:
+            async for content in upstream_stream():
+                yield content
+            return
+        
+        key = ResponseCache.make_key(tool_type.value, payload)
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                for content in cached:
+                    yield content
+                return
+        
+        if flight is not None:
+            upstream = flight.stream(key, upstream_stream)
+        else:
+            upstream = upstream_stream()
+        
+        if cache is None:
+            async for content in upstream:
+                yield content
+            return
+        
+        chunks = []
+        async for content in upstream:
+            chunks.append(content)
+            yield content
+        cache.put(key, tool_type.value, chunks)
     
     async def generate_text_stream(
         self,
         prompt: str,
         model: str = "openai",
         system_prompt: Optional[str] = None,
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        tool_type: ToolType = ToolType.TEXT_GENERATION
     ) -> AsyncGenerator[str, None]:
         """
         Generate text with streaming using Pollinations.AI
         """
-        messages = []
-        
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        
-        # Add conversation history
-        messages.extend(self.conversation_history[-6:])  # Last 3 exchanges
-        
-        # Add current user message
-        messages.append({"role": "user", "content": prompt})
+        # History is trimmed and compacted to the model's token budget
+        # instead of a fixed number of messages; older turns live on in the
+        # rolling summary
+        summary, history = await self.history_store.load_with_summary(self.session_id, self.max_history)
+        messages = self.context_window.build(model, system_prompt, history, prompt, summary=summary)
         
         payload = {
             "model": model,
@@ -101,29 +259,8 @@ class PollinationsAgent:
             "stream": True
         }
         
-        async with self.client.stream(
-            "POST",
-            f"{self.BASE_URL_TEXT}/openai",
-            json=payload,
-            headers={"Content-Type": "application/json", "Accept": "text/event-stream"}
-        ) as response:
-            # Check for HTTP errors
-            if response.status_code != 200:
-                error_text = await response.aread()
-                raise Exception(f"API error {response.status_code}: {error_text.decode()}")
-            
-            async for line in response.aiter_lines():
-                if line.startswith("data: "):
-                    data = line[6:]
-                    if data.strip() == "[DONE]":
-                        break
-                    try:
-                        chunk = json.loads(data)
-                        content = chunk.get("choices", [{}])[0].get("delta", {}).get("content")
-                        if content:
-                            yield content
-                    except json.JSONDecodeError:
-                        continue
+        async for content in self._cached_completion(payload, tool_type):
+            yield content
     
     async def generate_image(
         self,
@@ -143,7 +280,7 @@ class PollinationsAgent:
             "nologo": "true"
         }
         
-        if seed:
+        if seed is not None:
             params["seed"] = seed
         
         # URL encode the prompt and construct the image URL
@@ -173,29 +310,43 @@ class PollinationsAgent:
             "stream": True
         }
         
-        async with self.client.stream(
-            "POST",
-            f"{self.BASE_URL_TEXT}/openai",
-            json=payload,
-            headers={"Content-Type": "application/json", "Accept": "text/event-stream"}
-        ) as response:
-            # Check for HTTP errors
-            if response.status_code != 200:
-                error_text = await response.aread()
-                raise Exception(f"API error {response.status_code}: {error_text.decode()}")
-            
-            async for line in response.aiter_lines():
-                if line.startswith("data: "):
-                    data = line[6:]
-                    if data.strip() == "[DONE]":
-                        break
-                    try:
-                        chunk = json.loads(data)
-                        content = chunk.get("choices", [{}])[0].get("delta", {}).get("content")
-                        if content:
-                            yield content
-                    except json.JSONDecodeError:
-                        continue
+        async for content in self._cached_completion(payload, ToolType.SEARCH):
+            yield content
+    
+    async def analyze_image_stream(
+        self,
+        prompt: str,
+        image_id: str,
+        model: str = "openai"
+    ) -> AsyncGenerator[str, None]:
+        """
+        Describe or answer questions about an uploaded image, streaming
+        """
+        if self.vision_store is None:
+            raise RuntimeError("Análise de imagem não está habilitada")
+        image_url = await self.vision_store.data_url(image_id)
+        if image_url is None:
+            raise RuntimeError("Imagem não encontrada; envie-a novamente")
+        
+        summary, history = await self.history_store.load_with_summary(self.session_id, self.max_history)
+        messages = self.context_window.build(model, None, history, prompt, summary=summary)
+        # The image rides along with the question; history stays text only
+        messages[-1] = {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": image_url}}
+            ]
+        }
+        
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": True
+        }
+        
+        async for content in self._cached_completion(payload, ToolType.VISION):
+            yield content
     
     def _extract_text_for_tts(self, user_message: str) -> str:
         """
@@ -229,153 +380,615 @@ class PollinationsAgent:
     async def generate_audio_url(
         self,
         text: str,
-        voice: str = "nova"
+        voice: str = "nova",
+        verbatim: bool = False
     ) -> str:
         """
         Generate audio and return its URL
         """
-        from urllib.parse import quote
-        
         # Extract actual text to speak (remove trigger words)
-        clean_text = self._extract_text_for_tts(text)
-        encoded_text = quote(f"Say verbatim: {clean_text}")
-        
-        url = f"{self.BASE_URL_TEXT}/{encoded_text}"
-        params = {
-            "model": "openai-audio",
-            "voice": voice
-        }
+        clean_text = text if verbatim else self._extract_text_for_tts(text)
+        return self._audio_url(clean_text, voice)
+    
+    def _audio_url(self, text: str, voice: str) -> str:
+        """Upstream URL speaking `text`; the URL itself is the audio endpoint"""
+        from urllib.parse import quote
         
-        # The URL itself is the audio endpoint
-        return f"{url}?model={params['model']}&voice={params['voice']}"
+        encoded_text = quote(f"Say verbatim: {text}")
+        return f"{self.BASE_URL_TEXT}/{encoded_text}?model=openai-audio&voice={voice}"
     
-    async def process_message_stream(
+    def _model_candidates(self, kind: str, requested: Optional[str], default: str) -> List[str]:
+        """
+        Models to try for a text/reasoning/search request, best first
+        """
+        if requested == ModelRouter.AUTO:
+            requested = None if self.router is None else requested
+        if self.router is None:
+            return [requested or default]
+        return self.router.candidates(kind, requested) or [requested or default]
+    
+    async def _with_fallback(
         self,
-        user_message: str,
-        selected_models: Optional[Dict[str, str]] = None
+        candidates: List[str],
+        make_stream
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """
-        Process user message and stream responses with tool information
+        Stream text_chunk events from the first candidate model that starts
+        answering. A model that fails before its first chunk is skipped with
+        a model_fallback event; once text has been sent there is no switching.
         """
-        # Determine which tool to use
+        for index, model in enumerate(candidates):
+            started = False
+            try:
+                async for chunk in make_stream(model):
+                    started = True
+                    yield {"type": "text_chunk", "content": chunk}
+                return
+            except Exception as e:
+                if started or index == len(candidates) - 1:
+                    raise
+                if self.router is not None:
+                    self.router.fallbacks += 1
+                yield {
+                    "type": "model_fallback",
+                    "from": model,
+                    "to": candidates[index + 1],
+                    "reason": str(e)
+                }
+    
+    TOOL_NAMES = {
+        ToolType.TEXT_GENERATION: "💬 Geração de Texto",
+        ToolType.IMAGE_GENERATION: "🎨 Geração de Imagem",
+        ToolType.SEARCH: "🔍 Pesquisa Web",
+        ToolType.TEXT_TO_SPEECH: "🔊 Text-to-Speech",
+        ToolType.REASONING: "🧠 Raciocínio Avançado",
+        ToolType.VISION: "👁️ Análise de Imagem"
+    }
+    
+    def plan(self, user_message: str) -> List[PlanStep]:
+        """
+        Tool steps for a message: several for compound requests when a
+        planner is configured, otherwise the single routed tool
+        """
+        if self.planner is not None:
+            return self.planner.plan(user_message)
         tool_type = self._determine_tool(user_message)
-        
-        # Get selected models or use defaults
-        models = selected_models or {}
-        text_model = models.get("text", "openai")
-        search_model = models.get("search", "searchgpt")
-        reasoning_model = models.get("reasoning", "openai-reasoning")
-        image_model = models.get("image", "flux")
-        audio_voice = models.get("audio", "nova")
-        
-        # Emit tool selection
-        tool_names = {
-            ToolType.TEXT_GENERATION: "💬 Geração de Texto",
-            ToolType.IMAGE_GENERATION: "🎨 Geração de Imagem",
-            ToolType.SEARCH: "🔍 Pesquisa Web",
-            ToolType.TEXT_TO_SPEECH: "🔊 Text-to-Speech",
-            ToolType.REASONING: "🧠 Raciocínio Avançado",
-            ToolType.VISION: "👁️ Análise de Imagem"
-        }
-        
-        yield {
+        return [PlanStep(f"{tool_type.value}-1", tool_type.value, user_message)]
+    
+    def _tool_candidates(self, tool_type: ToolType, models: Dict[str, str]) -> List[str]:
+        """
+        Models to try for a tool; text-based tools go through the fallback
+        chain ("auto" = fastest)
+        """
+        if tool_type == ToolType.SEARCH:
+            return self._model_candidates("search", models.get("search"), "searchgpt")
+        if tool_type == ToolType.REASONING:
+            return self._model_candidates("reasoning", models.get("reasoning"), "openai-reasoning")
+        if tool_type == ToolType.TEXT_GENERATION:
+            return self._model_candidates("text", models.get("text"), "openai")
+        if tool_type == ToolType.IMAGE_GENERATION:
+            return [models.get("image", "flux")]
+        if tool_type == ToolType.VISION:
+            return self._model_candidates("vision", models.get("vision"), "openai")
+        return [models.get("audio", "nova")]
+    
+    @staticmethod
+    def _image_seed(models: Dict[str, str]) -> Optional[int]:
+        """Optional fixed image seed sent as models["image_seed"]"""
+        seed = models.get("image_seed")
+        return int(seed) if seed not in (None, "") and str(seed).isdigit() else None
+    
+    def _tool_selection(self, tool_type: ToolType, candidates: List[str]) -> Dict[str, Any]:
+        return {
             "type": "tool_selection",
-            "tool": tool_names.get(tool_type, "Unknown"),
-            "tool_type": tool_type.value
+            "tool": self.TOOL_NAMES.get(tool_type, "Unknown"),
+            "tool_type": tool_type.value,
+            "model": candidates[0],
+            "fallbacks": candidates[1:]
         }
+    
+    async def _tool_events(
+        self,
+        tool_type: ToolType,
+        prompt: str,
+        candidates: List[str],
+        verbatim: bool = False,
+        image_seed: Optional[int] = None,
+        image_variants: Optional[List[Dict[str, Any]]] = None,
+        image_preview: bool = True,
+        image_id: Optional[str] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Run one tool and stream its status and content events. `verbatim`
+        speaks `prompt` as is instead of looking for trigger words;
+        `image_variants` turns the image tool into a batch; `image_id` is the
+        upload the vision tool looks at.
+        """
+        if tool_type == ToolType.IMAGE_GENERATION and image_variants:
+            yield {"type": "status", "message": f"Gerando {len(image_variants)} variações..."}
+            async for event in self._image_batch_events(prompt, image_variants, image_preview):
+                yield event
         
-        # Execute the appropriate tool
-        if tool_type == ToolType.IMAGE_GENERATION:
+        elif tool_type == ToolType.IMAGE_GENERATION:
             yield {"type": "status", "message": "Gerando imagem..."}
-            image_url = await self.generate_image(user_message, model=image_model)
+            if self.image_pipeline is not None:
+                async for event in self._pipeline_image_events(prompt, candidates[0], image_seed):
+                    yield event
+                return
+            image_url = await self.generate_image(prompt, model=candidates[0], seed=image_seed)
             yield {
                 "type": "image",
                 "url": image_url,
-                "prompt": user_message
+                "prompt": prompt
             }
-            
-            # Add to conversation history (bounded)
-            self._add_to_history_bounded(
-                user_message,
-                f"Imagem gerada com sucesso! URL: {image_url}"
-            )
+        
+        elif tool_type == ToolType.VISION:
+            yield {"type": "status", "message": "Analisando imagem..."}
+            async for event in self._with_fallback(
+                candidates,
+                lambda model: self.analyze_image_stream(prompt, image_id, model=model)
+            ):
+                yield event
         
         elif tool_type == ToolType.SEARCH:
             yield {"type": "status", "message": "Pesquisando na web..."}
-            full_response = ""
-            async for chunk in self.search_web(user_message, model=search_model):
-                full_response += chunk
-                yield {
-                    "type": "text_chunk",
-                    "content": chunk
-                }
-            
-            # Add to conversation history (bounded)
-            self._add_to_history_bounded(user_message, full_response)
+            async for event in self._with_fallback(
+                candidates,
+                lambda model: self.search_web(prompt, model=model)
+            ):
+                yield event
+        
+        elif tool_type == ToolType.TEXT_TO_SPEECH and self.speech_pipeline is not None:
+            yield {"type": "status", "message": "Gerando áudio..."}
+            text = prompt if verbatim else self._extract_text_for_tts(prompt)
+            stream = self._open_speech(candidates[0])
+            stream.speak(text)
+            try:
+                async for event in stream.drain():
+                    yield event
+            finally:
+                stream.close()
+            yield {"type": "audio_end", "segments": stream.started, "text": text}
         
         elif tool_type == ToolType.TEXT_TO_SPEECH:
             yield {"type": "status", "message": "Gerando áudio..."}
-            audio_url = await self.generate_audio_url(user_message, voice=audio_voice)
+            audio_url = await self.generate_audio_url(prompt, voice=candidates[0], verbatim=verbatim)
             yield {
                 "type": "audio",
                 "url": audio_url,
-                "text": user_message
+                "text": prompt
             }
-            
-            # Add to conversation history (bounded)
-            self._add_to_history_bounded(
-                user_message,
-                "Áudio gerado com sucesso!"
-            )
         
         elif tool_type == ToolType.REASONING:
             yield {"type": "status", "message": "Pensando profundamente..."}
-            full_response = ""
-            async for chunk in self.generate_text_stream(
-                user_message,
-                model=reasoning_model,
-                system_prompt="Você é um assistente que pensa profundamente sobre problemas complexos."
+            async for event in self._with_fallback(
+                candidates,
+                lambda model: self.generate_text_stream(
+                    prompt,
+                    model=model,
+                    system_prompt="Você é um assistente que pensa profundamente sobre problemas complexos.",
+                    tool_type=ToolType.REASONING
+                )
             ):
-                full_response += chunk
-                yield {
-                    "type": "text_chunk",
-                    "content": chunk
-                }
-            
-            # Add to conversation history (bounded)
-            self._add_to_history_bounded(user_message, full_response)
+                yield event
         
         else:  # TEXT_GENERATION
             yield {"type": "status", "message": "Gerando resposta..."}
-            full_response = ""
-            async for chunk in self.generate_text_stream(
-                user_message,
-                model=text_model,
-                system_prompt="Você é um assistente útil e amigável que responde em português."
+            async for event in self._with_fallback(
+                candidates,
+                lambda model: self.generate_text_stream(
+                    prompt,
+                    model=model,
+                    system_prompt="Você é um assistente útil e amigável que responde em português."
+                )
             ):
-                full_response += chunk
+                yield event
+    
+    async def _pipeline_image_events(
+        self,
+        prompt: str,
+        model: str,
+        seed: Optional[int] = None,
+        width: int = 1024,
+        height: int = 1024
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Fetch the image into the media cache, streaming download progress,
+        and point the client at the local copy. Falls back to the upstream
+        URL if the fetch fails.
+        """
+        # An explicit seed makes the image reproducible, so repeats are cache
+        # hits; otherwise pick one so every request still gets a new image
+        if seed is None:
+            seed = random.randint(1, 2 ** 31 - 1)
+        upstream_url = await self.generate_image(prompt, model=model, width=width, height=height, seed=seed)
+        key = media_key(prompt=prompt, model=model, width=width, height=height, seed=seed)
+        try:
+            async for event in self.image_pipeline.fetch(key, upstream_url):
+                if event["type"] != "image_ready":
+                    yield event
+                    continue
                 yield {
-                    "type": "text_chunk",
-                    "content": chunk
+                    "type": "image",
+                    "url": event["url"],
+                    "prompt": prompt,
+                    "cached": event["cached"],
+                    "seed": seed
                 }
-            
-            # Add to conversation history (bounded)
-            self._add_to_history_bounded(user_message, full_response)
+        except Exception as e:
+            yield {"type": "status", "message": f"Cache de imagens indisponível ({e}), carregando direto..."}
+            yield {"type": "image", "url": upstream_url, "prompt": prompt, "seed": seed}
+    
+    async def _image_variant(self, prompt: str, variant: Dict[str, Any], preview: bool) -> Dict[str, Any]:
+        """
+        Generate one variant (or its low-resolution preview) and return its
+        image/image_preview event
+        """
+        width, height = variant["width"], variant["height"]
+        if preview:
+            # Same seed and aspect ratio, a fraction of the pixels
+            scale = self.IMAGE_PREVIEW_SIZE / max(width, height)
+            width, height = max(64, int(width * scale)), max(64, int(height * scale))
+        if self.image_pipeline is None:
+            url = await self.generate_image(
+                prompt, model=variant["model"], width=width, height=height, seed=variant["seed"]
+            )
+        else:
+            url = None
+            async for event in self._pipeline_image_events(
+                prompt, variant["model"], variant["seed"], width=width, height=height
+            ):
+                if event["type"] == "image":
+                    url = event["url"]
+        return {
+            "type": "image_preview" if preview else "image",
+            "url": url,
+            "prompt": prompt,
+            **variant
+        }
+    
+    async def _image_batch_events(
+        self,
+        prompt: str,
+        variants: List[Dict[str, Any]],
+        preview: bool = True
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Fan out the variants of a batch over a bounded pool and stream each
+        image as soon as it is ready, not in request order. Previews of all
+        variants are queued ahead of the full-resolution images.
+        """
+        variants = [{"variant": index, **variant} for index, variant in enumerate(variants)]
+        yield {"type": "image_batch", "variants": variants, "preview": preview}
+        
+        jobs: asyncio.Queue = asyncio.Queue()
+        for is_preview in ([True, False] if preview else [False]):
+            for variant in variants:
+                jobs.put_nowait((variant, is_preview))
+        results: asyncio.Queue = asyncio.Queue()
+        total = jobs.qsize()
+        
+        async def worker():
+            while not jobs.empty():
+                variant, is_preview = jobs.get_nowait()
+                try:
+                    event = await self._image_variant(prompt, variant, is_preview)
+                except Exception as e:
+                    event = {
+                        "type": "image_error",
+                        "variant": variant["variant"],
+                        "preview": is_preview,
+                        "message": str(e)
+                    }
+                await results.put(event)
+        
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.IMAGE_BATCH_CONCURRENCY, total))]
+        try:
+            for _ in range(total):
+                yield await results.get()
+        finally:
+            for task in workers:
+                task.cancel()
+    
+    def _open_speech(self, voice: str) -> SpeechStream:
+        return self.speech_pipeline.open(voice, lambda text: self._audio_url(text, voice))
+    
+    async def _speak_events(
+        self,
+        events: AsyncGenerator[Dict[str, Any], None],
+        voice: str
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Pass a text tool's events through while speaking its answer: each
+        sentence is sent to TTS as soon as it has streamed, and its
+        audio_segment event is merged into the stream once ready.
+        """
+        stream = self._open_speech(voice)
+        next_event: Optional[asyncio.Future] = asyncio.ensure_future(events.__anext__())
+        try:
+            while next_event is not None:
+                head = stream.head()
+                await asyncio.wait({next_event, head} if head else {next_event}, return_when=asyncio.FIRST_COMPLETED)
+                for event in stream.ready():
+                    yield event
+                if not next_event.done():
+                    continue
+                try:
+                    event = next_event.result()
+                except StopAsyncIteration:
+                    next_event = None
+                    break
+                next_event = asyncio.ensure_future(events.__anext__())
+                if event["type"] == "text_chunk":
+                    stream.feed(event["content"])
+                yield event
+            stream.finish()
+            async for event in stream.drain():
+                yield event
+            if stream.started:
+                yield {"type": "audio_end", "segments": stream.started}
+        finally:
+            if next_event is not None:
+                next_event.cancel()
+                await asyncio.gather(next_event, return_exceptions=True)
+            await events.aclose()
+            stream.close()
+    
+    @staticmethod
+    def _history_text(event: Dict[str, Any], text: str) -> str:
+        """
+        What a tool's answer looks like in the conversation history
+        """
+        if event["type"] == "text_chunk":
+            return text + event["content"]
+        if event["type"] == "image" and "variant" in event:
+            line = f"Variação {event['variant'] + 1} ({event['model']}, seed {event['seed']}): {event['url']}"
+            return f"{text}\n{line}" if text else f"Imagens geradas com sucesso!\n{line}"
+        if event["type"] == "image":
+            return f"Imagem gerada com sucesso! URL: {event['url']}"
+        if event["type"] in ("audio", "audio_end") and not text:
+            return "Áudio gerado com sucesso!"
+        return text
+    
+    async def process_message_stream(
+        self,
+        user_message: str,
+        selected_models: Optional[Dict[str, str]] = None,
+        tool_type: Optional[ToolType] = None,
+        plan: Optional[List[PlanStep]] = None,
+        image_variants: Optional[List[Dict[str, Any]]] = None,
+        image_preview: bool = True,
+        speak: bool = False,
+        image_id: Optional[str] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Process user message and stream responses with tool information.
+        `image_variants` (seed/model/width/height dicts) makes the image tool
+        generate a batch; `speak` reads a text answer aloud while it streams
+        (needs a speech pipeline); `image_id` (an upload) asks the vision
+        tool about that image.
+        """
+        # Get selected models or use defaults
+        models = selected_models or {}
+        
+        # A message with an attached image is always about that image
+        if image_id is not None and tool_type is None:
+            tool_type = ToolType.VISION
+        
+        # Determine which tool(s) to use (unless the caller already did)
+        if tool_type is None:
+            plan = plan or self.plan(user_message)
+            if len(plan) > 1:
+                async for event in self._run_plan(user_message, plan, models):
+                    yield event
+                return
+            tool_type = ToolType(plan[0].tool)
+        
+        candidates = self._tool_candidates(tool_type, models)
+        
+        # Emit tool selection
+        yield self._tool_selection(tool_type, candidates)
+        
+        # Execute the appropriate tool
+        full_response = ""
+        events = self._tool_events(
+            tool_type,
+            user_message,
+            candidates,
+            image_seed=self._image_seed(models),
+            image_variants=image_variants,
+            image_preview=image_preview,
+            image_id=image_id
+        )
+        if speak and self.speech_pipeline is not None and (tool_type.value in TEXT_TOOLS or tool_type == ToolType.VISION):
+            events = self._speak_events(events, models.get("audio", "nova"))
+        finished = False
+        try:
+            # aclosing: a cancelled stream closes the tool (and its upstream
+            # request) right away instead of whenever it is collected
+            async with aclosing(events):
+                async for event in events:
+                    full_response = self._history_text(event, full_response)
+                    yield event
+            finished = True
+        finally:
+            if not finished:
+                self._record_interrupted(user_message, full_response)
+        
+        # Add to conversation history (bounded)
+        await self._add_to_history_bounded(user_message, full_response)
         
         # Signal completion
         yield {"type": "done"}
+        
+        # The user already has the whole answer, so summarizing is off the
+        # hot path. If the stream is closed before this point, trimmed
+        # messages wait for the next turn.
+        self._schedule_summary()
     
-    def _add_to_history_bounded(self, user_message: str, assistant_response: str):
+    async def _run_plan(
+        self,
+        user_message: str,
+        plan: List[PlanStep],
+        models: Dict[str, str]
+    ) -> AsyncGenerator[Dict[str, Any], None]:
         """
-        Add messages to history and keep it bounded to prevent unbounded growth
+        Run the steps of a compound request concurrently and multiplex their
+        events into one stream, each tagged with its step's tool_id. A step
+        with depends_on waits for that step's text and builds on it.
         """
-        self.conversation_history.append({"role": "user", "content": user_message})
-        self.conversation_history.append({"role": "assistant", "content": assistant_response})
+        yield {"type": "plan", "steps": [step.to_dict() for step in plan]}
         
-        # Keep only last 10 messages (5 exchanges)
-        if len(self.conversation_history) > 10:
-            self.conversation_history = self.conversation_history[-10:]
+        queue: asyncio.Queue = asyncio.Queue()
+        outputs: Dict[str, asyncio.Future] = {
+            step.id: asyncio.get_running_loop().create_future() for step in plan
+        }
+        
+        async def run(step: PlanStep):
+            tool_type = ToolType(step.tool)
+            candidates = self._tool_candidates(tool_type, models)
+            text = ""
+            try:
+                await queue.put({**self._tool_selection(tool_type, candidates), "tool_id": step.id})
+                prompt, verbatim = step.prompt, False
+                if step.depends_on is not None:
+                    await queue.put({"type": "status", "message": "Aguardando resultado anterior...", "tool_id": step.id})
+                    try:
+                        source = await outputs[step.depends_on]
+                    except Exception:
+                        raise RuntimeError(f"A etapa {step.depends_on} falhou")
+                    if tool_type == ToolType.TEXT_TO_SPEECH:
+                        prompt, verbatim = truncate_to_tokens(source, self.SPOKEN_RESULT_TOKENS), True
+                    else:
+                        prompt = f"{step.prompt}\n\nResultado da pesquisa:\n{source}"
+                async for event in self._tool_events(
+                    tool_type, prompt, candidates, verbatim=verbatim, image_seed=self._image_seed(models)
+                ):
+                    text = self._history_text(event, text)
+                    await queue.put({**event, "tool_id": step.id})
+                outputs[step.id].set_result(text)
+                await queue.put({"type": "tool_done", "tool_id": step.id})
+            except Exception as e:
+                outputs[step.id].set_exception(e)
+                await queue.put({"type": "error", "message": str(e), "tool_id": step.id})
+            finally:
+                # Dependants of a failed step fail too instead of waiting forever
+                if not outputs[step.id].done():
+                    outputs[step.id].cancel()
+                # Retrieve the result so a failure is never reported as unhandled
+                if not outputs[step.id].cancelled():
+                    outputs[step.id].exception()
+                await queue.put(None)
+        
+        tasks = [asyncio.create_task(run(step)) for step in plan]
+        texts: Dict[str, str] = {}
+        finished = False
+        try:
+            running = len(tasks)
+            while running:
+                event = await queue.get()
+                if event is None:
+                    running -= 1
+                else:
+                    texts[event["tool_id"]] = self._history_text(event, texts.get(event["tool_id"], ""))
+                    yield event
+            finished = True
+        finally:
+            # Client went away: stop the steps still running
+            for task in tasks:
+                task.cancel()
+            if not finished:
+                self._record_interrupted(
+                    user_message,
+                    "\n\n".join(texts[step.id] for step in plan if texts.get(step.id))
+                )
+        
+        # One history entry for the whole request, sections in plan order
+        sections = []
+        for step in plan:
+            future = outputs[step.id]
+            if not future.cancelled() and future.exception() is None and future.result():
+                sections.append(future.result())
+        await self._add_to_history_bounded(user_message, "\n\n".join(sections))
+        
+        yield {"type": "done"}
+        self._schedule_summary()
+    
+    async def get_history(self, limit: Optional[int] = None) -> List[Dict]:
+        """
+        Return the most recent messages of this session, oldest first
+        """
+        return await self.history_store.load(self.session_id, limit or self.max_history)
+    
+    async def _add_to_history_bounded(self, user_message: str, assistant_response: str):
+        """
+        Add messages to history and keep it bounded to prevent unbounded growth
+        """
+        # One write per turn; the store trims to the last max_history messages
+        # (default 10 = 5 exchanges)
+        trimmed = await self.history_store.append(
+            self.session_id,
+            [
+                {"role": "user", "content": user_message},
+                {"role": "assistant", "content": assistant_response}
+            ],
+            self.max_history,
+            keep_trimmed=self.summarizer is not None
+        )
+        if self.summarizer is not None and trimmed:
+            self._summary_due = True
+    
+    def _spawn(self, coro):
+        """Run `coro` in a background task that close() waits for"""
+        task = asyncio.create_task(coro)
+        # Keep a reference until it finishes so it is not garbage collected
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+    
+    def _record_interrupted(self, user_message: str, partial: str):
+        """
+        Save what was sent of a cancelled or failed answer. Runs in the
+        background: the stream being torn down may itself be cancelled.
+        """
+        if partial:
+            self._spawn(self._add_to_history_bounded(user_message, partial + self.INTERRUPTED_MARK))
+    
+    def _schedule_summary(self):
+        """
+        Fold trimmed messages into the session summary in a background task
+        """
+        if not self._summary_due:
+            return
+        self._summary_due = False
+        self._spawn(self._update_summary())
+    
+    async def _update_summary(self):
+        """
+        Incrementally update the stored summary with the pending messages.
+        Updates of one session run one at a time, each folding in whatever
+        messages are pending when it starts; they stay pending until the new
+        summary is saved, so a cancelled or failed update loses nothing. The
+        call bypasses the router and the circuit breakers, which measure
+        user-facing traffic.
+        """
+        async with self._summary_lock:
+            epoch = self._history_epoch
+            messages = await self.history_store.load_pending(self.session_id)
+            if not messages:
+                return
+            previous = await self.history_store.load_summary(self.session_id)
+            summary = await self.summarizer.update(self._request_completion, previous, messages)
+            if epoch == self._history_epoch:
+                await self.history_store.save_summary(self.session_id, summary, len(messages))
+    
+    async def get_summary(self) -> Optional[str]:
+        """
+        Return the rolling summary of the turns trimmed from the history
+        """
+        return await self.history_store.load_summary(self.session_id)
     
-    def clear_history(self):
-        """Clear conversation history"""
-        self.conversation_history = []
+    async def clear_history(self):
+        """Clear conversation history and its summary"""
+        self._summary_due = False
+        self._history_epoch += 1
+        await self.history_store.clear(self.session_id)
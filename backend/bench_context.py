@@ -0,0 +1,72 @@
+"""
+Benchmark: upstream payload size, fixed last-6 history vs. the token budget
+Run with: python bench_context.py [--turns N] [--answer-words W]
+
+Builds a conversation whose answers are long (search results, essays) and
+compares the JSON payload the agent sends for the next message, plus the
+time spent assembling it.
+"""
+import argparse
+import json
+import random
+import time
+
+from context import ContextWindow, message_tokens
+
+
+def old_messages(system_prompt, history, prompt):
+    """What generate_text_stream sent before: the last 6 messages verbatim"""
+    messages = [{"role": "system", "content": system_prompt}]
+    messages.extend(history[-6:])
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def make_history(turns: int, answer_words: int, rng: random.Random):
+    words = "o modelo responde com um texto longo sobre vários assuntos diferentes e detalhados".split()
+    history = []
+    for i in range(turns):
+        answer = ". ".join(
+            " ".join(rng.choice(words) for _ in range(12)) for _ in range(answer_words // 12)
+        )
+        history.append({"role": "user", "content": f"pergunta número {i} sobre um assunto"})
+        history.append({"role": "assistant", "content": answer})
+    return history
+
+
+def measure(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=5, help="past exchanges in the history")
+    parser.add_argument("--answer-words", type=int, default=800, help="words per assistant answer")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    history = make_history(args.turns, args.answer_words, random.Random(42))
+    system_prompt = "Você é um assistente útil."
+    prompt = "e o que mais?"
+    window = ContextWindow()
+
+    print(f"{'model':<20}{'old bytes':>12}{'new bytes':>12}{'old tokens':>12}{'new tokens':>12}{'build (µs)':>12}")
+    for model in ["openai-fast", "mistral", "openai", "openai-reasoning"]:
+        old = old_messages(system_prompt, history, prompt)
+        new = window.build(model, system_prompt, history, prompt)
+        old_bytes = len(json.dumps({"model": model, "messages": old}).encode())
+        new_bytes = len(json.dumps({"model": model, "messages": new}).encode())
+        elapsed = measure(lambda: window.build(model, system_prompt, history, prompt), args.repeat)
+        print(
+            f"{model:<20}{old_bytes:>12}{new_bytes:>12}"
+            f"{sum(map(message_tokens, old)):>12}{sum(map(message_tokens, new)):>12}{elapsed * 1e6:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Benchmark: per-message tool routing latency of the intent classifier
+Run with: python bench_intent.py [--model intent_model.npz] [--repeat N]
+
+Without --model a classifier is trained on routing_corpus.jsonl first.
+Needs numpy.
+"""
+import argparse
+import os
+import time
+
+from intent import ClassifierRouter, IntentClassifier, hashed_features, load_corpus
+from tool_router import ToolRouter
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "routing_corpus.jsonl")
+
+
+def per_message(fn, messages, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for message in messages:
+            fn(message)
+        best = min(best, time.perf_counter() - start)
+    return best / len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", help="trained .npz model (default: train on the corpus)")
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    samples = load_corpus(args.corpus)
+    messages = [text for text, _ in samples]
+    classifier = IntentClassifier.load(args.model) if args.model else IntentClassifier.train(samples)
+    keywords = ToolRouter()
+    router = ClassifierRouter(classifier, keywords)
+
+    cases = [
+        ("hashed features", lambda m: hashed_features(m, classifier.dim)),
+        ("classifier predict", classifier.predict),
+        ("classifier + keyword fallback", router.route),
+        ("keyword router only", keywords.route),
+    ]
+    print(f"{len(messages)} messages, {classifier.dim} buckets, {len(classifier.classes)} tools")
+    for name, fn in cases:
+        print(f"  {name:<32}{per_message(fn, messages, args.repeat) * 1e6:8.1f} µs/message")
+
+
+if __name__ == "__main__":
+    main()
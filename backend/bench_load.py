@@ -0,0 +1,296 @@
+"""
+Load test: concurrent streaming clients against /chat, with a fake upstream
+Run with: python bench_load.py [--clients 50] [--requests 500] [--output results.json] [upstream options]
+
+Starts the fake Pollinations upstream (fake_upstream.py) in this process and
+the backend (uvicorn main:app) as a subprocess pointed at it, then keeps
+`--clients` concurrent sessions streaming /chat until `--requests` have
+finished. Reports requests/s, p50/p95/p99 time to first token and total
+time, and the backend's CPU time per stream and RSS (Linux /proc).
+
+Results are written as JSON (--output) with the git commit, so runs can be
+compared between commits: --baseline previous.json prints the differences.
+--url drives an already running backend instead (no CPU/RSS figures).
+Backend settings go through --env, e.g. --env ADMISSION_ENABLED=0.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from fake_upstream import FakeUpstream, add_config_arguments, config_from_args
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+MESSAGE = "Explique como funciona a fotossíntese em detalhes"
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile, None without values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def distribution_ms(values: List[float]) -> Dict[str, Optional[float]]:
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        "p50": ms(percentile(values, 50)),
+        "p95": ms(percentile(values, 95)),
+        "p99": ms(percentile(values, 99)),
+        "max": ms(max(values) if values else None),
+    }
+
+
+def process_usage(pid: int) -> Optional[Dict[str, float]]:
+    """CPU seconds and RSS of a process from /proc, None where unavailable"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Fields after the command name; utime and stime are 14 and 15
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        memory = {}
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "VmHWM"):
+                    memory[name] = int(value.split()[0]) / 1024
+        return {
+            "cpu_s": (int(fields[11]) + int(fields[12])) / ticks,
+            "rss_mb": memory.get("VmRSS", 0.0),
+            "rss_peak_mb": memory.get("VmHWM", 0.0),
+        }
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_backend(port: int, upstream_url: str, env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env={
+            **os.environ,
+            "POLLINATIONS_TEXT_URL": upstream_url,
+            "UPSTREAM_WARM_URLS": f"{upstream_url}/",
+            **env,
+        },
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, url: str, backend: Optional[subprocess.Popen], timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if backend is not None and backend.poll() is not None:
+            raise RuntimeError(f"backend exited with code {backend.returncode}")
+        try:
+            if (await client.get(f"{url}/api")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"backend at {url} did not start within {timeout:.0f}s")
+
+
+async def chat(client: httpx.AsyncClient, url: str, session_id: str, message: str) -> Dict[str, Any]:
+    """One streamed /chat request, timed from the client's side"""
+    started = time.perf_counter()
+    ttft = None
+    chunks = 0
+    error = None
+    try:
+        async with client.stream(
+            "POST", f"{url}/chat",
+            json={"message": message, "models": {"text": "openai"}},
+            headers={"X-Session-ID": session_id}
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                error = f"HTTP {response.status_code}"
+            else:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    event = json.loads(line[6:])
+                    if event["type"] == "text_chunk":
+                        if ttft is None:
+                            ttft = time.perf_counter() - started
+                        chunks += 1
+                    elif event["type"] == "error":
+                        error = event["message"]
+    except httpx.HTTPError as e:
+        error = f"{type(e).__name__}: {e}"
+    return {"ttft": ttft, "duration": time.perf_counter() - started, "chunks": chunks, "error": error}
+
+
+async def drive(url: str, clients: int, requests: int, message: str, identical: bool = False) -> Dict[str, Any]:
+    """
+    Run `requests` chats over `clients` concurrent sessions. Messages are
+    numbered unless `identical`, as identical concurrent requests share one
+    upstream stream (single flight).
+    """
+    results: List[Dict[str, Any]] = []
+    remaining = requests
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    timeout = httpx.Timeout(10.0, read=120.0)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        async def session():
+            nonlocal remaining
+            session_id = f"loadtest-{uuid.uuid4().hex}"
+            while remaining > 0:
+                remaining -= 1
+                text = message if identical else f"{message} ({requests - remaining})"
+                results.append(await chat(client, url, session_id, text))
+
+        started = time.perf_counter()
+        await asyncio.gather(*[session() for _ in range(clients)])
+        wall = time.perf_counter() - started
+
+    ok = [r for r in results if r["error"] is None]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if r["error"] is not None:
+            errors[r["error"][:80]] = errors.get(r["error"][:80], 0) + 1
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "failed": len(results) - len(ok),
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "requests_per_s": round(len(results) / wall, 2),
+        "text_frames_per_s": round(sum(r["chunks"] for r in results) / wall, 1),
+        "ttft_ms": distribution_ms([r["ttft"] for r in ok if r["ttft"] is not None]),
+        "duration_ms": distribution_ms([r["duration"] for r in ok]),
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]):
+    """Print the headline numbers next to a previous run's"""
+    def pick(run, path):
+        value = run
+        for key in path:
+            value = (value or {}).get(key)
+        return value
+
+    print(f"\nvs baseline {baseline.get('commit') or '?'} ({baseline.get('timestamp', '?')}):")
+    for label, path in [
+        ("requests/s", ("results", "requests_per_s")),
+        ("ttft p50 ms", ("results", "ttft_ms", "p50")),
+        ("ttft p95 ms", ("results", "ttft_ms", "p95")),
+        ("ttft p99 ms", ("results", "ttft_ms", "p99")),
+        ("cpu ms/stream", ("backend", "cpu_ms_per_stream")),
+        ("rss peak MB", ("backend", "rss_peak_mb")),
+    ]:
+        new, old = pick(current, path), pick(baseline, path)
+        if new is None or old is None:
+            continue
+        change = f"{(new / old - 1) * 100:+.1f}%" if old else "n/a"
+        print(f"  {label:<15} {old:>10} -> {new:<10} {change}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50, help="concurrent streaming sessions")
+    parser.add_argument("--requests", type=int, default=500, help="total /chat requests")
+    parser.add_argument("--warmup", type=int, default=10, help="requests before measuring")
+    parser.add_argument("--message", default=MESSAGE)
+    parser.add_argument("--identical", action="store_true", help="same message every time (measures coalescing)")
+    parser.add_argument("--url", help="existing backend to drive instead of starting one")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="backend environment")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON of a previous run to compare with")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(config_from_args(args))
+    upstream_url = await upstream.start()
+    backend = None
+    url = args.url
+    if url is None:
+        url = f"http://127.0.0.1:{free_port()}"
+        env = dict(item.split("=", 1) for item in args.env)
+        backend = start_backend(int(url.rsplit(":", 1)[1]), upstream_url, env)
+
+    try:
+        async with httpx.AsyncClient() as client:
+            await wait_ready(client, url, backend)
+        if args.warmup:
+            await drive(url, min(args.clients, args.warmup), args.warmup, args.message, args.identical)
+
+        before = process_usage(backend.pid) if backend else None
+        print(f"{args.requests} requests from {args.clients} clients against {url}")
+        results = await drive(url, args.clients, args.requests, args.message, args.identical)
+        after = process_usage(backend.pid) if backend else None
+    finally:
+        if backend is not None:
+            backend.terminate()
+            try:
+                backend.wait(10)
+            except subprocess.TimeoutExpired:
+                backend.kill()
+        await upstream.stop()
+
+    usage = None
+    if before and after:
+        cpu = after["cpu_s"] - before["cpu_s"]
+        usage = {
+            "cpu_s": round(cpu, 3),
+            "cpu_ms_per_stream": round(cpu / results["requests"] * 1000, 3),
+            "cpu_utilization": round(cpu / results["wall_s"], 3),
+            "rss_mb": round(after["rss_mb"], 1),
+            "rss_peak_mb": round(after["rss_peak_mb"], 1),
+        }
+
+    run = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "config": {
+            "clients": args.clients,
+            "requests": args.requests,
+            "message": args.message,
+            "identical": args.identical,
+            "backend_env": args.env,
+            "upstream": upstream.config.to_dict(),
+        },
+        "results": results,
+        "backend": usage,
+        "upstream": upstream.stats(),
+    }
+
+    print(json.dumps({"results": results, "backend": usage}, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2, ensure_ascii=False)
+        print(f"Saved to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(run, json.load(f))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""
+Benchmark: cost of the /metrics instrumentation on the streaming hot path
+Run with: python bench_metrics.py [--tokens N] [--repeat R]
+
+Streams `--tokens` text deltas through the same layers a /chat request goes
+through (upstream SSE parsing, agent events, SSE frames) with and without
+ChatMetrics, and reports the added cost per delta. `--no-parse` feeds the
+deltas from memory instead of parsing upstream SSE bytes, the worst case
+for the relative overhead.
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Optional
+
+from metrics import ChatMetrics
+from sse import FlushPolicy, encode_events, iter_delta_content
+
+
+def upstream_bytes(tokens: int, read_size: int = 4096) -> list:
+    """Upstream SSE body split into socket-sized reads"""
+    body = b"".join(
+        f"data: {json.dumps({'choices': [{'delta': {'content': ' palavra' if i % 3 else ' ação'}}]})}\n\n".encode()
+        for i in range(tokens)
+    )
+    return [body[i:i + read_size] for i in range(0, len(body), read_size)]
+
+
+async def upstream(tokens: int, reads: Optional[list]):
+    if reads is None:
+        for i in range(tokens):
+            yield " palavra" if i % 3 else " ação"
+        return
+
+    async def socket():
+        for chunk in reads:
+            yield chunk
+
+    async for content in iter_delta_content(socket()):
+        yield content
+
+
+async def agent_events(source):
+    yield {"type": "tool_selection", "tool_type": "text_generation", "model": "openai"}
+    async for chunk in source:
+        yield {"type": "text_chunk", "content": chunk}
+    yield {"type": "done"}
+
+
+async def plain(tokens: int, reads: Optional[list]) -> int:
+    size = 0
+    async for frame in encode_events(agent_events(upstream(tokens, reads)), FlushPolicy.per_token()):
+        size += len(frame)
+    return size
+
+
+async def instrumented(metrics: ChatMetrics, tokens: int, reads: Optional[list]) -> int:
+    trace = metrics.trace()
+    trace.routed("text_generation", 0.0)
+    source = metrics.observe_stream("text_generation", "openai", upstream(tokens, reads))
+    async for frame in encode_events(trace.events(agent_events(source)), FlushPolicy.per_token()):
+        trace.wrote(len(frame))
+    trace.finish("completed")
+    return trace.bytes
+
+
+async def measure(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--no-parse", action="store_true", help="deltas from memory, no upstream SSE parsing")
+    args = parser.parse_args()
+
+    reads = None if args.no_parse else upstream_bytes(args.tokens)
+
+    metrics = ChatMetrics()
+    base = await measure(lambda: plain(args.tokens, reads), args.repeat)
+    timed = await measure(lambda: instrumented(metrics, args.tokens, reads), args.repeat)
+    per_token = (timed - base) / args.tokens
+
+    source = "in-memory deltas" if args.no_parse else "parsed upstream SSE"
+    print(f"{args.tokens} text deltas ({source}), per-token SSE frames, best of {args.repeat}")
+    print(f"  {'without metrics':<20} {base * 1000:8.2f} ms  {base / args.tokens * 1e9:8.0f} ns/delta")
+    print(f"  {'with metrics':<20} {timed * 1000:8.2f} ms  {timed / args.tokens * 1e9:8.0f} ns/delta")
+    print(f"  {'overhead':<20} {(timed / base - 1) * 100:7.1f} %   {per_token * 1e9:8.0f} ns/delta")
+
+    start = time.perf_counter()
+    text = metrics.render()
+    print(f"  render /metrics      {(time.perf_counter() - start) * 1e6:8.0f} µs  {len(text)} bytes")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
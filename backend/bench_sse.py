@@ -0,0 +1,95 @@
+"""
+Microbenchmark: upstream SSE decoding, old line loop vs. shared decoder
+Run with: python bench_sse.py [--chunks N] [--read-size BYTES]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from sse import iter_delta_content
+
+
+def build_stream(chunks: int) -> bytes:
+    """Build a realistic OpenAI-style SSE body with small token deltas"""
+    words = ["Olá", " mundo", ",", " isto", " é", " um", " teste", " de", " \"streaming\"", " ação", "\n"]
+    parts = []
+    for i in range(chunks):
+        chunk = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "openai",
+            "choices": [{"index": 0, "delta": {"content": words[i % len(words)]}, "finish_reason": None}]
+        }
+        # Compact, non-ASCII-preserving JSON like a Node.js upstream sends
+        parts.append(b"data: " + json.dumps(chunk, separators=(",", ":"), ensure_ascii=False).encode() + b"\n\n")
+    parts.append(b"data: [DONE]\n\n")
+    return b"".join(parts)
+
+
+def make_response(body: bytes, read_size: int) -> httpx.Response:
+    async def stream():
+        for i in range(0, len(body), read_size):
+            yield body[i:i + read_size]
+    return httpx.Response(200, content=stream())
+
+
+async def old_loop(response: httpx.Response) -> int:
+    """The loop generate_text_stream/search_web used before the shared decoder"""
+    total = 0
+    async for line in response.aiter_lines():
+        if line.startswith("data: "):
+            data = line[6:]
+            if data.strip() == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+                content = chunk.get("choices", [{}])[0].get("delta", {}).get("content")
+                if content:
+                    total += len(content)
+            except json.JSONDecodeError:
+                continue
+    return total
+
+
+async def new_loop(response: httpx.Response) -> int:
+    total = 0
+    async for content in iter_delta_content(response.aiter_bytes()):
+        total += len(content)
+    return total
+
+
+async def measure(loop_fn, body: bytes, read_size: int, repeat: int):
+    best = float("inf")
+    result = 0
+    for _ in range(repeat):
+        response = make_response(body, read_size)
+        start = time.perf_counter()
+        result = await loop_fn(response)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--read-size", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    body = build_stream(args.chunks)
+    old_time, old_total = await measure(old_loop, body, args.read_size, args.repeat)
+    new_time, new_total = await measure(new_loop, body, args.read_size, args.repeat)
+    assert old_total == new_total, "decoders disagree"
+
+    print(f"{args.chunks} chunks, {len(body) / 1024:.0f} KiB, {args.read_size} B reads")
+    print(f"  old aiter_lines + json.loads: {old_time * 1000:8.1f} ms  ({args.chunks / old_time:,.0f} chunks/s)")
+    print(f"  shared SSE decoder:           {new_time * 1000:8.1f} ms  ({args.chunks / new_time:,.0f} chunks/s)")
+    print(f"  speedup: {old_time / new_time:.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
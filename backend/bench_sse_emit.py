@@ -0,0 +1,72 @@
+"""
+Benchmark: /chat SSE emission with and without text chunk coalescing
+Run with: python bench_sse_emit.py [--tokens N] [--burst K] [--interval-ms MS]
+
+The fake agent emits `--tokens` small text chunks in bursts of `--burst`
+every `--interval-ms`, like deltas arriving from upstream network reads.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from sse import FlushPolicy, encode_events
+
+
+async def fake_agent_events(tokens: int, burst: int, interval: float):
+    yield {"type": "tool_selection", "tool": "💬 Geração de Texto", "tool_type": "text_generation"}
+    yield {"type": "status", "message": "Gerando resposta..."}
+    for i in range(tokens):
+        if interval and i % burst == 0:
+            await asyncio.sleep(interval)
+        yield {"type": "text_chunk", "content": " palavra" if i % 3 else " ação"}
+    yield {"type": "done"}
+
+
+async def legacy_frames(events):
+    """The per-event json.dumps loop event_generator used before"""
+    async for event in events:
+        yield f"data: {json.dumps(event)}\n\n"
+
+
+async def run(name: str, frames_factory):
+    frames = 0
+    size = 0
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    async for frame in frames_factory():
+        frames += 1
+        size += len(frame)
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    print(
+        f"  {name:<28} {frames:7d} frames {size / 1024:8.1f} KiB  "
+        f"{frames / wall:10,.0f} frames/s {size / wall / 1024:10,.0f} KiB/s  cpu {cpu * 1000:7.1f} ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--burst", type=int, default=8)
+    parser.add_argument("--interval-ms", type=float, default=0.0)
+    parser.add_argument("--max-bytes", type=int, default=2048)
+    parser.add_argument("--max-delay-ms", type=float, default=25.0)
+    args = parser.parse_args()
+
+    interval = args.interval_ms / 1000.0
+
+    def events():
+        return fake_agent_events(args.tokens, args.burst, interval)
+
+    print(f"{args.tokens} text chunks, bursts of {args.burst} every {args.interval_ms} ms")
+    await run("legacy json.dumps/token", lambda: legacy_frames(events()))
+    await run("per-token (pre-encoded)", lambda: encode_events(events(), FlushPolicy.per_token()))
+    await run(
+        f"coalesced {args.max_bytes}B/{args.max_delay_ms:g}ms",
+        lambda: encode_events(events(), FlushPolicy(args.max_bytes, args.max_delay_ms))
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""
+Benchmark: tool routing, old linear keyword scans vs. the compiled router
+Run with: python bench_tool_router.py [--words N] [--extra-keywords K]
+
+Measures per-message latency on short corpus messages, on long messages
+(`--words` words) and with `--extra-keywords` synthetic keywords per tool,
+and prints the routing accuracy of both on routing_corpus.jsonl.
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from tool_router import DEFAULT_KEYWORDS, ToolRouter
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "routing_corpus.jsonl")
+
+# The lists _determine_tool rebuilt and scanned one after the other
+OLD_KEYWORDS = [
+    ("image_generation", ["imagem", "desenhe", "crie uma imagem", "gere uma imagem", "picture", "draw", "image", "foto", "ilustração"]),
+    ("search", ["pesquise", "busque", "procure", "search", "find", "latest", "news", "notícias", "o que está acontecendo"]),
+    ("text_to_speech", ["fale", "diga", "áudio", "voz", "speak", "say", "audio", "voice"]),
+    ("reasoning", ["pense", "raciocine", "analise profundamente", "think", "reason", "analyze deeply", "complexo"]),
+]
+
+
+def make_old_router(keywords):
+    def route(message: str) -> str:
+        message_lower = message.lower()
+        for tool, words in keywords:
+            if any(keyword in message_lower for keyword in list(words)):
+                return tool
+        return "text_generation"
+    return route
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def synthetic_keywords(count: int, rng: random.Random):
+    """Pseudo-words that never occur in the messages"""
+    letters = "bcdfghjklmnpqrstvwxz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(6, 10))) for _ in range(count)]
+
+
+def measure(route, messages, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for message in messages:
+            route(message)
+        best = min(best, time.perf_counter() - start)
+    return best / len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--words", type=int, default=2000, help="words per long message")
+    parser.add_argument("--extra-keywords", type=int, default=500, help="synthetic keywords added per tool")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    corpus = load_corpus()
+    short = [item["message"] for item in corpus]
+    filler = "o modelo responde com um texto longo sobre vários assuntos diferentes".split()
+    long_messages = [" ".join(rng.choice(filler) for _ in range(args.words)) + " " + m for m in short[:10]]
+
+    old = make_old_router(OLD_KEYWORDS)
+    new = ToolRouter().route
+
+    big_old = make_old_router([(t, w + synthetic_keywords(args.extra_keywords, rng)) for t, w in OLD_KEYWORDS])
+    big_keywords = {
+        lang: {tool: words + synthetic_keywords(args.extra_keywords, rng) for tool, words in tools.items()}
+        for lang, tools in DEFAULT_KEYWORDS.items()
+    }
+    big_router = ToolRouter(keywords=big_keywords)
+    big_new = big_router.route
+
+    print(f"{'case':<40}{'old (µs)':>12}{'router (µs)':>14}")
+    cases = [
+        (f"corpus messages ({len(short)})", old, new, short),
+        (f"long messages (~{args.words} words)", old, new, long_messages),
+        (f"corpus, +{args.extra_keywords} keywords/tool", big_old, big_new, short),
+        (f"long, +{args.extra_keywords} keywords/tool", big_old, big_new, long_messages),
+    ]
+    for name, old_route, new_route, messages in cases:
+        old_time = measure(old_route, messages, args.repeat)
+        new_time = measure(new_route, messages, args.repeat)
+        print(f"{name:<40}{old_time * 1e6:>12.1f}{new_time * 1e6:>14.1f}")
+    print(f"router keywords: {ToolRouter().keyword_count} default, {big_router.keyword_count} large")
+
+    for name, route in [("old", old), ("router", new)]:
+        correct = sum(route(item["message"]) == item["tool"] for item in corpus)
+        print(f"accuracy {name:<7} {correct}/{len(corpus)} ({correct / len(corpus):.0%})")
+
+
+if __name__ == "__main__":
+    main()
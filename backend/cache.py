@@ -0,0 +1,120 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class ResponseCache:
+    """
+    LRU cache of streamed upstream responses, bounded by total bytes.
+
+    Values are the exact list of text chunks an upstream stream produced, so
+    a hit can be replayed as the same sequence of text_chunk events. Each
+    tool has its own TTL (search results go stale much faster than plain
+    text answers).
+    """
+
+    DEFAULT_TTLS = {
+        "search": 300.0,
+        "text_generation": 3600.0,
+        "reasoning": 3600.0,
+    }
+
+    # Rough per-entry bookkeeping cost counted against max_bytes
+    ENTRY_OVERHEAD = 200
+
+    def __init__(
+        self,
+        max_bytes: int = 32 * 1024 * 1024,
+        ttls: Optional[Dict[str, float]] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_bytes = max_bytes
+        self.ttls = {**self.DEFAULT_TTLS, **(ttls or {})}
+        self.clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, int, Tuple[str, ...]]]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        """Collapse whitespace and case so trivially different prompts match"""
+        return " ".join(prompt.split()).casefold()
+
+    @classmethod
+    def make_key(cls, tool: str, payload: Dict[str, Any]) -> str:
+        """
+        Build a cache key from an upstream chat payload: model, temperature,
+        system prompt and history window, plus the normalized user prompt
+        """
+        messages = list(payload.get("messages", []))
+        if messages and messages[-1].get("role") == "user":
+            last = messages[-1]
+            messages[-1] = {"role": "user", "content": cls.normalize_prompt(last.get("content", ""))}
+        material = json.dumps(
+            [tool, payload.get("model"), payload.get("temperature"), messages],
+            ensure_ascii=False,
+            separators=(",", ":")
+        )
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """Return the cached chunks for a key, or None on a miss"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, size, chunks = entry
+        if expires_at <= self.clock():
+            del self._entries[key]
+            self.size -= size
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return list(chunks)
+
+    def put(self, key: str, tool: str, chunks: List[str]):
+        """Store a complete response, evicting least recently used entries"""
+        ttl = self.ttls.get(tool, 0)
+        if ttl <= 0:
+            return
+        size = self.ENTRY_OVERHEAD + sum(len(c.encode("utf-8")) for c in chunks)
+        if size > self.max_bytes:
+            return
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        self._entries[key] = (self.clock() + ttl, size, tuple(chunks))
+        self.size += size
+
+        while self.size > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for monitoring"""
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "ttls": dict(self.ttls),
+        }
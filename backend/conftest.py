@@ -0,0 +1,38 @@
+"""
+Fixtures shared by the test modules
+"""
+import pytest
+import pytest_asyncio
+
+
+class FakeClock:
+    """Monotonic clock the test moves forward by hand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest_asyncio.fixture
+async def serve():
+    """
+    Start fake_upstream servers for a test: `await serve(server)` sets
+    `server.url` and the server is stopped when the test ends
+    """
+    servers = []
+
+    async def start(server):
+        server.url = await server.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        await server.stop()
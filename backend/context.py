@@ -0,0 +1,204 @@
+import os
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Rough chat-format cost of each message besides its content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Fast local token estimate: about 4 characters per token for Latin text,
+    but never fewer tokens than words. Counting spaces instead of splitting
+    keeps it cheap enough to run on every history message of every request.
+    """
+    if not text:
+        return 0
+    return max((len(text) + 3) // 4, text.count(" ") + 1)
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    return estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Keep the leading sentences of `text` that fit in `max_tokens`, cutting
+    the last one at a word boundary if needed
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max(0, max_tokens * 4 - 2)
+    kept = ""
+    for sentence in _SENTENCE_END.split(text):
+        candidate = f"{kept} {sentence}" if kept else sentence
+        if len(candidate) > limit:
+            break
+        kept = candidate
+    if not kept:
+        kept = text[:limit].rsplit(" ", 1)[0] if " " in text[:limit] else text[:limit]
+    return kept + " […]"
+
+
+class ContextWindow:
+    """
+    Assembles the messages sent upstream against a per-model token budget.
+
+    The newest turns are kept verbatim while they fit. Older long messages
+    (e.g. a big search answer) are replaced by a compacted version that is
+    computed once and cached, and turns that no longer fit are dropped.
+    """
+
+    DEFAULT_BUDGETS = {
+        "openai": 4000,
+        "openai-fast": 2000,
+        "mistral": 3000,
+        "claude": 4000,
+        "openai-reasoning": 6000,
+    }
+
+    def __init__(
+        self,
+        budgets: Optional[Dict[str, int]] = None,
+        default_budget: int = 3000,
+        keep_recent: int = 2,
+        compact_above: int = 400,
+        compact_to: int = 150,
+        cache_size: int = 1024
+    ):
+        self.budgets = {**self.DEFAULT_BUDGETS, **(budgets or {})}
+        self.default_budget = default_budget
+        # Messages at the end of the history never compacted if they fit
+        self.keep_recent = keep_recent
+        self.compact_above = compact_above
+        self.compact_to = compact_to
+        self.cache_size = cache_size
+        self._compacted: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.messages_kept = 0
+        self.messages_compacted = 0
+        self.messages_dropped = 0
+        self.compaction_hits = 0
+        self.summaries_used = 0
+
+    @classmethod
+    def from_env(cls) -> "ContextWindow":
+        """
+        CONTEXT_TOKEN_BUDGET sets the default budget and
+        CONTEXT_TOKEN_BUDGET_<MODEL> (e.g. _OPENAI_FAST) a per-model one
+        """
+        budgets = {}
+        for model in cls.DEFAULT_BUDGETS:
+            value = os.getenv("CONTEXT_TOKEN_BUDGET_" + model.upper().replace("-", "_"))
+            if value:
+                budgets[model] = int(value)
+        return cls(
+            budgets=budgets,
+            default_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000")),
+            compact_above=int(os.getenv("CONTEXT_COMPACT_ABOVE", "400")),
+            compact_to=int(os.getenv("CONTEXT_COMPACT_TO", "150"))
+        )
+
+    def budget_for(self, model: str) -> int:
+        return self.budgets.get(model, self.default_budget)
+
+    def compact(self, content: str, max_tokens: int) -> str:
+        """Cached truncation of an old message to `max_tokens`"""
+        key = (content, max_tokens)
+        compacted = self._compacted.get(key)
+        if compacted is not None:
+            self._compacted.move_to_end(key)
+            self.compaction_hits += 1
+            return compacted
+        compacted = truncate_to_tokens(content, max_tokens)
+        self._compacted[key] = compacted
+        if len(self._compacted) > self.cache_size:
+            self._compacted.popitem(last=False)
+        return compacted
+
+    def build(
+        self,
+        model: str,
+        system_prompt: Optional[str],
+        history: List[Dict[str, Any]],
+        prompt: str,
+        summary: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Return system prompt + summary + budgeted history + user prompt. The
+        system prompt and the new user message are always sent in full; the
+        summary of older turns gets at most half of what is left.
+        """
+        head = [{"role": "system", "content": system_prompt}] if system_prompt else []
+        user = {"role": "user", "content": prompt}
+        used = sum(message_tokens(m) for m in head) + message_tokens(user)
+        remaining = self.budget_for(model) - used
+
+        if summary:
+            room = remaining // 2 - MESSAGE_OVERHEAD_TOKENS
+            if room >= 32:
+                summary_message = {
+                    "role": "system",
+                    "content": "Resumo da conversa anterior:\n" + self.compact(summary, room)
+                }
+                head.append(summary_message)
+                cost = message_tokens(summary_message)
+                used += cost
+                remaining -= cost
+                self.summaries_used += 1
+
+        selected: List[Dict[str, Any]] = []
+        compacted = 0
+        for age, message in enumerate(reversed(history)):
+            content = message.get("content") or ""
+            cost = message_tokens(message)
+            shortened = False
+            if age >= self.keep_recent and cost - MESSAGE_OVERHEAD_TOKENS > self.compact_above:
+                content = self.compact(content, self.compact_to)
+                cost = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+                shortened = True
+            if cost > remaining:
+                # Try a compacted copy before giving up on older turns
+                room = remaining - MESSAGE_OVERHEAD_TOKENS
+                if room < 32:
+                    break
+                content = self.compact(content, min(room, self.compact_to))
+                cost = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+                if cost > remaining:
+                    break
+                shortened = True
+            # Counted once, even when compacted again to fit
+            compacted += shortened
+            selected.append({"role": message.get("role", "user"), "content": content})
+            remaining -= cost
+            used += cost
+
+        selected.reverse()
+        self.requests += 1
+        self.prompt_tokens += used
+        self.max_prompt_tokens = max(self.max_prompt_tokens, used)
+        self.messages_kept += len(selected) - compacted
+        self.messages_compacted += compacted
+        self.messages_dropped += len(history) - len(selected)
+        return head + selected + [user]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "budgets": self.budgets,
+            "default_budget": self.default_budget,
+            "requests": self.requests,
+            "avg_prompt_tokens": self.prompt_tokens / self.requests if self.requests else 0.0,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "messages_kept": self.messages_kept,
+            "messages_compacted": self.messages_compacted,
+            "messages_dropped": self.messages_dropped,
+            "summaries_used": self.summaries_used,
+            "compaction_cache_entries": len(self._compacted),
+            "compaction_cache_hits": self.compaction_hits,
+        }
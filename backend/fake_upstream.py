@@ -0,0 +1,325 @@
+"""
+Local stand-in for text.pollinations.ai/openai, for load tests and benchmarks
+Run with: python fake_upstream.py [--port 9000] [--token-rate 50] [--error-rate 0.01] ...
+
+Answers POST /openai with an SSE stream of chat completion deltas over
+keep-alive HTTP/1.1 (chunked), with a configurable time to first token,
+token rate, delta size and injected failures. Point the backend at it with
+POLLINATIONS_TEXT_URL=http://127.0.0.1:9000.
+
+LocalServer and FakeHTTPServer are also the base of the fake upstreams the
+tests script (image, speech, Redis...).
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+from typing import Any, Dict, Optional, Set
+
+
+class FakeUpstreamConfig:
+    """
+    How the fake answers. Time to first token is log-normal around
+    `latency_ms` (`latency_sigma=0` makes it fixed); `error_rate` of the
+    requests get a 500 and `drop_rate` are cut off mid-stream.
+    """
+
+    def __init__(
+        self,
+        tokens: int = 200,
+        token_rate: float = 50.0,
+        chunk_tokens: int = 1,
+        latency_ms: float = 300.0,
+        latency_sigma: float = 0.5,
+        error_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        self.tokens = tokens
+        # Tokens per second within a stream; 0 sends them as fast as possible
+        self.token_rate = token_rate
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.seed = seed
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+
+class LocalServer:
+    """
+    asyncio TCP server on 127.0.0.1 for tests and benchmarks. Subclasses
+    implement `serve()` for one connection; stop() cancels connections that
+    are still open, such as idle keep-alive ones.
+    """
+
+    def __init__(self):
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.port = 0
+        self.connections = 0
+        self._connections: Set[asyncio.Task] = set()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self.server = await asyncio.start_server(self._handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return f"http://{host}:{self.port}"
+
+    async def stop(self):
+        self.server.close()
+        for task in self._connections:
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        self.connections += 1
+        try:
+            await self.serve(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Client gone, or cancelled by stop(): end quietly, as asyncio
+            # reports handler tasks that end cancelled
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        raise NotImplementedError
+
+
+class HTTPRequest:
+    """Request line, lower-cased headers and body of one HTTP/1.1 request"""
+
+    def __init__(self, method: str, path: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+
+class FakeHTTPServer(LocalServer):
+    """
+    Keep-alive HTTP/1.1 server: `respond()` writes the answer to each
+    request and returns False to close the connection afterwards (for
+    bodies delimited by the end of the connection).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.requests = 0
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Keep-alive: serve requests until the client closes the connection
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except asyncio.IncompleteReadError:
+                # Closed between requests, e.g. a connection warm-up probe
+                return
+            lines = head.decode("latin-1").split("\r\n")
+            method, path, _ = lines[0].split(" ", 2)
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length") or 0)
+            body = await reader.readexactly(length) if length else b""
+            self.requests += 1
+            keep_alive = await self.respond(HTTPRequest(method, path, headers, body), reader, writer)
+            await writer.drain()
+            if not keep_alive:
+                return
+
+    async def respond(self, request: HTTPRequest, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        raise NotImplementedError
+
+    @staticmethod
+    def write_chunk(writer: asyncio.StreamWriter, data: bytes):
+        """Write one chunk of a chunked body"""
+        writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    @staticmethod
+    def sse_delta(content: str) -> bytes:
+        """SSE event of a chat completion delta, as the upstream streams them"""
+        delta = {"choices": [{"index": 0, "delta": {"content": content}}]}
+        return f"data: {json.dumps(delta)}\n\n".encode()
+
+
+class FakeUpstream(FakeHTTPServer):
+    """The fake server; counts what it served in `stats()`"""
+
+    WORDS = ["o", "modelo", "responde", "com", "um", "texto", "sobre", "ação", "e", "informação"]
+
+    def __init__(self, config: Optional[FakeUpstreamConfig] = None):
+        super().__init__()
+        self.config = config or FakeUpstreamConfig()
+        self.random = random.Random(self.config.seed)
+        self.streams = 0
+        self.active = 0
+        self.errors = 0
+        self.drops = 0
+        self.tokens_sent = 0
+
+    async def respond(self, request: HTTPRequest, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        if request.method == "POST" and request.path.split("?")[0] == "/openai":
+            return await self._completion(writer)
+        if request.method in ("GET", "HEAD") and request.path == "/":
+            # Connection warm-up
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+        else:
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+        return True
+
+    def first_token_delay(self) -> float:
+        config = self.config
+        if config.latency_ms <= 0:
+            return 0.0
+        if config.latency_sigma <= 0:
+            return config.latency_ms / 1000.0
+        return self.random.lognormvariate(math.log(config.latency_ms), config.latency_sigma) / 1000.0
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            # Keep-alive: serve requests until the client closes the connection
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                method, path, _ = lines[0].split(" ", 2)
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length:
+                    await reader.readexactly(length)
+                self.requests += 1
+
+                if method == "POST" and path.split("?")[0] == "/openai":
+                    if not await self._completion(writer):
+                        return
+                elif method in ("GET", "HEAD") and path == "/":
+                    # Connection warm-up
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+                else:
+                    writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # Cancelled by stop(): end quietly, as asyncio reports handler
+            # tasks that end cancelled
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _completion(self, writer: asyncio.StreamWriter) -> bool:
+        """Write one response; False if the connection was dropped"""
+        config = self.config
+        await asyncio.sleep(self.first_token_delay())
+
+        roll = self.random.random()
+        if roll < config.error_rate:
+            self.errors += 1
+            body = b'{"error": "injected failure"}'
+            writer.write(
+                b"HTTP/1.1 500 Internal Server Error\r\nContent-Type: application/json\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+            )
+            return True
+        drop_at = config.tokens // 2 if roll < config.error_rate + config.drop_rate else None
+
+        self.streams += 1
+        self.active += 1
+        try:
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n"
+            )
+            interval = config.chunk_tokens / config.token_rate if config.token_rate > 0 else 0.0
+            sent = 0
+            while sent < config.tokens:
+                if drop_at is not None and sent >= drop_at:
+                    self.drops += 1
+                    writer.transport.abort()
+                    return False
+                count = min(config.chunk_tokens, config.tokens - sent)
+                content = "".join(" " + self.random.choice(self.WORDS) for _ in range(count))
+                self.write_chunk(writer, self.sse_delta(content))
+                sent += count
+                self.tokens_sent += count
+                await writer.drain()
+                if interval:
+                    await asyncio.sleep(interval)
+            self.write_chunk(writer, b"data: [DONE]\n\n")
+            writer.write(b"0\r\n\r\n")
+            return True
+        finally:
+            self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "streams": self.streams,
+            "active": self.active,
+            "errors_injected": self.errors,
+            "drops_injected": self.drops,
+            "tokens_sent": self.tokens_sent,
+        }
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """Command line options of FakeUpstreamConfig, shared with bench_load.py"""
+    defaults = FakeUpstreamConfig()
+    parser.add_argument("--tokens", type=int, default=defaults.tokens, help="tokens per answer")
+    parser.add_argument("--token-rate", type=float, default=defaults.token_rate, help="tokens/s per stream (0 = unthrottled)")
+    parser.add_argument("--chunk-tokens", type=int, default=defaults.chunk_tokens, help="tokens per SSE delta")
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms, help="median time to first token")
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma, help="log-normal spread (0 = fixed)")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="fraction answered with 500")
+    parser.add_argument("--drop-rate", type=float, default=defaults.drop_rate, help="fraction cut off mid-stream")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args: argparse.Namespace) -> FakeUpstreamConfig:
+    return FakeUpstreamConfig(
+        tokens=args.tokens,
+        token_rate=args.token_rate,
+        chunk_tokens=args.chunk_tokens,
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        seed=args.seed
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(config_from_args(args))
+    url = await upstream.start(args.host, args.port)
+    print(f"Fake upstream on {url} ({json.dumps(upstream.config.to_dict())})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await upstream.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
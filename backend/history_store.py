@@ -0,0 +1,494 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+
+class HistoryStore:
+    """
+    Interface for conversation history storage shared by all agents.
+
+    Every method is a single round trip to the backend, so a chat turn costs
+    one read (load_with_summary) and one write (append). Each session also
+    has a rolling summary of the messages trimmed from its history, and the
+    trimmed messages waiting to be folded into it.
+    """
+
+    async def load(self, session_id: str, limit: int) -> List[Dict]:
+        """Return the last `limit` messages of a session, oldest first"""
+        raise NotImplementedError
+
+    async def append(
+        self, session_id: str, messages: List[Dict], max_messages: int, keep_trimmed: bool = False
+    ) -> List[Dict]:
+        """
+        Append messages and trim the session to the last `max_messages`.
+        Returns the trimmed messages, oldest first. With `keep_trimmed` they
+        are also added to the session's pending messages (see load_pending).
+        """
+        raise NotImplementedError
+
+    async def load_pending(self, session_id: str) -> List[Dict]:
+        """Return the trimmed messages not yet in the summary, oldest first"""
+        raise NotImplementedError
+
+    async def load_summary(self, session_id: str) -> Optional[str]:
+        """Return the rolling summary of a session, if any"""
+        raise NotImplementedError
+
+    async def save_summary(self, session_id: str, summary: str, summarized: int = 0):
+        """
+        Replace the rolling summary of a session and, in the same write,
+        drop the first `summarized` pending messages it now covers
+        """
+        raise NotImplementedError
+
+    async def load_with_summary(self, session_id: str, limit: int) -> Tuple[Optional[str], List[Dict]]:
+        """Summary and last `limit` messages; backends override to do it in one round trip"""
+        return await self.load_summary(session_id), await self.load(session_id, limit)
+
+    async def clear(self, session_id: str):
+        """Delete all messages, pending messages and the summary of a session"""
+        raise NotImplementedError
+
+    async def close(self):
+        """Release backend resources"""
+
+
+class InMemoryHistoryStore(HistoryStore):
+    """
+    Process-local history, the default for single-worker setups
+    """
+
+    def __init__(self):
+        self._histories: Dict[str, List[Dict]] = defaultdict(list)
+        self._summaries: Dict[str, str] = {}
+        self._pending: Dict[str, List[Dict]] = {}
+
+    async def load(self, session_id: str, limit: int) -> List[Dict]:
+        if limit <= 0 or session_id not in self._histories:
+            return []
+        return list(self._histories[session_id][-limit:])
+
+    async def append(
+        self, session_id: str, messages: List[Dict], max_messages: int, keep_trimmed: bool = False
+    ) -> List[Dict]:
+        history = self._histories[session_id]
+        history.extend(messages)
+        if len(history) <= max_messages:
+            return []
+        trimmed = history[:-max_messages]
+        del history[:-max_messages]
+        if keep_trimmed:
+            self._pending.setdefault(session_id, []).extend(trimmed)
+        return trimmed
+
+    async def load_pending(self, session_id: str) -> List[Dict]:
+        return list(self._pending.get(session_id, []))
+
+    async def load_summary(self, session_id: str) -> Optional[str]:
+        return self._summaries.get(session_id)
+
+    async def save_summary(self, session_id: str, summary: str, summarized: int = 0):
+        self._summaries[session_id] = summary
+        if summarized and session_id in self._pending:
+            del self._pending[session_id][:summarized]
+
+    async def clear(self, session_id: str):
+        self._histories.pop(session_id, None)
+        self._summaries.pop(session_id, None)
+        self._pending.pop(session_id, None)
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """
+    SQLite history in WAL mode, shareable by several workers on one host.
+
+    sqlite3 is blocking, so all statements run on a dedicated single thread
+    to keep the event loop free and the connection single-threaded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " session_id TEXT NOT NULL,"
+                " role TEXT NOT NULL,"
+                " content TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                " session_id TEXT PRIMARY KEY,"
+                " summary TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " session_id TEXT NOT NULL,"
+                " role TEXT NOT NULL,"
+                " content TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_pending_session ON pending (session_id, id)")
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _load(self, session_id: str, limit: int) -> List[Dict]:
+        rows = self._connect().execute(
+            "SELECT role, content FROM ("
+            " SELECT id, role, content FROM messages WHERE session_id = ?"
+            " ORDER BY id DESC LIMIT ?"
+            ") ORDER BY id",
+            (session_id, limit)
+        ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def _append(self, session_id: str, messages: List[Dict], max_messages: int, keep_trimmed: bool) -> List[Dict]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+                [(session_id, m["role"], m["content"]) for m in messages]
+            )
+            rows = conn.execute(
+                "SELECT id, role, content FROM messages WHERE session_id = ? AND id NOT IN ("
+                " SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)"
+                " ORDER BY id",
+                (session_id, session_id, max_messages)
+            ).fetchall()
+            if rows:
+                conn.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND id <= ?",
+                    (session_id, rows[-1][0])
+                )
+                if keep_trimmed:
+                    conn.executemany(
+                        "INSERT INTO pending (session_id, role, content) VALUES (?, ?, ?)",
+                        [(session_id, role, content) for _, role, content in rows]
+                    )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [{"role": role, "content": content} for _, role, content in rows]
+
+    def _load_pending(self, session_id: str) -> List[Dict]:
+        rows = self._connect().execute(
+            "SELECT role, content FROM pending WHERE session_id = ? ORDER BY id", (session_id,)
+        ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def _load_summary(self, session_id: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT summary FROM summaries WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _save_summary(self, session_id: str, summary: str, summarized: int):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO summaries (session_id, summary) VALUES (?, ?)"
+                " ON CONFLICT (session_id) DO UPDATE SET summary = excluded.summary",
+                (session_id, summary)
+            )
+            if summarized:
+                conn.execute(
+                    "DELETE FROM pending WHERE id IN ("
+                    " SELECT id FROM pending WHERE session_id = ? ORDER BY id LIMIT ?)",
+                    (session_id, summarized)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _load_with_summary(self, session_id: str, limit: int) -> Tuple[Optional[str], List[Dict]]:
+        return self._load_summary(session_id), self._load(session_id, limit) if limit > 0 else []
+
+    def _clear(self, session_id: str):
+        conn = self._connect()
+        conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM pending WHERE session_id = ?", (session_id,))
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def load(self, session_id: str, limit: int) -> List[Dict]:
+        if limit <= 0:
+            return []
+        return await self._run(self._load, session_id, limit)
+
+    async def append(
+        self, session_id: str, messages: List[Dict], max_messages: int, keep_trimmed: bool = False
+    ) -> List[Dict]:
+        return await self._run(self._append, session_id, messages, max_messages, keep_trimmed)
+
+    async def load_pending(self, session_id: str) -> List[Dict]:
+        return await self._run(self._load_pending, session_id)
+
+    async def load_summary(self, session_id: str) -> Optional[str]:
+        return await self._run(self._load_summary, session_id)
+
+    async def save_summary(self, session_id: str, summary: str, summarized: int = 0):
+        await self._run(self._save_summary, session_id, summary, summarized)
+
+    async def load_with_summary(self, session_id: str, limit: int) -> Tuple[Optional[str], List[Dict]]:
+        return await self._run(self._load_with_summary, session_id, limit)
+
+    async def clear(self, session_id: str):
+        await self._run(self._clear, session_id)
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+
+class RedisError(Exception):
+    """Error reply returned by a Redis-protocol server"""
+
+
+def encode_command(*args) -> bytes:
+    """Encode one command as a RESP array of bulk strings"""
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(out)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """
+    Read a single RESP reply. Error replies are returned as RedisError
+    instances so a pipeline can read every reply before raising.
+    """
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    prefix, body = line[:1], line[1:-2]
+    if prefix == b"+":
+        return body.decode()
+    if prefix == b"-":
+        return RedisError(body.decode())
+    if prefix == b":":
+        return int(body)
+    if prefix == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if prefix == b"*":
+        count = int(body)
+        if count < 0:
+            return None
+        return [await read_reply(reader) for _ in range(count)]
+    raise RedisError(f"Unexpected reply: {line!r}")
+
+
+class RedisHistoryStore(HistoryStore):
+    """
+    History kept in Redis lists (or any server speaking the Redis protocol).
+
+    Each session is a list of JSON messages under `<prefix><session_id>`
+    and a summary string under `<prefix><session_id>:summary`. Writes run
+    APPEND_SCRIPT, one atomic round trip that pushes, trims and moves kept
+    trimmed messages to the `<prefix><session_id>:pending` list, so
+    concurrent appends to a session neither lose nor repeat messages.
+    """
+
+    # KEYS: history, pending. ARGV: max_messages, ttl (0: none),
+    # keep_trimmed (0/1), then the messages. Returns the trimmed messages.
+    APPEND_SCRIPT = """
+local max, ttl = tonumber(ARGV[1]), tonumber(ARGV[2])
+redis.call("RPUSH", KEYS[1], unpack(ARGV, 4))
+local trimmed = redis.call("LRANGE", KEYS[1], 0, -max - 1)
+redis.call("LTRIM", KEYS[1], -max, -1)
+if ttl > 0 then redis.call("EXPIRE", KEYS[1], ttl) end
+if ARGV[3] == "1" and #trimmed > 0 then
+    redis.call("RPUSH", KEYS[2], unpack(trimmed))
+    if ttl > 0 then redis.call("EXPIRE", KEYS[2], ttl) end
+end
+return trimmed
+"""
+    APPEND_SHA = hashlib.sha1(APPEND_SCRIPT.encode()).hexdigest()
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        key_prefix: str = "mega-agent:history:",
+        ttl: Optional[int] = 7 * 24 * 3600,
+        max_connections: int = 10
+    ):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+        self.max_connections = max_connections
+        self._idle: List[tuple] = []
+        self._slots = asyncio.Semaphore(max_connections)
+
+    async def _open(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            await self._pipeline_on(reader, writer, setup)
+        return reader, writer
+
+    @staticmethod
+    async def _pipeline_on(reader, writer, commands) -> list:
+        writer.write(b"".join(encode_command(*cmd) for cmd in commands))
+        await writer.drain()
+        replies = [await read_reply(reader) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    async def pipeline(self, commands: List[tuple]) -> list:
+        """Send several commands in one write and read all replies"""
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else await self._open()
+            try:
+                replies = await self._pipeline_on(conn[0], conn[1], commands)
+            except RedisError:
+                # Protocol is still in sync after a full pipeline read
+                self._idle.append(conn)
+                raise
+            except BaseException:
+                conn[1].close()
+                raise
+            self._idle.append(conn)
+            return replies
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.key_prefix}{session_id}"
+
+    def _summary_key(self, session_id: str) -> str:
+        return f"{self.key_prefix}{session_id}:summary"
+
+    def _pending_key(self, session_id: str) -> str:
+        return f"{self.key_prefix}{session_id}:pending"
+
+    async def load(self, session_id: str, limit: int) -> List[Dict]:
+        if limit <= 0:
+            return []
+        (items,) = await self.pipeline([("LRANGE", self._key(session_id), -limit, -1)])
+        return [json.loads(item) for item in items or []]
+
+    async def append(
+        self, session_id: str, messages: List[Dict], max_messages: int, keep_trimmed: bool = False
+    ) -> List[Dict]:
+        args = (
+            2, self._key(session_id), self._pending_key(session_id),
+            max_messages, self.ttl or 0, int(keep_trimmed),
+            *[json.dumps(m, ensure_ascii=False) for m in messages]
+        )
+        try:
+            (trimmed,) = await self.pipeline([("EVALSHA", self.APPEND_SHA, *args)])
+        except RedisError as e:
+            if not str(e).startswith("NOSCRIPT"):
+                raise
+            # First append since the server started: send the script itself
+            (trimmed,) = await self.pipeline([("EVAL", self.APPEND_SCRIPT, *args)])
+        return [json.loads(item) for item in trimmed or []]
+
+    async def load_pending(self, session_id: str) -> List[Dict]:
+        (items,) = await self.pipeline([("LRANGE", self._pending_key(session_id), 0, -1)])
+        return [json.loads(item) for item in items or []]
+
+    async def load_summary(self, session_id: str) -> Optional[str]:
+        (summary,) = await self.pipeline([("GET", self._summary_key(session_id))])
+        return summary.decode() if summary is not None else None
+
+    async def save_summary(self, session_id: str, summary: str, summarized: int = 0):
+        command = ("SET", self._summary_key(session_id), summary.encode())
+        command = command + ("EX", self.ttl) if self.ttl else command
+        if not summarized:
+            await self.pipeline([command])
+            return
+        await self.pipeline([
+            ("MULTI",), command, ("LTRIM", self._pending_key(session_id), summarized, -1), ("EXEC",)
+        ])
+
+    async def load_with_summary(self, session_id: str, limit: int) -> Tuple[Optional[str], List[Dict]]:
+        if limit <= 0:
+            return await self.load_summary(session_id), []
+        summary, items = await self.pipeline([
+            ("GET", self._summary_key(session_id)),
+            ("LRANGE", self._key(session_id), -limit, -1)
+        ])
+        return (
+            summary.decode() if summary is not None else None,
+            [json.loads(item) for item in items or []]
+        )
+
+    async def clear(self, session_id: str):
+        await self.pipeline([
+            ("DEL", self._key(session_id), self._summary_key(session_id), self._pending_key(session_id))
+        ])
+
+    async def close(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+def create_history_store(url: Optional[str] = None) -> Optional[HistoryStore]:
+    """
+    Build a shared history store from a URL:
+
+        memory://                  -> None (each agent keeps its own history)
+        sqlite:///path/to/file.db  -> SQLiteHistoryStore
+        redis://[:password@]host[:port][/db] -> RedisHistoryStore
+    """
+    if not url or url.startswith("memory:"):
+        return None
+
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        path = url[len("sqlite:///"):] if url.startswith("sqlite:///") else ""
+        return SQLiteHistoryStore(path or "history.db")
+    if parsed.scheme == "redis":
+        db = parsed.path.lstrip("/")
+        return RedisHistoryStore(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or 6379,
+            db=int(db) if db else 0,
+            password=unquote(parsed.password) if parsed.password else None
+        )
+    raise ValueError(f"Unsupported history store URL: {url}")
@@ -0,0 +1,278 @@
+"""
+Optional learned intent classifier for tool routing.
+
+Messages are turned into hashed word, word-bigram and character-trigram
+features and scored by a linear model stored as a NumPy array, so routing
+a message costs microseconds and needs no network. Below a confidence
+threshold the keyword ToolRouter decides instead.
+
+CLI (needs numpy):
+    python intent.py train routing_corpus.jsonl --out intent_model.npz
+    python intent.py evaluate intent_model.npz routing_corpus.jsonl
+    python intent.py export intent_model.npz --out intent_model.f16.npz
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import time
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from tool_router import TOOLS, ToolRouter, normalize_text
+
+try:
+    import numpy as np
+except ImportError:  # Optional dependency: keyword routing still works
+    np = None
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIM = 1 << 18
+
+
+def numpy_available() -> bool:
+    return np is not None
+
+
+# Distinct crc32 start values keep the feature kinds apart
+_WORD_SEED = 0x5717
+_BIGRAM_SEED = 0xB16A
+_TRIGRAM_SEED = 0x7716
+
+
+def hashed_features(text: str, dim: int = DEFAULT_DIM) -> List[int]:
+    """
+    Bucket indices of the word, word-bigram and char-trigram features of a
+    message. crc32 keeps them stable across processes, unlike hash().
+    """
+    mask = dim - 1
+    crc32 = zlib.crc32
+    normalized = normalize_text(text).encode("utf-8")
+    words = normalized.split()
+    features = [crc32(word, _WORD_SEED) & mask for word in words]
+    features += [crc32(a + b" " + b, _BIGRAM_SEED) & mask for a, b in zip(words, words[1:])]
+    # Trigrams over the padded text also capture word starts and ends
+    padded = b" " + normalized + b" "
+    features += [crc32(padded[i:i + 3], _TRIGRAM_SEED) & mask for i in range(len(padded) - 2)]
+    return features
+
+
+def load_corpus(path: str) -> List[Tuple[str, str]]:
+    """Read a JSONL corpus of {"message": ..., "tool": ...} lines"""
+    with open(path, encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    return [(item["message"], item["tool"]) for item in items]
+
+
+class IntentClassifier:
+    """
+    Multinomial logistic regression over hashed features. `weights` has one
+    row per feature bucket and one column per tool.
+    """
+
+    def __init__(self, weights, bias, classes: Sequence[str]):
+        if np is None:
+            raise RuntimeError("IntentClassifier needs numpy (pip install numpy)")
+        self.weights = weights
+        self.bias = bias
+        self.classes = list(classes)
+        self.dim = weights.shape[0]
+
+    def _vectorize(self, text: str):
+        features = hashed_features(text, self.dim)
+        # 1/sqrt(n) keeps logits comparable between short and long messages
+        scale = 1.0 / math.sqrt(len(features)) if features else 0.0
+        return np.array(features, dtype=np.intp), scale
+
+    def _logits(self, index, scale):
+        return self.weights.take(index, axis=0).sum(axis=0, dtype=np.float32) * scale + self.bias
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """Probability of each tool for a message"""
+        logits = self._logits(*self._vectorize(text)).tolist()
+        top = max(logits)
+        exp = [math.exp(x - top) for x in logits]
+        total = sum(exp)
+        return {tool: e / total for tool, e in zip(self.classes, exp)}
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Most likely tool and its probability"""
+        # A handful of classes: plain floats beat more NumPy calls here
+        logits = self._logits(*self._vectorize(text)).tolist()
+        top = max(logits)
+        best = logits.index(top)
+        return self.classes[best], 1.0 / sum(math.exp(x - top) for x in logits)
+
+    @classmethod
+    def train(
+        cls,
+        samples: Sequence[Tuple[str, str]],
+        dim: int = DEFAULT_DIM,
+        epochs: int = 30,
+        learning_rate: float = 0.5,
+        seed: int = 0
+    ) -> "IntentClassifier":
+        """Fit the model with plain SGD on (message, tool) pairs"""
+        if np is None:
+            raise RuntimeError("Training needs numpy (pip install numpy)")
+        classes = sorted({tool for _, tool in samples})
+        model = cls(np.zeros((dim, len(classes)), dtype=np.float32), np.zeros(len(classes), dtype=np.float32), classes)
+        vectors = [model._vectorize(text) for text, _ in samples]
+        labels = [classes.index(tool) for _, tool in samples]
+
+        order = list(range(len(samples)))
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(order)
+            rate = learning_rate / (1 + epoch * 0.1)
+            for i in order:
+                index, scale = vectors[i]
+                logits = model._logits(index, scale)
+                gradient = np.exp(logits - logits.max())
+                gradient /= gradient.sum()
+                gradient[labels[i]] -= 1.0
+                # np.add.at accumulates repeated buckets correctly
+                np.add.at(model.weights, index, (-rate * scale) * gradient)
+                model.bias -= rate * gradient
+        return model
+
+    def save(self, path: str, dtype=None):
+        """Write weights, bias and class names to a .npz file"""
+        np.savez_compressed(
+            path,
+            weights=self.weights.astype(dtype or self.weights.dtype),
+            bias=self.bias.astype(np.float32),
+            classes=np.array(self.classes)
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "IntentClassifier":
+        if np is None:
+            raise RuntimeError("IntentClassifier needs numpy (pip install numpy)")
+        with np.load(path) as data:
+            weights = data["weights"].astype(np.float32)
+            return cls(weights, data["bias"], [str(c) for c in data["classes"]])
+
+
+class ClassifierRouter:
+    """
+    Tool router that trusts the classifier above `min_confidence` and asks
+    the keyword router otherwise. Same route() interface as ToolRouter.
+    """
+
+    def __init__(self, classifier: IntentClassifier, fallback: ToolRouter, min_confidence: float = 0.7):
+        self.classifier = classifier
+        self.fallback = fallback
+        self.min_confidence = min_confidence
+        self.classified = 0
+        self.fallbacks = 0
+
+    def route(self, message: str) -> str:
+        tool, confidence = self.classifier.predict(message)
+        if confidence >= self.min_confidence:
+            self.classified += 1
+            return tool
+        self.fallbacks += 1
+        return self.fallback.route(message)
+
+
+def load_intent_router(path: str, fallback: ToolRouter, min_confidence: float = 0.7):
+    """
+    Wrap `fallback` with the model at `path`, or return `fallback` itself if
+    numpy is missing or the model cannot be read
+    """
+    if not numpy_available():
+        logger.warning("INTENT_MODEL_PATH is set but numpy is not installed; using keyword routing")
+        return fallback
+    try:
+        classifier = IntentClassifier.load(path)
+    except (OSError, KeyError, ValueError) as e:
+        logger.warning("Could not load intent model %s: %s; using keyword routing", path, e)
+        return fallback
+    unknown = set(classifier.classes) - TOOLS
+    if unknown:
+        logger.warning("Intent model %s has unknown tools %s; using keyword routing", path, sorted(unknown))
+        return fallback
+    return ClassifierRouter(classifier, fallback, min_confidence)
+
+
+def evaluate(
+    classifier: IntentClassifier,
+    samples: Sequence[Tuple[str, str]],
+    min_confidence: float = 0.7,
+    fallback: Optional[ToolRouter] = None
+) -> Dict[str, object]:
+    """Accuracy of the classifier alone and combined with the keyword fallback"""
+    fallback = fallback or ToolRouter()
+    router = ClassifierRouter(classifier, fallback, min_confidence)
+    correct = combined = 0
+    confusion: Dict[str, Dict[str, int]] = {}
+    for text, tool in samples:
+        predicted, _ = classifier.predict(text)
+        correct += predicted == tool
+        combined += router.route(text) == tool
+        row = confusion.setdefault(tool, {})
+        row[predicted] = row.get(predicted, 0) + 1
+    total = len(samples) or 1
+    return {
+        "samples": len(samples),
+        "accuracy": correct / total,
+        "accuracy_with_fallback": combined / total,
+        "fallback_rate": router.fallbacks / total,
+        "confusion": confusion,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train, evaluate and export the tool intent classifier")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    train = commands.add_parser("train", help="fit a model on a labeled JSONL corpus")
+    train.add_argument("corpus")
+    train.add_argument("--out", default="intent_model.npz")
+    train.add_argument("--dim", type=int, default=DEFAULT_DIM, help="feature buckets (power of two)")
+    train.add_argument("--epochs", type=int, default=30)
+    train.add_argument("--holdout", type=float, default=0.0, help="fraction kept aside for evaluation")
+    train.add_argument("--seed", type=int, default=0)
+
+    evaluate_cmd = commands.add_parser("evaluate", help="report accuracy on a labeled corpus")
+    evaluate_cmd.add_argument("model")
+    evaluate_cmd.add_argument("corpus")
+    evaluate_cmd.add_argument("--min-confidence", type=float, default=0.7)
+
+    export = commands.add_parser("export", help="write a float16 copy for deployment")
+    export.add_argument("model")
+    export.add_argument("--out", required=True)
+
+    args = parser.parse_args()
+    if not numpy_available():
+        parser.error("numpy is required: pip install numpy")
+
+    if args.command == "train":
+        if args.dim & (args.dim - 1):
+            parser.error("--dim must be a power of two")
+        samples = load_corpus(args.corpus)
+        random.Random(args.seed).shuffle(samples)
+        held = int(len(samples) * args.holdout)
+        started = time.perf_counter()
+        model = IntentClassifier.train(samples[held:], dim=args.dim, epochs=args.epochs, seed=args.seed)
+        print(f"trained on {len(samples) - held} samples in {time.perf_counter() - started:.2f}s")
+        if held:
+            print(json.dumps(evaluate(model, samples[:held]), indent=2, ensure_ascii=False))
+        model.save(args.out)
+        print(f"saved {args.out}")
+    elif args.command == "evaluate":
+        model = IntentClassifier.load(args.model)
+        report = evaluate(model, load_corpus(args.corpus), args.min_confidence)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        IntentClassifier.load(args.model).save(args.out, dtype=np.float16)
+        print(f"exported {args.out} ({os.path.getsize(args.out) / 1024:.0f} KiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,695 @@
+"""
+Background chat jobs: requests queued by the API and run by worker tasks,
+which publish each job's events to a channel any number of viewers follow
+Run a broker with:  python jobs.py broker [--host 127.0.0.1] [--port 7700]
+Run workers with:   python jobs.py worker --broker broker://127.0.0.1:7700 [--concurrency 8]
+
+JOB_QUEUE_URL picks the backend: memory:// keeps the queue and channels in
+the API process; broker://host:port talks to a broker process started as
+above, shared by API front-ends and worker processes on the same network.
+Worker processes need the API's HISTORY_STORE_URL, a sqlite:// or redis://
+store: with in-memory history they would answer from their own.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from streams import cancellable
+
+STATUSES = ("queued", "running", "completed", "failed", "cancelled")
+
+logger = logging.getLogger(__name__)
+
+
+class JobError(Exception):
+    """Job request that cannot be served; `status` is the HTTP status to answer"""
+
+    def __init__(self, message: str, status: int = 404):
+        super().__init__(message)
+        self.status = status
+
+
+class Job:
+    """A queued /chat request: the ChatRequest fields and the session it runs in"""
+
+    def __init__(self, session_id: str, request: Dict[str, Any], id: Optional[str] = None, status: str = "queued"):
+        self.id = id or uuid.uuid4().hex
+        self.session_id = session_id
+        self.request = request
+        self.status = status
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.claims = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Job":
+        job = cls(data["session_id"], data["request"], data["id"], data["status"])
+        job.created, job.started, job.finished = data["created"], data["started"], data["finished"]
+        job.claims = data.get("claims", 0)
+        return job
+
+
+class JobChannel:
+    """
+    Events of one job, numbered from 1, kept for replay up to `max_events`
+    (oldest dropped first). The worker never waits for viewers; a viewer
+    that falls further behind than the buffer gets a JobError.
+    """
+
+    def __init__(self, max_events: int = 10000):
+        self.max_events = max_events
+        self._events: "deque[Tuple[int, Dict[str, Any]]]" = deque()
+        self.last_seq = 0
+        self.closed = False
+        self.cancelled = asyncio.Event()
+        self.viewers = 0
+        self._changed: Optional[asyncio.Event] = None
+
+    @property
+    def first_seq(self) -> int:
+        return self._events[0][0] if self._events else self.last_seq + 1
+
+    def append(self, event: Dict[str, Any]):
+        self.last_seq += 1
+        self._events.append((self.last_seq, event))
+        if len(self._events) > self.max_events:
+            self._events.popleft()
+        self._notify()
+
+    def close(self):
+        self.closed = True
+        self._notify()
+
+    async def follow(self, after: int = 0) -> AsyncGenerator[Tuple[int, Dict[str, Any]], None]:
+        """(seq, event) after `after`, then live ones until the job ends"""
+        self.viewers += 1
+        try:
+            while True:
+                if after + 1 < self.first_seq:
+                    raise JobError("Eventos já descartados", 410)
+                while after < self.last_seq:
+                    after, event = self._events[after + 1 - self.first_seq]
+                    yield after, event
+                    if after + 1 < self.first_seq:
+                        raise JobError("Eventos já descartados", 410)
+                if self.closed:
+                    return
+                if self._changed is None:
+                    self._changed = asyncio.Event()
+                await self._changed.wait()
+        finally:
+            self.viewers -= 1
+
+    def _notify(self):
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+
+class JobBroker:
+    """
+    Interface of the job queue and its per-job event channels. Jobs are
+    claimed by one worker each; events are fanned out to every subscriber.
+    """
+
+    async def submit(self, job: Job):
+        """Queue a job; JobError(503) when the queue is full"""
+        raise NotImplementedError
+
+    async def claim(self) -> Job:
+        """
+        Wait for the next queued job and mark it running. The claim lapses
+        if the job's events are not published within the claim timeout.
+        """
+        raise NotImplementedError
+
+    async def publish(self, job_id: str, events: AsyncIterator[Dict[str, Any]]):
+        """
+        Publish a running job's events until they end, the job is cancelled
+        (the events are closed, so the upstream request is too) or they fail.
+        JobError(409) if the job is not claimed (or its claim lapsed).
+        """
+        raise NotImplementedError
+
+    async def subscribe(self, job_id: str, after: int = 0) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """
+        (seq, event) of a job after `after`, live until it ends. Raises
+        JobError(404) for unknown or expired jobs and JobError(410) if the
+        events were dropped, here or while iterating.
+        """
+        raise NotImplementedError
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        raise NotImplementedError
+
+    async def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job; False if unknown or already finished"""
+        raise NotImplementedError
+
+    async def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def close(self):
+        """Release backend resources"""
+
+
+class MemoryJobBroker(JobBroker):
+    """
+    Queue and channels in this process, for a single API process with
+    in-process workers; also what the broker process serves. Finished jobs
+    stay subscribable for `retain_seconds`, at most `max_retained` of them.
+    A claimed job whose worker does not start publishing within
+    `claim_timeout` is queued again, and failed after `max_claims` claims.
+    """
+
+    def __init__(
+        self,
+        max_queued: int = 1000,
+        max_events: int = 10000,
+        retain_seconds: float = 300.0,
+        max_retained: int = 1000,
+        claim_timeout: float = 30.0,
+        max_claims: int = 3
+    ):
+        self.max_queued = max_queued
+        self.max_events = max_events
+        self.retain_seconds = retain_seconds
+        self.max_retained = max_retained
+        self.claim_timeout = claim_timeout
+        self.max_claims = max_claims
+        self._queue: "deque[Job]" = deque()
+        self._leases: Dict[str, asyncio.TimerHandle] = {}
+        self._queued = asyncio.Event()
+        self._jobs: Dict[str, Job] = {}
+        self._channels: Dict[str, JobChannel] = {}
+        self._finished: "OrderedDict[str, Job]" = OrderedDict()
+        self.submitted = 0
+        self.outcomes = {status: 0 for status in STATUSES[2:]}
+
+    @classmethod
+    def from_env(cls) -> "MemoryJobBroker":
+        """Build from JOB_* environment variables"""
+        return cls(
+            max_queued=int(os.getenv("JOB_MAX_QUEUE", "1000")),
+            max_events=int(os.getenv("JOB_MAX_EVENTS", "10000")),
+            retain_seconds=float(os.getenv("JOB_TTL", "300")),
+            max_retained=int(os.getenv("JOB_MAX_FINISHED", "1000")),
+            claim_timeout=float(os.getenv("JOB_CLAIM_TIMEOUT", "30"))
+        )
+
+    async def submit(self, job: Job):
+        if len(self._queue) >= self.max_queued:
+            raise JobError("Fila de jobs cheia, tente novamente em instantes", 503)
+        self._jobs[job.id] = job
+        self._channels[job.id] = JobChannel(self.max_events)
+        self._queue.append(job)
+        self.submitted += 1
+        self._queued.set()
+
+    async def requeue(self, job: Job):
+        """Put back a claimed job that never reached its worker"""
+        self._requeue(job)
+
+    def _requeue(self, job: Job):
+        lease = self._leases.pop(job.id, None)
+        if lease is not None:
+            lease.cancel()
+        job.status, job.started = "queued", None
+        self._queue.appendleft(job)
+        self._queued.set()
+
+    def _claim_lapsed(self, job: Job):
+        """The worker never started publishing: hand the job to another one"""
+        del self._leases[job.id]
+        channel = self._channels[job.id]
+        if channel.cancelled.is_set():
+            channel.append({"type": "cancelled"})
+            self._finish(job, "cancelled")
+        elif job.claims >= self.max_claims:
+            channel.append({"type": "error", "message": "Nenhum worker concluiu o job"})
+            self._finish(job, "failed")
+        else:
+            self._requeue(job)
+
+    async def claim(self) -> Job:
+        while True:
+            while not self._queue:
+                self._queued.clear()
+                await self._queued.wait()
+            job = self._queue.popleft()
+            if job.status == "queued":
+                job.status, job.started = "running", time.time()
+                job.claims += 1
+                self._leases[job.id] = asyncio.get_running_loop().call_later(
+                    self.claim_timeout, self._claim_lapsed, job
+                )
+                return job
+
+    async def publish(self, job_id: str, events: AsyncIterator[Dict[str, Any]]) -> str:
+        """As JobBroker.publish; returns the job's final status"""
+        lease = self._leases.pop(job_id, None)
+        if lease is None:
+            raise JobError("Job não está reservado para este worker", 409)
+        lease.cancel()
+        job, channel = self._jobs[job_id], self._channels[job_id]
+        status = "failed"
+        try:
+            async for event in cancellable(events, channel.cancelled):
+                channel.append(event)
+            if channel.cancelled.is_set():
+                status = "cancelled"
+                channel.append({"type": "cancelled"})
+            else:
+                status = "completed"
+        except asyncio.CancelledError:
+            # Worker shutting down
+            status = "cancelled"
+            channel.append({"type": "cancelled"})
+            raise
+        except Exception as e:
+            channel.append({"type": "error", "message": str(e)})
+        finally:
+            self._finish(job, status)
+        return status
+
+    def _finish(self, job: Job, status: str):
+        job.status, job.finished = status, time.time()
+        self.outcomes[status] += 1
+        self._channels[job.id].close()
+        self._finished[job.id] = job
+        self._prune()
+
+    def _prune(self):
+        expired = time.time() - self.retain_seconds
+        finished = self._finished
+        while finished and (len(finished) > self.max_retained or next(iter(finished.values())).finished < expired):
+            job_id, _ = finished.popitem(last=False)
+            self._jobs.pop(job_id, None)
+            self._channels.pop(job_id, None)
+
+    async def subscribe(self, job_id: str, after: int = 0) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        self._prune()
+        channel = self._channels.get(job_id)
+        if channel is None:
+            raise JobError("Job não encontrado", 404)
+        if after + 1 < channel.first_seq:
+            raise JobError("Eventos já descartados", 410)
+        return channel.follow(after)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        self._prune()
+        return self._jobs.get(job_id)
+
+    async def cancel(self, job_id: str) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job.status not in ("queued", "running"):
+            return False
+        if job.status == "queued":
+            # Nobody publishes it, so close the channel here
+            self._queue.remove(job)
+            self._channels[job.id].append({"type": "cancelled"})
+            self._finish(job, "cancelled")
+        else:
+            self._channels[job.id].cancelled.set()
+        return True
+
+    async def stats(self) -> Dict[str, Any]:
+        self._prune()
+        statuses = [job.status for job in self._jobs.values()]
+        return {
+            "backend": "memory",
+            "submitted": self.submitted,
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            **self.outcomes,
+            "viewers": sum(channel.viewers for channel in self._channels.values()),
+            "retained": len(self._finished),
+        }
+
+
+# Broker protocol: one JSON command line per connection, then JSON lines.
+# publish: the worker sends event lines, then {"end": true} or {"error": ...};
+# the broker answers "cancel" when the job is cancelled.
+
+
+class JobBrokerServer:
+    """Serves a MemoryJobBroker to API front-ends and worker processes over TCP"""
+
+    def __init__(self, broker: MemoryJobBroker):
+        self.broker = broker
+        self.server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 7700) -> str:
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return f"broker://{host}:{self.server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        self.server.close()
+        for task in self._connections:
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            command = json.loads(await reader.readline())
+            op = command.get("op")
+            if op == "submit":
+                try:
+                    await self.broker.submit(Job.from_dict(command["job"]))
+                    reply = {"ok": True}
+                except JobError as e:
+                    reply = {"error": str(e), "status": e.status}
+                await self._reply(writer, reply)
+            elif op == "claim":
+                await self._claim(reader, writer)
+            elif op == "publish":
+                await self._publish(command["id"], reader, writer)
+            elif op == "subscribe":
+                await self._subscribe(command["id"], command.get("after", 0), writer)
+            elif op == "get":
+                job = await self.broker.get(command["id"])
+                await self._reply(writer, {"job": job.to_dict() if job else None})
+            elif op == "cancel":
+                await self._reply(writer, {"ok": await self.broker.cancel(command["id"])})
+            elif op == "stats":
+                await self._reply(writer, await self.broker.stats())
+        except (ConnectionError, ValueError, KeyError, asyncio.CancelledError):
+            # Bad command, client gone or server stopping: drop the connection
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    @staticmethod
+    async def _reply(writer: asyncio.StreamWriter, data: Dict[str, Any]):
+        writer.write(json.dumps(data).encode() + b"\n")
+        await writer.drain()
+
+    async def _claim(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        claim = asyncio.ensure_future(self.broker.claim())
+        gone = asyncio.ensure_future(reader.read(1))
+        try:
+            await asyncio.wait({claim, gone}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            gone.cancel()
+            if not claim.done():
+                # The worker went away while waiting
+                claim.cancel()
+                return
+        job = claim.result()
+        try:
+            await self._reply(writer, {"job": job.to_dict()})
+        except ConnectionError:
+            await self.broker.requeue(job)
+
+    async def _publish(self, job_id: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        async def events():
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionError("Worker desconectado")
+                data = json.loads(line)
+                if "type" in data:
+                    yield data
+                elif "error" in data:
+                    raise RuntimeError(data["error"])
+                else:
+                    return
+
+        try:
+            status = await self.broker.publish(job_id, events())
+        except JobError as e:
+            # Claim lapsed: the job is someone else's now, stop this worker
+            await self._reply(writer, {"error": str(e), "status": e.status})
+            return
+        if status == "cancelled":
+            writer.write(b"cancel\n")
+            await writer.drain()
+
+    async def _subscribe(self, job_id: str, after: int, writer: asyncio.StreamWriter):
+        try:
+            events = await self.broker.subscribe(job_id, after)
+            await self._reply(writer, {"ok": True})
+            async for seq, event in events:
+                writer.write(json.dumps({"seq": seq, "event": event}).encode() + b"\n")
+                await writer.drain()
+        except JobError as e:
+            await self._reply(writer, {"error": str(e), "status": e.status})
+
+
+class RemoteJobBroker(JobBroker):
+    """Client of a JobBrokerServer (broker://host:port)"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 7700):
+        self.host = host
+        self.port = port
+
+    async def _open(self, command: Dict[str, Any]):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        writer.write(json.dumps(command).encode() + b"\n")
+        await writer.drain()
+        return reader, writer
+
+    async def _request(self, command: Dict[str, Any]) -> Dict[str, Any]:
+        reader, writer = await self._open(command)
+        try:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("Broker fechou a conexão")
+            reply = json.loads(line)
+        finally:
+            writer.close()
+        if "error" in reply:
+            raise JobError(reply["error"], reply.get("status", 500))
+        return reply
+
+    async def submit(self, job: Job):
+        await self._request({"op": "submit", "job": job.to_dict()})
+
+    async def claim(self) -> Job:
+        return Job.from_dict((await self._request({"op": "claim"}))["job"])
+
+    async def publish(self, job_id: str, events: AsyncIterator[Dict[str, Any]]):
+        reader, writer = await self._open({"op": "publish", "id": job_id})
+        cancelled = asyncio.Event()
+
+        async def watch():
+            if await reader.readline():
+                cancelled.set()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            try:
+                async for event in cancellable(events, cancelled):
+                    writer.write(json.dumps(event).encode() + b"\n")
+                    await writer.drain()
+                end = {"end": True}
+            except Exception as e:
+                if isinstance(e, ConnectionError):
+                    raise
+                end = {"error": str(e)}
+            if cancelled.is_set():
+                # The broker already ended the job
+                return
+            writer.write(json.dumps(end).encode() + b"\n")
+            await writer.drain()
+            # Wait for the broker to take the end (and say if it cancelled)
+            await asyncio.wait_for(asyncio.shield(watcher), 5)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            watcher.cancel()
+            writer.close()
+
+    async def subscribe(self, job_id: str, after: int = 0) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        reader, writer = await self._open({"op": "subscribe", "id": job_id, "after": after})
+        try:
+            reply = json.loads(await reader.readline() or b"{}")
+        except BaseException:
+            writer.close()
+            raise
+        if "ok" not in reply:
+            writer.close()
+            raise JobError(reply.get("error", "Broker fechou a conexão"), reply.get("status", 502))
+
+        async def events():
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        return
+                    data = json.loads(line)
+                    if "error" in data:
+                        raise JobError(data["error"], data.get("status", 500))
+                    yield data["seq"], data["event"]
+            finally:
+                writer.close()
+
+        return events()
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = (await self._request({"op": "get", "id": job_id}))["job"]
+        return Job.from_dict(job) if job else None
+
+    async def cancel(self, job_id: str) -> bool:
+        return (await self._request({"op": "cancel", "id": job_id}))["ok"]
+
+    async def stats(self) -> Dict[str, Any]:
+        return {**await self._request({"op": "stats"}), "backend": f"broker://{self.host}:{self.port}"}
+
+
+class JobWorker:
+    """
+    Runs queued jobs, `concurrency` at a time: `run(job)` returns the job's
+    agent events, which are published to its channel
+    """
+
+    RETRY_DELAY = 1.0
+
+    def __init__(
+        self,
+        broker: JobBroker,
+        run: Callable[[Job], AsyncIterator[Dict[str, Any]]],
+        concurrency: int = 4
+    ):
+        self.broker = broker
+        self.run = run
+        self.concurrency = concurrency
+        self.running = 0
+        self.processed = 0
+        self._tasks: Set[asyncio.Task] = set()
+
+    def start(self):
+        for _ in range(self.concurrency):
+            self._tasks.add(asyncio.ensure_future(self._work()))
+
+    async def _work(self):
+        while True:
+            try:
+                job = await self.broker.claim()
+            except Exception as e:
+                # Broker unreachable or confused: wait for it to come back
+                logger.warning("Job claim failed: %s", e)
+                await asyncio.sleep(self.RETRY_DELAY)
+                continue
+            self.running += 1
+            try:
+                try:
+                    events = self.run(job)
+                except Exception as e:
+                    # Published like a failure midway: the job ends as
+                    # failed and its viewers get the error
+                    events = _failing(e)
+                await self.broker.publish(job.id, events)
+            except Exception as e:
+                # The broker ends the job (or its claim lapses and it runs
+                # again); this worker keeps going
+                logger.warning("Publishing job %s failed: %s", job.id, e)
+            finally:
+                self.running -= 1
+                self.processed += 1
+
+    async def stop(self):
+        """Cancel the workers; running jobs end with a "cancelled" event"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"concurrency": self.concurrency, "running": self.running, "processed": self.processed}
+
+
+async def _failing(error: Exception) -> AsyncGenerator[Dict[str, Any], None]:
+    raise error
+    yield
+
+
+def create_job_broker(url: Optional[str] = None) -> Optional[JobBroker]:
+    """
+    Build the job broker from a URL:
+
+        (unset)                 -> None (/chat streams directly)
+        memory://               -> MemoryJobBroker in this process
+        broker://host[:port]    -> RemoteJobBroker (python jobs.py broker)
+    """
+    if not url:
+        return None
+    if url.startswith("memory:"):
+        return MemoryJobBroker.from_env()
+    parsed = urlparse(url)
+    if parsed.scheme == "broker":
+        return RemoteJobBroker(parsed.hostname or "127.0.0.1", parsed.port or 7700)
+    raise ValueError(f"Unsupported job queue URL: {url}")
+
+
+async def run_broker(host: str, port: int):
+    server = JobBrokerServer(MemoryJobBroker.from_env())
+    print(f"Job broker on {await server.start(host, port)}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+async def run_workers(url: str, concurrency: int):
+    # The worker needs the same agents, pipelines and history store as the API
+    os.environ["JOB_QUEUE_URL"] = url
+    import main
+
+    worker = JobWorker(main.job_broker, main.run_job, concurrency)
+    worker.start()
+    print(f"{concurrency} job worker(s) on {url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await worker.stop()
+        await main.sessions.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    broker = commands.add_parser("broker", help="run the job broker")
+    broker.add_argument("--host", default="127.0.0.1")
+    broker.add_argument("--port", type=int, default=7700)
+    worker = commands.add_parser("worker", help="run job workers")
+    worker.add_argument("--broker", default=os.getenv("JOB_QUEUE_URL", "broker://127.0.0.1:7700"))
+    worker.add_argument("--concurrency", type=int, default=int(os.getenv("JOB_WORKERS", "4")))
+    args = parser.parse_args(argv)
+    if (
+        args.command == "worker"
+        and not args.broker.startswith("memory:")
+        and os.getenv("HISTORY_STORE_URL", "memory://").startswith("memory://")
+    ):
+        parser.error(
+            "workers in their own process keep a separate in-memory history; "
+            "set HISTORY_STORE_URL (sqlite:// or redis://) to the API's store"
+        )
+
+    try:
+        if args.command == "broker":
+            asyncio.run(run_broker(args.host, args.port))
+        else:
+            asyncio.run(run_workers(args.broker, args.concurrency))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
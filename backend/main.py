@@ -1,13 +1,36 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from typing import Optional, Dict
-import json
+from pydantic import BaseModel, Field
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional
+import asyncio
 import os
+import time
 
-from agent import PollinationsAgent
+from admission import AdmissionController, Overloaded, Permit
+from agent import PollinationsAgent, ToolType
+from cache import ResponseCache
+from context import ContextWindow
+from history_store import create_history_store
+from intent import load_intent_router
+from jobs import Job, JobError, JobWorker, create_job_broker
+from media import (
+    ImagePipeline, MediaCache, RangeNotSatisfiable, image_variants, is_media_key, iter_file, parse_range, sniff_content_type
+)
+from metrics import ChatMetrics, ChatTrace
+from planner import PlanStep, ToolPlanner
+from resilience import ResiliencePolicy, UpstreamResilience
+from routing import ModelRouter
+from sessions import SessionManager
+from singleflight import SingleFlight
+from summary import ConversationSummarizer
+from speech import SpeechPipeline
+from streams import ChatStream, StreamRegistry, cancellable
+from sse import FlushPolicy, coalesce_events, encode_event, encode_events
+from tool_router import ToolRouter
+from transport import UpstreamSettings, create_upstream_client, create_upstream_transport, warm_connections
+from vision import UploadError, VisionStore, multipart_boundary, multipart_file
 
 app = FastAPI(title="Mega Agent API", version="1.0.0")
 
@@ -18,15 +41,189 @@ app.add_middleware(
     allow_credentials=False,  # No cookies/auth, so False is safer
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Session-ID", "X-Stream-ID"],
 )
 
-# Global agent instance
-agent = PollinationsAgent()
+# Session handling: each client gets its own agent and history
+SESSION_HEADER = "X-Session-ID"
+SESSION_COOKIE = "session_id"
+# Id of a /chat response, for POST /chat/{id}/cancel
+STREAM_HEADER = "X-Stream-ID"
+JOB_HEADER = "X-Job-ID"
+
+# Upstream text API; point it at fake_upstream.py for load tests
+PollinationsAgent.BASE_URL_TEXT = os.getenv("POLLINATIONS_TEXT_URL", PollinationsAgent.BASE_URL_TEXT).rstrip("/")
+
+# One pooled upstream client shared by every session (UPSTREAM_* settings)
+upstream_settings = UpstreamSettings.from_env()
+upstream_transport = create_upstream_transport(upstream_settings)
+upstream_client = create_upstream_client(upstream_settings, upstream_transport)
+
+# Retries before the first byte, optional hedging and per-model circuit breakers
+upstream_resilience = UpstreamResilience(ResiliencePolicy.from_env())
+
+# Model fallback chains (MODEL_CHAIN_TEXT=openai,openai-fast,mistral); models
+# with an open circuit breaker are tried last
+model_router = ModelRouter.from_env(is_available=upstream_resilience.available)
+
+# Keyword router for tools (TOOL_ROUTER_LANGUAGES, TOOL_ROUTER_KEYWORDS)
+tool_router = ToolRouter.from_env()
+
+# Optional learned intent classifier in front of the keywords (needs numpy)
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH")
+if INTENT_MODEL_PATH:
+    tool_router = load_intent_router(
+        INTENT_MODEL_PATH,
+        tool_router,
+        min_confidence=float(os.getenv("INTENT_MIN_CONFIDENCE", "0.7"))
+    )
+
+# Token budget per model for the history sent upstream (CONTEXT_TOKEN_BUDGET,
+# CONTEXT_TOKEN_BUDGET_<MODEL>); older long turns are compacted or dropped
+context_window = ContextWindow.from_env()
+
+# Turns trimmed from the history are folded into a rolling summary in the
+# background after each answer. Opt-in (SUMMARY_ENABLED=1): it costs an
+# extra upstream call per turn once the history is full; otherwise trimmed
+# turns are dropped.
+summarizer = ConversationSummarizer.from_env() if os.getenv("SUMMARY_ENABLED", "0") == "1" else None
+
+# Compound requests ("pesquise X e desenhe Y") run their tools concurrently
+# in one stream (PLANNER_ENABLED=0 keeps one tool per message)
+planner = ToolPlanner(
+    tool_router,
+    max_steps=int(os.getenv("PLANNER_MAX_STEPS", "4"))
+) if os.getenv("PLANNER_ENABLED", "1") != "0" else None
+
+# Opt-in response cache: RESPONSE_CACHE_MB=0 (default) disables it
+RESPONSE_CACHE_MB = float(os.getenv("RESPONSE_CACHE_MB", "0"))
+response_cache = ResponseCache(
+    max_bytes=int(RESPONSE_CACHE_MB * 1024 * 1024),
+    ttls={
+        "search": float(os.getenv("CACHE_TTL_SEARCH", "300")),
+        "text_generation": float(os.getenv("CACHE_TTL_TEXT", "3600")),
+        "reasoning": float(os.getenv("CACHE_TTL_REASONING", "3600")),
+    }
+) if RESPONSE_CACHE_MB > 0 else None
+
+# Identical concurrent upstream calls share one stream (SINGLE_FLIGHT=0 disables)
+single_flight = SingleFlight() if os.getenv("SINGLE_FLIGHT", "1") != "0" else None
+
+# Bounds concurrent /chat streams globally and per tool (ADMISSION_ENABLED=0 disables)
+admission = AdmissionController.from_env() if os.getenv("ADMISSION_ENABLED", "1") != "0" else None
+
+# Opt-in server-side image fetching into a local cache served from /media
+# (IMAGE_PIPELINE=1, IMAGE_CACHE_DIR, IMAGE_CACHE_MB)
+image_pipeline = ImagePipeline.from_env(upstream_client) if os.getenv("IMAGE_PIPELINE", "0") == "1" else None
+
+# Opt-in sentence-by-sentence text-to-speech into a local cache served from
+# /media/audio (TTS_PIPELINE=1, TTS_CACHE_DIR, TTS_CACHE_MB)
+speech_pipeline = SpeechPipeline.from_env(upstream_client) if os.getenv("TTS_PIPELINE", "0") == "1" else None
+
+# Uploaded images for the vision tool, downscaled and deduplicated by hash
+# (VISION_ENABLED=0 disables)
+vision_store = VisionStore.from_env() if os.getenv("VISION_ENABLED", "1") != "0" else None
+
+# /chat responses in flight and recently finished, for cancellation,
+# Last-Event-ID resumption and stream counts (RESUME_WINDOW, RESUME_TTL,
+# RESUME_BUFFER_KB, RESUME_MAX_STREAMS)
+streams = StreamRegistry.from_env()
+
+# Generation as background jobs: /chat enqueues a job, worker tasks (here,
+# JOB_WORKERS, and/or in `python jobs.py worker` processes) run it and any
+# number of viewers follow its events (JOB_QUEUE_URL=memory:// or
+# broker://host:port; unset streams /chat directly)
+job_broker = create_job_broker(os.getenv("JOB_QUEUE_URL"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+
+# Hot path latency histograms for /metrics (METRICS_ENABLED=0 disables,
+# METRICS_TRACING=1 adds OpenTelemetry spans)
+metrics = ChatMetrics.from_env() if os.getenv("METRICS_ENABLED", "1") != "0" else None
+
+sessions = SessionManager(
+    max_sessions=int(os.getenv("MAX_SESSIONS", "10000")),
+    idle_ttl=float(os.getenv("SESSION_IDLE_TTL", "1800")),
+    max_history=int(os.getenv("MAX_HISTORY_MESSAGES", "10")),
+    client=upstream_client,
+    # memory:// (default), sqlite:///history.db or redis://host:6379/0
+    history_store=create_history_store(os.getenv("HISTORY_STORE_URL")),
+    response_cache=response_cache,
+    single_flight=single_flight,
+    resilience=upstream_resilience,
+    router=model_router,
+    tool_router=tool_router,
+    context_window=context_window,
+    summarizer=summarizer,
+    planner=planner,
+    image_pipeline=image_pipeline,
+    speech_pipeline=speech_pipeline,
+    vision_store=vision_store,
+    metrics=metrics
+)
+
+
+def get_session_id(http_request: Request) -> str:
+    """
+    Read the session id from the header or cookie, or create a new one
+    """
+    session_id = http_request.headers.get(SESSION_HEADER) or http_request.cookies.get(SESSION_COOKIE)
+    if SessionManager.is_valid_session_id(session_id):
+        return session_id
+    return SessionManager.new_session_id()
+
+
+# Default coalescing of text chunks into SSE frames
+FLUSH_MAX_BYTES = int(os.getenv("SSE_FLUSH_MAX_BYTES", "2048"))
+FLUSH_MAX_DELAY_MS = float(os.getenv("SSE_FLUSH_MAX_DELAY_MS", "25"))
+
+
+class FlushOptions(BaseModel):
+    """How text chunks are merged into SSE frames for this request"""
+    per_token: bool = False
+    max_bytes: int = Field(FLUSH_MAX_BYTES, ge=0)
+    max_delay_ms: float = Field(FLUSH_MAX_DELAY_MS, ge=0)
+    
+    def to_policy(self) -> FlushPolicy:
+        if self.per_token:
+            return FlushPolicy.per_token()
+        return FlushPolicy(max_bytes=self.max_bytes, max_delay_ms=self.max_delay_ms)
+
+
+# Upper bound on the images of one batch request
+IMAGE_BATCH_MAX = int(os.getenv("IMAGE_BATCH_MAX", "8"))
+
+
+class ImageBatchOptions(BaseModel):
+    """Variants of one image request: every seed x model x size combination"""
+    seeds: Optional[List[int]] = None
+    models: Optional[List[str]] = None
+    sizes: Optional[List[str]] = None
+    count: int = Field(4, ge=1)
+    preview: bool = True
+    
+    def to_variants(self, default_model: str) -> List[Dict[str, Any]]:
+        unknown = [m for m in self.models or [] if m not in PollinationsAgent.IMAGE_MODELS]
+        if unknown:
+            raise ValueError(f"Modelo de imagem desconhecido: {', '.join(unknown)}")
+        return image_variants(
+            default_model,
+            seeds=self.seeds,
+            models=self.models,
+            sizes=self.sizes,
+            count=self.count,
+            max_variants=IMAGE_BATCH_MAX
+        )
 
 
 class ChatRequest(BaseModel):
     message: str
     models: Optional[Dict[str, str]] = None
+    flush: Optional[FlushOptions] = None
+    image_batch: Optional[ImageBatchOptions] = None
+    # Read a text answer aloud while it streams (TTS_PIPELINE=1)
+    speak: bool = False
+    # Id returned by POST /uploads: the message is a question about that image
+    image_id: Optional[str] = None
 
 
 class ModelsResponse(BaseModel):
@@ -45,9 +242,30 @@ async def api_info():
         "version": "1.0.0",
         "endpoints": {
             "/chat": "POST - Send a message to the agent (streaming)",
+            "/chat/{id}/cancel": "POST - Stop a streaming response (id from the X-Stream-ID header)",
+            "/chat/{id}/events": "GET - Resume a streaming response after its Last-Event-ID",
+            "/streams/stats": "GET - Active, completed, cancelled and disconnected streams",
+            "/jobs": "POST - Queue a chat request as a background job (JOB_QUEUE_URL)",
+            "/jobs/{id}": "GET - Job status",
+            "/jobs/{id}/events": "GET - Follow a job's events (SSE, Last-Event-ID)",
+            "/jobs/{id}/ws": "WebSocket - Follow a job's events",
+            "/jobs/{id}/cancel": "POST - Cancel a queued or running job",
+            "/jobs/stats": "GET - Queued, running and finished jobs, viewers and workers",
+            "/metrics": "GET - Latency histograms by tool and model (Prometheus format)",
             "/models": "GET - Get available models",
-            "/clear": "POST - Clear conversation history"
-        }
+            "/clear": "POST - Clear conversation history",
+            "/cache/stats": "GET - Response cache counters",
+            "/media/images/{key}": "GET - Cached generated image (ETag, Range), when IMAGE_PIPELINE=1",
+            "/media/audio/{key}": "GET - Cached speech segment (ETag, Range), when TTS_PIPELINE=1",
+            "/media/stats": "GET - Image fetches, speech segments and media cache size, hits and evictions",
+            "/uploads": "POST - Upload an image for the vision tool (multipart or raw body)",
+            "/vision/stats": "GET - Vision uploads, deduplication and image sizes",
+            "/upstream/stats": "GET - Upstream connection pool, retry/hedge and circuit breaker metrics",
+            "/admission/stats": "GET - Concurrency limits, queue depth and admitted/rejected counts",
+            "/routing/stats": "GET - Model fallback chains, rolling TTFT, tokens/s and error rate per model, and planner counters",
+            "/context/stats": "GET - Token budgets, prompt tokens, kept/compacted/dropped history messages and summary updates"
+        },
+        "session": f"Send the {SESSION_HEADER} header or {SESSION_COOKIE} cookie to keep a conversation"
     }
 
 
@@ -63,47 +281,543 @@ async def get_models():
     )
 
 
+def serve_media(cache: Optional[MediaCache], key: str, http_request: Request, not_found: str) -> Response:
+    """Serve a file from a media cache; files never change, so cache forever"""
+    path = cache.get(key) if cache is not None and is_media_key(key) else None
+    if path is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    
+    etag = f'"{key}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes"
+    }
+    if etag in http_request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        content_type = sniff_content_type(f.read(12))
+    
+    range_header = http_request.headers.get("range")
+    if http_request.headers.get("if-range", etag) != etag:
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, size)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    
+    start, end = byte_range or (0, size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range is not None:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(
+        iter_file(path, start, end),
+        status_code=206 if byte_range is not None else 200,
+        media_type=content_type,
+        headers=headers
+    )
+
+
+@app.get("/media/images/{key}")
+async def media_image(key: str, http_request: Request):
+    """Serve a generated image from the media cache"""
+    cache = image_pipeline.cache if image_pipeline is not None else None
+    return serve_media(cache, key, http_request, "Imagem não encontrada")
+
+
+@app.get("/media/audio/{key}")
+async def media_audio(key: str, http_request: Request):
+    """Serve a speech segment from the TTS cache"""
+    cache = speech_pipeline.cache if speech_pipeline is not None else None
+    return serve_media(cache, key, http_request, "Áudio não encontrado")
+
+
+@app.get("/media/stats")
+async def media_stats():
+    """Image fetches, speech segments and media cache counters"""
+    speech = {"enabled": True, **speech_pipeline.stats()} if speech_pipeline is not None else {"enabled": False}
+    if image_pipeline is None:
+        return {"enabled": False, "speech": speech}
+    return {"enabled": True, **image_pipeline.stats(), "speech": speech}
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Response cache hit/miss/eviction counters"""
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.stats()}
+
+
+@app.get("/upstream/stats")
+async def upstream_stats():
+    """Upstream metrics: pool wait, connection counts, retries, hedges and breakers"""
+    return {
+        "http2": upstream_transport.http2,
+        "max_connections": upstream_settings.max_connections,
+        **upstream_transport.stats(),
+        "resilience": upstream_resilience.stats()
+    }
+
+
+@app.get("/routing/stats")
+async def routing_stats():
+    """Model fallback chains, rolling TTFT, tokens/s and error rate per model, and planner counters"""
+    return {
+        **model_router.stats(),
+        "planner": planner.stats() if planner is not None else {"enabled": False}
+    }
+
+
+@app.get("/context/stats")
+async def context_stats():
+    """Token budgets, how much history was kept, compacted or dropped, and summary updates"""
+    return {
+        **context_window.stats(),
+        "summary": summarizer.stats() if summarizer is not None else {"enabled": False}
+    }
+
+
+@app.get("/admission/stats")
+async def admission_stats():
+    """Concurrency limits, queue depth and admitted/rejected counts"""
+    if admission is None:
+        return {"enabled": False}
+    return {"enabled": True, **admission.stats()}
+
+
+async def track_admission(
+    events: AsyncIterator[Dict[str, Any]],
+    permit: Permit
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Report time to first content and errors to the admission controller,
+    and free the slot when the stream ends
+    """
+    try:
+        async for event in events:
+            if event["type"] in ("text_chunk", "image", "audio"):
+                permit.first_token()
+            yield event
+    except Exception:
+        permit.release(error=True)
+        raise
+    finally:
+        permit.release()
+
+
+def check_chat_request(request: ChatRequest):
+    """Reject invalid options before any work starts or is queued"""
+    if request.image_id is not None and (vision_store is None or not is_media_key(request.image_id)):
+        raise HTTPException(status_code=400, detail="image_id inválido")
+    if request.image_batch is not None:
+        try:
+            request.image_batch.to_variants((request.models or {}).get("image", "flux"))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+def plan_chat(agent: PollinationsAgent, request: ChatRequest, trace: Optional[ChatTrace] = None) -> List[PlanStep]:
+    if request.image_id is not None:
+        # A question about an uploaded image is a single vision step
+        return [PlanStep("vision-1", ToolType.VISION.value, request.message)]
+    routing_started = time.perf_counter()
+    plan = agent.plan(request.message)
+    if trace is not None:
+        trace.routed(plan[0].tool if len(plan) == 1 else ChatTrace.PLAN, time.perf_counter() - routing_started)
+    return plan
+
+
+def chat_events(agent: PollinationsAgent, request: ChatRequest, plan: List[PlanStep]) -> AsyncIterator[Dict[str, Any]]:
+    """The agent stream answering a checked request"""
+    if request.image_id is not None:
+        return agent.process_message_stream(
+            request.message,
+            request.models,
+            image_id=request.image_id,
+            speak=request.speak
+        )
+    if request.image_batch is not None and [step.tool for step in plan] == [ToolType.IMAGE_GENERATION.value]:
+        # Batch options only apply to plain image requests
+        return agent.process_message_stream(
+            request.message,
+            request.models,
+            tool_type=ToolType.IMAGE_GENERATION,
+            image_variants=request.image_batch.to_variants((request.models or {}).get("image", "flux")),
+            image_preview=request.image_batch.preview
+        )
+    return agent.process_message_stream(request.message, request.models, plan=plan, speak=request.speak)
+
+
+async def run_job(job: Job) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Agent events of a queued request, in the worker that claimed it: admitted,
+    traced and with text merged per its flush policy like a direct /chat
+    """
+    request = ChatRequest(**job.request)
+    agent = sessions.get(job.session_id)
+    policy = (request.flush or FlushOptions()).to_policy()
+    trace = metrics.trace() if metrics is not None else None
+    plan = plan_chat(agent, request, trace)
+    events = chat_events(agent, request, plan)
+    outcome = "failed"
+    try:
+        if admission is not None:
+            # Overloaded fails the job; its viewers get the error
+            events = track_admission(events, await admission.admit(plan[0].tool))
+        if trace is not None:
+            events = trace.events(events)
+        async for event in coalesce_events(events, policy):
+            if trace is not None:
+                trace.wrote(len(encode_event(event)))
+            yield event
+        outcome = "completed"
+    except (GeneratorExit, asyncio.CancelledError):
+        outcome = "cancelled"
+        raise
+    finally:
+        await events.aclose()
+        if trace is not None:
+            trace.finish(outcome)
+
+
+async def submit_job(session_id: str, request: ChatRequest) -> Job:
+    job = Job(session_id, request.model_dump())
+    try:
+        await job_broker.submit(job)
+    except JobError as e:
+        raise HTTPException(status_code=e.status, detail=str(e), headers={"Retry-After": "1"})
+    return job
+
+
+async def job_frames(events: AsyncIterator) -> AsyncGenerator[bytes, None]:
+    """SSE frames of a job's events, each with its sequence number as id"""
+    try:
+        async for seq, event in events:
+            yield b"id: %d\n%s" % (seq, encode_event(event))
+    except JobError as e:
+        yield encode_event({"type": "error", "message": str(e)})
+
+
 @app.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """
     Chat with the agent (streaming response)
     """
-    async def event_generator():
+    session_id = get_session_id(http_request)
+    check_chat_request(request)
+    
+    if job_broker is not None:
+        # Generation runs in a job worker; this response is one of its viewers
+        job = await submit_job(session_id, request)
+        response = event_stream_response(session_id, job_frames(await job_broker.subscribe(job.id)))
+        response.headers[JOB_HEADER] = job.id
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax")
+        return response
+    
+    agent = sessions.get(session_id)
+    policy = (request.flush or FlushOptions()).to_policy()
+    trace = metrics.trace() if metrics is not None else None
+    plan = plan_chat(agent, request, trace)
+    events = chat_events(agent, request, plan)
+    
+    if admission is not None:
         try:
-            async for event in agent.process_message_stream(
-                request.message,
-                request.models
-            ):
-                yield f"data: {json.dumps(event)}\n\n"
+            # A compound request is admitted under its first tool
+            permit = await admission.admit(plan[0].tool)
+        except Overloaded as e:
+            raise HTTPException(
+                status_code=503,
+                detail=str(e),
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        events = track_admission(events, permit)
+    
+    if trace is not None:
+        events = trace.events(events)
+    stream = streams.create(session_id)
+    
+    async def produce():
+        outcome = "failed"
+        try:
+            # A cancel request, or the client going away for longer than the
+            # resume window, tears down the agent stream and its upstream request
+            async for frame in cancellable(encode_events(events, policy), stream.cancelled):
+                if trace is not None:
+                    trace.wrote(len(frame))
+                await stream.log.append(frame)
+            if stream.cancelled.is_set():
+                outcome = "disconnected" if stream.abandoned else "cancelled"
+                await stream.log.append(encode_event({"type": "cancelled"}))
+            else:
+                outcome = "completed"
+        except asyncio.CancelledError:
+            # Shutdown
+            outcome = "disconnected"
+            raise
         except Exception as e:
             error_event = {
                 "type": "error",
                 "message": str(e)
             }
-            yield f"data: {json.dumps(error_event)}\n\n"
+            await stream.log.append(encode_event(error_event))
+        finally:
+            streams.finish(stream, outcome)
+            if trace is not None:
+                trace.finish(outcome)
     
+    streams.add(stream)
+    stream.task = asyncio.ensure_future(produce())
+    response = event_stream_response(session_id, stream.follow())
+    response.headers[STREAM_HEADER] = stream.id
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax")
+    return response
+
+
+def event_stream_response(session_id: str, frames: AsyncIterator[bytes]) -> StreamingResponse:
     return StreamingResponse(
-        event_generator(),
+        frames,
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"
+            "X-Accel-Buffering": "no",
+            SESSION_HEADER: session_id
         }
     )
 
 
+def read_last_event_id(http_request: Request, default: Optional[int]) -> int:
+    """Last-Event-ID header, else the `last_event_id` query parameter"""
+    header = http_request.headers.get("last-event-id")
+    try:
+        return int(header) if header is not None else (default or 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Last-Event-ID inválido")
+
+
+@app.get("/chat/{stream_id}/events")
+async def resume_chat(stream_id: str, http_request: Request, last_event_id: Optional[int] = None):
+    """
+    Resume a /chat response after a dropped connection: replays the frames
+    after Last-Event-ID (header, or `last_event_id` for the first
+    EventSource request) and follows the live tail, without a new upstream
+    call. Works while the stream runs and for RESUME_TTL seconds after.
+    """
+    after = read_last_event_id(http_request, last_event_id)
+    stream = streams.get(stream_id, get_session_id(http_request))
+    if stream is None:
+        raise HTTPException(status_code=404, detail="Stream não encontrado")
+    try:
+        # Registers the reader now, so nothing is evicted before the response starts
+        frames = stream.follow(after)
+    except ValueError:
+        raise HTTPException(status_code=410, detail="Eventos já descartados; envie a mensagem novamente")
+    streams.resumed += 1
+    response = event_stream_response(stream.session_id, frames)
+    response.headers[STREAM_HEADER] = stream.id
+    return response
+
+
+@app.post("/chat/{stream_id}/cancel")
+async def cancel_chat(stream_id: str, http_request: Request):
+    """
+    Stop a /chat response of the caller's session: the upstream request is
+    closed, the partial answer kept in history and the stream ends with a
+    "cancelled" event. Streams live in the worker that serves them; closing
+    the connection cancels from anywhere.
+    """
+    if not streams.cancel(stream_id, get_session_id(http_request)):
+        raise HTTPException(status_code=404, detail="Stream não encontrado")
+    return {"message": "Stream cancelled"}
+
+
+@app.get("/streams/stats")
+async def streams_stats():
+    """Active /chat streams and how finished ones ended"""
+    return streams.stats()
+
+
+def require_job_broker():
+    if job_broker is None:
+        raise HTTPException(status_code=404, detail="Fila de jobs desativada (JOB_QUEUE_URL)")
+
+
+async def get_job(job_id: str, http_request: Request) -> Job:
+    """A job of the caller's session"""
+    require_job_broker()
+    job = await job_broker.get(job_id)
+    if job is None or job.session_id != get_session_id(http_request):
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: ChatRequest, http_request: Request):
+    """
+    Queue a chat request and return its id without waiting: a job worker
+    generates the answer, and any number of viewers of the same session
+    follow it with GET /jobs/{id}/events or the /jobs/{id}/ws WebSocket
+    """
+    require_job_broker()
+    session_id = get_session_id(http_request)
+    check_chat_request(request)
+    job = await submit_job(session_id, request)
+    response = JSONResponse(
+        {"job_id": job.id, "status": job.status},
+        status_code=202,
+        headers={SESSION_HEADER: session_id, JOB_HEADER: job.id}
+    )
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax")
+    return response
+
+
+@app.get("/jobs/stats")
+async def jobs_stats():
+    """Queued, running and finished jobs, viewers, and this process's workers"""
+    require_job_broker()
+    worker = getattr(app.state, "job_worker", None)
+    return {**await job_broker.stats(), "workers": worker.stats() if worker is not None else None}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, http_request: Request):
+    """Status and timestamps of a job"""
+    job = await get_job(job_id, http_request)
+    return {key: value for key, value in job.to_dict().items() if key not in ("session_id", "request")}
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, http_request: Request, last_event_id: Optional[int] = None):
+    """
+    A job's events as SSE, from after Last-Event-ID (header or query), then
+    live until the job ends
+    """
+    job = await get_job(job_id, http_request)
+    after = read_last_event_id(http_request, last_event_id)
+    try:
+        events = await job_broker.subscribe(job.id, after)
+    except JobError as e:
+        raise HTTPException(status_code=e.status, detail=str(e))
+    response = event_stream_response(job.session_id, job_frames(events))
+    response.headers[JOB_HEADER] = job.id
+    return response
+
+
+@app.websocket("/jobs/{job_id}/ws")
+async def job_websocket(websocket: WebSocket, job_id: str, after: int = 0):
+    """
+    A job's events over a WebSocket, as JSON messages with their `seq`.
+    Closes normally when the job ends; 4404 for unknown jobs, 4410 when the
+    events after `after` were dropped.
+    """
+    await websocket.accept()
+    job = await job_broker.get(job_id) if job_broker is not None else None
+    if job is None or job.session_id != get_session_id(websocket):
+        await websocket.close(code=4404)
+        return
+    try:
+        async for seq, event in await job_broker.subscribe(job.id, after):
+            await websocket.send_json({"seq": seq, **event})
+    except JobError as e:
+        await websocket.close(code=4000 + e.status)
+        return
+    except WebSocketDisconnect:
+        return
+    await websocket.close()
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, http_request: Request):
+    """
+    Cancel a job of the caller's session: a queued job never runs, a running
+    one stops like a cancelled /chat stream (partial answer kept) and its
+    viewers get a "cancelled" event
+    """
+    job = await get_job(job_id, http_request)
+    if not await job_broker.cancel(job.id):
+        raise HTTPException(status_code=409, detail="Job já terminou")
+    return {"message": "Job cancelled"}
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Routing, pool wait, TTFB, TTFT, inter-token gap, tokens/sec, stream
+    duration and SSE bytes histograms, by tool and model
+    """
+    if metrics is None:
+        raise HTTPException(status_code=404, detail="Métricas desativadas")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/uploads")
+async def upload_image(http_request: Request):
+    """
+    Upload an image for the vision tool, as multipart/form-data or a raw
+    image/* body. The body is streamed to disk, never held in memory, and
+    the answer's id goes into /chat as image_id.
+    """
+    if vision_store is None:
+        raise HTTPException(status_code=404, detail="Análise de imagem desabilitada")
+    length = http_request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > vision_store.max_upload_bytes:
+        raise HTTPException(status_code=413, detail="Upload grande demais")
+    
+    content_type = http_request.headers.get("content-type", "")
+    boundary = multipart_boundary(content_type)
+    chunks = http_request.stream()
+    if boundary is not None:
+        chunks = multipart_file(chunks, boundary)
+    elif not content_type.startswith(("image/", "application/octet-stream")):
+        raise HTTPException(status_code=415, detail="Envie multipart/form-data ou uma imagem")
+    try:
+        return await vision_store.store(chunks)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status, detail=str(e))
+
+
+@app.get("/vision/stats")
+async def vision_stats():
+    """Uploads, deduplicated uploads and bytes before/after downscaling"""
+    if vision_store is None:
+        return {"enabled": False}
+    return {"enabled": True, **vision_store.stats()}
+
+
 @app.post("/clear")
-async def clear_history():
-    """Clear conversation history"""
-    agent.clear_history()
+async def clear_history(http_request: Request):
+    """Clear conversation history of the caller's session"""
+    # get() rather than peek(): with a shared store the session may have
+    # been created by another worker
+    agent = sessions.get(get_session_id(http_request))
+    await agent.clear_history()
     return {"message": "Conversation history cleared"}
 
 
+@app.on_event("startup")
+async def startup_event():
+    """Warm upstream connections in the background, start job workers"""
+    app.state.warmup = asyncio.ensure_future(warm_connections(upstream_client, upstream_settings))
+    if job_broker is not None and JOB_WORKERS > 0:
+        app.state.job_worker = JobWorker(job_broker, run_job, JOB_WORKERS)
+        app.state.job_worker.start()
+
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
-    await agent.close()
+    # Streams still running here were not drained (plain uvicorn, or past
+    # the serve.py deadline): stop them so their partial answers are saved
+    await streams.close()
+    if getattr(app.state, "job_worker", None) is not None:
+        # Running jobs end with a "cancelled" event and keep their partial answer
+        await app.state.job_worker.stop()
+    if job_broker is not None:
+        await job_broker.close()
+    await sessions.close()
 
 
 # Mount static files (frontend)
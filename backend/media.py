@@ -0,0 +1,395 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+# First bytes of the image and audio formats the upstream returns
+_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"ID3", "audio/mpeg"),
+    (b"\xff\xfb", "audio/mpeg"),
+    (b"\xff\xf3", "audio/mpeg"),
+    (b"\xff\xf2", "audio/mpeg"),
+    (b"OggS", "audio/ogg"),
+]
+
+
+def sniff_content_type(head: bytes) -> str:
+    for signature, content_type in _SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "audio/wav"
+    return "application/octet-stream"
+
+
+def media_key(**params: Any) -> str:
+    """Stable cache key of a generation request (prompt, model, size, seed)"""
+    canonical = json.dumps(params, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_media_key(key: str) -> bool:
+    return len(key) == 64 and all(c in "0123456789abcdef" for c in key)
+
+
+class RangeNotSatisfiable(Exception):
+    """Range header outside the file"""
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Inclusive (start, end) of a single "bytes=" range, or None to send the
+    whole file (no header, multiple ranges or a unit we do not know)
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if not start_text:
+            # Suffix range: the last N bytes
+            length = int(end_text)
+            if length <= 0:
+                raise RangeNotSatisfiable(header)
+            return max(0, size - length), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+
+def iter_file(path: str, start: int, end: int, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Yield bytes start..end (inclusive) of a file"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class MediaCache:
+    """
+    On-disk cache of generated media, one file per request key, bounded by
+    total size with least-recently-used eviction.
+
+    Files are written to a temporary name and renamed, so readers (other
+    workers included) never see partial files. The LRU order lives in memory
+    and is rebuilt from file modification times at startup; hits touch the
+    file so the order survives restarts. The directory is created on the
+    first write, so configuring a cache leaves no trace until it is used.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+
+    def _load(self):
+        files = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not is_media_key(name):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self.total_bytes += size
+        self._evict()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def ensure_directory(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, key: str) -> Optional[str]:
+        """Path of a cached file, or None"""
+        size = self._entries.get(key)
+        path = self.path(key)
+        if size is None:
+            # Possibly written by another worker sharing the directory
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                self.misses += 1
+                return None
+            self._entries[key] = size
+            self.total_bytes += size
+        elif not os.path.exists(path):
+            # Evicted by another worker
+            self._forget(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return path
+
+    def write(self, key: str, data: bytes) -> str:
+        """
+        Write the file for `key` without touching the index, so it can run
+        in a thread; call add() afterwards
+        """
+        path = self.path(key)
+        temp = f"{path}.{uuid.uuid4().hex}.tmp"
+        self.ensure_directory()
+        with open(temp, "wb") as f:
+            f.write(data)
+        os.replace(temp, path)
+        return path
+
+    def put(self, key: str, data: bytes) -> str:
+        """Store `data` under `key` and return its path"""
+        path = self.write(key, data)
+        self.add(key, len(data))
+        return path
+
+    def add(self, key: str, size: int):
+        """Record a written file and evict down to max_bytes"""
+        if key in self._entries:
+            self.total_bytes -= self._entries[key]
+        self._entries[key] = size
+        self._entries.move_to_end(key)
+        self.total_bytes += size
+        self._evict()
+
+    def _forget(self, key: str):
+        self.total_bytes -= self._entries.pop(key, 0)
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, _ = next(iter(self._entries.items()))
+            self._forget(key)
+            try:
+                os.unlink(self.path(key))
+            except FileNotFoundError:
+                pass
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class MediaPipeline:
+    """
+    Fetches generated media server-side into a MediaCache so they are
+    served from MEDIA_PATH<key>. Concurrent requests for the same key share
+    one download, and progress is reported while it runs.
+    """
+
+    MEDIA_PATH = "/media/"
+    # Prefix of the progress/ready event types
+    EVENT = "media"
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        cache: MediaCache,
+        max_concurrency: int = 8,
+        timeout: float = 120.0,
+        max_bytes: int = 20 * 1024 * 1024
+    ):
+        self.client = client
+        self.cache = cache
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._inflight: Dict[str, "asyncio.Future[str]"] = {}
+        self.fetches = 0
+        self.shared = 0
+        self.failures = 0
+        self.completed = 0
+        self.fetch_time_total = 0.0
+
+    def media_url(self, key: str) -> str:
+        return self.MEDIA_PATH + key
+
+    async def _download(self, key: str, url: str, progress: "asyncio.Queue") -> str:
+        async with self._slots:
+            started = time.perf_counter()
+            self.fetches += 1
+            async with self.client.stream("GET", url, timeout=self.timeout) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    raise RuntimeError(f"{self.EVENT.capitalize()} API error {response.status_code}: {body[:200].decode(errors='replace')}")
+                total = int(response.headers.get("content-length") or 0) or None
+                chunks = []
+                received = 0
+                async for chunk in response.aiter_bytes():
+                    chunks.append(chunk)
+                    received += len(chunk)
+                    if received > self.max_bytes:
+                        raise RuntimeError(f"{self.EVENT.capitalize()} too large")
+                    progress.put_nowait((received, total))
+            data = b"".join(chunks)
+            path = await asyncio.get_running_loop().run_in_executor(None, self.cache.write, key, data)
+            self.cache.add(key, len(data))
+            self.completed += 1
+            self.fetch_time_total += time.perf_counter() - started
+            return path
+
+    def _start(self, key: str, url: str) -> Tuple["asyncio.Future[str]", "asyncio.Queue"]:
+        future = self._inflight.get(key)
+        if future is not None:
+            self.shared += 1
+            return future, asyncio.Queue()
+        progress: asyncio.Queue = asyncio.Queue()
+        future = asyncio.ensure_future(self._download(key, url, progress))
+        self._inflight[key] = future
+
+        def finished(f):
+            self._inflight.pop(key, None)
+            if not f.cancelled() and f.exception() is not None:
+                self.failures += 1
+        future.add_done_callback(finished)
+        return future, progress
+
+    async def fetch(
+        self,
+        key: str,
+        url: str,
+        progress_interval: float = 0.25
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Make sure the file for `key` is cached, yielding progress events
+        ({"type": "<EVENT>_progress", ...}) and finally
+        {"type": "<EVENT>_ready", "url": <media url>, "cached": bool}.
+        """
+        if self.cache.get(key) is not None:
+            yield {"type": f"{self.EVENT}_ready", "url": self.media_url(key), "cached": True}
+            return
+
+        future, progress = self._start(key, url)
+        # Shield: a client going away must not abort a download others share
+        waiter = asyncio.shield(future)
+        last_sent = 0.0
+        getter = None
+        try:
+            while True:
+                getter = asyncio.ensure_future(progress.get())
+                done, _ = await asyncio.wait({waiter, getter}, return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    break
+                received, total = getter.result()
+                now = time.monotonic()
+                if now - last_sent >= progress_interval:
+                    last_sent = now
+                    yield {
+                        "type": f"{self.EVENT}_progress",
+                        "received": received,
+                        "total": total,
+                        "percent": round(received * 100 / total) if total else None
+                    }
+        finally:
+            if getter is not None:
+                getter.cancel()
+        await waiter
+        yield {"type": f"{self.EVENT}_ready", "url": self.media_url(key), "cached": False}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "fetches": self.fetches,
+            "completed": self.completed,
+            "shared": self.shared,
+            "failures": self.failures,
+            "inflight": len(self._inflight),
+            "avg_fetch_ms": self.fetch_time_total / self.completed * 1000 if self.completed else 0.0,
+            "cache": self.cache.stats(),
+        }
+
+
+class ImagePipeline(MediaPipeline):
+    """Generated images, fetched as soon as the tool is chosen"""
+
+    MEDIA_PATH = "/media/images/"
+    EVENT = "image"
+
+    @classmethod
+    def from_env(cls, client: httpx.AsyncClient) -> "ImagePipeline":
+        return cls(
+            client,
+            MediaCache(
+                os.getenv("IMAGE_CACHE_DIR", "media_cache"),
+                max_bytes=int(float(os.getenv("IMAGE_CACHE_MB", "512")) * 1024 * 1024)
+            ),
+            max_concurrency=int(os.getenv("IMAGE_FETCH_CONCURRENCY", "8")),
+            timeout=float(os.getenv("IMAGE_FETCH_TIMEOUT", "120"))
+        )
+
+
+def parse_size(size: str) -> Tuple[int, int]:
+    """"768x512" -> (768, 512)"""
+    width, _, height = size.lower().partition("x")
+    width, height = int(width), int(height)
+    if not (64 <= width <= 2048 and 64 <= height <= 2048):
+        raise ValueError(f"Tamanho inválido: {size}")
+    return width, height
+
+
+def image_variants(
+    model: str,
+    seeds: Optional[List[int]] = None,
+    models: Optional[List[str]] = None,
+    sizes: Optional[List[str]] = None,
+    count: int = 0,
+    max_variants: int = 8,
+    rng: Optional[random.Random] = None
+) -> List[Dict[str, Any]]:
+    """
+    Every combination of seeds x models x sizes, as dicts with seed, model,
+    width and height. Without seeds, `count` random seeds are drawn.
+    """
+    rng = rng or random.Random()
+    if not seeds:
+        seeds = [rng.randint(1, 2 ** 31 - 1) for _ in range(max(count, 1))]
+    dimensions = [parse_size(size) for size in sizes] if sizes else [(1024, 1024)]
+    variants = [
+        {"seed": seed, "model": variant_model, "width": width, "height": height}
+        for variant_model in (models or [model])
+        for width, height in dimensions
+        for seed in seeds
+    ]
+    if len(variants) > max_variants:
+        raise ValueError(f"Máximo de {max_variants} variações por pedido ({len(variants)} pedidas)")
+    return variants
@@ -0,0 +1,270 @@
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # Optional dependency: spans are only recorded when installed
+    otel_trace = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def tracing_available() -> bool:
+    return otel_trace is not None
+
+
+# Bucket upper bounds, in seconds unless noted
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+GAP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+RATE_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Series:
+    """
+    One label set of a histogram: per-bucket counts (the last one is +Inf)
+    and the sum. Hot paths keep a Series instead of looking up labels on
+    every observation.
+    """
+
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        # Buckets are inclusive upper bounds, like Prometheus' "le"
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+
+class Histogram:
+    """Prometheus-style histogram with a fixed set of label names"""
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], labels: Sequence[str] = ("tool", "model")):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series: Dict[Tuple[str, ...], Series] = {}
+
+    def series(self, *values: str) -> Series:
+        series = self._series.get(values)
+        if series is None:
+            series = self._series[values] = Series(self.buckets)
+        return series
+
+    def observe(self, value: float, *values: str):
+        self.series(*values).observe(value)
+
+    def render(self) -> List[str]:
+        """Lines of the text exposition format"""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, series in sorted(self._series.items()):
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, values))
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {series.sum!r}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class UpstreamTiming:
+    """Connection-level timings of the upstream request a stream is making"""
+
+    __slots__ = ("pool_wait", "ttfb")
+
+    def __init__(self):
+        self.pool_wait: Optional[float] = None
+        self.ttfb: Optional[float] = None
+
+
+# Set by ChatMetrics.observe_stream for the task making the request; the
+# transport and the request code fill it in without knowing tool or model
+_upstream_timing: ContextVar[Optional[UpstreamTiming]] = ContextVar("upstream_timing", default=None)
+
+
+def current_upstream_timing() -> Optional[UpstreamTiming]:
+    return _upstream_timing.get()
+
+
+class ChatMetrics:
+    """
+    Latency histograms of the /chat hot path, labelled by tool and model,
+    served on /metrics in the Prometheus text format. Observations are a
+    bisect and two additions, so they stay on in production; optional
+    OpenTelemetry spans add one span per request.
+    """
+
+    def __init__(self, tracer: Any = None):
+        self.routing = Histogram(
+            "chat_routing_seconds", "Time to pick the tools for a message", LATENCY_BUCKETS, ("tool",)
+        )
+        self.pool_wait = Histogram(
+            "upstream_pool_wait_seconds", "Wait for a pooled upstream connection", LATENCY_BUCKETS
+        )
+        self.ttfb = Histogram(
+            "upstream_ttfb_seconds", "Upstream request start to response headers", LATENCY_BUCKETS
+        )
+        self.ttft = Histogram(
+            "upstream_ttft_seconds", "Upstream request start to the first text delta", LATENCY_BUCKETS
+        )
+        self.inter_token = Histogram(
+            "upstream_inter_token_seconds", "Gap between consecutive text deltas", GAP_BUCKETS
+        )
+        self.tokens_per_second = Histogram(
+            "upstream_tokens_per_second", "Text deltas per second after the first one", RATE_BUCKETS
+        )
+        self.stream_duration = Histogram(
+            "chat_stream_duration_seconds", "Whole /chat response, from request to last frame", LATENCY_BUCKETS
+        )
+        self.sse_bytes = Histogram(
+            "chat_sse_bytes", "SSE bytes written per /chat response", BYTES_BUCKETS
+        )
+        self.tracer = tracer
+
+    @classmethod
+    def from_env(cls) -> "ChatMetrics":
+        tracer = None
+        if os.getenv("METRICS_TRACING", "0") == "1":
+            if tracing_available():
+                tracer = otel_trace.get_tracer("mega-agente")
+            else:
+                logger.warning("METRICS_TRACING=1 but opentelemetry-api is not installed; spans are off")
+        return cls(tracer=tracer)
+
+    @property
+    def histograms(self) -> List[Histogram]:
+        return [
+            self.routing, self.pool_wait, self.ttfb, self.ttft, self.inter_token,
+            self.tokens_per_second, self.stream_duration, self.sse_bytes,
+        ]
+
+    def render(self) -> str:
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.render())
+        return "\n".join(lines) + "\n"
+
+    async def observe_stream(self, tool: str, model: str, source: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+        """
+        Pass an upstream stream's text deltas through while recording pool
+        wait, TTFB, TTFT, inter-token gaps and tokens/sec
+        """
+        timing = UpstreamTiming()
+        token = _upstream_timing.set(timing)
+        gaps = self.inter_token.series(tool, model)
+        # Inter-token gaps are bucketed inline: this runs once per delta
+        buckets, counts = gaps.buckets, gaps.counts
+        gap_total = 0.0
+        clock = time.perf_counter
+        started = clock()
+        first = last = 0.0
+        tokens = 0
+        try:
+            async for chunk in source:
+                now = clock()
+                if tokens:
+                    gap = now - last
+                    counts[bisect_left(buckets, gap)] += 1
+                    gap_total += gap
+                else:
+                    first = now
+                    self.ttft.observe(now - started, tool, model)
+                    if timing.pool_wait is not None:
+                        self.pool_wait.observe(timing.pool_wait, tool, model)
+                    if timing.ttfb is not None:
+                        self.ttfb.observe(timing.ttfb, tool, model)
+                last = now
+                tokens += 1
+                yield chunk
+        finally:
+            gaps.sum += gap_total
+            # Later upstream calls of this task (prefetch, summary, TTS) must
+            # not be timed into a finished stream
+            try:
+                _upstream_timing.reset(token)
+            except ValueError:
+                # Closed from another context, which never saw the timing
+                pass
+        if tokens > 1 and last > first:
+            self.tokens_per_second.observe((tokens - 1) / (last - first), tool, model)
+
+    def trace(self) -> "ChatTrace":
+        return ChatTrace(self)
+
+
+class ChatTrace:
+    """
+    Timings of one /chat request. The tool and model are taken from the
+    agent's events; duration and bytes are recorded when it finishes.
+    """
+
+    # Label of a compound request, whatever its tools
+    PLAN = "plan"
+
+    def __init__(self, metrics: ChatMetrics):
+        self.metrics = metrics
+        self.started = time.perf_counter()
+        self.tool = "unknown"
+        self.model = ""
+        self.bytes = 0
+        self.span = metrics.tracer.start_span("chat") if metrics.tracer is not None else None
+
+    def routed(self, tool: str, seconds: float):
+        self.metrics.routing.observe(seconds, tool)
+        if self.span is not None:
+            self.span.set_attribute("chat.routing_ms", seconds * 1000)
+
+    async def events(self, events: AsyncIterator[Dict[str, Any]]) -> AsyncGenerator[Dict[str, Any], None]:
+        """Pass agent events through, noting the tool and the first content"""
+        span = self.span
+        async for event in events:
+            kind = event["type"]
+            if kind == "text_chunk":
+                if span is not None:
+                    span.add_event("first_content")
+                    span = None
+            elif kind == "tool_selection" and "tool_id" not in event:
+                self.tool, self.model = event["tool_type"], event.get("model", "")
+            elif kind == "plan":
+                self.tool = self.PLAN
+            yield event
+
+    def wrote(self, size: int):
+        self.bytes += size
+
+    def finish(self, outcome: str):
+        duration = time.perf_counter() - self.started
+        self.metrics.stream_duration.observe(duration, self.tool, self.model)
+        self.metrics.sse_bytes.observe(self.bytes, self.tool, self.model)
+        if self.span is not None:
+            self.span.set_attribute("chat.tool", self.tool)
+            self.span.set_attribute("chat.model", self.model)
+            self.span.set_attribute("chat.outcome", outcome)
+            self.span.set_attribute("chat.sse_bytes", self.bytes)
+            self.span.end()
@@ -0,0 +1,113 @@
+import re
+from typing import Any, Dict, List, Optional
+
+from tool_router import DEFAULT_TOOL, ToolRouter, fold_text
+
+
+# Clause boundaries of compound requests ("pesquise X e desenhe Y",
+# "search X, then draw it"). The separator is kept so clauses that do not
+# start a new tool can be glued back unchanged.
+_CLAUSE_SPLIT = re.compile(
+    r"(\s*(?:[,;]\s*)?\b(?:e\s+depois|e\s+ent[aã]o|depois|e|and\s+then|then|and|also|tamb[eé]m)\b\s+|\s*;\s*)",
+    re.IGNORECASE
+)
+
+# Words pointing back at an earlier part of the request
+BACK_REFERENCES = {
+    "it", "this", "that", "them", "result", "results",
+    "isso", "isto", "disso", "disto", "nisso", "dele", "dela", "deles", "delas", "resultado", "resultados",
+}
+
+# Tools whose output is text other steps can use
+TEXT_TOOLS = {"search", "text_generation", "reasoning"}
+
+
+class PlanStep:
+    """
+    One tool call of a plan. `depends_on` is the id of the step whose text
+    output this step needs before it can start.
+    """
+
+    def __init__(self, id: str, tool: str, prompt: str, depends_on: Optional[str] = None):
+        self.id = id
+        self.tool = tool
+        self.prompt = prompt
+        self.depends_on = depends_on
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "tool": self.tool, "prompt": self.prompt, "depends_on": self.depends_on}
+
+    def __repr__(self) -> str:
+        return f"PlanStep({self.id!r}, {self.tool!r}, {self.prompt!r}, depends_on={self.depends_on!r})"
+
+
+def _has_back_reference(text: str) -> bool:
+    return not BACK_REFERENCES.isdisjoint(fold_text(text).split())
+
+
+class ToolPlanner:
+    """
+    Splits a compound request into tool steps. Each clause is routed with
+    the tool router; clauses that do not call for a tool of their own, or
+    call for the same tool as the previous one, stay with the previous
+    step, so "pesquise gatos e cachorros" is still one search and "draw a
+    cat and a dog picture" one image. A plain text clause referring back to
+    a search ("and then summarize it") is a step of its own.
+
+    Steps run concurrently unless one needs another's text: a text or
+    reasoning step after a search builds on the search result, and a
+    text-to-speech step referring back ("leia isso") speaks the previous
+    text output.
+    """
+
+    def __init__(self, tool_router: ToolRouter, max_steps: int = 4):
+        self.tool_router = tool_router
+        self.max_steps = max_steps
+        self.plans = 0
+        self.compound = 0
+
+    def _route(self, clause: str) -> str:
+        return self.tool_router.route(clause)
+
+    def plan(self, message: str) -> List[PlanStep]:
+        """Steps for a message, in order; a single step for simple requests"""
+        self.plans += 1
+        parts = _CLAUSE_SPLIT.split(message)
+        # parts alternates clause, separator, clause, ...
+        clauses = [(parts[i], parts[i - 1] if i else "") for i in range(0, len(parts), 2)]
+
+        groups: List[List[str]] = []
+        for clause, separator in clauses:
+            tool = self._route(clause) if clause.strip() else DEFAULT_TOOL
+            new_step = tool != DEFAULT_TOOL or (
+                bool(groups) and groups[-1][0] == "search" and _has_back_reference(clause)
+            )
+            if groups and (not new_step or tool == groups[-1][0] or len(groups) == self.max_steps):
+                groups[-1][1] += separator + clause
+            else:
+                groups.append([tool, clause])
+
+        if len(groups) == 1:
+            tool = self._route(message)
+            return [PlanStep(f"{tool}-1", tool, message)]
+
+        self.compound += 1
+        steps: List[PlanStep] = []
+        counts: Dict[str, int] = {}
+        for tool, prompt in groups:
+            counts[tool] = counts.get(tool, 0) + 1
+            step = PlanStep(f"{tool}-{counts[tool]}", tool, prompt.strip())
+            previous_text = next((s for s in reversed(steps) if s.tool in TEXT_TOOLS), None)
+            previous_search = next((s for s in reversed(steps) if s.tool == "search"), None)
+            if tool in ("text_generation", "reasoning") and previous_search is not None:
+                step.depends_on = previous_search.id
+            elif tool == "text_to_speech" and previous_text is not None and _has_back_reference(prompt):
+                step.depends_on = previous_text.id
+            elif tool == "image_generation" and _has_back_reference(prompt):
+                # "draw an image of it": the whole request says what "it" is
+                step.prompt = message
+            steps.append(step)
+        return steps
+
+    def stats(self) -> Dict[str, Any]:
+        return {"plans": self.plans, "compound": self.compound, "max_steps": self.max_steps}
@@ -0,0 +1,372 @@
+import asyncio
+import math
+import os
+import random
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, Optional, Tuple
+
+import httpx
+
+
+class UpstreamError(Exception):
+    """Non-200 answer from the upstream API"""
+
+    def __init__(self, status_code: int, body: str = "", retry_after: Optional[float] = None):
+        super().__init__(f"API error {status_code}: {body}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code in (408, 425, 429) or self.status_code >= 500
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the upstream while a model's breaker is open"""
+
+    def __init__(self, model: str, retry_after: int):
+        super().__init__(f"Modelo {model} indisponível no momento, tente novamente em {retry_after}s")
+        self.model = model
+        self.retry_after = retry_after
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Connection problems, timeouts, 5xx and 429 are worth another try"""
+    if isinstance(error, UpstreamError):
+        return error.retryable
+    return isinstance(error, httpx.TransportError)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive upstream failures and fails
+    fast for `reset_timeout` seconds. Then a single trial request is let
+    through (half-open): success closes the breaker, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._trial = False
+
+    def allow(self) -> bool:
+        """Whether a request may go upstream now"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if self.clock() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._trial = False
+        if self._trial:
+            return False
+        self._trial = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.state = self.CLOSED
+        self._trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened += 1
+            self.state = self.OPEN
+            self._opened_at = self.clock()
+            self._trial = False
+
+    def release(self):
+        """The trial request ended without a verdict (e.g. cancelled)"""
+        self._trial = False
+
+    def is_open(self) -> bool:
+        """Open and still cooling down, without taking the half-open trial"""
+        return self.state == self.OPEN and self.clock() - self._opened_at < self.reset_timeout
+
+    def retry_after(self) -> int:
+        remaining = self.reset_timeout - (self.clock() - self._opened_at)
+        return max(1, math.ceil(remaining))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "failures": self.failures, "opened": self.opened}
+
+
+class LatencyWindow:
+    """Rolling window of recent time-to-first-token samples"""
+
+    def __init__(self, size: int = 200):
+        self._samples: "deque[float]" = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+class ResiliencePolicy:
+    """
+    Retry, hedging and circuit breaker settings for upstream streams
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 2,
+        backoff_base: float = 0.2,
+        backoff_max: float = 2.0,
+        hedge: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_min_delay: float = 0.5,
+        hedge_min_samples: int = 20,
+        hedge_max_ratio: float = 0.1,
+        breaker_threshold: int = 5,
+        breaker_reset: float = 30.0
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        # Upper bound on hedged requests as a fraction of all requests
+        self.hedge_max_ratio = hedge_max_ratio
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+
+    @classmethod
+    def from_env(cls) -> "ResiliencePolicy":
+        """Read settings from UPSTREAM_RETRY_*, UPSTREAM_HEDGE_* and UPSTREAM_BREAKER_*"""
+        return cls(
+            max_retries=int(os.getenv("UPSTREAM_MAX_RETRIES", "2")),
+            backoff_base=float(os.getenv("UPSTREAM_RETRY_BACKOFF", "0.2")),
+            backoff_max=float(os.getenv("UPSTREAM_RETRY_BACKOFF_MAX", "2")),
+            hedge=os.getenv("UPSTREAM_HEDGE", "0") == "1",
+            hedge_percentile=float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "95")),
+            hedge_min_delay=float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", "0.5")),
+            hedge_max_ratio=float(os.getenv("UPSTREAM_HEDGE_MAX_RATIO", "0.1")),
+            breaker_threshold=int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", "5")),
+            breaker_reset=float(os.getenv("UPSTREAM_BREAKER_RESET", "30"))
+        )
+
+
+async def _next(source: AsyncIterator[str]) -> Tuple[bool, Optional[str]]:
+    # StopAsyncIteration does not travel well through tasks
+    try:
+        return True, await source.__anext__()
+    except StopAsyncIteration:
+        return False, None
+
+
+async def _aclose(source: AsyncIterator[str]):
+    aclose = getattr(source, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+class UpstreamResilience:
+    """
+    Wraps upstream streaming calls with:
+
+    - retries with full-jitter backoff, only before the first chunk, so a
+      retry can never duplicate text the client already received
+    - an optional hedged second request when the first chunk is later than
+      the model's recent TTFT percentile; the slower attempt is cancelled
+    - a circuit breaker per model
+    """
+
+    def __init__(
+        self,
+        policy: Optional[ResiliencePolicy] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.policy = policy or ResiliencePolicy()
+        self.clock = clock
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.latencies: Dict[str, LatencyWindow] = {}
+        self.requests = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.short_circuited = 0
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        breaker = self.breakers.get(model)
+        if breaker is None:
+            breaker = CircuitBreaker(self.policy.breaker_threshold, self.policy.breaker_reset, self.clock)
+            self.breakers[model] = breaker
+        return breaker
+
+    def available(self, model: str) -> bool:
+        breaker = self.breakers.get(model)
+        return breaker is None or not breaker.is_open()
+
+    def latency(self, model: str) -> LatencyWindow:
+        window = self.latencies.get(model)
+        if window is None:
+            window = self.latencies[model] = LatencyWindow()
+        return window
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        """Full jitter, raised to the upstream's Retry-After when it sent one"""
+        ceiling = min(self.policy.backoff_max, self.policy.backoff_base * 2 ** attempt)
+        delay = random.uniform(0, ceiling)
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after:
+            delay = max(delay, min(retry_after, self.policy.backoff_max))
+        return delay
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """How long to wait for the first chunk before hedging, or None"""
+        policy = self.policy
+        if not policy.hedge or self.hedges >= policy.hedge_max_ratio * self.requests:
+            return None
+        window = self.latency(model)
+        if len(window) < max(1, policy.hedge_min_samples):
+            return None
+        return max(policy.hedge_min_delay, window.percentile(policy.hedge_percentile))
+
+    async def _first_chunk(
+        self,
+        model: str,
+        factory: Callable[[], AsyncIterator[str]]
+    ) -> Tuple[AsyncIterator[str], bool, Optional[str]]:
+        """
+        Start an attempt (plus a hedge if it is slow) and return the source
+        that produced a first chunk, with the chunk itself
+        """
+        started = self.clock()
+        primary = factory()
+        delay = self.hedge_delay(model)
+        if delay is None:
+            has_chunk, first = await _next(primary)
+            self.latency(model).add(self.clock() - started)
+            return primary, has_chunk, first
+
+        attempts = {asyncio.ensure_future(_next(primary)): (primary, started)}
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            # Re-check the budget: other requests may have hedged meanwhile
+            if not done and self.hedges < self.policy.hedge_max_ratio * self.requests:
+                self.hedges += 1
+                hedge = factory()
+                attempts[asyncio.ensure_future(_next(hedge))] = (hedge, self.clock())
+
+            error: Optional[BaseException] = None
+            while attempts:
+                done, _ = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    source, attempt_started = attempts.pop(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if source is not primary:
+                        self.hedge_wins += 1
+                    self.latency(model).add(self.clock() - attempt_started)
+                    has_chunk, first = task.result()
+                    return source, has_chunk, first
+            raise error
+        finally:
+            # Cancel the losers and let them close their connections
+            for task in attempts:
+                task.cancel()
+            if attempts:
+                await asyncio.wait(attempts)
+            for task, (source, _) in attempts.items():
+                if not task.cancelled():
+                    task.exception()
+                await _aclose(source)
+
+    async def stream(
+        self,
+        model: str,
+        factory: Callable[[], AsyncIterator[str]]
+    ) -> AsyncGenerator[str, None]:
+        """
+        Yield the chunks of `factory()`, retrying/hedging until the first
+        chunk arrives. Errors after that are passed through untouched.
+        """
+        breaker = self.breaker(model)
+        self.requests += 1
+        last_error: Optional[BaseException] = None
+        for attempt in range(self.policy.max_retries + 1):
+            if not breaker.allow():
+                if last_error is not None:
+                    raise last_error
+                self.short_circuited += 1
+                raise CircuitOpenError(model, breaker.retry_after())
+            try:
+                source, has_chunk, first = await self._first_chunk(model, factory)
+            except Exception as e:
+                if not is_retryable(e):
+                    # The upstream answered (e.g. 400): it is healthy
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                last_error = e
+                if attempt == self.policy.max_retries:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.backoff(attempt, e))
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            break
+
+        if not has_chunk:
+            return
+        try:
+            yield first
+            async for chunk in source:
+                yield chunk
+        except Exception as e:
+            if is_retryable(e):
+                breaker.record_failure()
+            raise
+        finally:
+            await _aclose(source)
+
+    def stats(self) -> Dict[str, Any]:
+        models = {}
+        for model, breaker in self.breakers.items():
+            window = self.latency(model)
+            models[model] = {
+                **breaker.stats(),
+                "ttft_p50_ms": (window.percentile(50) or 0.0) * 1000,
+                "ttft_p95_ms": (window.percentile(95) or 0.0) * 1000,
+                "ttft_p99_ms": (window.percentile(99) or 0.0) * 1000,
+            }
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "short_circuited": self.short_circuited,
+            "hedging": self.policy.hedge,
+            "models": models,
+        }
@@ -0,0 +1,211 @@
+import os
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional
+
+
+class ModelStats:
+    """
+    Rolling (EWMA) time-to-first-token, tokens/sec and error rate of one
+    model, as seen from the upstream calls
+    """
+
+    ALPHA = 0.2
+
+    def __init__(self):
+        self.ttft: Optional[float] = None
+        self.tokens_per_sec: Optional[float] = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_failure = 0.0
+        self.last_ttft = 0.0
+
+    def _ewma(self, current: Optional[float], sample: float) -> float:
+        return sample if current is None else current + self.ALPHA * (sample - current)
+
+    def record_success(self, ttft: Optional[float], tokens: int, duration: float, now: float):
+        self.requests += 1
+        self.consecutive_failures = 0
+        self.error_rate = self._ewma(self.error_rate, 0.0)
+        if ttft is not None:
+            self.ttft = self._ewma(self.ttft, ttft)
+            self.last_ttft = now
+            # Each upstream delta is roughly one token
+            if tokens > 1 and duration > ttft:
+                self.tokens_per_sec = self._ewma(self.tokens_per_sec, (tokens - 1) / (duration - ttft))
+
+    def record_failure(self, now: float):
+        self.requests += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_failure = now
+        self.error_rate = self._ewma(self.error_rate, 1.0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ttft_ms": self.ttft * 1000 if self.ttft is not None else None,
+            "tokens_per_sec": self.tokens_per_sec,
+            "error_rate": round(self.error_rate, 3),
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class ModelRouter:
+    """
+    Orders the models to try for a request along a fallback chain per tool,
+    e.g. openai -> openai-fast -> mistral for text.
+
+    Models that are failing or slower than the slow TTFT of the kind are
+    moved behind the healthy ones, so the agent falls back to them only as a
+    last resort. A slow model is tried first again once its last TTFT is
+    `slow_cooldown` old, and that probe restarts its rolling TTFT. A model
+    the request asked for is only moved back while failing.
+    The special model "auto" tries the chain's fastest healthy model first.
+    """
+
+    AUTO = "auto"
+
+    DEFAULT_CHAINS = {
+        "text": ["openai", "openai-fast", "mistral"],
+        "reasoning": ["openai-reasoning", "openai"],
+        "search": ["searchgpt"],
+        "vision": ["openai"],
+    }
+
+    # Slow TTFT by kind, where the default does not fit; reasoning models
+    # think before their first token
+    DEFAULT_SLOW_TTFT = {"reasoning": 30.0}
+
+    def __init__(
+        self,
+        chains: Optional[Dict[str, List[str]]] = None,
+        slow_ttft: float = 8.0,
+        slow_ttft_by_kind: Optional[Dict[str, float]] = None,
+        slow_cooldown: float = 60.0,
+        failure_threshold: int = 2,
+        failure_cooldown: float = 30.0,
+        is_available: Optional[Callable[[str], bool]] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.chains = {**self.DEFAULT_CHAINS, **(chains or {})}
+        self.slow_ttft = slow_ttft
+        self.slow_ttft_by_kind = {**self.DEFAULT_SLOW_TTFT, **(slow_ttft_by_kind or {})}
+        self.slow_cooldown = slow_cooldown
+        self.failure_threshold = failure_threshold
+        self.failure_cooldown = failure_cooldown
+        # e.g. "is the circuit breaker of this model closed?"
+        self.is_available = is_available
+        self.clock = clock
+        self.models: Dict[str, ModelStats] = {}
+        self.fallbacks = 0
+
+    @classmethod
+    def from_env(cls, is_available: Optional[Callable[[str], bool]] = None) -> "ModelRouter":
+        """
+        Read chains from MODEL_CHAIN_<TOOL> (comma separated), slow TTFTs
+        from ROUTING_SLOW_TTFT_<TOOL> and the other ROUTING_* settings
+        """
+        chains = {}
+        slow_ttft_by_kind = {}
+        for kind in cls.DEFAULT_CHAINS:
+            value = os.getenv(f"MODEL_CHAIN_{kind.upper()}")
+            if value:
+                chains[kind] = [m.strip() for m in value.split(",") if m.strip()]
+            value = os.getenv(f"ROUTING_SLOW_TTFT_{kind.upper()}")
+            if value:
+                slow_ttft_by_kind[kind] = float(value)
+        return cls(
+            chains=chains,
+            slow_ttft=float(os.getenv("ROUTING_SLOW_TTFT", "8")),
+            slow_ttft_by_kind=slow_ttft_by_kind,
+            slow_cooldown=float(os.getenv("ROUTING_SLOW_COOLDOWN", "60")),
+            failure_threshold=int(os.getenv("ROUTING_FAILURE_THRESHOLD", "2")),
+            failure_cooldown=float(os.getenv("ROUTING_FAILURE_COOLDOWN", "30")),
+            is_available=is_available
+        )
+
+    def stats_for(self, model: str) -> ModelStats:
+        stats = self.models.get(model)
+        if stats is None:
+            stats = self.models[model] = ModelStats()
+        return stats
+
+    def failing(self, model: str) -> bool:
+        if self.is_available is not None and not self.is_available(model):
+            return True
+        stats = self.models.get(model)
+        return (
+            stats is not None
+            and stats.consecutive_failures >= self.failure_threshold
+            and self.clock() - stats.last_failure < self.failure_cooldown
+        )
+
+    def slow(self, model: str, kind: Optional[str] = None) -> bool:
+        stats = self.models.get(model)
+        return (
+            stats is not None
+            and stats.ttft is not None
+            and stats.ttft > self.slow_ttft_by_kind.get(kind, self.slow_ttft)
+            and self.clock() - stats.last_ttft < self.slow_cooldown
+        )
+
+    def healthy(self, model: str, kind: Optional[str] = None) -> bool:
+        return not self.failing(model) and not self.slow(model, kind)
+
+    def candidates(self, kind: str, requested: Optional[str] = None) -> List[str]:
+        """
+        Models to try, in order, for a request of `kind` ("text",
+        "reasoning", "search" or "vision") that asked for `requested`
+        """
+        chain = self.chains.get(kind, [])
+        if requested == self.AUTO:
+            # Measured models by rolling TTFT, then the unmeasured ones
+            order = sorted(chain, key=lambda m: (
+                self.models.get(m) is None or self.models[m].ttft is None,
+                self.models[m].ttft if m in self.models and self.models[m].ttft is not None else 0.0
+            ))
+        elif requested:
+            order = [m for m in chain if m != requested]
+            preferred = [m for m in order if self.healthy(m, kind)]
+            rest = [m for m in order if m not in preferred]
+            if self.failing(requested):
+                return preferred + [requested] + rest
+            return [requested] + preferred + rest
+        else:
+            order = list(chain)
+
+        preferred = [m for m in order if self.healthy(m, kind)]
+        return preferred + [m for m in order if m not in preferred]
+
+    async def observe(self, model: str, source: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+        """Pass chunks through while measuring TTFT, tokens/sec and errors"""
+        stats = self.stats_for(model)
+        started = self.clock()
+        if stats.ttft is not None and started - stats.last_ttft >= self.slow_cooldown:
+            # Stale: measure this model afresh rather than dragging its past along
+            stats.ttft = None
+        ttft: Optional[float] = None
+        tokens = 0
+        try:
+            async for chunk in source:
+                if ttft is None:
+                    ttft = self.clock() - started
+                tokens += 1
+                yield chunk
+        except Exception:
+            stats.record_failure(self.clock())
+            raise
+        finished = self.clock()
+        stats.record_success(ttft, tokens, finished - started, finished)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "chains": self.chains,
+            "fallbacks": self.fallbacks,
+            "models": {
+                model: {**stats.stats(), "healthy": self.healthy(model)}
+                for model, stats in self.models.items()
+            },
+        }
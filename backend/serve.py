@@ -0,0 +1,175 @@
+"""
+Production launcher: several uvicorn workers with uvloop/httptools and a
+graceful drain
+Run with: python backend/serve.py [--workers N] [--port 8000] [--drain-timeout 30]
+
+Nothing is installed at startup; install requirements.txt when building the
+image or the virtualenv. On SIGTERM/SIGINT each worker stops accepting
+connections, lets in-flight SSE answers finish for up to --drain-timeout
+seconds, then cancels what is left: those answers end with a "cancelled"
+event and keep their partial text in history. Only then are the sessions
+and the upstream client closed.
+"""
+import argparse
+import asyncio
+import importlib.util
+import logging
+import math
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+import streams
+
+logger = logging.getLogger("uvicorn.error")
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds cancelled streams get to send their last event before uvicorn
+# cancels the response tasks outright
+CANCEL_GRACE = 5.0
+
+
+def cgroup_cpu_limit(root: str = "/sys/fs/cgroup") -> Optional[float]:
+    """CPUs allowed by a container CPU quota (cgroup v2 or v1), None if unlimited"""
+    try:
+        with open(os.path.join(root, "cpu.max")) as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(os.path.join(root, "cpu", "cpu.cfs_quota_us")) as f:
+            quota = int(f.read())
+        with open(os.path.join(root, "cpu", "cpu.cfs_period_us")) as f:
+            period = int(f.read())
+        return quota / period if quota > 0 and period > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus(cgroup_root: str = "/sys/fs/cgroup") -> int:
+    """CPUs this process may use: affinity mask, capped by any container quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS/Windows
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit(cgroup_root)
+    if limit is not None:
+        cpus = min(cpus, max(1, math.ceil(limit)))
+    return max(1, cpus)
+
+
+def default_workers() -> int:
+    """
+    One worker per usable CPU: each worker is a single-threaded event loop,
+    and streaming answers spend their time waiting on the upstream
+    """
+    return available_cpus()
+
+
+def event_loop() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") is not None else "asyncio"
+
+
+def http_implementation() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") is not None else "h11"
+
+
+def server_options(args: argparse.Namespace) -> Dict[str, Any]:
+    """Keyword arguments for uvicorn.Config"""
+    return {
+        "app": "main:app",
+        "host": args.host,
+        "port": args.port,
+        "workers": args.workers,
+        "loop": event_loop(),
+        "http": http_implementation(),
+        # Backstop only: DrainingServer cancels streams at the drain deadline
+        "timeout_graceful_shutdown": args.drain_timeout + CANCEL_GRACE,
+        "timeout_keep_alive": args.keep_alive,
+        "proxy_headers": True,
+        "forwarded_allow_ips": args.forwarded_allow_ips,
+        "log_level": args.log_level,
+        "access_log": args.access_log,
+    }
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    uvicorn.Server whose shutdown also drains the /chat streams: past the
+    deadline they are cancelled cleanly instead of having their response
+    task cancelled mid-write, which would leave the client a truncated body
+    """
+
+    def __init__(self, config: uvicorn.Config, drain_timeout: float):
+        super().__init__(config)
+        self.drain_timeout = drain_timeout
+
+    async def drain_streams(self):
+        cancelled = await streams.drain(self.drain_timeout, CANCEL_GRACE)
+        if cancelled:
+            logger.warning("Cancelled %d stream(s) still running at the drain deadline", cancelled)
+
+    async def shutdown(self, sockets: Optional[List[Any]] = None):
+        drain = asyncio.ensure_future(self.drain_streams())
+        try:
+            # Stops accepting connections and waits for in-flight responses
+            await super().shutdown(sockets)
+        finally:
+            drain.cancel()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "0")),
+        help="worker processes (default: usable CPUs)"
+    )
+    parser.add_argument(
+        "--drain-timeout", type=float, default=float(os.getenv("DRAIN_TIMEOUT", "30")),
+        help="seconds in-flight streams may run after a shutdown signal"
+    )
+    parser.add_argument("--keep-alive", type=int, default=int(os.getenv("KEEP_ALIVE_TIMEOUT", "5")))
+    parser.add_argument("--forwarded-allow-ips", default=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"))
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    parser.add_argument("--access-log", action="store_true", default=os.getenv("ACCESS_LOG", "0") == "1")
+    args = parser.parse_args(argv)
+    if args.workers <= 0:
+        args.workers = default_workers()
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    options = server_options(args)
+    # Also sets up uvicorn's logging
+    config = uvicorn.Config(**options)
+    if args.workers > 1 and os.getenv("HISTORY_STORE_URL", "memory://").startswith("memory://"):
+        logger.warning(
+            "%d workers with the in-memory history store: each worker keeps its own "
+            "sessions; set HISTORY_STORE_URL (sqlite:// or redis://) to share them",
+            args.workers
+        )
+    logger.info(
+        "Serving with %d worker(s), loop=%s, http=%s, drain timeout %.0fs",
+        args.workers, options["loop"], options["http"], args.drain_timeout
+    )
+    server = DrainingServer(config, args.drain_timeout)
+    if args.workers > 1:
+        Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+    else:
+        server.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import asyncio
+import re
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import httpx
+
+from agent import PollinationsAgent
+from cache import ResponseCache
+from context import ContextWindow
+from history_store import HistoryStore
+from media import ImagePipeline
+from metrics import ChatMetrics
+from planner import ToolPlanner
+from resilience import UpstreamResilience
+from routing import ModelRouter
+from tool_router import ToolRouter
+from singleflight import SingleFlight
+from speech import SpeechPipeline
+from summary import ConversationSummarizer
+from vision import VisionStore
+from transport import create_upstream_client
+
+
+# Session ids come from clients, so only accept short opaque tokens
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,128}$")
+
+
+class SessionManager:
+    """
+    Keeps one PollinationsAgent per session, all sharing a pooled HTTP client
+    and, when configured, a shared history store (SQLite/Redis) so several
+    workers can serve the same session.
+
+    Sessions live in an OrderedDict ordered by last access, so lookup is O(1)
+    and both idle-TTL expiry and the max_sessions cap only ever pop from the
+    front of the dict.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 10000,
+        idle_ttl: float = 1800.0,
+        max_history: int = 10,
+        client: Optional[httpx.AsyncClient] = None,
+        history_store: Optional[HistoryStore] = None,
+        response_cache: Optional[ResponseCache] = None,
+        single_flight: Optional[SingleFlight] = None,
+        resilience: Optional[UpstreamResilience] = None,
+        router: Optional[ModelRouter] = None,
+        tool_router: Optional[ToolRouter] = None,
+        context_window: Optional[ContextWindow] = None,
+        summarizer: Optional[ConversationSummarizer] = None,
+        planner: Optional[ToolPlanner] = None,
+        image_pipeline: Optional[ImagePipeline] = None,
+        speech_pipeline: Optional[SpeechPipeline] = None,
+        vision_store: Optional[VisionStore] = None,
+        metrics: Optional[ChatMetrics] = None
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_history = max_history
+        self.client = client or create_upstream_client()
+        self.history_store = history_store
+        self.response_cache = response_cache
+        self.single_flight = single_flight
+        self.resilience = resilience
+        self.router = router
+        self.tool_router = tool_router
+        self.context_window = context_window
+        self.summarizer = summarizer
+        self.planner = planner
+        self.image_pipeline = image_pipeline
+        self.speech_pipeline = speech_pipeline
+        self.vision_store = vision_store
+        self.metrics = metrics
+        self._sessions: "OrderedDict[str, Tuple[float, PollinationsAgent]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    @staticmethod
+    def new_session_id() -> str:
+        """Generate a fresh random session id"""
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def is_valid_session_id(session_id: Optional[str]) -> bool:
+        """Check that a client supplied session id is well formed"""
+        return bool(session_id) and _SESSION_ID_RE.match(session_id) is not None
+
+    def get(self, session_id: str) -> PollinationsAgent:
+        """
+        Return the agent for a session, creating it if needed
+        """
+        now = time.monotonic()
+        self.purge_expired(now)
+
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            agent = PollinationsAgent(
+                client=self.client,
+                max_history=self.max_history,
+                history_store=self.history_store,
+                session_id=session_id,
+                response_cache=self.response_cache,
+                single_flight=self.single_flight,
+                resilience=self.resilience,
+                router=self.router,
+                tool_router=self.tool_router,
+                context_window=self.context_window,
+                summarizer=self.summarizer,
+                planner=self.planner,
+                image_pipeline=self.image_pipeline,
+                speech_pipeline=self.speech_pipeline,
+                vision_store=self.vision_store,
+                metrics=self.metrics
+            )
+            self._sessions[session_id] = (now, agent)
+            # Enforce the cap by dropping the least recently used sessions
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return agent
+
+        agent = entry[1]
+        self._sessions[session_id] = (now, agent)
+        self._sessions.move_to_end(session_id)
+        return agent
+
+    def peek(self, session_id: str) -> Optional[PollinationsAgent]:
+        """
+        Return the agent for a session without creating or touching it
+        """
+        entry = self._sessions.get(session_id)
+        return entry[1] if entry else None
+
+    def discard(self, session_id: str):
+        """Forget a session"""
+        self._sessions.pop(session_id, None)
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        """
+        Drop sessions idle for longer than idle_ttl, returning how many
+        """
+        if now is None:
+            now = time.monotonic()
+        deadline = now - self.idle_ttl
+        removed = 0
+        while self._sessions:
+            session_id, (last_seen, _) = next(iter(self._sessions.items()))
+            if last_seen > deadline:
+                break
+            del self._sessions[session_id]
+            removed += 1
+        return removed
+
+    async def close(self):
+        """Drop all sessions and close the shared HTTP client and store"""
+        agents = [agent for _, agent in self._sessions.values()]
+        self._sessions.clear()
+        # Let pending summary updates finish while the client is still open
+        await asyncio.gather(*(agent.close() for agent in agents))
+        await self.client.aclose()
+        if self.history_store:
+            await self.history_store.close()
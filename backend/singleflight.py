@@ -0,0 +1,114 @@
+import asyncio
+from typing import AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional
+
+
+class SharedStream:
+    """
+    One upstream stream fanned out to any number of subscribers.
+
+    A producer task appends every chunk to a shared buffer as fast as the
+    upstream delivers it. Each subscriber keeps its own read position, so a
+    slow consumer never stalls the others and a late joiner first replays
+    the chunks it missed.
+    """
+
+    def __init__(self, source: AsyncIterator[str]):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run(source))
+
+    async def _run(self, source: AsyncIterator[str]):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = ConnectionAbortedError("Upstream stream cancelled")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self):
+        # Wake everyone waiting on the current event, then start a new one
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        self.subscribers += 1
+        position = 0
+        try:
+            while True:
+                chunks = self.chunks
+                while position < len(chunks):
+                    yield chunks[position]
+                    position += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                # Nobody is listening anymore: stop paying for the upstream
+                self._task.cancel()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical upstream calls into one SharedStream
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, SharedStream] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def stream(
+        self,
+        key: str,
+        factory: Callable[[], AsyncIterator[str]]
+    ) -> AsyncGenerator[str, None]:
+        """
+        Yield the chunks of the in-flight stream for `key`, starting it
+        with `factory()` if there is none
+        """
+        shared = self._inflight.get(key)
+        if shared is None:
+            shared = SharedStream(factory())
+            self._inflight[key] = shared
+            shared._task.add_done_callback(lambda _: self._forget(key, shared))
+            self.leaders += 1
+        else:
+            self.followers += 1
+
+        subscription = shared.subscribe()
+        try:
+            async for chunk in subscription:
+                yield chunk
+        finally:
+            # Close explicitly so the subscriber count is current right now
+            await subscription.aclose()
+            if shared.subscribers == 0 and not shared.done:
+                # Abandoned and being cancelled: new callers start afresh
+                self._forget(key, shared)
+
+    def _forget(self, key: str, shared: SharedStream):
+        if self._inflight.get(key) is shared:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "followers": self.followers,
+        }
@@ -0,0 +1,197 @@
+import asyncio
+import os
+import re
+import textwrap
+from collections import deque
+from typing import Any, AsyncGenerator, Callable, Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+from media import MediaCache, MediaPipeline, media_key
+
+# A sentence ends at . ! ? or … (closing quotes/brackets included) followed by
+# whitespace; the end of the text only counts once the text is complete
+_SENTENCE_END = re.compile(r"[.!?…]+[\"')\]»]*\s+")
+
+
+def _wrap(sentence: str, max_chars: int) -> List[str]:
+    """A sentence longer than max_chars, cut at word boundaries"""
+    if len(sentence) <= max_chars:
+        return [sentence]
+    return textwrap.wrap(sentence, max_chars, break_on_hyphens=False)
+
+
+class SentenceBuffer:
+    """
+    Collects streamed text and hands back complete sentences as soon as
+    they end. Text running past max_chars without a sentence end is cut at
+    the last space so a segment never waits on an endless sentence.
+    """
+
+    def __init__(self, max_chars: int = 300):
+        self.max_chars = max_chars
+        self._text = ""
+
+    def feed(self, text: str) -> List[str]:
+        self._text += text
+        sentences: List[str] = []
+        while True:
+            match = _SENTENCE_END.search(self._text)
+            if match is not None and match.end() <= self.max_chars:
+                sentence, self._text = self._text[:match.end()].strip(), self._text[match.end():]
+            elif len(self._text) > self.max_chars:
+                cut = self._text.rfind(" ", 0, self.max_chars + 1)
+                cut = cut if cut > 0 else self.max_chars
+                sentence, self._text = self._text[:cut].strip(), self._text[cut:]
+            else:
+                return sentences
+            if sentence:
+                sentences.append(sentence)
+
+    def flush(self) -> List[str]:
+        """Whatever is left once the text is complete"""
+        rest, self._text = self._text.strip(), ""
+        return _wrap(rest, self.max_chars) if rest else []
+
+
+def split_sentences(text: str, max_chars: int = 300) -> List[str]:
+    """
+    Speech segments of a complete text. The first sentence stays on its own
+    so playback starts quickly; the rest are packed up to max_chars to save
+    upstream calls.
+    """
+    buffer = SentenceBuffer(max_chars)
+    sentences = buffer.feed(text) + buffer.flush()
+    segments = sentences[:1]
+    for sentence in sentences[1:]:
+        if len(segments) > 1 and len(segments[-1]) + 1 + len(sentence) <= max_chars:
+            segments[-1] += " " + sentence
+        else:
+            segments.append(sentence)
+    return segments
+
+
+class SpeechPipeline(MediaPipeline):
+    """
+    Renders text-to-speech segment by segment into an on-disk cache, keyed
+    by (text, voice), and serves them from /media/audio/<key>. Short
+    segments keep upstream URLs small and let playback start on the first
+    sentence while the rest are still rendering.
+    """
+
+    MEDIA_PATH = "/media/audio/"
+    EVENT = "audio"
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        cache: MediaCache,
+        max_concurrency: int = 4,
+        timeout: float = 60.0,
+        max_bytes: int = 10 * 1024 * 1024,
+        segment_chars: int = 300
+    ):
+        super().__init__(client, cache, max_concurrency=max_concurrency, timeout=timeout, max_bytes=max_bytes)
+        self.segment_chars = segment_chars
+        self.segments = 0
+        self.cached_segments = 0
+
+    @classmethod
+    def from_env(cls, client: httpx.AsyncClient) -> "SpeechPipeline":
+        return cls(
+            client,
+            MediaCache(
+                os.getenv("TTS_CACHE_DIR", "tts_cache"),
+                max_bytes=int(float(os.getenv("TTS_CACHE_MB", "256")) * 1024 * 1024)
+            ),
+            max_concurrency=int(os.getenv("TTS_CONCURRENCY", "4")),
+            timeout=float(os.getenv("TTS_TIMEOUT", "60")),
+            segment_chars=int(os.getenv("TTS_SEGMENT_CHARS", "300"))
+        )
+
+    async def render(self, text: str, voice: str, url: str) -> Dict[str, Any]:
+        """Cache one segment and return its audio_segment event (without index)"""
+        key = media_key(kind="tts", text=text, voice=voice)
+        ready = None
+        async for event in self.fetch(key, url, progress_interval=float("inf")):
+            ready = event
+        self.segments += 1
+        if ready["cached"]:
+            self.cached_segments += 1
+        return {"type": "audio_segment", "url": ready["url"], "text": text, "cached": ready["cached"]}
+
+    def open(self, voice: str, url_for: Callable[[str], str]) -> "SpeechStream":
+        """Speak text fed in pieces; `url_for(text)` is the upstream URL of a segment"""
+        return SpeechStream(self, voice, url_for)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "segments": self.segments,
+            "cached_segments": self.cached_segments,
+            "segment_chars": self.segment_chars,
+        }
+
+
+class SpeechStream:
+    """
+    Starts rendering each sentence as soon as it is complete and hands the
+    segments back in order, so audio never plays out of sequence even
+    though the segments render concurrently.
+    """
+
+    def __init__(self, pipeline: SpeechPipeline, voice: str, url_for: Callable[[str], str]):
+        self.pipeline = pipeline
+        self.voice = voice
+        self.url_for = url_for
+        self._buffer = SentenceBuffer(pipeline.segment_chars)
+        self._pending: Deque[Tuple[int, asyncio.Future]] = deque()
+        self.started = 0
+
+    def _start(self, text: str):
+        task = asyncio.ensure_future(self.pipeline.render(text, self.voice, self.url_for(text)))
+        self._pending.append((self.started, task))
+        self.started += 1
+
+    def feed(self, text: str):
+        for sentence in self._buffer.feed(text):
+            self._start(sentence)
+
+    def speak(self, text: str):
+        """Speak a complete text"""
+        for segment in split_sentences(text, self.pipeline.segment_chars):
+            self._start(segment)
+
+    def finish(self):
+        """The text is complete: speak what is left in the buffer"""
+        for sentence in self._buffer.flush():
+            self._start(sentence)
+
+    def head(self) -> Optional[asyncio.Future]:
+        """The next segment in order, to wait on"""
+        return self._pending[0][1] if self._pending else None
+
+    def ready(self) -> List[Dict[str, Any]]:
+        """Events of the segments finished in order so far"""
+        events = []
+        while self._pending and self._pending[0][1].done():
+            index, task = self._pending.popleft()
+            if task.cancelled():
+                continue
+            if task.exception() is not None:
+                events.append({"type": "audio_error", "index": index, "message": str(task.exception())})
+            else:
+                events.append({**task.result(), "index": index})
+        return events
+
+    async def drain(self) -> AsyncGenerator[Dict[str, Any], None]:
+        """Wait for the remaining segments, yielding them in order"""
+        while self._pending:
+            await asyncio.wait({self.head()})
+            for event in self.ready():
+                yield event
+
+    def close(self):
+        for _, task in self._pending:
+            task.cancel()
+        self._pending.clear()
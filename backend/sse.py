@@ -0,0 +1,422 @@
+import asyncio
+import json
+import re
+import time
+from collections import deque
+from json.decoder import scanstring
+from json.encoder import encode_basestring_ascii
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional
+
+
+# Matches `"delta": {` optionally followed by a `"role"` key, up to the
+# start of the `"content"` value.
+_DELTA_CONTENT_RE = re.compile(
+    rb'"delta"\s*:\s*\{\s*(?:"role"\s*:\s*"\w*"\s*,\s*)?"content"\s*:\s*'
+)
+# Matches a delta carrying no content at all, e.g. the final `"delta": {}`
+_DELTA_EMPTY_RE = re.compile(rb'"delta"\s*:\s*\{\s*(?:"role"\s*:\s*"\w*"\s*)?\}')
+
+_UNDECIDED = object()
+_BOM = b"\xef\xbb\xbf"
+
+
+class SSEDecoder:
+    """
+    Incremental Server-Sent Events decoder working on raw bytes.
+
+    Follows the event stream format of the HTML spec: lines may end in CRLF,
+    LF or CR, lines starting with ':' are comments, `data:` lines of one
+    event are joined with '\\n' and a blank line dispatches the event.
+    Only `data` payloads are returned; the last `id` is kept in
+    `last_event_id`.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data: List[bytes] = []
+        self._pending_cr = False
+        self._started = False
+        self.last_event_id: Optional[bytes] = None
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """
+        Consume a chunk of the stream and return the completed event payloads
+        """
+        if not self._started:
+            if len(chunk) < len(_BOM) and _BOM.startswith(chunk):
+                self._buffer += chunk
+                return []
+            self._started = True
+            if self._buffer:
+                chunk = bytes(self._buffer) + chunk
+                self._buffer.clear()
+            if chunk.startswith(_BOM):
+                chunk = chunk[len(_BOM):]
+
+        if self._pending_cr:
+            # A CR ended the previous chunk; a following LF belongs to it
+            self._pending_cr = False
+            if chunk[:1] == b"\n":
+                chunk = chunk[1:]
+
+        buffer = self._buffer
+        buffer += chunk
+        if b"\r" in buffer:
+            # Rare: normalize CRLF and lone CR line endings to LF. A trailing
+            # CR ends its line now, and a following LF is dropped next time.
+            self._pending_cr = buffer.endswith(b"\r")
+            buffer[:] = buffer.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+        last = buffer.rfind(b"\n")
+        if last == -1:
+            return []
+        lines = bytes(buffer[:last]).split(b"\n")
+        del buffer[:last + 1]
+
+        events: List[bytes] = []
+        data = self._data
+        for line in lines:
+            if not line:
+                if data:
+                    events.append(data[0] if len(data) == 1 else b"\n".join(data))
+                    data.clear()
+            elif line.startswith(b"data: "):
+                data.append(line[6:])
+            else:
+                self._process_line(line, events)
+        return events
+
+    def flush(self) -> List[bytes]:
+        """
+        Dispatch a trailing event the upstream did not terminate with a
+        blank line. The spec drops it, but being lenient costs nothing.
+        """
+        events: List[bytes] = []
+        if self._buffer:
+            self._process_line(bytes(self._buffer), events)
+            self._buffer.clear()
+        self._process_line(b"", events)
+        return events
+
+    def _process_line(self, line: bytes, events: List[bytes]):
+        if not line:
+            if self._data:
+                data = self._data
+                events.append(data[0] if len(data) == 1 else b"\n".join(data))
+                data.clear()
+            return
+        if line[0] == 0x3A:  # ':' starts a comment
+            return
+        colon = line.find(b":")
+        if colon == -1:
+            field, value = line, b""
+        else:
+            field = line[:colon]
+            value = line[colon + 1:]
+            if value[:1] == b" ":
+                value = value[1:]
+        if field == b"data":
+            self._data.append(value)
+        elif field == b"id" and b"\0" not in value:
+            self.last_event_id = value
+        # `event` and `retry` are not used by the upstream API
+
+
+def _scan_json_string(data: bytes, start: int):
+    """
+    Read the JSON string starting right after the opening quote at `start`
+    """
+    end = data.find(b'"', start)
+    if end == -1:
+        return _UNDECIDED
+    if data.find(b"\\", start, end) == -1:
+        # Common case: no escapes, decode the slice directly
+        try:
+            return data[start:end].decode("utf-8")
+        except UnicodeDecodeError:
+            return _UNDECIDED
+    # Escapes present: let the C string scanner of the json module find the
+    # closing quote and unescape, without decoding the rest of the chunk
+    try:
+        return scanstring(data[start:].decode("utf-8"), 0)[0]
+    except ValueError:
+        return _UNDECIDED
+
+
+def _fast_delta_content(data: bytes):
+    """
+    Pull `choices[0].delta.content` out of a chunk without building dicts.
+    Returns _UNDECIDED when the payload does not have the usual shape.
+    """
+    if data.count(b'"delta"') != 1:
+        return _UNDECIDED
+    match = _DELTA_CONTENT_RE.search(data)
+    if match is None:
+        if _DELTA_EMPTY_RE.search(data):
+            return None
+        return _UNDECIDED
+    if match.start() and data[match.start() - 1] == 0x5C:
+        return _UNDECIDED
+    pos = match.end()
+    first = data[pos:pos + 1]
+    if first == b'"':
+        return _scan_json_string(data, pos + 1)
+    if data.startswith(b"null", pos):
+        return None
+    return _UNDECIDED
+
+
+def _parse_delta_content(data: bytes) -> Optional[str]:
+    """
+    Slow path: fully decode the chunk and walk to `choices[0].delta.content`
+    """
+    try:
+        chunk = json.loads(data)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        if b"\n" not in data:
+            return None
+        # Lenient: several JSON chunks sent as consecutive data lines
+        parts = [_parse_delta_content(line) for line in data.split(b"\n")]
+        return "".join(p for p in parts if p) or None
+    if not isinstance(chunk, dict):
+        return None
+    choices = chunk.get("choices") or [{}]
+    delta = choices[0].get("delta") if isinstance(choices[0], dict) else None
+    content = delta.get("content") if isinstance(delta, dict) else None
+    return content if isinstance(content, str) else None
+
+
+def extract_delta_content(data: bytes) -> Optional[str]:
+    """
+    Return the text delta of an OpenAI-style streaming chunk, if any
+    """
+    content = _fast_delta_content(data)
+    if content is _UNDECIDED:
+        return _parse_delta_content(data)
+    return content
+
+
+async def iter_delta_content(byte_stream: AsyncIterator[bytes]) -> AsyncGenerator[str, None]:
+    """
+    Decode an upstream SSE byte stream into text deltas, stopping at [DONE]
+    """
+    decoder = SSEDecoder()
+    async for chunk in byte_stream:
+        for data in decoder.feed(chunk):
+            if data[:1] != b"{" and data.strip() == b"[DONE]":
+                return
+            content = extract_delta_content(data)
+            if content:
+                yield content
+    for data in decoder.flush():
+        if data.strip() == b"[DONE]":
+            return
+        content = extract_delta_content(data)
+        if content:
+            yield content
+
+
+# Downstream (/chat) side: text chunks are written by appending the escaped
+# content to a fixed frame, producing the same bytes as json.dumps(event).
+_TEXT_FRAME_PREFIX = 'data: {"type": "text_chunk", "content": '
+_TEXT_FRAME_SUFFIX = '}\n\n'
+
+
+def encode_event(event: Dict[str, Any]) -> bytes:
+    """Serialize any event as one SSE frame"""
+    return f"data: {json.dumps(event)}\n\n".encode()
+
+
+def encode_text_frame(content: str) -> bytes:
+    """Serialize a text_chunk event without building or dumping a dict"""
+    return (_TEXT_FRAME_PREFIX + encode_basestring_ascii(content) + _TEXT_FRAME_SUFFIX).encode()
+
+
+class FlushPolicy:
+    """
+    Controls how consecutive text_chunk events are merged into SSE frames.
+
+    Buffered text is written once its escaped JSON content reaches
+    `max_bytes` (non-ASCII text is written as \\u escapes, up to 12 bytes
+    per character) or once the oldest buffered chunk is `max_delay_ms` old (0 disables the time limit).
+    `max_bytes=0` writes every chunk immediately (per-token, for latency
+    sensitive clients).
+    """
+
+    def __init__(self, max_bytes: int = 2048, max_delay_ms: float = 25.0):
+        self.max_bytes = max_bytes
+        self.max_delay_ms = max_delay_ms
+
+    @classmethod
+    def per_token(cls) -> "FlushPolicy":
+        return cls(max_bytes=0, max_delay_ms=0)
+
+    @property
+    def coalescing(self) -> bool:
+        return self.max_bytes > 0
+
+
+async def encode_events(
+    events: AsyncIterator[Dict[str, Any]],
+    policy: Optional[FlushPolicy] = None
+) -> AsyncGenerator[bytes, None]:
+    """
+    Turn agent events into SSE frames, merging runs of text chunks per the
+    flush policy. Any other event flushes pending text first, so ordering is
+    preserved.
+    """
+    policy = policy or FlushPolicy.per_token()
+    if not policy.coalescing:
+        async for event in events:
+            if event.get("type") == "text_chunk":
+                yield encode_text_frame(event["content"])
+            else:
+                yield encode_event(event)
+        return
+
+    async for frame in _buffered(_FrameBuffer(policy), events):
+        yield frame
+
+
+async def coalesce_events(
+    events: AsyncIterator[Dict[str, Any]],
+    policy: Optional[FlushPolicy] = None
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Merge runs of text chunks per the flush policy like encode_events, but
+    yield events: for streams that are stored and numbered before being
+    encoded, such as job channels
+    """
+    policy = policy or FlushPolicy.per_token()
+    if not policy.coalescing:
+        async for event in events:
+            yield event
+        return
+
+    async for event in _buffered(_EventBuffer(policy), events):
+        yield event
+
+
+async def _buffered(buffer: "_FrameBuffer", events: AsyncIterator[Dict[str, Any]]) -> AsyncGenerator[Any, None]:
+    producer = asyncio.ensure_future(buffer.fill(events))
+    try:
+        async for frame in buffer.drain():
+            yield frame
+    finally:
+        if not producer.done():
+            producer.cancel()
+            # Wait until the agent stream (and its upstream request) is closed
+            await asyncio.gather(producer, return_exceptions=True)
+
+
+class _FrameBuffer:
+    """
+    Shared state between the task pulling agent events and the response
+    generator writing frames.
+
+    The producer appends text, already escaped, to `parts` and only wakes the writer when a
+    frame is ready (size limit, other event, end of stream) or when the
+    first chunk of a batch starts the delay timer, so a burst of deltas
+    costs no task switches.
+    """
+
+    MAX_PENDING_FRAMES = 64
+
+    def __init__(self, policy: FlushPolicy):
+        self.max_bytes = policy.max_bytes
+        self.max_delay = policy.max_delay_ms / 1000.0
+        self.parts: List[str] = []
+        self.size = 0
+        self.deadline = 0.0
+        self.frames: "deque[Any]" = deque()
+        self.finished = False
+        self.error: Optional[Exception] = None
+        self.wake = asyncio.Event()
+        self.space = asyncio.Event()
+
+    def flush_text(self):
+        if self.parts:
+            self.frames.append(self.text_frame('"' + "".join(self.parts) + '"'))
+            self.parts.clear()
+            self.size = 0
+
+    def text_frame(self, escaped: str) -> Any:
+        return (_TEXT_FRAME_PREFIX + escaped + _TEXT_FRAME_SUFFIX).encode()
+
+    def event_frame(self, event: Dict[str, Any]) -> Any:
+        return encode_event(event)
+
+    async def fill(self, events: AsyncIterator[Dict[str, Any]]):
+        try:
+            async for event in events:
+                if event.get("type") == "text_chunk":
+                    # Escaping is per character, so escaped chunks can be
+                    # joined; the limit then counts bytes actually written
+                    escaped = encode_basestring_ascii(event["content"])[1:-1]
+                    if not self.parts:
+                        self.deadline = time.monotonic() + self.max_delay
+                        self.wake.set()
+                    self.parts.append(escaped)
+                    self.size += len(escaped)
+                    if self.size < self.max_bytes:
+                        continue
+                    self.flush_text()
+                else:
+                    self.flush_text()
+                    self.frames.append(self.event_frame(event))
+                self.wake.set()
+                # Backpressure: do not run ahead of a slow client
+                while len(self.frames) >= self.MAX_PENDING_FRAMES:
+                    self.space.clear()
+                    await self.space.wait()
+        except Exception as e:
+            self.error = e
+        finally:
+            # Stopped while waiting for space: close the agent stream now
+            # rather than when it is garbage collected
+            try:
+                aclose = getattr(events, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+            finally:
+                self.finished = True
+                self.wake.set()
+
+    async def drain(self) -> AsyncGenerator[Any, None]:
+        loop = asyncio.get_running_loop()
+        while True:
+            while self.frames:
+                frame = self.frames.popleft()
+                self.space.set()
+                yield frame
+            if self.finished:
+                # Deliver what was already generated before any error
+                self.flush_text()
+                while self.frames:
+                    yield self.frames.popleft()
+                if self.error is not None:
+                    raise self.error
+                return
+
+            self.wake.clear()
+            timer = None
+            if self.parts and self.max_delay > 0:
+                timeout = self.deadline - time.monotonic()
+                if timeout <= 0:
+                    # Upstream is quiet: write what is buffered now
+                    self.flush_text()
+                    continue
+                timer = loop.call_later(timeout, self.wake.set)
+            await self.wake.wait()
+            if timer is not None:
+                timer.cancel()
+
+
+class _EventBuffer(_FrameBuffer):
+    """_FrameBuffer producing merged events instead of SSE frames"""
+
+    def text_frame(self, escaped: str) -> Dict[str, Any]:
+        return {"type": "text_chunk", "content": scanstring(escaped, 1)[0]}
+
+    def event_frame(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        return event
@@ -0,0 +1,356 @@
+import asyncio
+import os
+import time
+import uuid
+import weakref
+from collections import OrderedDict, deque
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, Optional, Set, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Sources being closed in the background, kept until they finish
+_closing: Set[asyncio.Future] = set()
+
+# Registries of this process, for drain() at shutdown
+_registries: "weakref.WeakSet[StreamRegistry]" = weakref.WeakSet()
+
+
+class EventLog:
+    """
+    The SSE frames of one /chat stream, numbered from 1 with an `id:` line
+    so a client can resume with Last-Event-ID. Keeps the latest frames up
+    to `max_bytes` (plus the frame being added). A reader following the
+    live tail holds back eviction, and with it the producer, until it has
+    read the oldest frame: a slow client slows the upstream as before
+    instead of losing frames.
+    """
+
+    def __init__(self, max_bytes: int = 128 * 1024):
+        self.max_bytes = max_bytes
+        self._frames: "deque[Tuple[int, bytes]]" = deque()
+        self.size = 0
+        self.last_seq = 0
+        self.closed = False
+        # Weak, so a reader dropped without being closed lets go of the log
+        self._readers: "weakref.WeakSet[LogReader]" = weakref.WeakSet()
+        self._changed: Optional[asyncio.Event] = None
+
+    @property
+    def readers(self) -> int:
+        return len(self._readers)
+
+    @property
+    def first_seq(self) -> int:
+        return self._frames[0][0] if self._frames else self.last_seq + 1
+
+    def can_replay(self, after: int) -> bool:
+        """Whether every frame after `after` is still here (or yet to come)"""
+        return self.first_seq - 1 <= after <= self.last_seq
+
+    async def append(self, frame: bytes):
+        self.last_seq += 1
+        framed = b"id: %d\n%s" % (self.last_seq, frame)
+        self._frames.append((self.last_seq, framed))
+        self.size += len(framed)
+        self._notify()
+        while self.size > self.max_bytes and len(self._frames) > 1:
+            oldest = self._frames[0][0]
+            if self._readers and min(reader.after for reader in self._readers) < oldest:
+                # A reader has not had the oldest frame yet
+                await self._wait()
+                continue
+            self.size -= len(self._frames.popleft()[1])
+
+    def close(self):
+        """No more frames: readers end once they have read them all"""
+        self.closed = True
+        self._notify()
+
+    def follow(self, after: int = 0, on_close: Optional[Callable[[], None]] = None) -> "LogReader":
+        """
+        Frames after sequence number `after`, then the live tail until
+        closed. The reader is registered right away, not on its first
+        iteration, so the frames cannot be evicted between this check and
+        the response starting; ValueError if they already are.
+        """
+        if not self.can_replay(after):
+            raise ValueError(f"frames after {after} are no longer buffered")
+        return LogReader(self, after, on_close)
+
+    def _notify(self):
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    async def _wait(self):
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        await self._changed.wait()
+
+
+class LogReader:
+    """
+    Async iterator over an EventLog, from EventLog.follow. Leaves the log
+    when it ends, is closed, is cancelled while waiting or, if it never ran
+    (e.g. the client went away before the response started), when it is
+    collected.
+    """
+
+    def __init__(self, log: EventLog, after: int, on_close: Optional[Callable[[], None]] = None):
+        self.log = log
+        # Sequence number of the last frame given to this reader
+        self.after = after
+        self.on_close = on_close
+        self.closed = False
+        log._readers.add(self)
+
+    def __aiter__(self) -> "LogReader":
+        return self
+
+    async def __anext__(self) -> bytes:
+        log = self.log
+        if self.closed:
+            raise StopAsyncIteration
+        try:
+            while self.after >= log.last_seq:
+                if log.closed:
+                    raise StopAsyncIteration
+                await log._wait()
+        except BaseException:
+            self.close()
+            raise
+        self.after, framed = log._frames[self.after + 1 - log._frames[0][0]]
+        log._notify()
+        return framed
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.log._readers.discard(self)
+        self.log._notify()
+        if self.on_close is not None:
+            self.on_close()
+
+    async def aclose(self):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+class ChatStream:
+    """
+    One /chat response. Its frames go to an EventLog that the HTTP
+    response, and any reconnect, follows. When the last reader leaves
+    before the end, the stream is cancelled unless a reader comes back
+    within `resume_window` seconds.
+    """
+
+    def __init__(self, session_id: str, buffer_bytes: int = 128 * 1024, resume_window: float = 0.0):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.cancelled = asyncio.Event()
+        self.log = EventLog(buffer_bytes)
+        self.resume_window = resume_window
+        # Cancelled because nobody came back to read it
+        self.abandoned = False
+        self.task: Optional[asyncio.Future] = None
+        self._abandon_timer: Optional[asyncio.TimerHandle] = None
+
+    def follow(self, after: int = 0) -> LogReader:
+        """The stream's frames after sequence number `after`, as in EventLog.follow"""
+        reader = self.log.follow(after, on_close=self._reader_left)
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+            self._abandon_timer = None
+        return reader
+
+    def _reader_left(self):
+        if self.log.readers or self.log.closed:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Collected outside the event loop, i.e. at shutdown
+            self._abandon()
+            return
+        self._abandon_timer = loop.call_later(self.resume_window, self._abandon)
+
+    def _abandon(self):
+        self._abandon_timer = None
+        if not self.log.readers and not self.log.closed:
+            self.abandoned = True
+            self.cancelled.set()
+
+
+class StreamRegistry:
+    """
+    Tracks the /chat streams of this process so they can be cancelled and
+    resumed by id, and counted. Outcomes: completed, cancelled (POST
+    /chat/{id}/cancel), disconnected (the client went away and did not come
+    back) and failed. Finished streams stay resumable for `retain_seconds`,
+    at most `max_retained` of them.
+    """
+
+    OUTCOMES = ("completed", "cancelled", "disconnected", "failed")
+
+    def __init__(
+        self,
+        buffer_bytes: int = 128 * 1024,
+        resume_window: float = 0.0,
+        retain_seconds: float = 60.0,
+        max_retained: int = 500
+    ):
+        self.buffer_bytes = buffer_bytes
+        self.resume_window = resume_window
+        self.retain_seconds = retain_seconds
+        self.max_retained = max_retained
+        self._active: Dict[str, ChatStream] = {}
+        self._retained: "OrderedDict[str, ChatStream]" = OrderedDict()
+        self.opened = 0
+        self.resumed = 0
+        self.outcomes = {outcome: 0 for outcome in self.OUTCOMES}
+        self.duration_total = 0.0
+        self._idle: Optional[asyncio.Event] = None
+        _registries.add(self)
+
+    @classmethod
+    def from_env(cls) -> "StreamRegistry":
+        """Build from RESUME_* environment variables"""
+        return cls(
+            buffer_bytes=int(os.getenv("RESUME_BUFFER_KB", "128")) * 1024,
+            resume_window=float(os.getenv("RESUME_WINDOW", "15")),
+            retain_seconds=float(os.getenv("RESUME_TTL", "60")),
+            max_retained=int(os.getenv("RESUME_MAX_STREAMS", "500"))
+        )
+
+    def create(self, session_id: str) -> ChatStream:
+        return ChatStream(session_id, self.buffer_bytes, self.resume_window)
+
+    def add(self, stream: ChatStream):
+        """Track a stream once its response starts"""
+        self._active[stream.id] = stream
+        self.opened += 1
+
+    def cancel(self, stream_id: str, session_id: Optional[str] = None) -> bool:
+        """Ask a stream to stop; False if there is no such stream (for this session)"""
+        stream = self._active.get(stream_id)
+        if stream is None or (session_id is not None and stream.session_id != session_id):
+            return False
+        stream.cancelled.set()
+        return True
+
+    def get(self, stream_id: str, session_id: Optional[str] = None) -> Optional[ChatStream]:
+        """A running or recently finished stream (of this session), for resuming"""
+        self._prune()
+        stream = self._active.get(stream_id) or self._retained.get(stream_id)
+        if stream is None or (session_id is not None and stream.session_id != session_id):
+            return None
+        return stream
+
+    def finish(self, stream: ChatStream, outcome: str):
+        if self._active.pop(stream.id, None) is None:
+            return
+        stream.finished = time.monotonic()
+        stream.log.close()
+        self.outcomes[outcome] += 1
+        self.duration_total += stream.finished - stream.started
+        if self.retain_seconds > 0 and self.max_retained > 0:
+            self._retained[stream.id] = stream
+            self._prune()
+        if not self._active and self._idle is not None:
+            self._idle.set()
+
+    def _prune(self):
+        expired = time.monotonic() - self.retain_seconds
+        retained = self._retained
+        while retained and (len(retained) > self.max_retained or next(iter(retained.values())).finished < expired):
+            retained.popitem(last=False)
+
+    async def drain(self, timeout: float, grace: float = 5.0) -> int:
+        """
+        Wait up to `timeout` seconds for the active streams to finish, then
+        cancel the rest (they end with a "cancelled" event and keep their
+        partial answer) and give them `grace` seconds to wind down.
+        Returns how many streams had to be cancelled.
+        """
+        self._idle = asyncio.Event()
+        if not self._active:
+            return 0
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return 0
+        except asyncio.TimeoutError:
+            pass
+        remaining = list(self._active.values())
+        for stream in remaining:
+            stream.cancelled.set()
+        try:
+            await asyncio.wait_for(self._idle.wait(), grace)
+        except asyncio.TimeoutError:
+            pass
+        return len(remaining)
+
+    async def close(self):
+        """Stop whatever is still producing (after drain, at shutdown)"""
+        tasks = [stream.task for stream in self._active.values() if stream.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        self._prune()
+        finished = sum(self.outcomes.values())
+        return {
+            "active": len(self._active),
+            "opened": self.opened,
+            **self.outcomes,
+            "resumed": self.resumed,
+            "resumable": len(self._retained),
+            "buffered_bytes": sum(
+                stream.log.size for streams in (self._active, self._retained) for stream in streams.values()
+            ),
+            "avg_duration_ms": self.duration_total / finished * 1000 if finished else 0.0,
+        }
+
+
+async def drain(timeout: float, grace: float = 5.0) -> int:
+    """Drain every StreamRegistry of this process; see StreamRegistry.drain"""
+    counts = await asyncio.gather(*[registry.drain(timeout, grace) for registry in list(_registries)])
+    return sum(counts)
+
+
+async def cancellable(source: AsyncIterator[T], cancelled: asyncio.Event) -> AsyncGenerator[T, None]:
+    """
+    Iterate `source` until `cancelled` is set. Each step runs in a task of
+    its own, so a cancel interrupts a step waiting on the upstream: the
+    source unwinds in that task, closing its upstream request and pool slot,
+    without the consumer having to wait for the next item.
+    """
+    stop = asyncio.ensure_future(cancelled.wait())
+    step: Optional[asyncio.Future] = None
+    try:
+        while True:
+            step = asyncio.ensure_future(source.__anext__())
+            await asyncio.wait({step, stop}, return_when=asyncio.FIRST_COMPLETED)
+            if not step.done():
+                return
+            try:
+                item = step.result()
+            except StopAsyncIteration:
+                return
+            step = None
+            yield item
+    finally:
+        stop.cancel()
+        if step is not None and not step.done():
+            step.cancel()
+        elif hasattr(source, "aclose"):
+            # Suspended between items: close it in a task, as this generator
+            # may itself be in the middle of being cancelled
+            task = asyncio.ensure_future(source.aclose())
+            _closing.add(task)
+            task.add_done_callback(_closing.discard)
@@ -0,0 +1,121 @@
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from context import estimate_tokens, truncate_to_tokens
+
+
+SUMMARY_SYSTEM_PROMPT = (
+    "Você mantém o resumo de uma conversa entre um usuário e um assistente. "
+    "Atualize o resumo atual com as novas mensagens, preservando fatos, nomes, "
+    "preferências, decisões e pedidos em aberto do usuário. Seja conciso, escreva "
+    "no máximo {words} palavras e responda apenas com o resumo atualizado."
+)
+
+ROLE_LABELS = {"user": "Usuário", "assistant": "Assistente"}
+
+# Streams the text of a chat completion payload, e.g. agent._stream_completion
+Completion = Callable[[Dict[str, Any]], AsyncIterator[str]]
+
+
+class ConversationSummarizer:
+    """
+    Folds messages trimmed from a session's history into its rolling
+    summary. Each update sends only the previous summary and the new
+    messages, so its cost does not grow with the length of the conversation.
+
+    If the upstream call fails the new messages are appended to the summary
+    as short extracts, so a trimmed turn is never silently lost.
+    """
+
+    def __init__(
+        self,
+        model: str = "openai-fast",
+        max_tokens: int = 300,
+        message_tokens: int = 400,
+        temperature: float = 0.2
+    ):
+        self.model = model
+        # Size the summary is held to; it is prepended to every text request
+        self.max_tokens = max_tokens
+        # Long answers are truncated before being summarized
+        self.message_tokens = message_tokens
+        self.temperature = temperature
+        self.updates = 0
+        self.failures = 0
+        self.messages_summarized = 0
+        self.update_time_total = 0.0
+
+    @classmethod
+    def from_env(cls) -> "ConversationSummarizer":
+        return cls(
+            model=os.getenv("SUMMARY_MODEL", "openai-fast"),
+            max_tokens=int(os.getenv("SUMMARY_MAX_TOKENS", "300")),
+            message_tokens=int(os.getenv("SUMMARY_MESSAGE_TOKENS", "400"))
+        )
+
+    def _transcript(self, messages: List[Dict]) -> str:
+        return "\n".join(
+            f"{ROLE_LABELS.get(m.get('role'), m.get('role'))}: "
+            f"{truncate_to_tokens(m.get('content') or '', self.message_tokens)}"
+            for m in messages
+        )
+
+    def payload(self, previous: Optional[str], messages: List[Dict]) -> Dict[str, Any]:
+        """Chat completion request that merges `messages` into `previous`"""
+        words = max(20, self.max_tokens * 3 // 4)
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT.format(words=words)},
+                {
+                    "role": "user",
+                    "content": f"Resumo atual:\n{previous or '(vazio)'}\n\n"
+                               f"Novas mensagens:\n{self._transcript(messages)}"
+                },
+            ],
+            "temperature": self.temperature,
+            "stream": True
+        }
+
+    def fallback(self, previous: Optional[str], messages: List[Dict]) -> str:
+        """
+        Extractive update used when the model is unavailable: one short line
+        per message, dropping the oldest lines beyond max_tokens
+        """
+        lines = previous.splitlines() if previous else []
+        for m in messages:
+            label = ROLE_LABELS.get(m.get("role"), m.get("role"))
+            lines.append(f"- {label}: {truncate_to_tokens(m.get('content') or '', 40)}")
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > self.max_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    async def update(self, complete: Completion, previous: Optional[str], messages: List[Dict]) -> str:
+        """Return the summary with `messages` folded into `previous`"""
+        if not messages:
+            return previous or ""
+        started = time.perf_counter()
+        try:
+            chunks = [chunk async for chunk in complete(self.payload(previous, messages))]
+            summary = "".join(chunks).strip()
+            if not summary:
+                raise ValueError("empty summary")
+            summary = truncate_to_tokens(summary, self.max_tokens)
+        except Exception:
+            self.failures += 1
+            summary = self.fallback(previous, messages)
+        self.updates += 1
+        self.messages_summarized += len(messages)
+        self.update_time_total += time.perf_counter() - started
+        return summary
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "updates": self.updates,
+            "failures": self.failures,
+            "messages_summarized": self.messages_summarized,
+            "avg_update_ms": self.update_time_total / self.updates * 1000 if self.updates else 0.0,
+        }
@@ -0,0 +1,100 @@
+"""
+Tests for the /chat admission controller
+Run with: pytest test_admission.py
+"""
+import asyncio
+import gc
+import pytest
+from admission import AdmissionController, ConcurrencyLimit, Overloaded
+
+
+def _controller(global_max=4, search_max=1, queue_timeout=0.05, max_queue=8):
+    return AdmissionController(
+        global_limit=ConcurrencyLimit("global", max_limit=global_max, initial=global_max, max_queue=max_queue),
+        tool_limits={"search": ConcurrencyLimit("search", max_limit=search_max, initial=search_max, max_queue=max_queue)},
+        queue_timeout=queue_timeout
+    )
+
+
+@pytest.mark.asyncio
+class TestAdmissionController:
+    """Test limits, queueing and rejection"""
+
+    async def test_per_tool_limit(self):
+        controller = _controller()
+        permit = await controller.admit("search")
+        # Text has no tool limit of its own and still fits globally
+        other = await controller.admit("text_generation")
+        with pytest.raises(Overloaded) as info:
+            await controller.admit("search")
+        assert info.value.scope == "search"
+        assert info.value.retry_after >= 1
+        permit.release()
+        other.release()
+        stats = controller.stats()
+        assert stats["tools"]["search"]["rejected"] == 1
+        assert stats["global"]["in_flight"] == 0
+
+    async def test_queued_request_gets_slot_on_release(self):
+        controller = _controller(queue_timeout=1.0)
+        first = await controller.admit("search")
+        waiting = asyncio.ensure_future(controller.admit("search"))
+        await asyncio.sleep(0)
+        assert controller.stats()["tools"]["search"]["queued"] == 1
+        first.release()
+        second = await asyncio.wait_for(waiting, timeout=0.5)
+        assert controller.stats()["tools"]["search"]["in_flight"] == 1
+        second.release()
+
+    async def test_fail_fast_when_queue_full(self):
+        controller = _controller(queue_timeout=1.0, max_queue=0)
+        permit = await controller.admit("search")
+        with pytest.raises(Overloaded):
+            await controller.admit("search")
+        permit.release()
+
+    async def test_cancelled_waiter_leaves_queue(self):
+        controller = _controller(queue_timeout=1.0)
+        permit = await controller.admit("search")
+        waiting = asyncio.ensure_future(controller.admit("search"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert controller.stats()["tools"]["search"]["queued"] == 0
+        permit.release()
+        assert controller.stats()["tools"]["search"]["in_flight"] == 0
+
+    async def test_unreleased_permit_frees_slot_when_dropped(self):
+        controller = _controller()
+        permit = await controller.admit("search")
+        del permit
+        gc.collect()
+        assert controller.stats()["tools"]["search"]["in_flight"] == 0
+
+
+class TestAIMD:
+    """Test limit adaptation"""
+
+    def test_increases_while_used_and_fast(self):
+        limit = ConcurrencyLimit("x", max_limit=10, initial=2, latency_target=1.0)
+        limit.in_flight = 2
+        limit.record(latency=0.1, hold=0.5)
+        assert limit.capacity == 3
+
+    def test_backs_off_on_slow_upstream_and_errors(self):
+        limit = ConcurrencyLimit("x", max_limit=100, initial=50, latency_target=1.0, backoff=0.5)
+        limit.record(latency=5.0, hold=5.0)
+        assert limit.capacity == 25
+        limit.record(latency=0.1, hold=0.1, error=True)
+        assert limit.capacity == 12
+        assert limit.errors == 1
+
+    def test_stays_within_bounds(self):
+        limit = ConcurrencyLimit("x", max_limit=3, min_limit=2, initial=3, latency_target=1.0, backoff=0.1)
+        limit.record(latency=5.0, hold=5.0)
+        assert limit.capacity == 2
+        limit.in_flight = 3
+        for _ in range(5):
+            limit.record(latency=0.1, hold=0.1)
+        assert limit.capacity == 3
@@ -62,25 +62,25 @@ class TestToolDetermination:
         assert sync_agent._determine_tool("conte-me uma história") == ToolType.TEXT_GENERATION
 
 
+@pytest.mark.asyncio
 class TestConversationHistory:
     """Test conversation history management"""
     
-    @pytest.fixture
-    def sync_agent(self):
-        """Create a synchronous agent for testing"""
-        agent = PollinationsAgent()
-        return agent
-    
-    def test_history_starts_empty(self, sync_agent):
-        assert len(sync_agent.conversation_history) == 0
-    
-    def test_clear_history(self, sync_agent):
-        sync_agent.conversation_history = [
-            {"role": "user", "content": "test"},
-            {"role": "assistant", "content": "response"}
-        ]
-        sync_agent.clear_history()
-        assert len(sync_agent.conversation_history) == 0
+    async def test_history_starts_empty(self, agent):
+        assert len(await agent.get_history()) == 0
+    
+    async def test_clear_history(self, agent):
+        await agent._add_to_history_bounded("test", "response")
+        assert len(await agent.get_history()) == 2
+        await agent.clear_history()
+        assert len(await agent.get_history()) == 0
+    
+    async def test_history_is_bounded(self, agent):
+        for i in range(8):
+            await agent._add_to_history_bounded(f"q{i}", f"a{i}")
+        history = await agent.get_history()
+        assert len(history) == agent.max_history
+        assert history[-1] == {"role": "assistant", "content": "a7"}
 
 
 @pytest.mark.asyncio
@@ -103,6 +103,12 @@ class TestImageGeneration:
             seed=42
         )
         assert url.startswith("https://image.pollinations.ai/")
+    
+    async def test_generate_image_with_seed_zero(self, agent):
+        """Test that seed 0 is sent like any other fixed seed"""
+        url = await agent.generate_image("a cat", seed=0)
+        assert "seed=0" in url
+        assert agent._image_seed({"image_seed": "0"}) == 0
 
 
 @pytest.mark.asyncio
@@ -0,0 +1,108 @@
+"""
+Tests for the response cache
+Run with: pytest test_cache.py
+"""
+import pytest
+from agent import PollinationsAgent
+from cache import ResponseCache
+
+
+def _payload(prompt, model="openai", history=None):
+    return {
+        "model": model,
+        "messages": [{"role": "system", "content": "sys"}] + (history or []) + [{"role": "user", "content": prompt}],
+        "temperature": 0.7,
+        "stream": True
+    }
+
+
+class TestResponseCache:
+    """Test keys, LRU eviction and TTLs"""
+
+    def test_key_normalizes_prompt(self):
+        a = ResponseCache.make_key("search", _payload("Latest   News"))
+        b = ResponseCache.make_key("search", _payload("  latest news "))
+        assert a == b
+
+    def test_key_depends_on_context(self):
+        base = ResponseCache.make_key("text_generation", _payload("oi"))
+        assert base != ResponseCache.make_key("text_generation", _payload("oi", model="mistral"))
+        assert base != ResponseCache.make_key("reasoning", _payload("oi"))
+        history = [{"role": "user", "content": "q"}, {"role": "assistant", "content": "a"}]
+        assert base != ResponseCache.make_key("text_generation", _payload("oi", history=history))
+
+    def test_hit_and_miss_counters(self):
+        cache = ResponseCache()
+        assert cache.get("k") is None
+        cache.put("k", "text_generation", ["a", "b"])
+        assert cache.get("k") == ["a", "b"]
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+    def test_lru_eviction_by_bytes(self):
+        cache = ResponseCache(max_bytes=3 * (ResponseCache.ENTRY_OVERHEAD + 10))
+        for key in ["a", "b", "c"]:
+            cache.put(key, "text_generation", ["x" * 10])
+        cache.get("a")  # "b" becomes least recently used
+        cache.put("d", "text_generation", ["x" * 10])
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.evictions == 1
+        assert cache.size <= cache.max_bytes
+
+    def test_per_tool_ttl(self, clock):
+        cache = ResponseCache(ttls={"search": 10, "text_generation": 100}, clock=clock)
+        cache.put("s", "search", ["news"])
+        cache.put("t", "text_generation", ["text"])
+        clock.now += 50
+        assert cache.get("s") is None
+        assert cache.get("t") == ["text"]
+        assert cache.expirations == 1
+
+    def test_oversized_and_uncached_tools_are_skipped(self):
+        cache = ResponseCache(max_bytes=ResponseCache.ENTRY_OVERHEAD + 5)
+        cache.put("big", "text_generation", ["x" * 100])
+        cache.put("img", "image_generation", ["x"])
+        assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+class TestCachedReplay:
+    """A hit must replay the same text_chunk events without going upstream"""
+
+    async def test_replay_through_process_message_stream(self):
+        cache = ResponseCache()
+        calls = []
+
+        async def fake_stream(payload):
+            calls.append(payload)
+            for chunk in ["Últimas", " notícias", "!"]:
+                yield chunk
+
+        results = []
+        for _ in range(2):
+            # Fresh sessions sharing one cache, as behind SessionManager
+            agent = PollinationsAgent(response_cache=cache)
+            agent._stream_completion = fake_stream
+            results.append([e async for e in agent.process_message_stream("latest news")])
+            await agent.close()
+
+        assert len(calls) == 1
+        assert results[0] == results[1]
+        assert [e["content"] for e in results[1] if e["type"] == "text_chunk"] == ["Últimas", " notícias", "!"]
+        assert cache.hits == 1
+
+    async def test_failed_stream_is_not_cached(self):
+        cache = ResponseCache()
+        agent = PollinationsAgent(response_cache=cache)
+
+        async def broken_stream(payload):
+            yield "partial"
+            raise RuntimeError("upstream died")
+
+        agent._stream_completion = broken_stream
+        with pytest.raises(RuntimeError):
+            async for _ in agent.search_web("latest news"):
+                pass
+        await agent.close()
+        assert len(cache) == 0
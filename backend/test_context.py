@@ -0,0 +1,128 @@
+"""
+Tests for the token-budgeted context window
+Run with: pytest test_context.py
+"""
+import pytest
+from agent import PollinationsAgent
+from context import ContextWindow, estimate_tokens, message_tokens, truncate_to_tokens
+
+
+def exchange(i: int, size: int = 10):
+    return [
+        {"role": "user", "content": f"pergunta {i} " + "palavra " * size},
+        {"role": "assistant", "content": f"resposta {i}. " + "texto longo. " * size},
+    ]
+
+
+def prompt_tokens(messages):
+    return sum(message_tokens(m) for m in messages)
+
+
+class TestEstimator:
+    """Test the local token estimate and truncation"""
+
+    def test_estimate(self):
+        assert estimate_tokens("") == 0
+        assert estimate_tokens("a" * 400) == 100
+        # Many short words count at least one token each
+        assert estimate_tokens("a b c d e f") == 6
+
+    def test_truncate_keeps_sentences(self):
+        text = "Primeira frase. Segunda frase. " + "Resto muito longo " * 100
+        short = truncate_to_tokens(text, 10)
+        assert short == "Primeira frase. Segunda frase. […]"
+        assert truncate_to_tokens("curto", 10) == "curto"
+
+    def test_truncate_at_word_boundary(self):
+        short = truncate_to_tokens("palavra " * 200, 5)
+        assert short.endswith(" […]")
+        assert all(word == "palavra" for word in short[:-4].split())
+
+
+class TestContextWindow:
+    """Test budgeted assembly of the upstream messages"""
+
+    def test_small_history_sent_unchanged(self):
+        window = ContextWindow()
+        history = exchange(1) + exchange(2)
+        messages = window.build("openai", "Seja breve", history, "oi")
+        assert messages == [{"role": "system", "content": "Seja breve"}] + history + [{"role": "user", "content": "oi"}]
+        assert window.stats()["messages_kept"] == 4
+
+    def test_respects_budget_and_keeps_recent_turns(self):
+        window = ContextWindow(budgets={"openai-fast": 300})
+        history = []
+        for i in range(10):
+            history += exchange(i, size=40)
+        messages = window.build("openai-fast", None, history, "nova pergunta")
+        assert prompt_tokens(messages) <= 300
+        assert messages[-1] == {"role": "user", "content": "nova pergunta"}
+        # Newest turns survive, oldest are dropped
+        assert messages[-2] == history[-1]
+        assert "pergunta 0" not in str(messages)
+        assert window.stats()["messages_dropped"] > 0
+
+    def test_old_long_messages_compacted_and_cached(self):
+        window = ContextWindow(compact_above=50, compact_to=20)
+        history = exchange(1, size=200) + exchange(2)
+        messages = window.build("openai", None, history, "e agora?")
+        assert messages[0]["content"].endswith(" […]")
+        assert estimate_tokens(messages[0]["content"]) <= 20
+        # The latest exchange is never compacted
+        assert messages[2:4] == history[2:]
+
+        window.build("openai", None, history, "de novo")
+        stats = window.stats()
+        assert stats["compaction_cache_hits"] >= 2
+        assert stats["messages_compacted"] == 4
+
+    def test_message_compacted_twice_counted_once(self):
+        window = ContextWindow(budgets={"openai-fast": 200}, compact_above=50, compact_to=150)
+        history = exchange(1, size=200) + exchange(2)
+        messages = window.build("openai-fast", None, history, "e agora?")
+        assert prompt_tokens(messages) <= 200
+        # The old answer is compacted, then compacted again to fit
+        assert len(messages) == 4 and estimate_tokens(messages[0]["content"]) < 150
+        stats = window.stats()
+        assert (stats["messages_kept"], stats["messages_compacted"], stats["messages_dropped"]) == (2, 1, 1)
+
+    def test_prompt_always_sent(self):
+        window = ContextWindow(default_budget=10)
+        prompt = "x" * 1000
+        messages = window.build("unknown", None, exchange(1), prompt)
+        assert messages == [{"role": "user", "content": prompt}]
+
+    def test_budgets_from_env(self, monkeypatch):
+        monkeypatch.setenv("CONTEXT_TOKEN_BUDGET", "1234")
+        monkeypatch.setenv("CONTEXT_TOKEN_BUDGET_OPENAI_FAST", "500")
+        window = ContextWindow.from_env()
+        assert window.budget_for("openai-fast") == 500
+        assert window.budget_for("openai") == 4000
+        assert window.budget_for("other") == 1234
+
+
+@pytest.mark.asyncio
+class TestAgentContext:
+    """Test that the agent sends the budgeted context upstream"""
+
+    async def test_payload_uses_context_window(self):
+        window = ContextWindow(budgets={"openai": 200})
+        agent = PollinationsAgent(max_history=20, context_window=window)
+        payloads = []
+
+        async def fake_completion(payload, tool_type):
+            payloads.append(payload)
+            yield "ok"
+
+        agent._cached_completion = fake_completion
+        for i in range(10):
+            await agent._add_to_history_bounded(f"q{i} " + "bla " * 50, f"a{i} " + "bla " * 50)
+
+        chunks = [c async for c in agent.generate_text_stream("oi", model="openai", system_prompt="sys")]
+        assert chunks == ["ok"]
+        messages = payloads[0]["messages"]
+        assert messages[0] == {"role": "system", "content": "sys"}
+        assert messages[-1] == {"role": "user", "content": "oi"}
+        assert prompt_tokens(messages) <= 200
+        assert window.stats()["requests"] == 1
+        await agent.close()
@@ -0,0 +1,54 @@
+"""
+Tests for the fake Pollinations upstream used by the load tests
+Run with: pytest test_fake_upstream.py
+"""
+import pytest
+from agent import PollinationsAgent
+from fake_upstream import FakeUpstream, FakeUpstreamConfig
+from resilience import UpstreamError
+
+
+async def collect(agent, model="openai"):
+    payload = {"model": model, "messages": [{"role": "user", "content": "oi"}], "stream": True}
+    return [chunk async for chunk in agent._request_completion(payload)]
+
+
+@pytest.mark.asyncio
+class TestFakeUpstream:
+    """Test streaming, keep-alive and injected failures"""
+
+    async def test_streams_deltas_over_one_connection(self):
+        upstream = FakeUpstream(FakeUpstreamConfig(tokens=12, token_rate=0, chunk_tokens=5, latency_ms=0))
+        agent = PollinationsAgent()
+        agent.BASE_URL_TEXT = await upstream.start()
+        try:
+            for _ in range(3):
+                chunks = await collect(agent)
+                assert len(chunks) == 3
+                assert len("".join(chunks).split()) == 12
+            assert agent.client._transport.connection_counts()["total"] == 1
+        finally:
+            await agent.close()
+            await upstream.stop()
+        assert upstream.stats()["streams"] == 3
+
+    async def test_injected_errors_and_drops(self):
+        agent = PollinationsAgent()
+        upstream = FakeUpstream(FakeUpstreamConfig(tokens=10, token_rate=0, latency_ms=0, error_rate=1.0))
+        agent.BASE_URL_TEXT = await upstream.start()
+        try:
+            with pytest.raises(UpstreamError) as error:
+                await collect(agent)
+            assert error.value.status_code == 500
+        finally:
+            await upstream.stop()
+
+        upstream = FakeUpstream(FakeUpstreamConfig(tokens=10, token_rate=0, latency_ms=0, drop_rate=1.0))
+        agent.BASE_URL_TEXT = await upstream.start()
+        try:
+            with pytest.raises(Exception):
+                await collect(agent)
+            assert upstream.stats()["drops_injected"] == 1
+        finally:
+            await agent.close()
+            await upstream.stop()
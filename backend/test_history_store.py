@@ -0,0 +1,248 @@
+"""
+Tests for the pluggable history stores
+Run with: pytest test_history_store.py
+"""
+import hashlib
+import pytest
+import pytest_asyncio
+from agent import PollinationsAgent
+from fake_upstream import LocalServer
+from history_store import (
+    InMemoryHistoryStore,
+    RedisHistoryStore,
+    SQLiteHistoryStore,
+    create_history_store,
+    encode_command,
+    read_reply,
+)
+
+
+class FakeRedisServer(LocalServer):
+    """
+    Minimal Redis-protocol server supporting the list commands we use.
+    Scripts are not interpreted: EVAL runs a Python copy of the store's
+    APPEND_SCRIPT.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.lists = {}
+        self.strings = {}
+        self.scripts = set()
+        self.commands = []
+        self.writes = 0
+
+    @staticmethod
+    def _reply(value) -> bytes:
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, bytes):
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(b"$%d\r\n%s\r\n" % (len(v), v) for v in value)
+        return b"+%s\r\n" % value.encode()
+
+    @staticmethod
+    def _slice(items, start, stop):
+        n = len(items)
+        start = max(start + n if start < 0 else start, 0)
+        stop = stop + n if stop < 0 else stop
+        return items[start:stop + 1]
+
+    def _execute(self, name, args) -> bytes:
+        key = args[0] if args else None
+        if name == "RPUSH":
+            self.lists.setdefault(key, []).extend(args[1:])
+            return self._reply(len(self.lists[key]))
+        if name == "LRANGE":
+            return self._reply(self._slice(self.lists.get(key, []), int(args[1]), int(args[2])))
+        if name == "LTRIM":
+            self.lists[key] = self._slice(self.lists.get(key, []), int(args[1]), int(args[2]))
+            return self._reply("OK")
+        if name == "DEL":
+            deleted = [k for k in args if self.lists.pop(k, None) is not None or self.strings.pop(k, None) is not None]
+            return self._reply(len(deleted))
+        if name == "GET":
+            return self._reply(self.strings.get(key))
+        if name == "SET":
+            self.strings[key] = args[1]
+            return self._reply("OK")
+        if name == "EXPIRE":
+            return self._reply(1)
+        if name in ("EVAL", "EVALSHA"):
+            if name == "EVAL":
+                self.scripts.add(hashlib.sha1(args[0]).hexdigest())
+            elif args[0].decode() not in self.scripts:
+                return b"-NOSCRIPT No matching script\r\n"
+            return self._reply(self._append_script(args[2:4], args[4:]))
+        return b"-ERR unknown command\r\n"
+
+    def _append_script(self, keys, argv):
+        history, pending = keys
+        max_messages, keep_trimmed = int(argv[0]), argv[2] == b"1"
+        self.lists.setdefault(history, []).extend(argv[3:])
+        trimmed = self._slice(self.lists[history], 0, -max_messages - 1)
+        self.lists[history] = self._slice(self.lists[history], -max_messages, -1)
+        if keep_trimmed and trimmed:
+            self.lists.setdefault(pending, []).extend(trimmed)
+        return trimmed
+
+    async def serve(self, reader, writer):
+        queued = None
+        while True:
+            try:
+                command = await read_reply(reader)
+            except ConnectionError:
+                # Closed by the client
+                return
+            name, *args = command
+            name = name.decode().upper()
+            self.commands.append(name)
+            if name == "MULTI":
+                queued, reply = [], self._reply("OK")
+            elif name == "EXEC":
+                replies = [self._execute(n, a) for n, a in queued]
+                queued, reply = None, b"*%d\r\n" % len(replies) + b"".join(replies)
+            elif queued is not None:
+                queued.append((name, args))
+                reply = self._reply("QUEUED")
+            else:
+                reply = self._execute(name, args)
+            writer.write(reply)
+            # Count flushes: a pipelined batch arrives in one read
+            if not reader._buffer:
+                self.writes += 1
+                await writer.drain()
+
+
+@pytest_asyncio.fixture
+async def redis_server(serve):
+    return await serve(FakeRedisServer())
+
+
+async def _exercise_store(store):
+    assert await store.load("s1", 10) == []
+    assert await store.append("s1", [{"role": "user", "content": "oi"}, {"role": "assistant", "content": "olá"}], 4) == []
+    await store.append("s1", [{"role": "user", "content": "q2"}, {"role": "assistant", "content": "a2"}], 4)
+    trimmed = await store.append("s1", [{"role": "user", "content": "q3"}, {"role": "assistant", "content": "a3"}], 4)
+    assert trimmed == [{"role": "user", "content": "oi"}, {"role": "assistant", "content": "olá"}]
+    history = await store.load("s1", 10)
+    assert [m["content"] for m in history] == ["q2", "a2", "q3", "a3"]
+    assert [m["content"] for m in await store.load("s1", 2)] == ["q3", "a3"]
+    assert await store.load("s2", 10) == []
+
+    assert await store.load_summary("s1") is None
+    await store.save_summary("s1", "O usuário disse oi.")
+    await store.save_summary("s1", "O usuário disse oi e olá.")
+    summary, history = await store.load_with_summary("s1", 2)
+    assert summary == "O usuário disse oi e olá."
+    assert [m["content"] for m in history] == ["q3", "a3"]
+    assert await store.load_with_summary("s2", 2) == (None, [])
+
+    assert await store.load_pending("s1") == []
+    trimmed = await store.append("s1", [{"role": "user", "content": "q4"}], 4, keep_trimmed=True)
+    assert trimmed == [{"role": "user", "content": "q2"}]
+    await store.append("s1", [{"role": "assistant", "content": "a4"}], 4, keep_trimmed=True)
+    # Pending messages stay until a summary covering them is saved
+    assert [m["content"] for m in await store.load_pending("s1")] == ["q2", "a2"]
+    await store.append("s1", [{"role": "user", "content": "q5"}], 4, keep_trimmed=True)
+    await store.save_summary("s1", "Resumo até a2.", summarized=2)
+    assert await store.load_summary("s1") == "Resumo até a2."
+    assert [m["content"] for m in await store.load_pending("s1")] == ["q3"]
+
+    await store.clear("s1")
+    assert await store.load("s1", 10) == []
+    assert await store.load_summary("s1") is None
+    assert await store.load_pending("s1") == []
+
+
+@pytest.mark.asyncio
+class TestHistoryStores:
+    """Every backend must behave the same"""
+
+    async def test_in_memory(self):
+        await _exercise_store(InMemoryHistoryStore())
+
+    async def test_sqlite(self, tmp_path):
+        store = SQLiteHistoryStore(str(tmp_path / "history.db"))
+        try:
+            await _exercise_store(store)
+        finally:
+            await store.close()
+
+    async def test_sqlite_shared_between_instances(self, tmp_path):
+        path = str(tmp_path / "history.db")
+        a, b = SQLiteHistoryStore(path), SQLiteHistoryStore(path)
+        try:
+            await a.append("s1", [{"role": "user", "content": "oi"}], 10)
+            assert await b.load("s1", 10) == [{"role": "user", "content": "oi"}]
+            # Turns waiting for the summary are visible to every worker
+            await a.append("s1", [{"role": "assistant", "content": "olá"}], 1, keep_trimmed=True)
+            assert await b.load_pending("s1") == [{"role": "user", "content": "oi"}]
+        finally:
+            await a.close()
+            await b.close()
+
+    async def test_redis(self, redis_server):
+        store = RedisHistoryStore(port=redis_server.port)
+        try:
+            await _exercise_store(store)
+        finally:
+            await store.close()
+
+    async def test_redis_append_is_one_round_trip(self, redis_server):
+        store = RedisHistoryStore(port=redis_server.port)
+        try:
+            await store.append("s1", [{"role": "user", "content": "oi"}], 10)
+            # The script is sent once, then only its hash
+            assert redis_server.commands == ["EVALSHA", "EVAL"]
+            redis_server.commands.clear()
+            writes = redis_server.writes
+            await store.append("s1", [{"role": "assistant", "content": "olá"}], 1, keep_trimmed=True)
+            assert redis_server.commands == ["EVALSHA"]
+            assert redis_server.writes == writes + 1
+            assert await store.load_pending("s1") == [{"role": "user", "content": "oi"}]
+        finally:
+            await store.close()
+
+    async def test_agent_uses_shared_store(self, redis_server):
+        store = RedisHistoryStore(port=redis_server.port)
+        first = PollinationsAgent(history_store=store, session_id="abc")
+        second = PollinationsAgent(history_store=store, session_id="abc")
+        try:
+            await first._add_to_history_bounded("oi", "olá")
+            assert len(await second.get_history()) == 2
+            await second.clear_history()
+            assert await first.get_history() == []
+        finally:
+            await first.close()
+            await second.close()
+            await store.close()
+
+
+class TestHistoryStoreConfig:
+    """Test store construction from URLs"""
+
+    def test_memory_url(self):
+        assert create_history_store(None) is None
+        assert create_history_store("memory://") is None
+
+    def test_sqlite_url(self):
+        store = create_history_store("sqlite:////tmp/history.db")
+        assert isinstance(store, SQLiteHistoryStore)
+        assert store.path == "/tmp/history.db"
+        store._executor.shutdown()
+
+    def test_redis_url(self):
+        store = create_history_store("redis://:secret@cache:6380/2")
+        assert isinstance(store, RedisHistoryStore)
+        assert (store.host, store.port, store.db, store.password) == ("cache", 6380, 2, "secret")
+
+    def test_unknown_url(self):
+        with pytest.raises(ValueError):
+            create_history_store("mongodb://localhost")
+
+    def test_encode_command(self):
+        assert encode_command("LRANGE", "k", -2, -1) == b"*4\r\n$6\r\nLRANGE\r\n$1\r\nk\r\n$2\r\n-2\r\n$2\r\n-1\r\n"
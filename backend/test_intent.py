@@ -0,0 +1,93 @@
+"""
+Tests for the optional intent classifier
+Run with: pytest test_intent.py
+"""
+import os
+import pytest
+import intent
+from intent import (
+    ClassifierRouter, IntentClassifier, hashed_features, load_corpus, load_intent_router, numpy_available
+)
+from tool_router import ToolRouter
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "routing_corpus.jsonl")
+
+needs_numpy = pytest.mark.skipif(not numpy_available(), reason="numpy is not installed")
+
+
+class TestFeatures:
+    """Test hashed features"""
+
+    def test_stable_and_bounded(self):
+        features = hashed_features("Crie uma IMAGEM", dim=1024)
+        assert features == hashed_features("crie uma imagem", dim=1024)
+        assert all(0 <= f < 1024 for f in features)
+        # 3 words, 2 bigrams, 15 char trigrams of " crie uma imagem "
+        assert len(features) == 3 + 2 + 15
+
+    def test_empty_message(self):
+        assert hashed_features("   ") == []
+
+    def test_falls_back_to_keywords_without_numpy(self, monkeypatch):
+        monkeypatch.setattr(intent, "np", None)
+        keywords = ToolRouter()
+        assert load_intent_router("missing.npz", keywords) is keywords
+
+
+@needs_numpy
+class TestIntentClassifier:
+    """Test training, persistence and the confidence fallback"""
+
+    @pytest.fixture(scope="class")
+    def model(self):
+        return IntentClassifier.train(load_corpus(CORPUS_PATH), dim=1 << 14)
+
+    def test_fits_corpus(self, model):
+        samples = load_corpus(CORPUS_PATH)
+        report = intent.evaluate(model, samples)
+        assert report["accuracy"] >= 0.95
+        assert report["accuracy_with_fallback"] >= 0.95
+
+    def test_scores_are_probabilities(self, model):
+        scores = model.scores("desenhe um gato")
+        assert set(scores) == set(model.classes)
+        assert sum(scores.values()) == pytest.approx(1.0)
+        tool, confidence = model.predict("desenhe um gato")
+        assert tool == "image_generation"
+        assert confidence == pytest.approx(scores[tool])
+
+    def test_save_load_and_export(self, model, tmp_path):
+        path = str(tmp_path / "model.npz")
+        model.save(path)
+        loaded = IntentClassifier.load(path)
+        assert loaded.predict("pesquise notícias") == model.predict("pesquise notícias")
+
+        exported = str(tmp_path / "model16.npz")
+        loaded.save(exported, dtype=intent.np.float16)
+        assert os.path.getsize(exported) < os.path.getsize(path)
+        assert IntentClassifier.load(exported).predict("pesquise notícias")[0] == "search"
+
+    def test_low_confidence_uses_keywords(self, model):
+        keywords = ToolRouter()
+        router = ClassifierRouter(model, keywords, min_confidence=1.01)
+        assert router.route("draw a cat") == "image_generation"
+        assert (router.classified, router.fallbacks) == (0, 1)
+
+        router = ClassifierRouter(model, keywords, min_confidence=0.0)
+        router.route("draw a cat")
+        assert router.classified == 1
+
+    def test_load_intent_router(self, model, tmp_path):
+        path = str(tmp_path / "model.npz")
+        model.save(path)
+        keywords = ToolRouter()
+        assert isinstance(load_intent_router(path, keywords), ClassifierRouter)
+        assert load_intent_router(str(tmp_path / "missing.npz"), keywords) is keywords
+
+        # A class the agent has no tool for would fail every message routed to it
+        model.classes[0], original = "translation", model.classes[0]
+        try:
+            model.save(path)
+        finally:
+            model.classes[0] = original
+        assert load_intent_router(path, keywords) is keywords
@@ -0,0 +1,248 @@
+"""
+Tests for background chat jobs: queue, pub/sub channels and the broker
+Run with: pytest test_jobs.py
+"""
+import asyncio
+import pytest
+import pytest_asyncio
+from jobs import (
+    Job, JobBrokerServer, JobError, JobWorker, MemoryJobBroker, RemoteJobBroker, create_job_broker, main
+)
+
+
+class FakeRun:
+    """Stands in for main.run_job: numbered text chunks, then done"""
+
+    def __init__(self, chunks=5, delay=0.0, fail_at=None):
+        self.chunks = chunks
+        self.delay = delay
+        self.fail_at = fail_at
+        self.closed = asyncio.Event()
+
+    async def __call__(self, job):
+        try:
+            for i in range(self.chunks):
+                if i == self.fail_at:
+                    raise RuntimeError("upstream falhou")
+                await asyncio.sleep(self.delay)
+                yield {"type": "text_chunk", "content": f"{job.request['message']}-{i}"}
+            yield {"type": "done"}
+        finally:
+            self.closed.set()
+
+
+async def collect(events):
+    return [item async for item in events]
+
+
+@pytest_asyncio.fixture
+async def remote():
+    server = JobBrokerServer(MemoryJobBroker())
+    url = await server.start(port=0)
+    yield server, create_job_broker(url)
+    await server.stop()
+
+
+@pytest.mark.asyncio
+class TestMemoryJobBroker:
+    """Test the queue, fan-out, replay and cancellation in one process"""
+
+    async def test_fan_out_and_replay(self):
+        broker = MemoryJobBroker()
+        worker = JobWorker(broker, FakeRun(chunks=3, delay=0.01), concurrency=2)
+        job = Job("sessao", {"message": "oi"})
+        await broker.submit(job)
+        viewers = [asyncio.ensure_future(collect(await broker.subscribe(job.id))) for _ in range(2)]
+        worker.start()
+        try:
+            first, second = await asyncio.wait_for(asyncio.gather(*viewers), 1)
+        finally:
+            await worker.stop()
+        assert first == second
+        assert [seq for seq, _ in first] == [1, 2, 3, 4]
+        assert first[-1][1] == {"type": "done"}
+        # A late viewer replays what it missed
+        assert await collect(await broker.subscribe(job.id, after=2)) == first[2:]
+        assert (await broker.get(job.id)).status == "completed"
+        stats = await broker.stats()
+        assert (stats["completed"], stats["viewers"], worker.stats()["processed"]) == (1, 0, 1)
+
+    async def test_cancel_running_and_queued_jobs(self):
+        broker = MemoryJobBroker()
+        run = FakeRun(chunks=1000, delay=0.01)
+        worker = JobWorker(broker, run, concurrency=1)
+        running, queued = Job("s", {"message": "a"}), Job("s", {"message": "b"})
+        await broker.submit(running)
+        await broker.submit(queued)
+        worker.start()
+        try:
+            events = await broker.subscribe(running.id)
+            await events.__anext__()
+            assert await broker.cancel(queued.id)
+            assert await broker.cancel(running.id)
+            rest = await asyncio.wait_for(collect(events), 1)
+            await asyncio.wait_for(run.closed.wait(), 1)
+        finally:
+            await worker.stop()
+        assert rest[-1][1] == {"type": "cancelled"}
+        assert (await broker.get(running.id)).status == "cancelled"
+        assert await collect(await broker.subscribe(queued.id)) == [(1, {"type": "cancelled"})]
+        assert not await broker.cancel(running.id)
+        assert worker.stats()["processed"] == 1
+
+    async def test_failure_queue_limit_and_expiry(self):
+        broker = MemoryJobBroker(max_queued=1, max_events=2, retain_seconds=0.05)
+        job = Job("s", {"message": "x"})
+        await broker.submit(job)
+        with pytest.raises(JobError) as full:
+            await broker.submit(Job("s", {"message": "y"}))
+        assert full.value.status == 503
+
+        claimed = await broker.claim()
+        assert claimed is job and job.status == "running"
+        await broker.publish(job.id, FakeRun(chunks=5, fail_at=3)(job))
+        assert job.status == "failed"
+        events = await collect(await broker.subscribe(job.id, after=3))
+        assert events[-1][1]["type"] == "error"
+        with pytest.raises(JobError) as gone:
+            await broker.subscribe(job.id)
+        assert gone.value.status == 410
+
+        await asyncio.sleep(0.1)
+        assert await broker.get(job.id) is None
+        with pytest.raises(JobError) as expired:
+            await broker.subscribe(job.id)
+        assert expired.value.status == 404
+
+    async def test_cancelled_queued_job_frees_its_slot(self):
+        broker = MemoryJobBroker(max_queued=1)
+        job = Job("s", {"message": "x"})
+        await broker.submit(job)
+        assert await broker.cancel(job.id)
+        await broker.submit(Job("s", {"message": "y"}))
+        assert (await broker.claim()).request == {"message": "y"}
+
+    async def test_lapsed_claim_is_requeued_then_failed(self):
+        broker = MemoryJobBroker(claim_timeout=0.02, max_claims=2)
+        job = Job("s", {"message": "x"})
+        await broker.submit(job)
+        await broker.claim()
+        await asyncio.sleep(0.05)
+        # The worker never published: the job is up for grabs again
+        assert job.status == "queued"
+        assert await asyncio.wait_for(broker.claim(), 1) is job and job.claims == 2
+        await asyncio.sleep(0.05)
+        assert job.status == "failed"
+        events = await collect(await broker.subscribe(job.id))
+        assert events[-1][1]["type"] == "error"
+        with pytest.raises(JobError) as late:
+            await broker.publish(job.id, FakeRun()(job))
+        assert late.value.status == 409
+
+    async def test_worker_survives_failing_runs(self):
+        broker = MemoryJobBroker()
+
+        def run(job):
+            if job.request["message"] == "quebra":
+                raise ValueError("pedido inválido")
+            return FakeRun(chunks=1)(job)
+
+        worker = JobWorker(broker, run, concurrency=1)
+        broken, fine = Job("s", {"message": "quebra"}), Job("s", {"message": "ok"})
+        await broker.submit(broken)
+        await broker.submit(fine)
+        worker.start()
+        try:
+            events = await asyncio.wait_for(collect(await broker.subscribe(fine.id)), 1)
+        finally:
+            await worker.stop()
+        assert events[-1][1] == {"type": "done"}
+        assert await collect(await broker.subscribe(broken.id)) == [(1, {"type": "error", "message": "pedido inválido"})]
+        assert (broken.status, worker.stats()["processed"]) == ("failed", 2)
+
+
+@pytest.mark.asyncio
+class TestBrokerServer:
+    """Test API front-ends and workers sharing a broker process over TCP"""
+
+    async def test_remote_workers_and_viewers(self, remote):
+        server, broker = remote
+        # The broker client holds no state: workers and front-ends can share it
+        worker = JobWorker(broker, FakeRun(chunks=3, delay=0.01), concurrency=2)
+        worker.start()
+        try:
+            jobs = [Job("s", {"message": f"m{i}"}) for i in range(3)]
+            for job in jobs:
+                await broker.submit(job)
+            results = await asyncio.wait_for(
+                asyncio.gather(*[collect(await broker.subscribe(job.id)) for job in jobs]), 2
+            )
+        finally:
+            await worker.stop()
+        for job, events in zip(jobs, results):
+            assert [event["content"] for _, event in events[:3]] == [f"{job.request['message']}-{i}" for i in range(3)]
+            assert events[-1] == (4, {"type": "done"})
+            assert (await broker.get(job.id)).status == "completed"
+        stats = await broker.stats()
+        assert stats["completed"] == 3 and stats["backend"].startswith("broker://")
+        with pytest.raises(JobError) as missing:
+            await broker.subscribe("desconhecido")
+        assert missing.value.status == 404
+
+    async def test_cancel_reaches_remote_worker(self, remote):
+        server, broker = remote
+        run = FakeRun(chunks=1000, delay=0.01)
+        worker = JobWorker(broker, run, concurrency=1)
+        worker.start()
+        try:
+            job = Job("s", {"message": "longo"})
+            await broker.submit(job)
+            events = await broker.subscribe(job.id)
+            await events.__anext__()
+            assert await broker.cancel(job.id)
+            rest = await asyncio.wait_for(collect(events), 1)
+            # The worker's agent stream is closed, not left running
+            await asyncio.wait_for(run.closed.wait(), 1)
+        finally:
+            await worker.stop()
+        assert rest[-1][1] == {"type": "cancelled"}
+        assert (await broker.get(job.id)).status == "cancelled"
+
+    async def test_worker_error_and_disconnect_fail_the_job(self, remote):
+        server, broker = remote
+        job = Job("s", {"message": "x"})
+        await broker.submit(job)
+        claimed = await broker.claim()
+        await broker.publish(claimed.id, FakeRun(chunks=3, fail_at=1)(claimed))
+        events = await collect(await broker.subscribe(job.id))
+        assert events[-1][1] == {"type": "error", "message": "upstream falhou"}
+        assert (await broker.get(job.id)).status == "failed"
+
+        job = Job("s", {"message": "y"})
+        await broker.submit(job)
+        await broker.claim()
+        publisher = asyncio.ensure_future(broker.publish(job.id, FakeRun(chunks=1000, delay=0.01)(job)))
+        events = await broker.subscribe(job.id)
+        await events.__anext__()
+        publisher.cancel()
+        rest = await asyncio.wait_for(collect(events), 1)
+        assert rest[-1][1]["type"] == "error"
+        assert (await broker.get(job.id)).status == "failed"
+
+
+class TestJobBrokerConfig:
+    """Test backend selection from JOB_QUEUE_URL"""
+
+    def test_urls(self):
+        assert create_job_broker(None) is None
+        assert isinstance(create_job_broker("memory://"), MemoryJobBroker)
+        broker = create_job_broker("broker://10.0.0.5:7800")
+        assert isinstance(broker, RemoteJobBroker) and (broker.host, broker.port) == ("10.0.0.5", 7800)
+        with pytest.raises(ValueError):
+            create_job_broker("amqp://localhost")
+
+    def test_remote_worker_refuses_in_memory_history(self, monkeypatch):
+        monkeypatch.delenv("HISTORY_STORE_URL", raising=False)
+        with pytest.raises(SystemExit) as refused:
+            main(["worker", "--broker", "broker://127.0.0.1:7700"])
+        assert refused.value.code == 2
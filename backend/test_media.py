@@ -0,0 +1,272 @@
+"""
+Tests for the image prefetch pipeline and the on-disk media cache
+Run with: pytest test_media.py
+"""
+import asyncio
+import os
+import random
+import pytest
+import pytest_asyncio
+from agent import PollinationsAgent, ToolType
+from fake_upstream import FakeHTTPServer
+from media import (
+    ImagePipeline, MediaCache, RangeNotSatisfiable, image_variants, media_key, parse_range, parse_size,
+    sniff_content_type
+)
+from transport import create_upstream_client
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 40
+
+
+class FakeImageServer(FakeHTTPServer):
+    """Serves PNG bytes for any GET, slowly and in several writes"""
+
+    def __init__(self, body: bytes = PNG, delay: float = 0.0, status: int = 200):
+        super().__init__()
+        self.body = body
+        self.delay = delay
+        self.status = status
+        self.paths = []
+
+    async def respond(self, request, reader, writer):
+        self.paths.append(request.path)
+        await asyncio.sleep(self.delay)
+        if self.status != 200:
+            writer.write(f"HTTP/1.1 {self.status} Error\r\nContent-Length: 4\r\nConnection: close\r\n\r\ndown".encode())
+            return False
+        writer.write(
+            f"HTTP/1.1 200 OK\r\nContent-Type: image/png\r\nContent-Length: {len(self.body)}\r\n"
+            f"Connection: close\r\n\r\n".encode()
+        )
+        for i in range(0, len(self.body), 2048):
+            if i:
+                await asyncio.sleep(0.01)
+            writer.write(self.body[i:i + 2048])
+            await writer.drain()
+        return False
+
+
+@pytest_asyncio.fixture
+async def image_server(serve):
+    async def start(**kwargs):
+        return await serve(FakeImageServer(**kwargs))
+
+    return start
+
+
+class TestMediaCache:
+    """Test storage, LRU eviction and reload from disk"""
+
+    def test_put_get_and_evict_least_recently_used(self, tmp_path):
+        cache = MediaCache(str(tmp_path), max_bytes=250)
+        keys = [media_key(prompt=p) for p in "abc"]
+        cache.put(keys[0], b"x" * 100)
+        cache.put(keys[1], b"y" * 100)
+        assert cache.get(keys[0]) is not None  # keys[1] is now the oldest
+        cache.put(keys[2], b"z" * 100)
+        assert cache.get(keys[1]) is None
+        assert not os.path.exists(cache.path(keys[1]))
+        assert cache.get(keys[0]) and cache.get(keys[2])
+        assert cache.stats()["bytes"] == 200
+        assert cache.stats()["evictions"] == 1
+
+    def test_reload_from_disk(self, tmp_path):
+        key = media_key(prompt="gato", seed=1)
+        MediaCache(str(tmp_path)).put(key, PNG)
+        reloaded = MediaCache(str(tmp_path))
+        assert reloaded.stats()["entries"] == 1
+        with open(reloaded.get(key), "rb") as f:
+            assert f.read() == PNG
+
+    def test_keys_are_stable(self):
+        assert media_key(prompt="a", seed=1) == media_key(seed=1, prompt="a")
+        assert media_key(prompt="a", seed=1) != media_key(prompt="a", seed=2)
+
+    def test_sniff_content_type(self):
+        assert sniff_content_type(PNG[:12]) == "image/png"
+        assert sniff_content_type(b"\xff\xd8\xff\xe0") == "image/jpeg"
+        assert sniff_content_type(b"RIFF\x00\x00\x00\x00WEBP") == "image/webp"
+
+
+class TestParseRange:
+    """Test single byte range parsing"""
+
+    def test_ranges(self):
+        assert parse_range(None, 100) is None
+        assert parse_range("bytes=0-9", 100) == (0, 9)
+        assert parse_range("bytes=90-", 100) == (90, 99)
+        assert parse_range("bytes=-10", 100) == (90, 99)
+        assert parse_range("bytes=50-500", 100) == (50, 99)
+        # Multiple ranges and unknown units get the whole file
+        assert parse_range("bytes=0-1,5-6", 100) is None
+        assert parse_range("items=0-1", 100) is None
+
+    def test_unsatisfiable(self):
+        with pytest.raises(RangeNotSatisfiable):
+            parse_range("bytes=100-", 100)
+        with pytest.raises(RangeNotSatisfiable):
+            parse_range("bytes=5-2", 100)
+
+
+@pytest.mark.asyncio
+class TestImagePipeline:
+    """Test fetching into the cache with progress and shared downloads"""
+
+    async def test_fetch_reports_progress_then_serves_from_cache(self, image_server, tmp_path):
+        server = await image_server()
+        client = create_upstream_client()
+        pipeline = ImagePipeline(client, MediaCache(str(tmp_path)))
+        try:
+            key = media_key(prompt="gato", seed=7)
+            events = [e async for e in pipeline.fetch(key, server.url + "/prompt/gato", progress_interval=0)]
+            assert events[-1] == {"type": "image_ready", "url": f"/media/images/{key}", "cached": False}
+            progress = [e for e in events if e["type"] == "image_progress"]
+            assert progress and progress[-1]["received"] == len(PNG) and progress[-1]["percent"] == 100
+            with open(pipeline.cache.get(key), "rb") as f:
+                assert f.read() == PNG
+
+            events = [e async for e in pipeline.fetch(key, server.url + "/prompt/gato")]
+            assert events == [{"type": "image_ready", "url": f"/media/images/{key}", "cached": True}]
+            assert len(server.paths) == 1
+        finally:
+            await client.aclose()
+
+    async def test_concurrent_requests_share_one_download(self, image_server, tmp_path):
+        server = await image_server(delay=0.1)
+        client = create_upstream_client()
+        pipeline = ImagePipeline(client, MediaCache(str(tmp_path)))
+        try:
+            key = media_key(prompt="pato", seed=3)
+
+            async def consume():
+                return [e async for e in pipeline.fetch(key, server.url + "/prompt/pato")]
+
+            results = await asyncio.gather(*(consume() for _ in range(5)))
+            assert all(r[-1]["type"] == "image_ready" for r in results)
+            assert len(server.paths) == 1
+            assert pipeline.stats()["shared"] == 4
+        finally:
+            await client.aclose()
+
+    async def test_upstream_error(self, image_server, tmp_path):
+        server = await image_server(status=500)
+        client = create_upstream_client()
+        pipeline = ImagePipeline(client, MediaCache(str(tmp_path)))
+        try:
+            with pytest.raises(RuntimeError):
+                [e async for e in pipeline.fetch(media_key(prompt="x"), server.url + "/prompt/x")]
+            assert pipeline.stats()["failures"] == 1
+            assert pipeline.cache.stats()["entries"] == 0
+        finally:
+            await client.aclose()
+
+
+@pytest.mark.asyncio
+class TestAgentImagePipeline:
+    """Test image events when the agent has a pipeline"""
+
+    async def test_fixed_seed_repeat_is_cached(self, image_server, tmp_path):
+        server = await image_server()
+        agent = PollinationsAgent()
+        agent.image_pipeline = ImagePipeline(agent.client, MediaCache(str(tmp_path)))
+        agent.BASE_URL_IMAGE = server.url
+        try:
+            models = {"image_seed": "42"}
+            first = [e async for e in agent.process_message_stream("desenhe um gato", models, ToolType.IMAGE_GENERATION)]
+            second = [e async for e in agent.process_message_stream("desenhe um gato", models, ToolType.IMAGE_GENERATION)]
+            images = [next(e for e in events if e["type"] == "image") for events in (first, second)]
+            assert images[0]["url"].startswith("/media/images/")
+            assert images[0]["url"] == images[1]["url"]
+            assert (images[0]["cached"], images[1]["cached"]) == (False, True)
+            assert len(server.paths) == 1
+            assert "seed=42" in server.paths[0]
+        finally:
+            await agent.close()
+
+    async def test_falls_back_to_upstream_url(self, image_server, tmp_path):
+        server = await image_server(status=503)
+        agent = PollinationsAgent()
+        agent.image_pipeline = ImagePipeline(agent.client, MediaCache(str(tmp_path)))
+        agent.BASE_URL_IMAGE = server.url
+        try:
+            events = [e async for e in agent.process_message_stream("desenhe um gato", tool_type=ToolType.IMAGE_GENERATION)]
+            image = next(e for e in events if e["type"] == "image")
+            assert image["url"].startswith(server.url)
+        finally:
+            await agent.close()
+
+
+class TestImageVariants:
+    """Test expansion of batch options into variants"""
+
+    def test_cartesian_product(self):
+        variants = image_variants("flux", seeds=[1, 2], models=["flux", "turbo"], sizes=["512x768"])
+        assert len(variants) == 4
+        assert {(v["model"], v["seed"]) for v in variants} == {("flux", 1), ("flux", 2), ("turbo", 1), ("turbo", 2)}
+        assert all((v["width"], v["height"]) == (512, 768) for v in variants)
+
+    def test_random_seeds_and_limits(self):
+        variants = image_variants("flux", count=3, rng=random.Random(0))
+        assert len({v["seed"] for v in variants}) == 3
+        assert all(v["model"] == "flux" for v in variants)
+        with pytest.raises(ValueError):
+            image_variants("flux", seeds=[1, 2, 3], sizes=["512x512", "1024x1024"], max_variants=4)
+        with pytest.raises(ValueError):
+            parse_size("10x10")
+        assert parse_size("768X512") == (768, 512)
+
+
+@pytest.mark.asyncio
+class TestImageBatch:
+    """Test bounded, as-completed fan-out of image variants"""
+
+    async def test_previews_first_and_bounded_concurrency(self):
+        agent = PollinationsAgent()
+        agent.IMAGE_BATCH_CONCURRENCY = 2
+        running = 0
+        peak = 0
+        calls = []
+
+        async def fake_generate(prompt, model="flux", width=1024, height=1024, seed=None):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            calls.append((seed, width))
+            await asyncio.sleep(0.02)
+            running -= 1
+            return f"http://img/{seed}/{width}"
+
+        agent.generate_image = fake_generate
+        variants = image_variants("flux", seeds=[1, 2, 3])
+        events = [e async for e in agent.process_message_stream(
+            "desenhe um gato", tool_type=ToolType.IMAGE_GENERATION, image_variants=variants
+        )]
+        assert events[2]["type"] == "image_batch"
+        assert [v["variant"] for v in events[2]["variants"]] == [0, 1, 2]
+        kinds = [e["type"] for e in events if e["type"] in ("image", "image_preview")]
+        assert kinds == ["image_preview"] * 3 + ["image"] * 3
+        assert peak == 2
+        # Previews keep the aspect ratio at a fraction of the size
+        assert sorted(w for _, w in calls) == [256] * 3 + [1024] * 3
+
+        history = await agent.get_history()
+        assert history[1]["content"].count("Variação") == 3
+        await agent.close()
+
+    async def test_streams_as_completed_and_reports_failures(self):
+        agent = PollinationsAgent()
+        delays = {1: 0.15, 2: 0.01, 3: 0.05}
+
+        async def fake_generate(prompt, model="flux", width=1024, height=1024, seed=None):
+            await asyncio.sleep(delays[seed])
+            if seed == 3:
+                raise RuntimeError("falhou")
+            return f"http://img/{seed}"
+
+        agent.generate_image = fake_generate
+        events = [e async for e in agent._image_batch_events(
+            "gato", image_variants("flux", seeds=[1, 2, 3]), preview=False
+        )]
+        assert [(e["type"], e["variant"]) for e in events[1:]] == [("image", 1), ("image_error", 2), ("image", 0)]
+        assert events[2]["preview"] is False
+        await agent.close()
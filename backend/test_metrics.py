@@ -0,0 +1,86 @@
+"""
+Tests for the /chat latency histograms and their Prometheus rendering
+Run with: pytest test_metrics.py
+"""
+import pytest
+from agent import PollinationsAgent, ToolType
+from fake_upstream import FakeUpstream, FakeUpstreamConfig
+from metrics import ChatMetrics, Histogram, current_upstream_timing
+
+
+class TestHistogram:
+    """Test bucketing and the text exposition format"""
+
+    def test_cumulative_buckets_sum_and_count(self):
+        histogram = Histogram("demo_seconds", "Demo", (0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, "text", 'mo"del')
+        lines = histogram.render()
+        assert lines[:2] == ["# HELP demo_seconds Demo", "# TYPE demo_seconds histogram"]
+        assert lines[2:] == [
+            'demo_seconds_bucket{tool="text",model="mo\\"del",le="0.1"} 2',
+            'demo_seconds_bucket{tool="text",model="mo\\"del",le="1.0"} 3',
+            'demo_seconds_bucket{tool="text",model="mo\\"del",le="+Inf"} 4',
+            'demo_seconds_sum{tool="text",model="mo\\"del"} 3.65',
+            'demo_seconds_count{tool="text",model="mo\\"del"} 4',
+        ]
+
+
+@pytest.mark.asyncio
+class TestChatMetrics:
+    """Test what an upstream stream and a /chat request record"""
+
+    async def test_upstream_stream_is_measured_by_tool_and_model(self, serve):
+        # Five deltas, 5 ms apart
+        server = await serve(FakeUpstream(FakeUpstreamConfig(tokens=5, token_rate=200, latency_ms=0)))
+        metrics = ChatMetrics()
+        agent = PollinationsAgent(metrics=metrics)
+        agent.BASE_URL_TEXT = server.url
+        try:
+            events = [e async for e in agent.process_message_stream(
+                "olá", {"search": "searchgpt"}, ToolType.SEARCH
+            )]
+            assert sum(e["type"] == "text_chunk" for e in events) == 5
+        finally:
+            await agent.close()
+
+        labels = ("search", "searchgpt")
+        for histogram in (metrics.pool_wait, metrics.ttfb, metrics.ttft, metrics.tokens_per_second):
+            assert histogram.series(*labels).count == 1, histogram.name
+        assert metrics.inter_token.series(*labels).count == 4
+        # Headers arrive before the first delta
+        assert metrics.ttfb.series(*labels).sum <= metrics.ttft.series(*labels).sum
+        assert 'upstream_ttft_seconds_count{tool="search",model="searchgpt"} 1' in metrics.render()
+
+    async def test_timing_is_unset_when_the_stream_ends(self):
+        async def upstream():
+            yield "a"
+            yield "b"
+
+        metrics = ChatMetrics()
+        seen = [current_upstream_timing() async for _ in metrics.observe_stream("text", "openai", upstream())]
+        assert all(timing is seen[0] for timing in seen) and seen[0] is not None
+        # e.g. a summary request later in the same task is not timed into it
+        assert current_upstream_timing() is None
+
+        stream = metrics.observe_stream("text", "openai", upstream())
+        await stream.__anext__()
+        await stream.aclose()
+        assert current_upstream_timing() is None
+
+    async def test_trace_labels_request_with_selected_tool(self):
+        metrics = ChatMetrics()
+        trace = metrics.trace()
+        trace.routed("text_generation", 0.002)
+
+        async def events():
+            yield {"type": "tool_selection", "tool_type": "text_generation", "model": "openai"}
+            yield {"type": "text_chunk", "content": "oi"}
+
+        assert len([e async for e in trace.events(events())]) == 2
+        trace.wrote(120)
+        trace.wrote(30)
+        trace.finish("completed")
+        assert metrics.routing.series("text_generation").count == 1
+        assert metrics.stream_duration.series("text_generation", "openai").count == 1
+        assert metrics.sse_bytes.series("text_generation", "openai").sum == 150
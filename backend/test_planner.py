@@ -0,0 +1,161 @@
+"""
+Tests for compound request planning and concurrent tool execution
+Run with: pytest test_planner.py
+"""
+import asyncio
+import time
+import pytest
+from agent import PollinationsAgent
+from planner import ToolPlanner
+from tool_router import ToolRouter
+
+
+def plan(message):
+    return [(s.id, s.tool, s.prompt, s.depends_on) for s in ToolPlanner(ToolRouter()).plan(message)]
+
+
+class TestToolPlanner:
+    """Test clause splitting and dependencies"""
+
+    def test_single_tool(self):
+        assert plan("olá, tudo bem?") == [("text_generation-1", "text_generation", "olá, tudo bem?", None)]
+        # Clauses without a tool of their own stay with the previous one
+        assert plan("pesquise sobre gatos e cachorros") == [
+            ("search-1", "search", "pesquise sobre gatos e cachorros", None)
+        ]
+
+    def test_same_tool_clauses_merge(self):
+        assert plan("draw a cat and a dog picture") == [
+            ("image_generation-1", "image_generation", "draw a cat and a dog picture", None)
+        ]
+        assert plan("fale olá e diga tchau") == [
+            ("text_to_speech-1", "text_to_speech", "fale olá e diga tchau", None)
+        ]
+        assert len(plan("qual a diferença entre fotos e imagens?")) == 1
+        assert len(plan("pesquise gatos e pesquise cachorros")) == 1
+
+    def test_independent_tools(self):
+        assert plan("desenhe um gato e diga olá") == [
+            ("image_generation-1", "image_generation", "desenhe um gato", None),
+            ("text_to_speech-1", "text_to_speech", "diga olá", None),
+        ]
+
+    def test_back_reference_in_image_uses_whole_request(self):
+        message = "search the latest news on Brazil and draw an image of it"
+        assert plan(message) == [
+            ("search-1", "search", "search the latest news on Brazil", None),
+            ("image_generation-1", "image_generation", message, None),
+        ]
+
+    def test_dependent_steps(self):
+        assert plan("pesquise as notícias de IA e depois analise profundamente o impacto") == [
+            ("search-1", "search", "pesquise as notícias de IA", None),
+            ("reasoning-1", "reasoning", "analise profundamente o impacto", "search-1"),
+        ]
+        assert plan("pesquise o clima em SP e leia isso em voz alta")[1][3] == "search-1"
+
+    def test_text_referring_back_to_search(self):
+        assert plan("search the latest news on rust and then summarize it") == [
+            ("search-1", "search", "search the latest news on rust", None),
+            ("text_generation-1", "text_generation", "summarize it", "search-1"),
+        ]
+        assert plan("pesquise gatos e resuma isso e leia isso em voz alta") == [
+            ("search-1", "search", "pesquise gatos", None),
+            ("text_generation-1", "text_generation", "resuma isso", "search-1"),
+            ("text_to_speech-1", "text_to_speech", "leia isso em voz alta", "text_generation-1"),
+        ]
+        # Without a back reference the clause is part of the search
+        assert plan("pesquise o clima e me explique") == [
+            ("search-1", "search", "pesquise o clima e me explique", None)
+        ]
+
+    def test_max_steps(self):
+        planner = ToolPlanner(ToolRouter(), max_steps=2)
+        steps = planner.plan("desenhe um gato e diga oi e pesquise notícias")
+        assert [s.tool for s in steps] == ["image_generation", "text_to_speech"]
+        assert steps[1].prompt == "diga oi e pesquise notícias"
+        assert planner.stats()["compound"] == 1
+
+
+@pytest.mark.asyncio
+class TestPlanExecution:
+    """Test multiplexed, concurrent execution in the agent"""
+
+    async def test_steps_run_concurrently_and_are_tagged(self):
+        agent = PollinationsAgent(planner=ToolPlanner(ToolRouter()))
+
+        async def fake_stream(payload):
+            await asyncio.sleep(0.2)
+            yield payload["messages"][-1]["content"].split()[-1]
+
+        agent._stream_completion = fake_stream
+        started = time.perf_counter()
+        events = [e async for e in agent.process_message_stream("analise profundamente cachorros e pesquise gatos e desenhe um pato")]
+        elapsed = time.perf_counter() - started
+
+        assert events[0]["type"] == "plan"
+        assert [s["id"] for s in events[0]["steps"]] == ["reasoning-1", "search-1", "image_generation-1"]
+        assert events[-1] == {"type": "done"}
+        tagged = events[1:-1]
+        assert all("tool_id" in e for e in tagged)
+        text = {e["tool_id"]: e["content"] for e in tagged if e["type"] == "text_chunk"}
+        assert text == {"reasoning-1": "cachorros", "search-1": "gatos"}
+        assert [e["tool_id"] for e in tagged if e["type"] == "tool_done"].count("image_generation-1") == 1
+        # Two 0.2 s completions in parallel, not one after the other
+        assert elapsed < 0.35
+
+        history = await agent.get_history()
+        assert history[1]["content"].startswith("cachorros\n\ngatos\n\nImagem gerada com sucesso!")
+        await agent.close()
+
+    async def test_dependent_step_gets_search_result(self):
+        agent = PollinationsAgent(planner=ToolPlanner(ToolRouter()))
+        payloads = []
+
+        async def fake_stream(payload):
+            payloads.append(payload)
+            yield "RESULTADO" if payload["model"] == "searchgpt" else "análise"
+
+        agent._stream_completion = fake_stream
+        events = [e async for e in agent.process_message_stream("pesquise notícias de IA e depois pense sobre o impacto")]
+        reasoning = [p for p in payloads if p["model"] != "searchgpt"][0]
+        assert "RESULTADO" in reasoning["messages"][-1]["content"]
+        order = [e["tool_id"] for e in events if e["type"] == "text_chunk"]
+        assert order == ["search-1", "reasoning-1"]
+        await agent.close()
+
+    async def test_failed_step_fails_dependants_only(self):
+        agent = PollinationsAgent(planner=ToolPlanner(ToolRouter()))
+
+        async def fake_stream(payload):
+            raise ConnectionError("down")
+            yield
+
+        agent._stream_completion = fake_stream
+        events = [e async for e in agent.process_message_stream("pesquise o clima e leia isso em voz alta e desenhe um sol")]
+        errors = {e["tool_id"]: e["message"] for e in events if e["type"] == "error"}
+        assert errors == {"search-1": "down", "text_to_speech-1": "A etapa search-1 falhou"}
+        assert any(e["type"] == "image" and e["tool_id"] == "image_generation-1" for e in events)
+        assert events[-1] == {"type": "done"}
+        await agent.close()
+
+    async def test_closing_stream_cancels_steps(self):
+        agent = PollinationsAgent(planner=ToolPlanner(ToolRouter()))
+        cancelled = asyncio.Event()
+
+        async def fake_stream(payload):
+            try:
+                await asyncio.sleep(10)
+                yield "never"
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        agent._stream_completion = fake_stream
+        stream = agent.process_message_stream("pesquise gatos e desenhe um pato")
+        async for event in stream:
+            if event["type"] == "image":
+                break
+        await stream.aclose()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await agent.close()
@@ -0,0 +1,177 @@
+"""
+Tests for retries, hedging and circuit breaking of upstream streams
+Run with: pytest test_resilience.py
+"""
+import asyncio
+import pytest
+import pytest_asyncio
+from agent import PollinationsAgent
+from fake_upstream import FakeHTTPServer
+from resilience import (
+    CircuitBreaker, CircuitOpenError, ResiliencePolicy, UpstreamError, UpstreamResilience
+)
+from transport import create_upstream_client
+
+
+class ScriptedUpstream(FakeHTTPServer):
+    """
+    Minimal Pollinations /openai endpoint. Each request gets the next
+    scripted reply: (status, delay before answering, text chunks).
+    """
+
+    def __init__(self, replies):
+        super().__init__()
+        self.replies = replies
+        self.aborted = 0
+
+    async def respond(self, request, reader, writer):
+        status, delay, chunks = self.replies[min(self.requests - 1, len(self.replies) - 1)]
+        try:
+            # Returns early (b"") if the client hangs up while we stall
+            if await asyncio.wait_for(reader.read(1), timeout=delay) == b"":
+                self.aborted += 1
+                return False
+        except asyncio.TimeoutError:
+            pass
+        if status != 200:
+            writer.write(f"HTTP/1.1 {status} Error\r\nContent-Length: 4\r\nConnection: close\r\n\r\ndown".encode())
+        else:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+            for chunk in chunks:
+                writer.write(self.sse_delta(chunk))
+            writer.write(b"data: [DONE]\n\n")
+        return False
+
+
+@pytest_asyncio.fixture
+async def upstream(serve):
+    async def start(replies):
+        return await serve(ScriptedUpstream(replies))
+
+    return start
+
+
+async def _ask(server, resilience):
+    agent = PollinationsAgent(client=create_upstream_client(), resilience=resilience)
+    agent.BASE_URL_TEXT = server.url
+    try:
+        return "".join([c async for c in agent.generate_text_stream("oi")])
+    finally:
+        await agent.client.aclose()
+
+
+class TestCircuitBreaker:
+    """Test breaker state transitions"""
+
+    def test_opens_after_threshold_and_half_opens(self, clock):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow()
+        assert breaker.retry_after() == 10
+
+        clock.now += 10
+        assert breaker.allow()  # The single trial request
+        assert not breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+
+        clock.now += 10
+        assert breaker.allow()
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.opened == 2
+
+    def test_success_resets_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+class TestRetries:
+    """Test retries before the first chunk only"""
+
+    async def test_retries_5xx_before_first_byte(self, upstream):
+        server = await upstream([(503, 0, []), (200, 0, ["Olá", "!"])])
+        resilience = UpstreamResilience(ResiliencePolicy(backoff_base=0.01))
+        assert await _ask(server, resilience) == "Olá!"
+        assert server.requests == 2
+        assert resilience.retries == 1
+
+    async def test_client_errors_are_not_retried(self, upstream):
+        server = await upstream([(400, 0, [])])
+        resilience = UpstreamResilience(ResiliencePolicy(backoff_base=0.01))
+        with pytest.raises(UpstreamError) as exc:
+            await _ask(server, resilience)
+        assert exc.value.status_code == 400
+        assert server.requests == 1
+
+    async def test_no_retry_after_first_chunk(self):
+        calls = []
+
+        async def flaky():
+            calls.append(1)
+            yield "partial"
+            raise UpstreamError(502)
+
+        resilience = UpstreamResilience(ResiliencePolicy(backoff_base=0.01))
+        received = []
+        with pytest.raises(UpstreamError):
+            async for chunk in resilience.stream("openai", flaky):
+                received.append(chunk)
+        assert received == ["partial"]
+        assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+class TestHedging:
+    """Test hedged requests against a slow upstream"""
+
+    async def test_slow_attempt_is_hedged_and_cancelled(self, upstream):
+        server = await upstream([(200, 5, ["lento"]), (200, 0, ["rápido"])])
+        resilience = UpstreamResilience(ResiliencePolicy(
+            hedge=True, hedge_min_delay=0.05, hedge_min_samples=3, hedge_max_ratio=1.0
+        ))
+        for _ in range(3):
+            resilience.latency("openai").add(0.01)
+
+        assert await asyncio.wait_for(_ask(server, resilience), timeout=2) == "rápido"
+        assert (resilience.hedges, resilience.hedge_wins) == (1, 1)
+        await asyncio.sleep(0.05)
+        assert server.aborted == 1
+
+    async def test_hedging_respects_budget(self):
+        resilience = UpstreamResilience(ResiliencePolicy(hedge=True, hedge_min_samples=1, hedge_max_ratio=0.1))
+        resilience.latency("openai").add(2.0)
+        resilience.requests, resilience.hedges = 10, 1
+        assert resilience.hedge_delay("openai") is None
+        resilience.requests = 20
+        assert resilience.hedge_delay("openai") == 2.0
+
+
+@pytest.mark.asyncio
+class TestBreakerIntegration:
+    """An open breaker fails fast without touching the upstream"""
+
+    async def test_fails_fast_while_open(self, upstream, clock):
+        server = await upstream([(500, 0, []), (500, 0, []), (200, 0, ["ok"])])
+        resilience = UpstreamResilience(
+            ResiliencePolicy(max_retries=0, breaker_threshold=2, breaker_reset=30),
+            clock=clock
+        )
+        for _ in range(2):
+            with pytest.raises(UpstreamError):
+                await _ask(server, resilience)
+        with pytest.raises(CircuitOpenError):
+            await _ask(server, resilience)
+        assert server.requests == 2
+        assert resilience.stats()["models"]["openai"]["state"] == "open"
+
+        clock.now += 30
+        assert await _ask(server, resilience) == "ok"
+        assert resilience.breaker("openai").state == CircuitBreaker.CLOSED
@@ -0,0 +1,132 @@
+"""
+Tests for model fallback chains and latency-aware routing
+Run with: pytest test_routing.py
+"""
+import pytest
+from agent import PollinationsAgent, ToolType
+from routing import ModelRouter
+
+
+async def collect(events):
+    return [item async for item in events]
+
+
+class TestModelRouter:
+    """Test candidate ordering"""
+
+    def test_requested_model_then_chain(self):
+        router = ModelRouter()
+        assert router.candidates("text") == ["openai", "openai-fast", "mistral"]
+        assert router.candidates("text", "mistral") == ["mistral", "openai", "openai-fast"]
+        assert router.candidates("text", "claude") == ["claude", "openai", "openai-fast", "mistral"]
+
+    def test_failing_model_is_demoted_until_cooldown(self, clock):
+        router = ModelRouter(failure_threshold=2, failure_cooldown=30, clock=clock)
+        for _ in range(2):
+            router.stats_for("openai").record_failure(clock())
+        assert router.candidates("text") == ["openai-fast", "mistral", "openai"]
+        clock.now += 30
+        assert router.candidates("text")[0] == "openai"
+
+    def test_slow_model_is_demoted(self, clock):
+        router = ModelRouter(slow_ttft=5, clock=clock)
+        router.stats_for("openai").record_success(ttft=9.0, tokens=10, duration=10.0, now=clock())
+        assert router.candidates("text")[-1] == "openai"
+        # Asked for by name, a slow model still goes first; a failing one does not
+        assert router.candidates("text", "openai")[0] == "openai"
+        for _ in range(2):
+            router.stats_for("openai").record_failure(clock())
+        assert router.candidates("text", "openai") == ["openai-fast", "mistral", "openai"]
+
+    def test_slow_ttft_per_kind(self, clock, monkeypatch):
+        monkeypatch.setenv("ROUTING_SLOW_TTFT_TEXT", "2")
+        router = ModelRouter.from_env()
+        router.clock = clock
+        router.stats_for("openai").record_success(ttft=3.0, tokens=10, duration=4.0, now=clock())
+        router.stats_for("openai-reasoning").record_success(ttft=12.0, tokens=10, duration=20.0, now=clock())
+        assert router.candidates("text")[-1] == "openai"
+        # Reasoning models get a longer default before they count as slow
+        assert router.candidates("reasoning") == ["openai-reasoning", "openai"]
+
+    @pytest.mark.asyncio
+    async def test_slow_model_is_probed_and_promoted_again(self, clock):
+        router = ModelRouter(slow_ttft=5, slow_cooldown=60, clock=clock)
+
+        async def answer(delay):
+            clock.now += delay
+            yield "oi"
+
+        await collect(router.observe("openai", answer(9.0)))
+        assert router.candidates("text")[-1] == "openai"
+        clock.now += 60
+        # The slow state lapsed: openai is tried first again and, now fast,
+        # stays first
+        assert router.candidates("text")[0] == "openai"
+        await collect(router.observe("openai", answer(0.5)))
+        assert router.models["openai"].ttft == 0.5
+        assert router.candidates("text")[0] == "openai"
+
+    def test_unavailable_model_is_demoted(self):
+        router = ModelRouter(is_available=lambda model: model != "openai")
+        assert router.candidates("text")[-1] == "openai"
+
+    def test_auto_prefers_fastest_measured_model(self):
+        router = ModelRouter()
+        router.stats_for("openai").record_success(ttft=2.0, tokens=5, duration=3.0, now=0.0)
+        router.stats_for("mistral").record_success(ttft=0.5, tokens=5, duration=1.0, now=0.0)
+        assert router.candidates("text", ModelRouter.AUTO) == ["mistral", "openai", "openai-fast"]
+
+    def test_rolling_ttft_and_tokens_per_second(self):
+        stats = ModelRouter().stats_for("openai")
+        stats.record_success(ttft=1.0, tokens=11, duration=2.0, now=0.0)
+        assert stats.ttft == 1.0
+        assert stats.tokens_per_sec == 10.0
+        stats.record_success(ttft=2.0, tokens=1, duration=2.0, now=0.0)
+        assert stats.ttft == pytest.approx(1.2)
+
+    def test_chains_from_env(self, monkeypatch):
+        monkeypatch.setenv("MODEL_CHAIN_TEXT", "mistral, openai")
+        router = ModelRouter.from_env()
+        assert router.candidates("text") == ["mistral", "openai"]
+        assert router.candidates("reasoning") == ModelRouter.DEFAULT_CHAINS["reasoning"]
+
+
+@pytest.mark.asyncio
+class TestAgentFallback:
+    """Test fallback through process_message_stream"""
+
+    async def test_falls_back_before_first_chunk(self):
+        router = ModelRouter()
+        agent = PollinationsAgent(router=router)
+
+        async def fake_request(payload):
+            if payload["model"] == "openai":
+                raise RuntimeError("API error 503: down")
+            yield f"via {payload['model']}"
+
+        agent._request_completion = fake_request
+        events = [e async for e in agent.process_message_stream("olá", tool_type=ToolType.TEXT_GENERATION)]
+        await agent.close()
+
+        assert events[0]["model"] == "openai"
+        assert events[0]["fallbacks"] == ["openai-fast", "mistral"]
+        fallback = next(e for e in events if e["type"] == "model_fallback")
+        assert (fallback["from"], fallback["to"]) == ("openai", "openai-fast")
+        assert [e["content"] for e in events if e["type"] == "text_chunk"] == ["via openai-fast"]
+        assert router.models["openai"].failures == 1
+        assert router.fallbacks == 1
+
+    async def test_no_switch_after_text_was_sent(self):
+        agent = PollinationsAgent(router=ModelRouter())
+
+        async def fake_request(payload):
+            yield "parcial"
+            raise RuntimeError("connection reset")
+
+        agent._request_completion = fake_request
+        received = []
+        with pytest.raises(RuntimeError):
+            async for event in agent.process_message_stream("olá", tool_type=ToolType.TEXT_GENERATION):
+                received.append(event)
+        await agent.close()
+        assert not any(e["type"] == "model_fallback" for e in received)
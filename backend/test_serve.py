@@ -0,0 +1,59 @@
+"""
+Tests for the production launcher
+Run with: pytest test_serve.py
+"""
+import serve
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+class TestCpuLimit:
+    """Test worker defaults from cgroup quotas"""
+
+    def test_cgroup_v2_quota(self, tmp_path):
+        write(tmp_path / "cpu.max", "150000 100000\n")
+        assert serve.cgroup_cpu_limit(str(tmp_path)) == 1.5
+
+    def test_cgroup_v2_unlimited(self, tmp_path):
+        write(tmp_path / "cpu.max", "max 100000\n")
+        assert serve.cgroup_cpu_limit(str(tmp_path)) is None
+
+    def test_cgroup_v1_quota(self, tmp_path):
+        write(tmp_path / "cpu" / "cpu.cfs_quota_us", "200000\n")
+        write(tmp_path / "cpu" / "cpu.cfs_period_us", "100000\n")
+        assert serve.cgroup_cpu_limit(str(tmp_path)) == 2.0
+        write(tmp_path / "cpu" / "cpu.cfs_quota_us", "-1\n")
+        assert serve.cgroup_cpu_limit(str(tmp_path)) is None
+
+    def test_quota_caps_available_cpus(self, tmp_path):
+        write(tmp_path / "cpu.max", "50000 100000\n")
+        assert serve.available_cpus(str(tmp_path)) == 1
+        assert serve.available_cpus(str(tmp_path / "missing")) >= 1
+
+
+class TestServerOptions:
+    """Test the uvicorn settings"""
+
+    def test_defaults(self, monkeypatch):
+        for name in ("WEB_CONCURRENCY", "DRAIN_TIMEOUT", "PORT", "HOST"):
+            monkeypatch.delenv(name, raising=False)
+        monkeypatch.setattr(serve, "default_workers", lambda: 3)
+        options = serve.server_options(serve.parse_args([]))
+        assert options["app"] == "main:app"
+        assert options["workers"] == 3
+        assert options["timeout_graceful_shutdown"] == 30 + serve.CANCEL_GRACE
+        assert (options["host"], options["port"]) == ("0.0.0.0", 8000)
+        assert options["loop"] in ("uvloop", "asyncio")
+        assert options["http"] in ("httptools", "h11")
+
+    def test_environment_and_flags(self, monkeypatch):
+        monkeypatch.setenv("WEB_CONCURRENCY", "4")
+        monkeypatch.setenv("DRAIN_TIMEOUT", "12")
+        options = serve.server_options(serve.parse_args(["--port", "9001"]))
+        assert options["workers"] == 4
+        assert options["timeout_graceful_shutdown"] == 12 + serve.CANCEL_GRACE
+        assert options["port"] == 9001
+        assert serve.server_options(serve.parse_args(["--workers", "2"]))["workers"] == 2
@@ -0,0 +1,76 @@
+"""
+Tests for per-session agent management
+Run with: pytest test_sessions.py
+"""
+import pytest
+import pytest_asyncio
+from sessions import SessionManager
+
+
+@pytest_asyncio.fixture
+async def manager():
+    """Create a session manager for testing"""
+    manager = SessionManager(max_sessions=3, idle_ttl=60.0, max_history=4)
+    yield manager
+    await manager.close()
+
+
+@pytest.mark.asyncio
+class TestSessionManager:
+    """Test session isolation, eviction and the shared client"""
+
+    async def test_sessions_are_isolated(self, manager):
+        a = manager.get("session-a")
+        b = manager.get("session-b")
+        await a._add_to_history_bounded("oi", "olá")
+        assert len(await a.get_history()) == 2
+        assert len(await b.get_history()) == 0
+        assert manager.get("session-a") is a
+
+    async def test_shared_client(self, manager):
+        a = manager.get("session-a")
+        b = manager.get("session-b")
+        assert a.client is b.client is manager.client
+        # Closing a session agent must not close the shared pool
+        await a.close()
+        assert not manager.client.is_closed
+
+    async def test_history_bound(self, manager):
+        agent = manager.get("session-a")
+        for i in range(5):
+            await agent._add_to_history_bounded(f"q{i}", f"a{i}")
+        history = await agent.get_history()
+        assert len(history) == 4
+        assert history[-1]["content"] == "a4"
+
+    async def test_max_sessions_evicts_least_recent(self, manager):
+        for name in ["session-1", "session-2", "session-3"]:
+            manager.get(name)
+        manager.get("session-1")  # touch, so session-2 is now the oldest
+        manager.get("session-4")
+        assert len(manager) == 3
+        assert "session-2" not in manager
+        assert "session-1" in manager
+
+    async def test_idle_sessions_expire(self, manager):
+        manager.get("session-a")
+        manager.get("session-b")
+        assert manager.purge_expired(now=10**9) == 2
+        assert len(manager) == 0
+
+    async def test_peek_does_not_create(self, manager):
+        assert manager.peek("session-x") is None
+        assert len(manager) == 0
+
+
+class TestSessionIds:
+    """Test session id validation"""
+
+    def test_generated_ids_are_valid(self):
+        assert SessionManager.is_valid_session_id(SessionManager.new_session_id())
+
+    def test_rejects_malformed_ids(self):
+        assert not SessionManager.is_valid_session_id(None)
+        assert not SessionManager.is_valid_session_id("short")
+        assert not SessionManager.is_valid_session_id("bad id; drop")
+        assert not SessionManager.is_valid_session_id("x" * 200)
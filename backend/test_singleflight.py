@@ -0,0 +1,108 @@
+"""
+Tests for single-flight request coalescing
+Run with: pytest test_singleflight.py
+"""
+import asyncio
+import pytest
+from singleflight import SingleFlight
+
+
+class FakeUpstream:
+    """Upstream stream whose chunks are released by the test"""
+
+    def __init__(self):
+        self.calls = 0
+        self.queue = asyncio.Queue()
+        self.closed = False
+
+    async def stream(self):
+        self.calls += 1
+        try:
+            while True:
+                item = await self.queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.closed = True
+
+
+async def _collect(agen, into=None, delay=0.0):
+    result = [] if into is None else into
+    async for chunk in agen:
+        result.append(chunk)
+        if delay:
+            await asyncio.sleep(delay)
+    return result
+
+
+@pytest.mark.asyncio
+class TestSingleFlight:
+    """Test sharing one upstream stream between identical calls"""
+
+    async def test_concurrent_calls_share_upstream(self):
+        flight, upstream = SingleFlight(), FakeUpstream()
+        tasks = [asyncio.ensure_future(_collect(flight.stream("k", upstream.stream))) for _ in range(5)]
+        await asyncio.sleep(0)
+        for chunk in ["a", "b", "c", None]:
+            upstream.queue.put_nowait(chunk)
+        results = await asyncio.gather(*tasks)
+        assert upstream.calls == 1
+        assert results == [["a", "b", "c"]] * 5
+        assert flight.stats() == {"in_flight": 0, "leaders": 1, "followers": 4}
+
+    async def test_late_joiner_replays_missed_chunks(self):
+        flight, upstream = SingleFlight(), FakeUpstream()
+        first = []
+        task = asyncio.ensure_future(_collect(flight.stream("k", upstream.stream), into=first))
+        upstream.queue.put_nowait("a")
+        upstream.queue.put_nowait("b")
+        while len(first) < 2:
+            await asyncio.sleep(0)
+        late = asyncio.ensure_future(_collect(flight.stream("k", upstream.stream)))
+        await asyncio.sleep(0)
+        upstream.queue.put_nowait("c")
+        upstream.queue.put_nowait(None)
+        assert await late == ["a", "b", "c"]
+        assert await task == ["a", "b", "c"]
+        assert upstream.calls == 1
+
+    async def test_slow_consumer_does_not_stall_others(self):
+        flight, upstream = SingleFlight(), FakeUpstream()
+        slow = asyncio.ensure_future(_collect(flight.stream("k", upstream.stream), delay=0.2))
+        fast = asyncio.ensure_future(_collect(flight.stream("k", upstream.stream)))
+        for chunk in ["a", "b", "c", None]:
+            upstream.queue.put_nowait(chunk)
+        assert await asyncio.wait_for(fast, timeout=0.1) == ["a", "b", "c"]
+        assert not slow.done()
+        assert await slow == ["a", "b", "c"]
+
+    async def test_errors_reach_every_subscriber(self):
+        flight, upstream = SingleFlight(), FakeUpstream()
+        tasks = [asyncio.ensure_future(_collect(flight.stream("k", upstream.stream))) for _ in range(2)]
+        await asyncio.sleep(0)
+        upstream.queue.put_nowait("a")
+        upstream.queue.put_nowait(RuntimeError("API error 500"))
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    async def test_abandoned_stream_is_cancelled(self):
+        flight, upstream = SingleFlight(), FakeUpstream()
+        agen = flight.stream("k", upstream.stream)
+        upstream.queue.put_nowait("a")
+        assert await agen.__anext__() == "a"
+        await agen.aclose()
+        await asyncio.sleep(0)
+        assert upstream.closed
+        assert len(flight) == 0
+
+    async def test_different_keys_do_not_share(self):
+        flight, upstream = SingleFlight(), FakeUpstream()
+        tasks = [asyncio.ensure_future(_collect(flight.stream(k, upstream.stream))) for k in ["a", "b"]]
+        await asyncio.sleep(0)
+        upstream.queue.put_nowait(None)
+        upstream.queue.put_nowait(None)
+        await asyncio.gather(*tasks)
+        assert upstream.calls == 2
@@ -0,0 +1,157 @@
+"""
+Tests for sentence-split text-to-speech and the speech segment cache
+Run with: pytest test_speech.py
+"""
+import asyncio
+import time
+from urllib.parse import unquote
+import pytest
+import pytest_asyncio
+from agent import PollinationsAgent, ToolType
+from fake_upstream import FakeHTTPServer
+from media import MediaCache
+from speech import SentenceBuffer, SpeechPipeline, split_sentences
+from transport import create_upstream_client
+
+MP3 = b"ID3\x03\x00" + bytes(range(256)) * 8
+
+
+class FakeSpeechServer(FakeHTTPServer):
+    """Answers any GET with MP3 bytes after a delay, recording the spoken text"""
+
+    def __init__(self, delay: float = 0.0, fail_on: str = None):
+        super().__init__()
+        self.delay = delay
+        self.fail_on = fail_on
+        self.texts = []
+
+    async def respond(self, request, reader, writer):
+        text = unquote(request.path)[1:].split("?")[0].replace("Say verbatim: ", "")
+        self.texts.append(text)
+        await asyncio.sleep(self.delay)
+        if self.fail_on and self.fail_on in text:
+            writer.write(b"HTTP/1.1 500 Error\r\nContent-Length: 4\r\nConnection: close\r\n\r\ndown")
+        else:
+            writer.write(
+                f"HTTP/1.1 200 OK\r\nContent-Type: audio/mpeg\r\nContent-Length: {len(MP3)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + MP3
+            )
+        return False
+
+
+@pytest_asyncio.fixture
+async def speech_agent(tmp_path, serve):
+    agents = []
+
+    async def start(**kwargs):
+        server = await serve(FakeSpeechServer(**kwargs))
+        agent = PollinationsAgent()
+        agent.BASE_URL_TEXT = server.url
+        agent.speech_pipeline = SpeechPipeline(agent.client, MediaCache(str(tmp_path)), segment_chars=60)
+        agents.append(agent)
+        return agent, server
+
+    yield start
+    for agent in agents:
+        await agent.close()
+
+
+class TestSentenceSplitting:
+    """Test segmenting of complete and streamed text"""
+
+    def test_first_sentence_alone_rest_packed(self):
+        text = "Olá! Tudo bem? Hoje vamos falar de gatos. Eles dormem muito."
+        assert split_sentences(text, max_chars=40) == [
+            "Olá!", "Tudo bem? Hoje vamos falar de gatos.", "Eles dormem muito."
+        ]
+
+    def test_long_sentence_is_cut_at_words(self):
+        segments = split_sentences("palavra " * 30, max_chars=50)
+        assert all(len(s) <= 50 for s in segments)
+        assert " ".join(segments).split() == ["palavra"] * 30
+
+    def test_buffer_returns_sentences_as_they_end(self):
+        buffer = SentenceBuffer(max_chars=100)
+        assert buffer.feed("Primeira fra") == []
+        assert buffer.feed("se. Segunda") == ["Primeira frase."]
+        # A sentence end is only known once whitespace follows
+        assert buffer.feed(" frase.") == []
+        assert buffer.feed(" ") == ["Segunda frase."]
+        assert buffer.feed("Resto sem ponto") == []
+        assert buffer.flush() == ["Resto sem ponto"]
+
+    def test_buffer_cuts_run_on_text(self):
+        buffer = SentenceBuffer(max_chars=20)
+        assert buffer.feed("um dois três quatro cinco seis") == ["um dois três quatro"]
+        assert buffer.flush() == ["cinco seis"]
+
+
+@pytest.mark.asyncio
+class TestSpeechPipeline:
+    """Test ordered, concurrent, cached segments"""
+
+    async def test_segments_render_concurrently_in_order_and_are_cached(self, tmp_path):
+        server = FakeSpeechServer(delay=0.1)
+        url = await server.start()
+        client = create_upstream_client()
+        pipeline = SpeechPipeline(client, MediaCache(str(tmp_path)), segment_chars=30)
+        try:
+            async def speak(text):
+                stream = pipeline.open("nova", lambda t: f"{url}/Say verbatim: {t}?voice=nova")
+                stream.speak(text)
+                return [e async for e in stream.drain()]
+
+            text = "Um. Dois dois dois dois. Três três três três. Quatro quatro quatro."
+            started = time.perf_counter()
+            events = await speak(text)
+            assert time.perf_counter() - started < 0.3
+            assert [e["index"] for e in events] == [0, 1, 2, 3]
+            assert [e["text"] for e in events] == split_sentences(text, 30)
+            assert all(e["type"] == "audio_segment" and e["url"].startswith("/media/audio/") for e in events)
+            with open(pipeline.cache.get(events[0]["url"].rsplit("/", 1)[1]), "rb") as f:
+                assert f.read() == MP3
+
+            again = await speak(text)
+            assert all(e["cached"] for e in again)
+            assert len(server.texts) == 4
+            assert pipeline.stats()["cached_segments"] == 4
+        finally:
+            await client.aclose()
+            await server.stop()
+
+
+@pytest.mark.asyncio
+class TestAgentSpeech:
+    """Test the TTS tool and speaking a streamed answer"""
+
+    async def test_tts_tool_streams_segments(self, speech_agent):
+        agent, server = await speech_agent(fail_on="Dois")
+        events = [e async for e in agent.process_message_stream(
+            "fale: Um. Dois. Três.", {"audio": "onyx"}, ToolType.TEXT_TO_SPEECH
+        )]
+        audio = [(e["type"], e.get("index")) for e in events if e["type"].startswith("audio")]
+        assert audio == [("audio_segment", 0), ("audio_error", 1), ("audio_end", None)]
+        assert sorted(server.texts) == ["Dois. Três.", "Um."]
+        history = await agent.get_history()
+        assert history[1]["content"] == "Áudio gerado com sucesso!"
+
+    async def test_speaks_while_text_streams(self, speech_agent):
+        agent, server = await speech_agent()
+
+        async def fake_stream(payload):
+            for chunk in ["Primeira frase ", "completa. Segunda", " frase aqui. ", "Fim"]:
+                await asyncio.sleep(0.05)
+                yield chunk
+
+        agent._stream_completion = fake_stream
+        events = [e async for e in agent.process_message_stream(
+            "conte algo", tool_type=ToolType.TEXT_GENERATION, speak=True
+        )]
+        kinds = [e["type"] for e in events]
+        # The first sentence is spoken before the answer has finished
+        assert kinds.index("audio_segment") < max(i for i, k in enumerate(kinds) if k == "text_chunk")
+        segments = [e["text"] for e in events if e["type"] == "audio_segment"]
+        assert segments == ["Primeira frase completa.", "Segunda frase aqui.", "Fim"]
+        assert kinds[-2:] == ["audio_end", "done"]
+        history = await agent.get_history()
+        assert history[1]["content"] == "Primeira frase completa. Segunda frase aqui. Fim"
@@ -0,0 +1,188 @@
+"""
+Tests for the upstream SSE decoder and the /chat frame encoder
+Run with: pytest test_sse.py
+"""
+import asyncio
+import json
+import pytest
+from sse import (
+    FlushPolicy,
+    SSEDecoder,
+    _parse_delta_content,
+    coalesce_events,
+    encode_events,
+    encode_text_frame,
+    extract_delta_content,
+    iter_delta_content,
+)
+
+
+def _chunk(content, role=None) -> bytes:
+    delta = {"content": content}
+    if role:
+        delta = {"role": role, **delta}
+    return json.dumps({
+        "id": "chatcmpl-1",
+        "object": "chat.completion.chunk",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": None}]
+    }).encode()
+
+
+def _feed_all(decoder, pieces):
+    events = []
+    for piece in pieces:
+        events.extend(decoder.feed(piece))
+    return events
+
+
+class TestSSEDecoder:
+    """Test SSE framing"""
+
+    def test_lf_and_crlf_and_cr(self):
+        for sep in [b"\n", b"\r\n", b"\r"]:
+            stream = b"data: one" + sep + sep + b"data: two" + sep + sep
+            assert _feed_all(SSEDecoder(), [stream]) == [b"one", b"two"]
+
+    def test_split_at_every_byte(self):
+        stream = b"data: hello\r\n\r\n: comment\r\ndata: world\r\n\r\n"
+        pieces = [stream[i:i + 1] for i in range(len(stream))]
+        assert _feed_all(SSEDecoder(), pieces) == [b"hello", b"world"]
+
+    def test_multiline_data_and_comments(self):
+        stream = b": keep-alive\ndata: {\"a\":\ndata: 1}\nevent: message\nid: 7\n\n"
+        decoder = SSEDecoder()
+        assert _feed_all(decoder, [stream]) == [b'{"a":\n1}']
+        assert decoder.last_event_id == b"7"
+
+    def test_field_without_space_and_bom(self):
+        stream = b"\xef\xbb\xbfdata:x\n\ndata\n\n"
+        assert _feed_all(SSEDecoder(), [stream[:2], stream[2:]]) == [b"x", b""]
+
+    def test_flush_unterminated_event(self):
+        decoder = SSEDecoder()
+        assert decoder.feed(b"data: tail") == []
+        assert decoder.flush() == [b"tail"]
+
+
+class TestDeltaExtraction:
+    """The fast path must agree with full JSON parsing"""
+
+    @pytest.mark.parametrize("content", [
+        "Olá", "plain text", "", 'with "quotes"', "back\\slash\\", "line\nbreak",
+        "emoji 🎉", "unicode éç", '"delta":{"content":"fake"}', "tab\t}"
+    ])
+    def test_matches_json(self, content):
+        for data in [_chunk(content), _chunk(content, role="assistant")]:
+            assert extract_delta_content(data) == content
+            assert extract_delta_content(data) == _parse_delta_content(data)
+
+    def test_non_ascii_unescaped(self):
+        data = json.dumps({"choices": [{"delta": {"content": "ação"}}]}, ensure_ascii=False).encode()
+        assert extract_delta_content(data) == "ação"
+
+    def test_empty_and_null_deltas(self):
+        assert extract_delta_content(b'{"choices":[{"delta":{},"finish_reason":"stop"}]}') is None
+        assert extract_delta_content(b'{"choices":[{"delta":{"content":null}}]}') is None
+
+    def test_fallbacks(self):
+        # Empty choices (e.g. prompt filter results) and unusual shapes
+        assert extract_delta_content(b'{"choices":[],"prompt_filter_results":[]}') is None
+        assert extract_delta_content(b'{"choices":[{"delta":{"tool_calls":[]}}]}') is None
+        assert extract_delta_content(b'{"choices":[{"delta":{"refusal":null,"content":"x"}}]}') == "x"
+        assert extract_delta_content(b"not json") is None
+        two = b'{"choices":[{"delta":{"content":"a"}},{"delta":{"content":"b"}}]}'
+        assert extract_delta_content(two) == "a"
+
+
+@pytest.mark.asyncio
+class TestIterDeltaContent:
+    """Test the full byte stream to text pipeline"""
+
+    async def test_stream_until_done(self):
+        body = b"".join(b"data: " + _chunk(c) + b"\n\n" for c in ["Ol", "á", " mundo"])
+        body += b"data: [DONE]\n\ndata: " + _chunk("ignored") + b"\n\n"
+
+        async def pieces():
+            for i in range(0, len(body), 7):
+                yield body[i:i + 7]
+
+        assert [c async for c in iter_delta_content(pieces())] == ["Ol", "á", " mundo"]
+
+
+async def _events(items, delay=0.0):
+    for item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def _text(content):
+    return {"type": "text_chunk", "content": content}
+
+
+def _frames_to_events(frames):
+    body = b"".join(frames).decode()
+    return [json.loads(f[6:]) for f in body.split("\n\n") if f]
+
+
+class TestEncodeTextFrame:
+    """The pre-encoded frame must match json.dumps exactly"""
+
+    @pytest.mark.parametrize("content", ["Olá", 'a "b" \\ c', "line\nbreak", "🎉", ""])
+    def test_same_bytes_as_json_dumps(self, content):
+        expected = f"data: {json.dumps(_text(content))}\n\n".encode()
+        assert encode_text_frame(content) == expected
+
+
+@pytest.mark.asyncio
+class TestEncodeEvents:
+    """Test coalescing of text chunks into frames"""
+
+    async def test_per_token(self):
+        items = [_text("a"), _text("b"), {"type": "done"}]
+        frames = [f async for f in encode_events(_events(items), FlushPolicy.per_token())]
+        assert len(frames) == 3
+        assert _frames_to_events(frames) == items
+
+    async def test_merges_until_next_event(self):
+        items = [{"type": "status", "message": "x"}, _text("a"), _text("b"), _text("c"), {"type": "done"}]
+        policy = FlushPolicy(max_bytes=1000, max_delay_ms=1000)
+        frames = [f async for f in encode_events(_events(items), policy)]
+        assert _frames_to_events(frames) == [items[0], _text("abc"), items[-1]]
+
+    async def test_max_bytes(self):
+        items = [_text("aaaa"), _text("bbbb"), _text("cc")]
+        frames = [f async for f in encode_events(_events(items), FlushPolicy(max_bytes=8, max_delay_ms=0))]
+        assert _frames_to_events(frames) == [_text("aaaabbbb"), _text("cc")]
+
+    async def test_max_bytes_counts_escaped_text(self):
+        # "ção" is written as \u00e7\u00e3o: 13 bytes, not 3 characters
+        items = [_text("ção"), _text("ção"), _text("😀")]
+        frames = [f async for f in encode_events(_events(items), FlushPolicy(max_bytes=13, max_delay_ms=0))]
+        assert _frames_to_events(frames) == items
+        assert frames[0] == encode_text_frame("ção")
+
+    async def test_max_delay_flushes_while_upstream_is_quiet(self):
+        items = [_text("a"), _text("b")]
+        policy = FlushPolicy(max_bytes=1000, max_delay_ms=5)
+        frames = [f async for f in encode_events(_events(items, delay=0.05), policy)]
+        assert _frames_to_events(frames) == items
+
+    async def test_error_keeps_partial_text(self):
+        items = [_text("a"), _text("b"), RuntimeError("boom")]
+        policy = FlushPolicy(max_bytes=1000, max_delay_ms=1000)
+        frames = []
+        with pytest.raises(RuntimeError):
+            async for frame in encode_events(_events(items), policy):
+                frames.append(frame)
+        assert _frames_to_events(frames) == [_text("ab")]
+
+    async def test_coalesce_events_merges_like_frames(self):
+        items = [_text("a\u00e7"), _text('"b"'), {"type": "done"}, _text("c")]
+        policy = FlushPolicy(max_bytes=1000, max_delay_ms=1000)
+        events = [e async for e in coalesce_events(_events(items), policy)]
+        assert events == [_text('a\u00e7"b"'), items[2], _text("c")]
+        frames = [f async for f in encode_events(_events(items), policy)]
+        assert _frames_to_events(frames) == events
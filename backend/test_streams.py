@@ -0,0 +1,251 @@
+"""
+Tests for mid-stream cancellation and resumable /chat streams
+Run with: pytest test_streams.py
+"""
+import asyncio
+import pytest
+import pytest_asyncio
+from agent import PollinationsAgent, ToolType
+from fake_upstream import FakeHTTPServer
+from sse import FlushPolicy, encode_events
+from streams import ChatStream, EventLog, StreamRegistry, cancellable
+
+
+class EndlessUpstream(FakeHTTPServer):
+    """Streams text deltas until the client hangs up, and notices when it does"""
+
+    def __init__(self):
+        super().__init__()
+        self.closed = asyncio.Event()
+
+    async def respond(self, request, reader, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+
+        async def watch():
+            await reader.read()
+            self.closed.set()
+
+        watcher = asyncio.create_task(watch())
+        try:
+            while not self.closed.is_set():
+                writer.write(self.sse_delta("palavra "))
+                await writer.drain()
+                await asyncio.sleep(0.01)
+        except ConnectionError:
+            self.closed.set()
+        finally:
+            watcher.cancel()
+        return False
+
+
+@pytest_asyncio.fixture
+async def upstream(serve):
+    server = await serve(EndlessUpstream())
+    agent = PollinationsAgent()
+    agent.BASE_URL_TEXT = server.url
+    yield agent, server
+    await agent.close()
+
+
+class TestStreamRegistry:
+    """Test cancel lookup and outcome counts"""
+
+    def test_cancel_only_own_active_streams(self):
+        streams = StreamRegistry()
+        stream = ChatStream("sessao-a")
+        streams.add(stream)
+        assert not streams.cancel(stream.id, "sessao-b")
+        assert not streams.cancel("desconhecido")
+        assert streams.cancel(stream.id, "sessao-a")
+        assert stream.cancelled.is_set()
+        streams.finish(stream, "cancelled")
+        streams.finish(stream, "cancelled")
+        assert not streams.cancel(stream.id)
+        stats = streams.stats()
+        assert (stats["active"], stats["opened"], stats["cancelled"]) == (0, 1, 1)
+
+    @pytest.mark.asyncio
+    async def test_drain_waits_then_cancels_what_is_left(self):
+        streams = StreamRegistry()
+        quick, slow = ChatStream("a"), ChatStream("b")
+        streams.add(quick)
+        streams.add(slow)
+
+        async def respond(stream, seconds):
+            # Stands in for the /chat generator: ends early once cancelled
+            try:
+                await asyncio.wait_for(stream.cancelled.wait(), seconds)
+                streams.finish(stream, "cancelled")
+            except asyncio.TimeoutError:
+                streams.finish(stream, "completed")
+
+        tasks = [asyncio.ensure_future(respond(quick, 0.05)), asyncio.ensure_future(respond(slow, 30))]
+        assert await streams.drain(0.2) == 1
+        await asyncio.gather(*tasks)
+        assert not quick.cancelled.is_set() and slow.cancelled.is_set()
+        stats = streams.stats()
+        assert (stats["active"], stats["completed"], stats["cancelled"]) == (0, 1, 1)
+        assert await streams.drain(0.2) == 0
+
+
+def frame(i):
+    return b'data: {"n": %d}\n\n' % i
+
+
+async def read_all(frames):
+    return [f async for f in frames]
+
+
+@pytest.mark.asyncio
+class TestEventLog:
+    """Test numbering, replay after Last-Event-ID and the memory cap"""
+
+    async def test_replay_then_follow_live_tail(self):
+        log = EventLog()
+        for i in range(1, 4):
+            await log.append(frame(i))
+        reader = asyncio.ensure_future(read_all(log.follow(1)))
+        await asyncio.sleep(0)
+        await log.append(frame(4))
+        log.close()
+        assert await reader == [b"id: %d\n" % i + frame(i) for i in (2, 3, 4)]
+        assert await read_all(log.follow(4)) == []
+
+    async def test_evicts_oldest_frames_past_the_cap(self):
+        log = EventLog(max_bytes=len(b"id: 10\n" + frame(10)) * 3)
+        for i in range(1, 11):
+            await log.append(frame(i))
+        assert log.first_seq == 8 and log.size <= log.max_bytes
+        assert log.can_replay(7) and log.can_replay(10)
+        assert not log.can_replay(6)
+        with pytest.raises(ValueError):
+            await read_all(log.follow(2))
+
+    async def test_live_reader_holds_back_eviction(self):
+        log = EventLog(max_bytes=1)
+        await log.append(frame(1))
+        reader = log.follow(0)
+        assert await reader.__anext__() == b"id: 1\n" + frame(1)
+        await log.append(frame(2))
+        # The reader has not had frame 2: adding frame 3 waits for it
+        producer = asyncio.ensure_future(log.append(frame(3)))
+        await asyncio.sleep(0.01)
+        assert not producer.done() and log.first_seq == 2
+        assert await reader.__anext__() == b"id: 2\n" + frame(2)
+        await asyncio.wait_for(producer, 1)
+        assert log.first_seq == 3
+        await reader.aclose()
+        assert log.readers == 0
+
+
+    async def test_reader_holds_its_position_before_it_starts(self):
+        log = EventLog(max_bytes=1)
+        await log.append(frame(1))
+        # As for a resumed response that has not started streaming yet
+        reader = log.follow(0)
+        producer = asyncio.ensure_future(log.append(frame(2)))
+        await asyncio.sleep(0.01)
+        assert not producer.done() and log.first_seq == 1
+        assert await reader.__anext__() == b"id: 1\n" + frame(1)
+        await asyncio.wait_for(producer, 1)
+        await reader.aclose()
+        assert log.readers == 0
+
+    async def test_reader_never_started_leaves_when_collected(self):
+        stream = ChatStream("a", resume_window=0)
+        await stream.log.append(frame(1))
+        reader = stream.follow(1)
+        assert stream.log.readers == 1
+        del reader
+        assert stream.log.readers == 0
+        await asyncio.sleep(0.01)
+        assert stream.abandoned
+
+
+@pytest.mark.asyncio
+class TestResume:
+    """Test abandoned streams and finished streams kept for replay"""
+
+    async def test_reader_coming_back_within_window_keeps_stream(self):
+        stream = ChatStream("a", resume_window=0.05)
+        await stream.log.append(frame(1))
+        first = stream.follow()
+        await first.__anext__()
+        await first.aclose()
+        second = asyncio.ensure_future(read_all(stream.follow(1)))
+        await asyncio.sleep(0.1)
+        assert not stream.cancelled.is_set()
+        second.cancel()
+        await asyncio.wait_for(stream.cancelled.wait(), 1)
+        assert stream.abandoned
+
+    async def test_finished_streams_are_retained_then_expire(self):
+        streams = StreamRegistry(retain_seconds=0.05, max_retained=1)
+        old, new = streams.create("a"), streams.create("a")
+        for stream in (old, new):
+            streams.add(stream)
+            await stream.log.append(frame(1))
+            streams.finish(stream, "completed")
+        assert streams.get(old.id) is None
+        assert streams.get(new.id, "a") is new and streams.get(new.id, "b") is None
+        assert new.log.closed
+        assert streams.stats()["resumable"] == 1
+        await asyncio.sleep(0.1)
+        assert streams.get(new.id) is None
+
+
+@pytest.mark.asyncio
+class TestCancellation:
+    """Test that stopping a stream closes the upstream and keeps the partial answer"""
+
+    async def test_cancel_closes_upstream_and_records_partial(self, upstream):
+        agent, server = upstream
+        cancelled = asyncio.Event()
+        events = agent.process_message_stream("conte uma história", tool_type=ToolType.TEXT_GENERATION)
+        frames = []
+        async for frame in cancellable(encode_events(events, FlushPolicy(max_bytes=64)), cancelled):
+            frames.append(frame)
+            if len(frames) == 3:
+                cancelled.set()
+
+        await asyncio.wait_for(server.closed.wait(), 1)
+        await asyncio.gather(*agent._background)
+        history = await agent.get_history()
+        assert history[0]["content"] == "conte uma história"
+        assert history[1]["content"].startswith("palavra palavra")
+        assert history[1]["content"].endswith(PollinationsAgent.INTERRUPTED_MARK)
+        # The pool slot is free again
+        assert agent.client._transport.connection_counts()["active"] == 0
+
+    async def test_client_disconnect_cancels_consumer(self, upstream):
+        agent, server = upstream
+        events = agent.process_message_stream("conte uma história", tool_type=ToolType.TEXT_GENERATION)
+        received = asyncio.Event()
+
+        async def respond():
+            # What Starlette does with the body iterator of a StreamingResponse
+            async for frame in cancellable(encode_events(events, FlushPolicy()), asyncio.Event()):
+                if b"text_chunk" in frame:
+                    received.set()
+
+        task = asyncio.create_task(respond())
+        await asyncio.wait_for(received.wait(), 1)
+        task.cancel()
+        await asyncio.wait_for(server.closed.wait(), 1)
+        await asyncio.gather(*agent._background)
+        assert (await agent.get_history())[1]["content"].endswith(PollinationsAgent.INTERRUPTED_MARK)
+
+    async def test_source_suspended_between_items_is_closed(self):
+        closed = asyncio.Event()
+
+        async def source():
+            try:
+                for i in range(10):
+                    yield i
+            finally:
+                closed.set()
+
+        stream = cancellable(source(), asyncio.Event())
+        assert await stream.__anext__() == 0
+        await stream.aclose()
+        await asyncio.wait_for(closed.wait(), 1)
@@ -0,0 +1,172 @@
+"""
+Tests for the rolling conversation summary
+Run with: pytest test_summary.py
+"""
+import asyncio
+import pytest
+from agent import PollinationsAgent, ToolType
+from context import ContextWindow
+from history_store import InMemoryHistoryStore
+from summary import SUMMARY_SYSTEM_PROMPT, ConversationSummarizer
+
+
+def is_summary_request(payload):
+    return payload["messages"][0]["content"].startswith(SUMMARY_SYSTEM_PROMPT[:40])
+
+
+@pytest.mark.asyncio
+class TestConversationSummarizer:
+    """Test incremental updates and the extractive fallback"""
+
+    async def test_update_sends_previous_summary_and_new_messages_only(self):
+        summarizer = ConversationSummarizer()
+        payloads = []
+
+        async def complete(payload):
+            payloads.append(payload)
+            yield "Resumo "
+            yield "novo."
+
+        messages = [{"role": "user", "content": "meu nome é Ana"}, {"role": "assistant", "content": "Olá, Ana!"}]
+        assert await summarizer.update(complete, "Resumo antigo.", messages) == "Resumo novo."
+        request = payloads[0]["messages"][1]["content"]
+        assert "Resumo antigo." in request
+        assert "Usuário: meu nome é Ana" in request
+        assert "Assistente: Olá, Ana!" in request
+        assert summarizer.stats()["updates"] == 1
+
+    async def test_fallback_when_upstream_fails(self):
+        summarizer = ConversationSummarizer(max_tokens=60)
+
+        async def complete(payload):
+            raise ConnectionError("down")
+            yield
+
+        summary = None
+        for i in range(10):
+            summary = await summarizer.update(complete, summary, [{"role": "user", "content": f"pergunta {i} " * 5}])
+        # Newest extracts are kept within the size limit
+        assert "pergunta 9" in summary
+        assert "pergunta 0" not in summary
+        assert summarizer.stats()["failures"] == 10
+
+    async def test_no_messages_no_call(self):
+        async def complete(payload):
+            raise AssertionError("should not be called")
+            yield
+
+        assert await ConversationSummarizer().update(complete, "igual", []) == "igual"
+
+
+@pytest.mark.asyncio
+class TestAgentSummary:
+    """Test that trimmed turns reach the summary and the next prompt"""
+
+    async def test_trimmed_turns_are_summarized_after_done(self):
+        agent = PollinationsAgent(max_history=2, summarizer=ConversationSummarizer(), context_window=ContextWindow())
+        payloads = []
+        release = asyncio.Event()
+
+        async def fake_stream(payload):
+            payloads.append(payload)
+            if is_summary_request(payload):
+                await release.wait()
+                yield "O usuário perguntou q0 e q1."
+            else:
+                yield "resposta"
+
+        agent._request_completion = fake_stream
+        for i in range(2):
+            events = [e async for e in agent.process_message_stream(f"q{i}", tool_type=ToolType.TEXT_GENERATION)]
+            assert events[-1] == {"type": "done"}
+
+        # The second turn trimmed q0 and finished without waiting for the summary
+        assert await agent.get_summary() is None
+        release.set()
+        await asyncio.gather(*agent._background)
+        assert await agent.get_summary() == "O usuário perguntou q0 e q1."
+
+        [e async for e in agent.process_message_stream("q2", tool_type=ToolType.TEXT_GENERATION)]
+        messages = [p for p in payloads if not is_summary_request(p)][-1]["messages"]
+        assert any("O usuário perguntou q0 e q1." in m["content"] for m in messages if m["role"] == "system")
+        assert [m["content"] for m in messages if m["role"] != "system"] == ["q1", "resposta", "q2"]
+        await agent.close()
+
+    async def test_clear_history_discards_running_update(self):
+        agent = PollinationsAgent(max_history=2, summarizer=ConversationSummarizer())
+        release = asyncio.Event()
+
+        async def fake_stream(payload):
+            if is_summary_request(payload):
+                await release.wait()
+            yield "texto"
+
+        agent._request_completion = fake_stream
+        for i in range(2):
+            [e async for e in agent.process_message_stream(f"q{i}", tool_type=ToolType.TEXT_GENERATION)]
+        await agent.clear_history()
+        release.set()
+        await agent.close()
+        assert await agent.get_summary() is None
+
+    async def test_pending_turns_survive_a_new_agent(self):
+        # e.g. the session was evicted, or the next turn reached another worker
+        store = InMemoryHistoryStore()
+        first = PollinationsAgent(max_history=2, history_store=store, summarizer=ConversationSummarizer())
+        await first._add_to_history_bounded("q0", "a0")
+        await first._add_to_history_bounded("q1", "a1")
+        await first.close()
+
+        second = PollinationsAgent(max_history=2, history_store=store, summarizer=ConversationSummarizer())
+        routed = []
+
+        class Router:
+            def observe(self, model, stream):
+                routed.append(model)
+                return stream
+
+        second.router = Router()
+
+        async def fake_request(payload):
+            assert is_summary_request(payload)
+            yield "Resumo de q0."
+
+        second._request_completion = fake_request
+        await second._add_to_history_bounded("q2", "a2")
+        second._schedule_summary()
+        await asyncio.gather(*second._background)
+        assert await second.get_summary() == "Resumo de q0."
+        assert await store.load_pending("default") == []
+        assert routed == []
+        await second.close()
+
+    async def test_cancelled_update_keeps_pending_turns(self):
+        # e.g. close() on shutdown while the summary request is in flight
+        store = InMemoryHistoryStore()
+        agent = PollinationsAgent(max_history=2, history_store=store, summarizer=ConversationSummarizer())
+        started = asyncio.Event()
+
+        async def fake_request(payload):
+            started.set()
+            await asyncio.Event().wait()
+            yield "nunca"
+
+        agent._request_completion = fake_request
+        await agent._add_to_history_bounded("q0", "a0")
+        await agent._add_to_history_bounded("q1", "a1")
+        update = asyncio.ensure_future(agent._update_summary())
+        await started.wait()
+        update.cancel()
+        await asyncio.gather(update, return_exceptions=True)
+        assert [m["content"] for m in await store.load_pending("default")] == ["q0", "a0"]
+        assert await agent.get_summary() is None
+        await agent.close()
+
+    async def test_without_summarizer_trimmed_turns_are_dropped(self):
+        agent = PollinationsAgent(max_history=2)
+        await agent._add_to_history_bounded("q0", "a0")
+        await agent._add_to_history_bounded("q1", "a1")
+        agent._schedule_summary()
+        assert not agent._background
+        assert await agent.get_summary() is None
+        await agent.close()
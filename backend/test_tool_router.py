@@ -0,0 +1,89 @@
+"""
+Tests for the compiled keyword tool router
+Run with: pytest test_tool_router.py
+"""
+import json
+import os
+import pytest
+from agent import PollinationsAgent, ToolType
+from tool_router import TOOLS, ToolRouter, normalize_text
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "routing_corpus.jsonl")
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class TestToolRouter:
+    """Test matching rules and configuration"""
+
+    def test_whole_words_only(self):
+        router = ToolRouter()
+        assert router.route("imagine a world without cars") == "text_generation"
+        assert router.route("summarize the findings") == "text_generation"
+        assert router.route("write an essay") == "text_generation"
+        assert router.route("an image, please!") == "image_generation"
+
+    def test_case_accent_and_punctuation_insensitive(self):
+        router = ToolRouter()
+        assert normalize_text("  Últimas  NOTÍCIAS! ") == "ultimas noticias"
+        assert router.route("ÚLTIMAS NOTÍCIAS, por favor") == "search"
+        assert router.route("gere audio dizendo oi") == "text_to_speech"
+        assert router.route("O que   está\nacontecendo?") == "search"
+
+    def test_priorities(self):
+        router = ToolRouter()
+        assert router.route("pesquise e desenhe um gato") == "image_generation"
+        router = ToolRouter(priorities={"search": -1})
+        assert router.route("pesquise e desenhe um gato") == "search"
+
+    def test_languages_and_custom_keywords(self):
+        assert ToolRouter(languages=["pt"]).route("draw a cat") == "text_generation"
+        router = ToolRouter(keywords={"es": {"search": ["busca*"], "image_generation": ["dibuja"]}})
+        assert router.route("búscame vuelos baratos") == "search"
+        assert router.route("buscando noticias") == "search"
+        assert router.route("dibuja un perro") == "image_generation"
+        assert router.route("busca y dibuja") == "image_generation"
+
+    def test_non_latin1_text(self):
+        router = ToolRouter(keywords={"ru": {"search": ["найди"]}, "en": {"search": ["news"]}})
+        assert router.route("Найди новости") == "search"
+        assert router.route("news — “today” ✓") == "search"
+
+    def test_from_env(self, tmp_path, monkeypatch):
+        config = tmp_path / "keywords.json"
+        config.write_text(json.dumps({"keywords": {"en": {"reasoning": ["ponder"]}}}))
+        monkeypatch.setenv("TOOL_ROUTER_KEYWORDS", str(config))
+        router = ToolRouter.from_env()
+        assert router.route("ponder this") == "reasoning"
+        assert router.route("draw a cat") == "text_generation"
+
+    def test_unknown_tools_fail_at_load(self, tmp_path, monkeypatch):
+        assert TOOLS == {tool.value for tool in ToolType}
+        with pytest.raises(ValueError):
+            ToolRouter(keywords={"en": {"translation": ["translate"]}})
+        config = tmp_path / "keywords.json"
+        config.write_text(json.dumps({"keywords": {"en": {"imagem": ["draw"]}}}))
+        monkeypatch.setenv("TOOL_ROUTER_KEYWORDS", str(config))
+        with pytest.raises(ValueError):
+            ToolRouter.from_env()
+
+
+class TestRoutingAccuracy:
+    """Every message of the labeled corpus must be routed correctly"""
+
+    def test_corpus(self):
+        router = ToolRouter()
+        wrong = [
+            (item["message"], item["tool"], router.route(item["message"]))
+            for item in load_corpus()
+            if router.route(item["message"]) != item["tool"]
+        ]
+        assert wrong == []
+
+    def test_agent_uses_router(self):
+        agent = PollinationsAgent(tool_router=ToolRouter(keywords={"en": {"search": ["lookup"]}}))
+        assert agent._determine_tool("lookup python") == ToolType.SEARCH
+        assert agent._determine_tool("draw a cat") == ToolType.TEXT_GENERATION
@@ -0,0 +1,93 @@
+"""
+Tests for the upstream transport and connection pool metrics
+Run with: pytest test_transport.py
+"""
+import asyncio
+import pytest
+import pytest_asyncio
+import httpx
+from fake_upstream import FakeHTTPServer
+from transport import UpstreamSettings, create_upstream_client, create_upstream_transport, warm_connections
+
+
+class SlowOkServer(FakeHTTPServer):
+    """Keep-alive server answering every request with 'ok' after a delay"""
+
+    def __init__(self, delay: float = 0.0):
+        super().__init__()
+        self.delay = delay
+
+    async def respond(self, request, reader, writer):
+        await asyncio.sleep(self.delay)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+        return True
+
+
+@pytest_asyncio.fixture
+async def server(serve):
+    return await serve(SlowOkServer(delay=0.05))
+
+
+class TestUpstreamSettings:
+    """Test settings and client construction"""
+
+    def test_split_timeouts_and_limits(self):
+        settings = UpstreamSettings(connect_timeout=1, read_timeout=2, write_timeout=3, pool_timeout=4, max_connections=7)
+        assert settings.timeout == httpx.Timeout(connect=1, read=2, write=3, pool=4)
+        assert settings.limits.max_connections == 7
+
+    def test_from_env(self, monkeypatch):
+        monkeypatch.setenv("UPSTREAM_MAX_CONNECTIONS", "12")
+        monkeypatch.setenv("UPSTREAM_READ_TIMEOUT", "45")
+        monkeypatch.setenv("UPSTREAM_WARM_URLS", "https://a/, https://b/")
+        settings = UpstreamSettings.from_env()
+        assert settings.max_connections == 12
+        assert settings.read_timeout == 45
+        assert settings.warm_urls == ["https://a/", "https://b/"]
+
+    def test_http2_falls_back_without_h2(self, monkeypatch):
+        monkeypatch.setattr("transport.http2_available", lambda: False)
+        transport = create_upstream_transport(UpstreamSettings(http2=True))
+        assert transport.http2 is False
+
+
+@pytest.mark.asyncio
+class TestInstrumentedTransport:
+    """Test pool wait and connection metrics against a local server"""
+
+    async def test_pool_wait_and_connection_counts(self, server):
+        settings = UpstreamSettings(max_connections=1, max_keepalive_connections=1)
+        transport = create_upstream_transport(settings)
+        client = create_upstream_client(settings, transport)
+        try:
+            responses = await asyncio.gather(*[client.get(server.url) for _ in range(3)])
+            assert all(r.text == "ok" for r in responses)
+            stats = transport.stats()
+            assert stats["requests"] == 3
+            assert stats["waiting_for_connection"] == 0
+            # With one connection, later requests had to queue for it
+            assert stats["pool_wait_max_ms"] >= 40
+            assert stats["connections"] == {"active": 0, "idle": 1, "total": 1}
+            assert server.connections == 1
+        finally:
+            await client.aclose()
+
+    async def test_pool_timeout(self, server):
+        settings = UpstreamSettings(max_connections=1, pool_timeout=0.01)
+        client = create_upstream_client(settings)
+        try:
+            results = await asyncio.gather(*[client.get(server.url) for _ in range(2)], return_exceptions=True)
+            assert any(isinstance(r, httpx.PoolTimeout) for r in results)
+        finally:
+            await client.aclose()
+
+    async def test_warm_connections(self, server):
+        settings = UpstreamSettings(warm_connections=3, warm_urls=[server.url])
+        transport = create_upstream_transport(settings)
+        client = create_upstream_client(settings, transport)
+        try:
+            await warm_connections(client, settings)
+            assert server.connections == 3
+            assert transport.connection_counts()["idle"] == 3
+        finally:
+            await client.aclose()
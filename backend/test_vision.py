@@ -0,0 +1,154 @@
+"""
+Tests for vision uploads: streaming multipart parsing, preprocessing and dedup
+Run with: pytest test_vision.py
+"""
+import io
+import pytest
+from agent import PollinationsAgent, ToolType
+from cache import ResponseCache
+from media import MediaCache
+from singleflight import SingleFlight
+from vision import UploadError, VisionStore, multipart_boundary, multipart_file, pillow_available
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 20
+
+needs_pillow = pytest.mark.skipif(not pillow_available(), reason="Pillow is not installed")
+
+
+def form(boundary: bytes, file: bytes) -> bytes:
+    return (
+        b"--" + boundary + b"\r\n"
+        b'Content-Disposition: form-data; name="note"\r\n\r\n'
+        b"texto\r\n"
+        b"--" + boundary + b"\r\n"
+        b'Content-Disposition: form-data; name="file"; filename="a.png"\r\n'
+        b"Content-Type: image/png\r\n\r\n" + file + b"\r\n"
+        b"--" + boundary + b"--\r\n"
+    )
+
+
+async def chunked(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+@pytest.mark.asyncio
+class TestMultipart:
+    """Test the streaming multipart/form-data parser"""
+
+    async def test_boundary(self):
+        assert multipart_boundary('multipart/form-data; boundary="abc"') == b"abc"
+        assert multipart_boundary("image/png") is None
+
+    @pytest.mark.parametrize("size", [1, 7, 64, 100000])
+    async def test_file_part_at_any_chunk_size(self, size):
+        # The file contains CRLFs and a partial delimiter
+        file = PNG + b"\r\n--bound" + PNG
+        body = form(b"boundary123", file)
+        parts = [p async for p in multipart_file(chunked(body, size), b"boundary123")]
+        assert b"".join(parts) == file
+        # Never more than one chunk plus a delimiter held at once
+        assert max(len(p) for p in parts) <= size + len(b"\r\n--boundary123")
+
+    async def test_no_file(self):
+        body = b'--b\r\nContent-Disposition: form-data; name="x"\r\n\r\n1\r\n--b--\r\n'
+        with pytest.raises(UploadError):
+            [p async for p in multipart_file(chunked(body, 10), b"b")]
+
+
+@pytest.mark.asyncio
+class TestVisionStore:
+    """Test hashing, deduplication and size limits"""
+
+    async def test_same_upload_is_processed_once(self, tmp_path):
+        store = VisionStore(MediaCache(str(tmp_path)))
+        first = await store.store(chunked(PNG, 1000))
+        second = await store.store(chunked(PNG, 300))
+        assert first["id"] == second["id"]
+        assert (first["cached"], second["cached"]) == (False, True)
+        assert store.stats()["deduplicated"] == 1
+        assert (await store.data_url(first["id"])).startswith("data:image/")
+        # Temporary upload files are gone
+        assert sorted(p.name for p in tmp_path.iterdir()) == [first["id"]]
+
+    async def test_directory_created_on_first_upload(self, tmp_path):
+        directory = tmp_path / "vision_cache"
+        store = VisionStore(MediaCache(str(directory)))
+        assert not directory.exists()
+        await store.store(chunked(PNG, 1000))
+        assert directory.is_dir()
+
+    async def test_rejects_large_and_non_images(self, tmp_path):
+        store = VisionStore(MediaCache(str(tmp_path)), max_upload_bytes=1000)
+        with pytest.raises(UploadError) as error:
+            await store.store(chunked(PNG, 100))
+        assert error.value.status == 413
+        with pytest.raises(UploadError) as error:
+            await store.store(chunked(b"nada de imagem", 100))
+        assert error.value.status == 415
+        assert store.stats()["rejected"] == 2
+        assert list(tmp_path.iterdir()) == []
+
+    @needs_pillow
+    async def test_downscales_to_bounded_jpeg(self, tmp_path):
+        from PIL import Image
+
+        out = io.BytesIO()
+        Image.new("RGBA", (3000, 1500), (255, 0, 0, 128)).save(out, "PNG")
+        store = VisionStore(MediaCache(str(tmp_path)), max_side=512)
+        result = await store.store(chunked(out.getvalue(), 65536))
+        with Image.open(store.cache.get(result["id"])) as image:
+            assert image.format == "JPEG"
+            assert image.size == (512, 256)
+
+
+@pytest.mark.asyncio
+class TestAgentVision:
+    """Test that an attached image is analyzed with streamed text"""
+
+    async def test_image_goes_to_upstream_and_answer_streams(self, tmp_path):
+        store = VisionStore(MediaCache(str(tmp_path)))
+        image = await store.store(chunked(PNG, 4096))
+        agent = PollinationsAgent(vision_store=store)
+        payloads = []
+
+        async def fake_stream(payload):
+            payloads.append(payload)
+            yield "Um "
+            yield "gráfico."
+
+        agent._stream_completion = fake_stream
+        events = [e async for e in agent.process_message_stream("o que é isso?", image_id=image["id"])]
+        assert events[0]["tool_type"] == ToolType.VISION.value
+        assert "".join(e["content"] for e in events if e["type"] == "text_chunk") == "Um gráfico."
+        content = payloads[0]["messages"][-1]["content"]
+        assert content[0] == {"type": "text", "text": "o que é isso?"}
+        assert content[1]["image_url"]["url"].startswith("data:image/png;base64,")
+        history = await agent.get_history()
+        assert history[0]["content"] == "o que é isso?"
+        await agent.close()
+
+    async def test_image_is_not_keyed_for_cache_or_single_flight(self, tmp_path, monkeypatch):
+        store = VisionStore(MediaCache(str(tmp_path)))
+        image = await store.store(chunked(PNG, 4096))
+        cache = ResponseCache()
+        agent = PollinationsAgent(vision_store=store, response_cache=cache, single_flight=SingleFlight())
+
+        def make_key(*args):
+            raise AssertionError("vision payloads must not be hashed")
+
+        async def fake_stream(payload):
+            yield "Um gráfico."
+
+        monkeypatch.setattr(ResponseCache, "make_key", make_key)
+        agent._stream_completion = fake_stream
+        events = [e async for e in agent.process_message_stream("o que é isso?", image_id=image["id"])]
+        assert [e["content"] for e in events if e["type"] == "text_chunk"] == ["Um gráfico."]
+        assert len(cache) == 0
+        await agent.close()
+
+    async def test_unknown_image(self, tmp_path):
+        agent = PollinationsAgent(vision_store=VisionStore(MediaCache(str(tmp_path))))
+        with pytest.raises(RuntimeError, match="envie-a novamente"):
+            [e async for e in agent._tool_events(ToolType.VISION, "e isso?", ["openai"], image_id="0" * 64)]
+        await agent.close()
@@ -0,0 +1,234 @@
+import json
+import os
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+DEFAULT_TOOL = "text_generation"
+
+# Values of agent.ToolType, the tools a router may return (agent imports
+# this module, not the other way around)
+TOOLS = frozenset({
+    "text_generation", "image_generation", "search", "text_to_speech", "speech_to_text", "vision", "reasoning"
+})
+
+# Per-language keywords for each tool. Matching is case and accent
+# insensitive and on whole words; a trailing "*" matches any word starting
+# with that stem (e.g. "pesquis*" for pesquise/pesquisar/pesquisando).
+DEFAULT_KEYWORDS: Dict[str, Dict[str, List[str]]] = {
+    "pt": {
+        "image_generation": [
+            "imagem", "imagens", "desenhe", "desenhar", "crie uma imagem", "gere uma imagem",
+            "foto", "fotos", "fotografia", "ilustracao", "ilustracoes", "ilustre"
+        ],
+        "search": [
+            "pesquise", "pesquisar", "busque", "buscar", "procure", "procurar",
+            "noticias", "ultimas noticias", "o que esta acontecendo"
+        ],
+        "text_to_speech": ["fale", "diga", "audio", "voz", "leia em voz alta"],
+        "reasoning": ["pense", "raciocine", "analise profundamente", "complexo", "passo a passo"],
+    },
+    "en": {
+        "image_generation": ["image", "images", "picture", "pictures", "draw", "photo", "photos", "illustration"],
+        "search": ["search", "find", "look up", "latest", "news"],
+        "text_to_speech": ["speak", "say", "audio", "voice", "read aloud"],
+        "reasoning": ["think", "reason", "analyze deeply", "step by step"],
+    },
+}
+
+# Lower wins when a message matches several tools
+DEFAULT_PRIORITIES: Dict[str, int] = {
+    "image_generation": 0,
+    "search": 1,
+    "text_to_speech": 2,
+    "reasoning": 3,
+}
+
+_COMBINING_MARKS = re.compile("[\u0300-\u036f]")
+_NON_WORD = re.compile(r"[\W_]")
+
+
+def _latin1_fold_table() -> bytes:
+    """
+    Lowercase, drop accents and turn anything that is not a letter or digit
+    into a space, for every Latin-1 character
+    """
+    table = bytearray(256)
+    for i in range(256):
+        char = unicodedata.normalize("NFD", chr(i).lower())[0]
+        table[i] = ord(char) if char.isalnum() and ord(char) < 256 else 0x20
+    return bytes(table)
+
+
+_LATIN1_FOLD = _latin1_fold_table()
+
+
+def fold_text(text: str) -> str:
+    """
+    Lowercase, accent-free text where every separator is a space. Latin-1
+    text (Portuguese, English, ...) is folded in one bytes.translate call;
+    anything else goes through casefold + NFD.
+    """
+    try:
+        return text.encode("latin-1").translate(_LATIN1_FOLD).decode("latin-1")
+    except UnicodeEncodeError:
+        text = _COMBINING_MARKS.sub("", unicodedata.normalize("NFD", text.casefold()))
+        return _NON_WORD.sub(" ", text)
+
+
+def normalize_text(text: str) -> str:
+    """Fold case, accents and punctuation and collapse whitespace"""
+    return " ".join(fold_text(text).split())
+
+
+def _char_pattern(char: str) -> str:
+    return " +" if char == " " else re.escape(char)
+
+
+def _trie_pattern(words: Iterable[Tuple[str, bool]]) -> str:
+    """
+    Build a regex from a character trie of the keywords, so the engine only
+    follows one branch per character instead of trying every alternative
+    """
+    trie: Dict[str, dict] = {}
+    for word, stem in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        # "" marks the end of a keyword; True if it is a stem
+        node[""] = node.get("", False) or stem
+
+    def emit(node: Dict[str, dict]) -> str:
+        end = node.get("")
+        branches = [_char_pattern(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if end is True:
+            # A stem swallows the rest of the word, longer keywords included
+            return "[^ ]*"
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if end is None:
+            return body
+        return "(?:" + body + ")?"
+
+    return emit(trie)
+
+
+class ToolRouter:
+    """
+    Picks the tool for a message with one compiled regex built from every
+    keyword of the enabled languages, so routing is a single pass over the
+    normalized message however many keywords there are.
+    """
+
+    def __init__(
+        self,
+        keywords: Optional[Dict[str, Dict[str, List[str]]]] = None,
+        priorities: Optional[Dict[str, int]] = None,
+        languages: Optional[List[str]] = None,
+        default: str = DEFAULT_TOOL
+    ):
+        keywords = keywords if keywords is not None else DEFAULT_KEYWORDS
+        unknown = {tool for table in keywords.values() for tool in table} - TOOLS
+        if default not in TOOLS:
+            unknown.add(default)
+        if unknown:
+            # Fail at startup rather than on every message routed there
+            raise ValueError(f"Unknown tool(s) {sorted(unknown)}; expected some of {sorted(TOOLS)}")
+        self.languages = languages or list(keywords)
+        self.priorities = {**DEFAULT_PRIORITIES, **(priorities or {})}
+        self.default = default
+
+        self._exact: Dict[str, str] = {}
+        self._stems: Dict[str, str] = {}
+        for language in self.languages:
+            for tool, words in keywords.get(language, {}).items():
+                for word in words:
+                    stem = word.endswith("*")
+                    key = normalize_text(word.rstrip("*")).strip()
+                    if not key:
+                        continue
+                    table = self._stems if stem else self._exact
+                    current = table.get(key)
+                    if current is None or self._priority(tool) < self._priority(current):
+                        table[key] = tool
+
+        words = [(w, False) for w in self._exact] + [(w, True) for w in self._stems]
+        self.keyword_count = len(words)
+        # Folded text only has letters, digits and spaces. Anchoring on the
+        # space before a word lets the engine jump straight to word starts.
+        self._pattern = re.compile(" (" + _trie_pattern(words) + ")(?= )") if words else None
+        self._top_priority = min((self._priority(t) for t in self._tools()), default=0)
+
+    @classmethod
+    def from_env(cls) -> "ToolRouter":
+        """
+        TOOL_ROUTER_LANGUAGES=pt,en picks the keyword sets and
+        TOOL_ROUTER_KEYWORDS=path.json replaces them with
+        {"keywords": {lang: {tool: [...]}}, "priorities": {tool: n}}
+        """
+        keywords = None
+        priorities = None
+        path = os.getenv("TOOL_ROUTER_KEYWORDS")
+        if path:
+            with open(path, encoding="utf-8") as f:
+                config = json.load(f)
+            keywords = config.get("keywords")
+            priorities = config.get("priorities")
+        languages = os.getenv("TOOL_ROUTER_LANGUAGES")
+        return cls(
+            keywords=keywords,
+            priorities=priorities,
+            languages=[l.strip() for l in languages.split(",") if l.strip()] if languages else None
+        )
+
+    def _priority(self, tool: str) -> int:
+        return self.priorities.get(tool, len(self.priorities))
+
+    def _tools(self) -> Iterable[str]:
+        return set(self._exact.values()) | set(self._stems.values())
+
+    @staticmethod
+    def _prepare(message: str) -> str:
+        return " " + fold_text(message) + " "
+
+    def _tool_for(self, match: str) -> Optional[str]:
+        match = " ".join(match.split())
+        tool = self._exact.get(match)
+        if tool is not None:
+            return tool
+        # Stem match: the longest stem that prefixes the matched word
+        for end in range(len(match), 0, -1):
+            tool = self._stems.get(match[:end])
+            if tool is not None:
+                return tool
+        return None
+
+    def matches(self, message: str) -> List[Tuple[str, str]]:
+        """All (keyword, tool) hits, for debugging routing decisions"""
+        if self._pattern is None:
+            return []
+        hits = []
+        for match in self._pattern.finditer(self._prepare(message)):
+            tool = self._tool_for(match.group(1))
+            if tool is not None:
+                hits.append((" ".join(match.group(1).split()), tool))
+        return hits
+
+    def route(self, message: str) -> str:
+        """Return the tool value for a message, or the default tool"""
+        if self._pattern is None:
+            return self.default
+        best: Optional[str] = None
+        best_priority = None
+        for match in self._pattern.finditer(self._prepare(message)):
+            tool = self._tool_for(match.group(1))
+            if tool is None:
+                continue
+            priority = self._priority(tool)
+            if best_priority is None or priority < best_priority:
+                best, best_priority = tool, priority
+                if priority == self._top_priority:
+                    break
+        return best or self.default
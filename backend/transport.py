@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from metrics import current_upstream_timing
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+class UpstreamSettings:
+    """
+    Connection pool, protocol and timeout settings for the upstream client
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 50,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 120.0,
+        write_timeout: float = 30.0,
+        pool_timeout: float = 10.0,
+        warm_connections: int = 2,
+        warm_urls: Optional[List[str]] = None
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self.connect_timeout = connect_timeout
+        # Applies to each socket read, i.e. the longest gap between tokens
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.pool_timeout = pool_timeout
+        self.warm_connections = warm_connections
+        self.warm_urls = warm_urls if warm_urls is not None else ["https://text.pollinations.ai/"]
+
+    @classmethod
+    def from_env(cls) -> "UpstreamSettings":
+        """Read settings from UPSTREAM_* environment variables"""
+        warm_urls = os.getenv("UPSTREAM_WARM_URLS")
+        return cls(
+            max_connections=_env_int("UPSTREAM_MAX_CONNECTIONS", 100),
+            max_keepalive_connections=_env_int("UPSTREAM_MAX_KEEPALIVE", 50),
+            keepalive_expiry=_env_float("UPSTREAM_KEEPALIVE_EXPIRY", 30.0),
+            http2=os.getenv("UPSTREAM_HTTP2", "0") == "1",
+            connect_timeout=_env_float("UPSTREAM_CONNECT_TIMEOUT", 10.0),
+            read_timeout=_env_float("UPSTREAM_READ_TIMEOUT", 120.0),
+            write_timeout=_env_float("UPSTREAM_WRITE_TIMEOUT", 30.0),
+            pool_timeout=_env_float("UPSTREAM_POOL_TIMEOUT", 10.0),
+            warm_connections=_env_int("UPSTREAM_WARM_CONNECTIONS", 2),
+            warm_urls=[u.strip() for u in warm_urls.split(",") if u.strip()] if warm_urls else None
+        )
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=self.read_timeout,
+            write=self.write_timeout,
+            pool=self.pool_timeout
+        )
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry
+        )
+
+
+def http2_available() -> bool:
+    """HTTP/2 needs the optional `h2` package (pip install httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    Wraps the pooled transport to measure how long requests wait for a
+    connection and to report active/idle connection counts.
+
+    Pool wait is the time until httpcore emits its first trace event for the
+    request, which happens once a connection has been assigned to it.
+    """
+
+    def __init__(self, transport: httpx.AsyncHTTPTransport, http2: bool = False):
+        self._transport = transport
+        self.http2 = http2
+        self.requests = 0
+        self.waiting = 0
+        self.pool_wait_count = 0
+        self.pool_wait_total = 0.0
+        self.pool_wait_max = 0.0
+        # Request body bytes sent upstream, e.g. to see context compaction pay off
+        self.request_bytes = 0
+        self.request_bytes_max = 0
+
+    def _record_pool_wait(self, seconds: float):
+        self.waiting -= 1
+        self.pool_wait_count += 1
+        self.pool_wait_total += seconds
+        if seconds > self.pool_wait_max:
+            self.pool_wait_max = seconds
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        self.waiting += 1
+        size = int(request.headers.get("content-length") or 0)
+        self.request_bytes += size
+        self.request_bytes_max = max(self.request_bytes_max, size)
+        started = time.perf_counter()
+        assigned = False
+        previous = request.extensions.get("trace")
+        # Per-request timings for the /metrics histograms, if being measured
+        timing = current_upstream_timing()
+
+        def record():
+            nonlocal assigned
+            assigned = True
+            seconds = time.perf_counter() - started
+            self._record_pool_wait(seconds)
+            if timing is not None:
+                timing.pool_wait = seconds
+
+        async def trace(event_name: str, info: Dict[str, Any]):
+            if not assigned:
+                record()
+            if previous is not None:
+                await previous(event_name, info)
+
+        request.extensions["trace"] = trace
+        try:
+            return await self._transport.handle_async_request(request)
+        finally:
+            if not assigned:
+                # Failed before getting a connection (e.g. pool timeout)
+                record()
+
+    def connection_counts(self) -> Dict[str, int]:
+        pool = getattr(self._transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for c in connections if c.is_idle())
+        return {"active": len(connections) - idle, "idle": idle, "total": len(connections)}
+
+    def stats(self) -> Dict[str, Any]:
+        count = self.pool_wait_count
+        return {
+            "requests": self.requests,
+            "waiting_for_connection": self.waiting,
+            "pool_wait_count": count,
+            "pool_wait_avg_ms": (self.pool_wait_total / count * 1000) if count else 0.0,
+            "pool_wait_max_ms": self.pool_wait_max * 1000,
+            "connections": self.connection_counts(),
+            "request_bytes_total": self.request_bytes,
+            "request_bytes_avg": self.request_bytes / self.requests if self.requests else 0.0,
+            "request_bytes_max": self.request_bytes_max,
+        }
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def create_upstream_transport(settings: UpstreamSettings) -> InstrumentedTransport:
+    """
+    Build the pooled transport, falling back to HTTP/1.1 if HTTP/2 is not
+    installed
+    """
+    http2 = settings.http2
+    if http2 and not http2_available():
+        logger.warning("UPSTREAM_HTTP2=1 but the 'h2' package is missing; using HTTP/1.1")
+        http2 = False
+    return InstrumentedTransport(
+        httpx.AsyncHTTPTransport(http2=http2, limits=settings.limits),
+        http2=http2
+    )
+
+
+def create_upstream_client(
+    settings: Optional[UpstreamSettings] = None,
+    transport: Optional[InstrumentedTransport] = None
+) -> httpx.AsyncClient:
+    """
+    Build an upstream client with explicit pool limits and split timeouts
+    """
+    settings = settings or UpstreamSettings()
+    return httpx.AsyncClient(
+        transport=transport or create_upstream_transport(settings),
+        timeout=settings.timeout
+    )
+
+
+async def warm_connections(client: httpx.AsyncClient, settings: UpstreamSettings):
+    """
+    Open `warm_connections` connections per upstream host ahead of the first
+    user, so nobody pays the TCP/TLS handshake. Failures are only logged.
+    """
+    if settings.warm_connections <= 0 or not settings.warm_urls:
+        return
+
+    async def touch(url: str):
+        try:
+            await client.head(url)
+        except httpx.HTTPError as e:
+            logger.warning("Connection warm-up to %s failed: %s", url, e)
+
+    # Concurrent requests force separate HTTP/1.1 connections
+    await asyncio.gather(*[
+        touch(url)
+        for url in settings.warm_urls
+        for _ in range(settings.warm_connections)
+    ])
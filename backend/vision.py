@@ -0,0 +1,218 @@
+import asyncio
+import base64
+import hashlib
+import io
+import os
+import uuid
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Optional
+
+from media import MediaCache, sniff_content_type
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Optional dependency: small images are passed through as is
+    Image = None
+
+
+def pillow_available() -> bool:
+    return Image is not None
+
+
+class UploadError(Exception):
+    """Upload the vision tool cannot use; `status` is the HTTP status to answer"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def multipart_boundary(content_type: str) -> Optional[bytes]:
+    """Boundary of a multipart/form-data Content-Type, or None"""
+    kind, _, params = content_type.partition(";")
+    if kind.strip().lower() != "multipart/form-data":
+        return None
+    for param in params.split(";"):
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary" and value:
+            return value.strip('"').encode("latin-1")
+    return None
+
+
+async def multipart_file(chunks: AsyncIterator[bytes], boundary: bytes) -> AsyncGenerator[bytes, None]:
+    """
+    Bytes of the first file part of a multipart/form-data body, yielded as
+    they arrive. Only a delimiter's length of data is held back between
+    chunks, so the file is never buffered whole.
+    """
+    delimiter = b"\r\n--" + boundary
+    # The body starts with "--boundary"; prefixing CRLF makes every delimiter alike
+    buffer = b"\r\n"
+    in_file = False
+    async for chunk in chunks:
+        buffer += chunk
+        while True:
+            if not in_file:
+                start = buffer.find(delimiter)
+                headers_end = buffer.find(b"\r\n\r\n", start + len(delimiter)) if start >= 0 else -1
+                if headers_end < 0:
+                    # Keep only what may hold a delimiter and its headers
+                    buffer = buffer[max(0, start):] if start >= 0 else buffer[-len(delimiter):]
+                    break
+                headers = buffer[start + len(delimiter):headers_end].decode("latin-1").lower()
+                buffer = buffer[headers_end + 4:]
+                if "filename=" in headers:
+                    in_file = True
+                continue
+            end = buffer.find(delimiter)
+            if end >= 0:
+                if end:
+                    yield buffer[:end]
+                return
+            keep = len(delimiter) - 1
+            if len(buffer) > keep:
+                yield buffer[:-keep]
+                buffer = buffer[-keep:]
+            break
+    if in_file:
+        raise UploadError("Upload incompleto")
+    raise UploadError("Nenhum arquivo no formulário")
+
+
+class VisionStore:
+    """
+    Uploaded images for the vision tool. Uploads stream to a temporary file
+    while being hashed; the image is then downscaled and re-encoded to a
+    bounded JPEG (with Pillow) and kept in a MediaCache under its content
+    hash, so the same image uploaded again skips processing and
+    re-analysis reuses the processed copy.
+    """
+
+    def __init__(
+        self,
+        cache: MediaCache,
+        max_side: int = 1024,
+        quality: int = 85,
+        max_upload_bytes: int = 20 * 1024 * 1024,
+        passthrough_bytes: int = 4 * 1024 * 1024
+    ):
+        self.cache = cache
+        self.max_side = max_side
+        self.quality = quality
+        self.max_upload_bytes = max_upload_bytes
+        # Without Pillow nothing can be downscaled; larger images are refused
+        self.passthrough_bytes = passthrough_bytes
+        self.uploads = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @classmethod
+    def from_env(cls) -> "VisionStore":
+        return cls(
+            MediaCache(
+                os.getenv("VISION_CACHE_DIR", "vision_cache"),
+                max_bytes=int(float(os.getenv("VISION_CACHE_MB", "128")) * 1024 * 1024)
+            ),
+            max_side=int(os.getenv("VISION_MAX_SIDE", "1024")),
+            max_upload_bytes=int(float(os.getenv("VISION_MAX_UPLOAD_MB", "20")) * 1024 * 1024)
+        )
+
+    def preprocess(self, path: str) -> bytes:
+        """Bounded JPEG of the image at `path` (runs in a thread)"""
+        with open(path, "rb") as f:
+            head = f.read(12)
+        if not sniff_content_type(head).startswith("image/"):
+            raise UploadError("Arquivo não é uma imagem suportada", status=415)
+
+        if Image is None:
+            if os.path.getsize(path) > self.passthrough_bytes:
+                raise UploadError("Imagem grande demais (instale Pillow para redimensionar)", status=413)
+            with open(path, "rb") as f:
+                return f.read()
+
+        try:
+            with Image.open(path) as image:
+                # JPEG decoding at a reduced scale keeps memory near the output size
+                image.draft("RGB", (self.max_side, self.max_side))
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((self.max_side, self.max_side))
+                if image.mode != "RGB":
+                    background = Image.new("RGB", image.size, "white")
+                    background.paste(image, mask=image.getchannel("A") if "A" in image.getbands() else None)
+                    image = background
+                out = io.BytesIO()
+                image.save(out, "JPEG", quality=self.quality, optimize=True)
+                return out.getvalue()
+        except (OSError, Image.DecompressionBombError) as e:
+            raise UploadError(f"Imagem inválida: {e}", status=415)
+
+    async def store(self, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """
+        Save an upload and return {"id", "cached", "bytes", "processed_bytes"}.
+        The id is the sha256 of the uploaded bytes.
+        """
+        loop = asyncio.get_running_loop()
+        digest = hashlib.sha256()
+        size = 0
+        self.cache.ensure_directory()
+        temp = os.path.join(self.cache.directory, f"upload.{uuid.uuid4().hex}.tmp")
+        f = open(temp, "wb")
+        try:
+            try:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_upload_bytes:
+                        raise UploadError("Upload grande demais", status=413)
+                    digest.update(chunk)
+                    await loop.run_in_executor(None, f.write, chunk)
+            finally:
+                f.close()
+            if not size:
+                raise UploadError("Upload vazio")
+
+            self.uploads += 1
+            self.bytes_in += size
+            key = digest.hexdigest()
+            if self.cache.get(key) is not None:
+                self.deduplicated += 1
+                return {"id": key, "cached": True, "bytes": size, "processed_bytes": os.path.getsize(self.cache.path(key))}
+
+            data = await loop.run_in_executor(None, self.preprocess, temp)
+            await loop.run_in_executor(None, self.cache.write, key, data)
+            self.cache.add(key, len(data))
+            self.bytes_out += len(data)
+            return {"id": key, "cached": False, "bytes": size, "processed_bytes": len(data)}
+        except UploadError:
+            self.rejected += 1
+            raise
+        finally:
+            try:
+                os.unlink(temp)
+            except FileNotFoundError:
+                pass
+
+    async def data_url(self, image_id: str) -> Optional[str]:
+        """Processed image as a base64 data URL for the upstream, or None"""
+        path = self.cache.get(image_id)
+        if path is None:
+            return None
+
+        def read() -> bytes:
+            with open(path, "rb") as f:
+                return f.read()
+
+        data = await asyncio.get_running_loop().run_in_executor(None, read)
+        return f"data:{sniff_content_type(data[:12])};base64,{base64.b64encode(data).decode('ascii')}"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pillow": pillow_available(),
+            "max_side": self.max_side,
+            "uploads": self.uploads,
+            "deduplicated": self.deduplicated,
+            "rejected": self.rejected,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "cache": self.cache.stats(),
+        }
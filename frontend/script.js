@@ -8,6 +8,9 @@ const API_BASE_URL = window.location.protocol === 'file:'
 const chatMessages = document.getElementById('chat-messages');
 const userInput = document.getElementById('user-input');
 const sendBtn = document.getElementById('send-btn');
+const stopBtn = document.getElementById('stop-btn');
+const attachBtn = document.getElementById('attach-btn');
+const imageInput = document.getElementById('image-input');
 const clearBtn = document.getElementById('clear-btn');
 const statusText = document.getElementById('status-text');
 const statusDot = document.querySelector('.status-dot');
@@ -17,11 +20,38 @@ const textModelSelect = document.getElementById('text-model');
 const searchModelSelect = document.getElementById('search-model');
 const reasoningModelSelect = document.getElementById('reasoning-model');
 const imageModelSelect = document.getElementById('image-model');
+const imageVariantsSelect = document.getElementById('image-variants');
+const speakAnswersSelect = document.getElementById('speak-answers');
 const audioVoiceSelect = document.getElementById('audio-voice');
 
 // State
 let isProcessing = false;
 let currentMessageElement = null;
+// Panels of a compound request, by tool id
+let toolPanels = {};
+let sessionId = localStorage.getItem('sessionId');
+// Response in flight: its URL for cancel/resume (/chat/{X-Stream-ID}, or
+// /jobs/{X-Job-ID} when the server runs answers as background jobs) and a
+// controller to abort the fetch
+let currentStreamUrl = null;
+let currentAbort = null;
+// Reconnects to GET /chat/{id}/events after a dropped connection
+const RESUME_ATTEMPTS = 3;
+
+function sessionHeaders(headers = {}) {
+    if (sessionId) {
+        headers['X-Session-ID'] = sessionId;
+    }
+    return headers;
+}
+
+function rememberSession(response) {
+    const id = response.headers.get('X-Session-ID');
+    if (id && id !== sessionId) {
+        sessionId = id;
+        localStorage.setItem('sessionId', id);
+    }
+}
 
 // Initialize
 document.addEventListener('DOMContentLoaded', () => {
@@ -31,6 +61,11 @@ document.addEventListener('DOMContentLoaded', () => {
 
 function setupEventListeners() {
     sendBtn.addEventListener('click', sendMessage);
+    stopBtn.addEventListener('click', stopResponse);
+    attachBtn.addEventListener('click', () => imageInput.click());
+    imageInput.addEventListener('change', () => {
+        attachBtn.classList.toggle('attached', imageInput.files.length > 0);
+    });
     clearBtn.addEventListener('click', clearConversation);
     
     userInput.addEventListener('keydown', (e) => {
@@ -48,6 +83,12 @@ function autoResizeTextarea() {
     userInput.style.height = userInput.scrollHeight + 'px';
 }
 
+function getImageBatch() {
+    // Only used by the backend when the message asks for an image
+    const count = parseInt(imageVariantsSelect.value, 10);
+    return count > 1 ? { count: count, preview: true } : null;
+}
+
 function getSelectedModels() {
     return {
         text: textModelSelect.value,
@@ -58,11 +99,30 @@ function getSelectedModels() {
     };
 }
 
+async function uploadImage(file) {
+    // multipart upload; the backend streams it to disk and answers with an id
+    const form = new FormData();
+    form.append('file', file);
+    const response = await fetch(`${API_BASE_URL}/uploads`, {
+        method: 'POST',
+        body: form
+    });
+    if (!response.ok) {
+        const error = await response.json().catch(() => ({}));
+        throw new Error(error.detail || `HTTP error! status: ${response.status}`);
+    }
+    return (await response.json()).id;
+}
+
 async function sendMessage() {
     const message = userInput.value.trim();
     
     if (!message || isProcessing) return;
     
+    const imageFile = imageInput.files[0] || null;
+    imageInput.value = '';
+    attachBtn.classList.remove('attached');
+    
     // Clear welcome message if it exists
     const welcomeMessage = document.querySelector('.welcome-message');
     if (welcomeMessage) {
@@ -70,7 +130,7 @@ async function sendMessage() {
     }
     
     // Add user message to chat
-    addUserMessage(message);
+    addUserMessage(message, imageFile);
     
     // Clear input
     userInput.value = '';
@@ -82,45 +142,131 @@ async function sendMessage() {
     try {
         // Get selected models
         const models = getSelectedModels();
+        const imageId = imageFile ? await uploadImage(imageFile) : null;
         
         // Send request to API
+        currentAbort = new AbortController();
         const response = await fetch(`${API_BASE_URL}/chat`, {
             method: 'POST',
-            headers: {
+            signal: currentAbort.signal,
+            headers: sessionHeaders({
                 'Content-Type': 'application/json',
-            },
+            }),
             body: JSON.stringify({
                 message: message,
-                models: models
+                models: models,
+                image_batch: getImageBatch(),
+                speak: speakAnswersSelect.value === '1',
+                image_id: imageId
             })
         });
         
         if (!response.ok) {
+            if (response.status === 503) {
+                const retryAfter = response.headers.get('Retry-After') || '1';
+                addErrorMessage(`Servidor ocupado. Tente novamente em ${retryAfter}s.`);
+                return;
+            }
             throw new Error('Failed to get response from server');
         }
         
-        // Process SSE stream
-        await processStream(response);
+        rememberSession(response);
+        const jobId = response.headers.get('X-Job-ID');
+        const streamId = response.headers.get('X-Stream-ID');
+        if (jobId) {
+            currentStreamUrl = `${API_BASE_URL}/jobs/${jobId}`;
+        } else if (streamId) {
+            currentStreamUrl = `${API_BASE_URL}/chat/${streamId}`;
+        }
+        
+        // Process SSE stream, resuming it if the connection drops
+        await followStream(response);
         
     } catch (error) {
-        console.error('Error:', error);
-        addErrorMessage('Desculpe, ocorreu um erro ao processar sua mensagem. Por favor, tente novamente.');
+        if (error.name === 'AbortError') {
+            markInterrupted();
+        } else {
+            console.error('Error:', error);
+            addErrorMessage('Desculpe, ocorreu um erro ao processar sua mensagem. Por favor, tente novamente.');
+        }
     } finally {
+        currentStreamUrl = null;
+        currentAbort = null;
         setProcessingState(false);
     }
 }
 
-async function processStream(response) {
+async function stopResponse() {
+    const abort = currentAbort;
+    if (!abort) {
+        return;
+    }
+    // Ask the server to stop so the partial answer ends cleanly; if this
+    // worker does not know the stream, dropping the connection stops it too
+    try {
+        if (currentStreamUrl) {
+            const response = await fetch(`${currentStreamUrl}/cancel`, {
+                method: 'POST',
+                headers: sessionHeaders()
+            });
+            if (response.ok) {
+                return;
+            }
+        }
+    } catch (error) {
+        console.error('Error cancelling:', error);
+    }
+    abort.abort();
+}
+
+async function followStream(response) {
+    // Shared across reconnects: the answer so far and the last event handled
+    const state = { text: '', lastEventId: '0', ended: false };
+    
+    for (let attempt = 0; ; attempt++) {
+        try {
+            if (attempt > 0) {
+                await new Promise(resolve => setTimeout(resolve, 500 * attempt));
+                response = await fetch(`${currentStreamUrl}/events`, {
+                    signal: currentAbort.signal,
+                    headers: sessionHeaders({ 'Last-Event-ID': state.lastEventId })
+                });
+                if (!response.ok) {
+                    // Expired (404) or no longer buffered (410)
+                    break;
+                }
+            }
+            await processStream(response, state);
+        } catch (error) {
+            if (error.name === 'AbortError') {
+                throw error;
+            }
+            console.warn('Conexão perdida, retomando a resposta...', error);
+        }
+        if (state.ended || !currentStreamUrl || attempt === RESUME_ATTEMPTS) {
+            break;
+        }
+    }
+    
+    if (!state.ended) {
+        throw new Error('Stream interrupted');
+    }
+}
+
+async function processStream(response, state) {
     const reader = response.body.getReader();
     const decoder = new TextDecoder();
     
     let buffer = '';
-    let currentText = '';
+    let eventId = null;
     
     while (true) {
         const { done, value } = await reader.read();
         
-        if (done) break;
+        if (done) {
+            state.ended = true;
+            break;
+        }
         
         buffer += decoder.decode(value, { stream: true });
         
@@ -128,13 +274,31 @@ async function processStream(response) {
         buffer = lines.pop() || '';
         
         for (const line of lines) {
-            if (line.startsWith('data: ')) {
+            if (line.startsWith('id: ')) {
+                eventId = line.slice(4);
+            } else if (line.startsWith('data: ')) {
+                // Received in full: a reconnect resumes after this event
+                if (eventId !== null) {
+                    state.lastEventId = eventId;
+                    eventId = null;
+                }
                 const data = line.slice(6);
                 
                 try {
                     const event = JSON.parse(data);
                     
+                    // Events of a compound request go to their tool's panel
+                    if (event.tool_id) {
+                        handleToolEvent(event);
+                        continue;
+                    }
+                    
                     switch (event.type) {
+                        case 'plan':
+                            createAssistantMessage();
+                            createToolPanels(event.steps);
+                            break;
+                        
                         case 'tool_selection':
                             createAssistantMessage();
                             addToolBadge(event.tool);
@@ -144,22 +308,61 @@ async function processStream(response) {
                             addStatusMessage(event.message);
                             break;
                         
+                        case 'model_fallback':
+                            addStatusMessage(`Modelo ${event.from} indisponível, usando ${event.to}...`);
+                            break;
+                        
                         case 'text_chunk':
-                            currentText += event.content;
-                            updateMessageText(currentText);
+                            state.text += event.content;
+                            updateMessageText(state.text);
+                            break;
+                        
+                        case 'image_progress':
+                            updateImageProgress(event);
+                            break;
+                        
+                        case 'image_batch':
+                            addImageBatch(event.variants);
+                            break;
+                        
+                        case 'image_preview':
+                            setBatchImage(event, true);
+                            break;
+                        
+                        case 'image_error':
+                            setBatchError(event);
                             break;
                         
                         case 'image':
-                            addImageToMessage(event.url, event.prompt);
+                            if (event.variant !== undefined) {
+                                setBatchImage(event, false);
+                            } else {
+                                addImageToMessage(event.url, event.prompt);
+                            }
                             break;
                         
                         case 'audio':
                             addAudioToMessage(event.url, event.text);
                             break;
                         
+                        case 'audio_segment':
+                            queueAudioSegment(event);
+                            break;
+                        
+                        case 'audio_error':
+                            console.warn(`Trecho de áudio ${event.index} falhou: ${event.message}`);
+                            break;
+                        
                         case 'done':
                             finalizeMessage();
-                            currentText = '';
+                            state.text = '';
+                            toolPanels = {};
+                            break;
+                        
+                        case 'cancelled':
+                            markInterrupted();
+                            state.text = '';
+                            toolPanels = {};
                             break;
                         
                         case 'error':
@@ -174,7 +377,7 @@ async function processStream(response) {
     }
 }
 
-function addUserMessage(text) {
+function addUserMessage(text, imageFile = null) {
     const messageDiv = document.createElement('div');
     messageDiv.className = 'message user';
     
@@ -182,6 +385,14 @@ function addUserMessage(text) {
     contentDiv.className = 'message-content';
     contentDiv.textContent = text;
     
+    if (imageFile) {
+        const img = document.createElement('img');
+        img.className = 'attached-image';
+        img.src = URL.createObjectURL(imageFile);
+        img.alt = imageFile.name;
+        contentDiv.appendChild(img);
+    }
+    
     messageDiv.appendChild(contentDiv);
     chatMessages.appendChild(messageDiv);
     scrollToBottom();
@@ -268,14 +479,39 @@ function formatText(text) {
         .replace(/\n/g, '<br>');
 }
 
+function mediaUrl(url) {
+    // Images cached by the backend are served from its /media route
+    return url.startsWith('/') ? API_BASE_URL + url : url;
+}
+
+function updateImageProgress(event) {
+    if (!currentMessageElement) return;
+    
+    let progress = currentMessageElement.querySelector('.image-progress');
+    if (!progress) {
+        progress = document.createElement('div');
+        progress.className = 'status-message image-progress';
+        currentMessageElement.appendChild(progress);
+    }
+    const kb = Math.round(event.received / 1024);
+    progress.textContent = event.percent !== null
+        ? `Baixando imagem... ${event.percent}%`
+        : `Baixando imagem... ${kb} KB`;
+}
+
 function addImageToMessage(url, prompt) {
     if (!currentMessageElement) return;
     
+    const progress = currentMessageElement.querySelector('.image-progress');
+    if (progress) {
+        progress.remove();
+    }
+    
     const imageContainer = document.createElement('div');
     imageContainer.className = 'image-container';
     
     const img = document.createElement('img');
-    img.src = url;
+    img.src = mediaUrl(url);
     img.alt = prompt;
     img.loading = 'lazy';
     
@@ -284,6 +520,55 @@ function addImageToMessage(url, prompt) {
     scrollToBottom();
 }
 
+function addImageBatch(variants) {
+    if (!currentMessageElement) return;
+    
+    const grid = document.createElement('div');
+    grid.className = 'image-batch';
+    variants.forEach(variant => {
+        const slot = document.createElement('div');
+        slot.className = 'image-container image-slot loading';
+        slot.dataset.variant = variant.variant;
+        slot.title = `${variant.model} · seed ${variant.seed} · ${variant.width}x${variant.height}`;
+        grid.appendChild(slot);
+    });
+    currentMessageElement.appendChild(grid);
+    scrollToBottom();
+}
+
+function batchSlot(variant) {
+    if (!currentMessageElement) return null;
+    return currentMessageElement.querySelector(`.image-slot[data-variant="${variant}"]`);
+}
+
+function setBatchImage(event, preview) {
+    const slot = batchSlot(event.variant);
+    if (!slot || !event.url) return;
+    // A late preview must not replace the full image
+    if (preview && slot.classList.contains('final')) return;
+    
+    let img = slot.querySelector('img');
+    if (!img) {
+        img = document.createElement('img');
+        img.alt = event.prompt;
+        slot.appendChild(img);
+    }
+    img.src = mediaUrl(event.url);
+    slot.classList.remove('loading');
+    slot.classList.toggle('preview', preview);
+    slot.classList.toggle('final', !preview);
+}
+
+function setBatchError(event) {
+    const slot = batchSlot(event.variant);
+    if (!slot || slot.classList.contains('final')) return;
+    // A failed preview keeps waiting for the full image
+    if (event.preview) return;
+    slot.classList.remove('loading', 'preview');
+    slot.classList.add('failed');
+    slot.textContent = 'Falha ao gerar';
+}
+
 function addAudioToMessage(url, text) {
     if (!currentMessageElement) return;
     
@@ -299,10 +584,131 @@ function addAudioToMessage(url, text) {
     scrollToBottom();
 }
 
+function queueAudioSegment(event) {
+    if (!currentMessageElement) return;
+    
+    // Segments arrive in order; each one plays when the previous ends
+    let container = currentMessageElement.querySelector('.audio-segments');
+    if (!container) {
+        container = document.createElement('div');
+        container.className = 'audio-container audio-segments';
+        const audio = document.createElement('audio');
+        audio.controls = true;
+        audio.autoplay = true;
+        container.appendChild(audio);
+        container.queue = [];
+        audio.addEventListener('ended', () => {
+            if (container.queue.length) {
+                audio.src = container.queue.shift();
+                audio.play();
+            }
+        });
+        currentMessageElement.appendChild(container);
+        scrollToBottom();
+    }
+    
+    const audio = container.querySelector('audio');
+    const url = mediaUrl(event.url);
+    if (!audio.src || (audio.ended && !container.queue.length)) {
+        audio.src = url;
+        audio.play().catch(() => {});
+    } else {
+        container.queue.push(url);
+    }
+}
+
+function createToolPanels(steps) {
+    if (!currentMessageElement) return;
+    
+    const grid = document.createElement('div');
+    grid.className = 'tool-panels';
+    
+    toolPanels = {};
+    for (const step of steps) {
+        const panel = document.createElement('div');
+        panel.className = 'tool-panel';
+        grid.appendChild(panel);
+        toolPanels[step.id] = { element: panel, text: '' };
+    }
+    
+    currentMessageElement.appendChild(grid);
+    scrollToBottom();
+}
+
+function handleToolEvent(event) {
+    const panel = toolPanels[event.tool_id];
+    if (!panel) return;
+    
+    // Reuse the single-tool renderers, pointed at the step's panel
+    const messageElement = currentMessageElement;
+    currentMessageElement = panel.element;
+    
+    switch (event.type) {
+        case 'tool_selection':
+            addToolBadge(event.tool);
+            break;
+        
+        case 'status':
+            addStatusMessage(event.message);
+            break;
+        
+        case 'model_fallback':
+            addStatusMessage(`Modelo ${event.from} indisponível, usando ${event.to}...`);
+            break;
+        
+        case 'text_chunk':
+            panel.text += event.content;
+            updateMessageText(panel.text);
+            break;
+        
+        case 'image_progress':
+            updateImageProgress(event);
+            break;
+        
+        case 'image':
+            addImageToMessage(event.url, event.prompt);
+            break;
+        
+        case 'audio':
+            addAudioToMessage(event.url, event.text);
+            break;
+        
+        case 'audio_segment':
+            queueAudioSegment(event);
+            break;
+        
+        case 'error': {
+            const errorDiv = document.createElement('div');
+            errorDiv.className = 'status-message';
+            errorDiv.textContent = `❌ ${event.message}`;
+            panel.element.appendChild(errorDiv);
+            panel.element.querySelectorAll('.typing-indicator').forEach(el => el.remove());
+            break;
+        }
+        
+        case 'tool_done':
+            panel.element.querySelectorAll('.typing-indicator').forEach(el => el.remove());
+            break;
+    }
+    
+    currentMessageElement = messageElement;
+}
+
 function finalizeMessage() {
     currentMessageElement = null;
 }
 
+function markInterrupted() {
+    if (currentMessageElement) {
+        currentMessageElement.querySelectorAll('.typing-indicator').forEach(el => el.remove());
+        const note = document.createElement('div');
+        note.className = 'status-message';
+        note.textContent = '⏹ Resposta interrompida';
+        currentMessageElement.appendChild(note);
+    }
+    finalizeMessage();
+}
+
 function addErrorMessage(errorText) {
     const messageDiv = document.createElement('div');
     messageDiv.className = 'message assistant';
@@ -320,6 +726,9 @@ function addErrorMessage(errorText) {
 function setProcessingState(processing) {
     isProcessing = processing;
     sendBtn.disabled = processing;
+    sendBtn.hidden = processing;
+    stopBtn.hidden = !processing;
+    attachBtn.disabled = processing;
     userInput.disabled = processing;
     
     if (processing) {
@@ -338,7 +747,8 @@ async function clearConversation() {
     
     try {
         await fetch(`${API_BASE_URL}/clear`, {
-            method: 'POST'
+            method: 'POST',
+            headers: sessionHeaders()
         });
         
         // Clear chat messages
@@ -27,17 +27,41 @@ def check_python_version():
     print(f"✅ Python {sys.version_info.major}.{sys.version_info.minor} detectado")
 
 
+def missing_dependencies(req_file):
+    """Requirements whose module cannot be imported"""
+    import importlib.util
+    import re
+
+    # Package names that differ from their import names
+    modules = {"uvicorn[standard]": "uvicorn", "pytest-asyncio": "pytest_asyncio"}
+    missing = []
+    for line in req_file.read_text().splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        package = re.split(r"[=<>!~;\s]", line, 1)[0]
+        module = modules.get(package, package.split("[", 1)[0].replace("-", "_"))
+        if importlib.util.find_spec(module) is None:
+            missing.append(package)
+    return missing
+
+
 def check_dependencies(base_dir):
-    """Check if required dependencies are installed"""
-    print("\n📦 Verificando e instalando dependências...")
+    """Install the requirements only if some are missing"""
+    print("\n📦 Verificando dependências...")
     
-    # Install from requirements.txt (pip will skip if already satisfied)
     req_file = base_dir / "requirements.txt"
     
     if not req_file.exists():
         print("❌ Arquivo requirements.txt não encontrado!")
         sys.exit(1)
     
+    missing = missing_dependencies(req_file)
+    if not missing:
+        print("✅ Dependências já instaladas")
+        return
+    
+    print(f"📥 Instalando: {', '.join(missing)}")
     try:
         subprocess.check_call([
             sys.executable, 
@@ -49,7 +73,7 @@ def check_dependencies(base_dir):
             "-r", 
             str(req_file)
         ])
-        print("✅ Dependências verificadas e instaladas!")
+        print("✅ Dependências instaladas!")
     except subprocess.CalledProcessError:
         print("❌ Erro ao instalar dependências!")
         print(f"   Execute manualmente: pip install -r {req_file}")
@@ -83,9 +107,6 @@ def start_server(base_dir):
     print("-"*60)
     print("\n💡 Dica: Pressione Ctrl+C para parar o servidor\n")
     
-    # Add base directory to Python path
-    sys.path.insert(0, str(base_dir))
-    
     # Start uvicorn server
     try:
         import uvicorn
@@ -101,9 +122,11 @@ def start_server(base_dir):
         browser_thread = threading.Thread(target=open_browser, daemon=True)
         browser_thread.start()
         
-        # Start server (using module path instead of chdir)
+        # Start server (the backend uses flat imports, so it is loaded
+        # from its own directory)
         uvicorn.run(
-            "backend.main:app",
+            "main:app",
+            app_dir=str(base_dir / "backend"),
             host="127.0.0.1",  # Localhost only for security
             port=8000,
             log_level="info"
@@ -11,19 +11,21 @@ if errorlevel 1 (
     exit /b 1
 )
 
-REM Check if virtual environment exists
+REM Activate virtual environment, creating it the first time
 if not exist "venv" (
     echo 📦 Creating virtual environment...
     python -m venv venv
 )
-
-REM Activate virtual environment
 echo 🔧 Activating virtual environment...
 call venv\Scripts\activate.bat
 
-REM Install dependencies
-echo 📥 Installing dependencies...
-pip install -q -r requirements.txt
+REM Install dependencies when requirements.txt differs from the copy saved at
+REM the last install, so an existing venv picks up new requirements
+fc /b requirements.txt venv\requirements.installed >nul 2>&1
+if errorlevel 1 (
+    echo 📥 Installing dependencies...
+    pip install -q -r requirements.txt && copy /y requirements.txt venv\requirements.installed >nul
+)
 
 REM Start the backend server
 echo.
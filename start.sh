@@ -10,19 +10,20 @@ if ! command -v python3 &> /dev/null; then
     exit 1
 fi
 
-# Check if virtual environment exists
+# Activate virtual environment, creating it the first time
 if [ ! -d "venv" ]; then
     echo "📦 Creating virtual environment..."
     python3 -m venv venv
 fi
-
-# Activate virtual environment
 echo "🔧 Activating virtual environment..."
 source venv/bin/activate
 
-# Install dependencies
-echo "📥 Installing dependencies..."
-pip install -q -r requirements.txt
+# Install dependencies when requirements.txt differs from the copy saved at
+# the last install, so an existing venv picks up new requirements
+if ! cmp -s requirements.txt venv/requirements.installed; then
+    echo "📥 Installing dependencies..."
+    pip install -q -r requirements.txt && cp requirements.txt venv/requirements.installed
+fi
 
 # Start the backend server
 echo ""